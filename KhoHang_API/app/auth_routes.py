@@ -15,6 +15,7 @@ from .security import (
 )
 from .email_service import send_otp_email, send_welcome_email
 from .auth_middleware import get_current_user
+from .rate_limiter import rate_limit, LOGIN_LIMITER, OTP_LIMITER
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
@@ -85,7 +86,7 @@ def get_valid_otp(db: Session, email: str, purpose: str) -> Optional[EmailOtpMod
 # REGISTER ENDPOINTS
 # ============================================
 
-@router.post("/register/request-otp")
+@router.post("/register/request-otp", dependencies=[Depends(rate_limit(OTP_LIMITER))])
 def register_request_otp(data: RegisterRequestOTP, db: Session = Depends(get_db)):
     """Request OTP for registration"""
     
@@ -220,7 +221,7 @@ def register_confirm(data: RegisterConfirm, db: Session = Depends(get_db)):
 # LOGIN ENDPOINT
 # ============================================
 
-@router.post("/login")
+@router.post("/login", dependencies=[Depends(rate_limit(LOGIN_LIMITER))])
 def login(data: LoginRequest, db: Session = Depends(get_db)):
     """Login with username/email and password"""
     
@@ -288,7 +289,7 @@ def get_me(current_user: dict = Depends(get_current_user), db: Session = Depends
 # PASSWORD RESET ENDPOINTS
 # ============================================
 
-@router.post("/password/request-otp")
+@router.post("/password/request-otp", dependencies=[Depends(rate_limit(OTP_LIMITER))])
 def password_reset_request_otp(data: PasswordResetRequestOTP, db: Session = Depends(get_db)):
     """Request OTP for password reset"""
     
@@ -363,7 +364,7 @@ def password_reset_confirm(data: PasswordResetConfirm, db: Session = Depends(get
 # PASSKEY ENDPOINTS
 # ============================================
 
-@router.post("/passkey/request-otp")
+@router.post("/passkey/request-otp", dependencies=[Depends(rate_limit(OTP_LIMITER))])
 def passkey_change_request_otp(
     data: PasskeyChangeRequestOTP,
     current_user: dict = Depends(get_current_user),
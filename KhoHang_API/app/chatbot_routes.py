@@ -6,12 +6,12 @@ from sqlalchemy.orm import Session
 from pathlib import Path
 from PIL import Image
 import io
-import uuid
-import aiofiles
-from typing import Optional
+from typing import Dict, Optional
 
 from app.database import get_db, ChatbotConfigModel, get_datadir
 from app.auth_middleware import get_current_user
+from app.rate_limiter import rate_limit, UPLOAD_LIMITER
+from app import upload_store
 from pydantic import BaseModel
 
 router = APIRouter(prefix="/api/chatbot", tags=["chatbot"])
@@ -25,6 +25,7 @@ CHAT_FILES_DIR = DATA_DIR / "uploads" / "chat_files"
 CHAT_FILES_DIR.mkdir(parents=True, exist_ok=True)
 
 ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.pdf', '.doc', '.docx', '.xls', '.xlsx', '.txt', '.zip', '.rar'}
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
 MAX_FILE_SIZE = 10 * 1024 * 1024
 
 MAX_AVATAR_SIZE = 800  # px
@@ -57,7 +58,7 @@ def get_chatbot_config(db: Session = Depends(get_db)):
         bot_description=config.bot_description
     )
 
-@router.post("/avatar")
+@router.post("/avatar", dependencies=[Depends(rate_limit(UPLOAD_LIMITER, key="user"))])
 async def upload_chatbot_avatar(
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
@@ -80,14 +81,9 @@ async def upload_chatbot_avatar(
         if not ext:
             ext = ".png"
         
-        # Lưu file gốc không convert
-        filename = f"chatbot_avatar_{uuid.uuid4().hex}{ext}"
-        filepath = CHATBOT_AVATAR_DIR / filename
-        
-        # Đọc và lưu file
-        contents = await file.read()
-        with open(filepath, "wb") as f:
-            f.write(contents)
+        # Lưu file gốc không convert (lưu một lần theo SHA-256)
+        stored = await upload_store.save_upload(db, file, "chatbot", ext, MAX_FILE_SIZE, prefix="chatbot_avatar_")
+        thumbnails = await upload_store.add_image_variants(db, stored, "chatbot")
         
         # Cập nhật database
         config = db.query(ChatbotConfigModel).first()
@@ -99,22 +95,22 @@ async def upload_chatbot_avatar(
             db.add(config)
         
         # Xóa avatar cũ nếu có
-        if config.avatar_url:
-            old_path = DATA_DIR / config.avatar_url.lstrip("/")
-            if old_path.exists():
-                old_path.unlink()
+        upload_store.release(db, config.avatar_url)
         
         # Cập nhật đường dẫn mới
-        config.avatar_url = f"/uploads/chatbot/{filename}"
+        config.avatar_url = stored.url
         db.commit()
         db.refresh(config)
         
         return {
             "success": True,
             "avatar_url": config.avatar_url,
+            "thumbnails": thumbnails,
             "message": "Chatbot avatar updated successfully"
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error uploading avatar: {str(e)}")
 
@@ -157,24 +153,29 @@ class FileUploadResponse(BaseModel):
     name: str
     size: int
     mime_type: str
+    thumbnail_url: Optional[str] = None  # medium variant (images only)
+    thumbnails: Optional[Dict[str, str]] = None  # { small, medium, large } -> url (images only)
 
 
-@router.post("/files", response_model=FileUploadResponse)
+@router.post("/files", response_model=FileUploadResponse, dependencies=[Depends(rate_limit(UPLOAD_LIMITER, key="user"))])
 async def upload_chatbot_file(
     file: UploadFile = File(...),
+    db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
     """
     API: POST /api/chatbot/files
     Purpose: Upload file attachment for chatbot
     Request (JSON): multipart/form-data with 'file' field
-    Response (JSON) [200]: { file_id, url, name, size, mime_type }
+    Response (JSON) [200]: { file_id, url, name, size, mime_type, thumbnail_url?, thumbnails? }
     Response Errors:
     - 400: { "detail": "Invalid file type or size" }
     - 401: { "detail": "Unauthorized" }
     - 413: { "detail": "File too large" }
+    - 429: { "detail": "Too many requests" }
     - 500: { "detail": "Internal Server Error" }
-    Notes: Max 10MB, allowed exts: png/jpg/jpeg/gif/webp/pdf/doc/docx/xls/xlsx/txt/zip/rar
+    Notes: Max 10MB, allowed exts: png/jpg/jpeg/gif/webp/pdf/doc/docx/xls/xlsx/txt/zip/rar;
+    content is deduplicated by SHA-256 (upload_store); images also get small/medium/large variants
     """
     if not file.filename:
         raise HTTPException(400, "Filename required")
@@ -183,28 +184,18 @@ async def upload_chatbot_file(
     if ext not in ALLOWED_EXTENSIONS:
         raise HTTPException(400, f"File type not allowed. Allowed: {', '.join(ALLOWED_EXTENSIONS)}")
     
-    file_id = str(uuid.uuid4())
-    safe_filename = f"{file_id}{ext}"
-    file_path = CHAT_FILES_DIR / safe_filename
-    
-    size = 0
-    async with aiofiles.open(file_path, 'wb') as f:
-        while chunk := await file.read(8192):
-            size += len(chunk)
-            if size > MAX_FILE_SIZE:
-                await f.close()
-                file_path.unlink(missing_ok=True)
-                raise HTTPException(413, "File too large (max 10MB)")
-            await f.write(chunk)
-    
-    print(f"[Chatbot Upload] File saved: {file_path} (exists: {file_path.exists()})")
+    stored = await upload_store.save_upload(db, file, "chat_files", ext, MAX_FILE_SIZE)
+    thumbnails = await upload_store.add_image_variants(db, stored, "chat_files") if ext in IMAGE_EXTENSIONS else {}
+    db.commit()
     
-    url = f"/uploads/chat_files/{safe_filename}"
+    print(f"[Chatbot Upload] File saved: {stored.url} ({stored.size} bytes{', deduplicated' if stored.deduplicated else ''})")
     
     return FileUploadResponse(
-        file_id=file_id,
-        url=url,
+        file_id=Path(stored.name).stem,
+        url=stored.url,
         name=file.filename,
-        size=size,
-        mime_type=file.content_type or "application/octet-stream"
+        size=stored.size,
+        mime_type=file.content_type or "application/octet-stream",
+        thumbnail_url=thumbnails.get("medium"),
+        thumbnails=thumbnails or None
     )
@@ -24,6 +24,35 @@ FROM_EMAIL = os.getenv("FROM_EMAIL", SMTP_USER)
 # Database
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./data.db")
 
+# Realtime chat backplane (optional)
+# "" = single worker; redis://host:port or unix:///path = fan-out across uvicorn workers
+RT_BACKPLANE_URL = os.getenv("RT_BACKPLANE_URL", "")
+
+# Reverse proxies allowed to set X-Forwarded-For (comma-separated IPs / CIDRs, e.g. "127.0.0.1,10.0.0.0/8")
+# "" = rate limits use the socket peer address only
+TRUSTED_PROXIES = [p.strip() for p in os.getenv("TRUSTED_PROXIES", "").split(",") if p.strip()]
+
+# Realtime chat cold storage (see app/rt_archive.py)
+# Messages older than this many days can be moved to data/archive/rt_messages_YYYY-MM.db; 0 = off
+RT_ARCHIVE_AFTER_DAYS = int(os.getenv("RT_ARCHIVE_AFTER_DAYS", "0"))
+
+# Image processing pool (see app/image_pool.py): worker processes for PIL work; 0 = threads in-process
+IMAGE_POOL_WORKERS = int(os.getenv("IMAGE_POOL_WORKERS", "2"))
+
+# Resumable chunked uploads (/rt/files/uploads): max file size and suggested chunk size
+RT_UPLOAD_MAX_SIZE_MB = int(os.getenv("RT_UPLOAD_MAX_SIZE_MB", "200"))
+RT_UPLOAD_CHUNK_SIZE_MB = int(os.getenv("RT_UPLOAD_CHUNK_SIZE_MB", "4"))
+
+# Voucher rendering pool (see app/voucher_export.py): worker processes for batch PDF/XLSX exports; 0 = threads in-process
+EXPORT_POOL_WORKERS = int(os.getenv("EXPORT_POOL_WORKERS", "2"))
+# Rendered vouchers kept in memory per worker (GET /stock/{in,out}/{id}/export.*)
+EXPORT_CACHE_MB = int(os.getenv("EXPORT_CACHE_MB", "64"))
+
+# Orphaned upload collector (see app/upload_gc.py): background sweep interval (0 = off, the default:
+# run it from POST /admin/uploads/gc first) and minimum upload age
+UPLOAD_GC_INTERVAL_HOURS = float(os.getenv("UPLOAD_GC_INTERVAL_HOURS", "0"))
+UPLOAD_GC_GRACE_HOURS = float(os.getenv("UPLOAD_GC_GRACE_HOURS", "48"))
+
 # Gemini AI (optional)
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
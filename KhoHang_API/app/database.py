@@ -4,7 +4,7 @@
 from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text, ForeignKey, JSON, text
+from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text, ForeignKey, JSON, UniqueConstraint, Index, text
 from datetime import datetime, timezone
 from pathlib import Path
 import os
@@ -326,6 +326,11 @@ class RTConversationMemberModel(Base):
     
     conversation = relationship("RTConversationModel", back_populates="members")
     user = relationship("UserModel")
+    
+    __table_args__ = (
+        # Conversation lists: memberships of one user, accepted or pending
+        Index("idx_rt_members_user_accepted", "user_id", "is_accepted"),
+    )
 
 
 class RTMessageModel(Base):
@@ -347,6 +352,14 @@ class RTMessageModel(Base):
     conversation = relationship("RTConversationModel", back_populates="messages")
     sender = relationship("UserModel")
     receipts = relationship("RTMessageReceiptModel", back_populates="message", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        # Live messages in order (deleted_at IS NULL is an equality probe on the 2nd column):
+        # pages, conv:sync, last message, msg:read, unread counts
+        Index("idx_rt_messages_conv_deleted_created", "conversation_id", "deleted_at", "created_at"),
+        # Idempotent msg:send (INSERT ... ON CONFLICT DO NOTHING targets this)
+        Index("idx_rt_messages_sender_client", "sender_id", "client_message_id", unique=True),
+    )
 
 
 class RTMessageReceiptModel(Base):
@@ -360,6 +373,11 @@ class RTMessageReceiptModel(Base):
     
     message = relationship("RTMessageModel", back_populates="receipts")
     user = relationship("UserModel")
+    
+    __table_args__ = (
+        # Unread receipts of one user (partial: read receipts are the vast majority)
+        Index("idx_rt_receipts_unread", "user_id", "message_id", sqlite_where=text("read_at IS NULL")),
+    )
 
 
 class RTMessageReactionModel(Base):
@@ -375,6 +393,22 @@ class RTMessageReactionModel(Base):
     user = relationship("UserModel")
 
 
+# Reactors listed with each count ("An, Binh and 3 others")
+REACTION_SAMPLE_SIZE = 3
+
+
+class RTMessageReactionCountModel(Base):
+    """Reaction totals per message and emoji, kept current with deltas on react/unreact"""
+    __tablename__ = "rt_message_reaction_counts"
+    
+    message_id = Column(String, ForeignKey("rt_messages.id"), primary_key=True)
+    emoji = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    sample_user_ids = Column(JSON, nullable=False, default=list)  # First few reactors, oldest first
+    
+    message = relationship("RTMessageModel", backref="reaction_counts")
+
+
 class RTPinnedMessageModel(Base):
     """Pinned messages per conversation - persists across sessions"""
     __tablename__ = "rt_pinned_messages"
@@ -389,6 +423,74 @@ class RTPinnedMessageModel(Base):
     user = relationship("UserModel")
 
 
+class RTOutboxEventModel(Base):
+    """Compact realtime events for recipients that were offline, drained on reconnect"""
+    __tablename__ = "rt_outbox_events"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(String, ForeignKey("users.id"), nullable=False)
+    conversation_id = Column(String, ForeignKey("rt_conversations.id"), nullable=False)
+    kind = Column(String, nullable=False)  # 'message', 'read', 'pin', 'truncated'
+    dedupe_key = Column(String, nullable=False)  # Later events with the same key replace earlier ones
+    payload = Column(JSON, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    
+    __table_args__ = (
+        UniqueConstraint("user_id", "dedupe_key", name="uq_rt_outbox_user_key"),
+        Index("idx_rt_outbox_user_conv_kind", "user_id", "conversation_id", "kind"),
+    )
+
+
+class UploadBlobModel(Base):
+    """Uploaded file content, stored once under its SHA-256 (see upload_store)"""
+    __tablename__ = "upload_blobs"
+    
+    sha256 = Column(String, primary_key=True)
+    size = Column(Integer, nullable=False)
+    path = Column(String, nullable=False)  # Relative to data/blobs: "ab/ab12...ef.pdf"
+    ref_count = Column(Integer, nullable=False, default=0)  # Rows in upload_refs
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+class UploadRefModel(Base):
+    """One upload URL (/uploads/{folder}/{name}) pointing at a blob"""
+    __tablename__ = "upload_refs"
+    
+    folder = Column(String, primary_key=True)  # rt_files, chat_files, chatbot, logos, avatars
+    name = Column(String, primary_key=True)
+    sha256 = Column(String, ForeignKey("upload_blobs.sha256"), nullable=False, index=True)
+    original_name = Column(String, nullable=True)
+    mime_type = Column(String, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+class UploadMentionModel(Base):
+    """An upload mentioned by a realtime message, live or archived (see upload_gc)"""
+    __tablename__ = "upload_mentions"
+    
+    folder = Column(String, primary_key=True)
+    stem = Column(String, primary_key=True)  # File name up to the first dot: covers image variants
+    message_id = Column(String, primary_key=True, index=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+
+
+class UploadSessionModel(Base):
+    """Resumable chunked upload in progress (see upload_sessions); data in data/blobs/tmp/<id>.upload"""
+    __tablename__ = "upload_sessions"
+    
+    id = Column(String, primary_key=True)  # uuid4 hex
+    user_id = Column(String, ForeignKey("users.id"), nullable=False, index=True)
+    folder = Column(String, nullable=False)
+    original_name = Column(String, nullable=False)
+    ext = Column(String, nullable=False)
+    mime_type = Column(String, nullable=True)
+    size = Column(Integer, nullable=False)  # Announced total size
+    received = Column(Integer, nullable=False, default=0)  # Bytes written so far = next expected offset
+    sha256 = Column(String, nullable=True)  # Announced checksum, verified on complete
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+
+
 def get_db():
     db = SessionLocal()
     try:
@@ -412,9 +514,24 @@ def ensure_stock_transaction_columns(engine):
 
 
 def ensure_rt_message_unique_constraint(engine):
-    """Ensure unique constraint on (sender_id, client_message_id) for idempotency."""
+    """
+    Ensure unique constraint on (sender_id, client_message_id) for idempotency.
+    
+    msg:send relies on it (INSERT ... ON CONFLICT). Duplicates left by older
+    versions would block the index, so all but the first copy get their
+    client_message_id suffixed with the message id; rows are kept since
+    receipts, reactions and replies may point at them.
+    """
     try:
         with engine.begin() as conn:
+            renamed = conn.execute(text(
+                "UPDATE rt_messages SET client_message_id = client_message_id || ':dup:' || id "
+                "WHERE client_message_id IS NOT NULL AND rowid NOT IN ("
+                "SELECT MIN(rowid) FROM rt_messages WHERE client_message_id IS NOT NULL "
+                "GROUP BY sender_id, client_message_id)"
+            )).rowcount
+            if renamed:
+                print(f"[DB] Renamed {renamed} duplicate rt_messages client_message_id(s)")
             conn.execute(text(
                 "CREATE UNIQUE INDEX IF NOT EXISTS idx_rt_messages_sender_client "
                 "ON rt_messages(sender_id, client_message_id)"
@@ -423,10 +540,81 @@ def ensure_rt_message_unique_constraint(engine):
         print(f"[WARN] Could not create rt_messages unique index: {e}")
 
 
+RT_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_rt_messages_conv_deleted_created "
+    "ON rt_messages(conversation_id, deleted_at, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_rt_members_user_accepted "
+    "ON rt_conversation_members(user_id, is_accepted)",
+    "CREATE INDEX IF NOT EXISTS idx_rt_receipts_unread "
+    "ON rt_message_receipts(user_id, message_id) WHERE read_at IS NULL",
+]
+
+
+def ensure_rt_indexes(engine):
+    """
+    Create indexes added after the realtime tables existed (create_all skips existing tables).
+    
+    Runs at startup against the live database: each index is built in its own
+    short transaction (no table rebuild, readers are never blocked in WAL mode),
+    and ANALYZE only runs when something was created so the planner sees the new
+    indexes with fresh statistics.
+    """
+    created = 0
+    for statement in RT_INDEXES:
+        name = statement.split()[5]
+        try:
+            with engine.begin() as conn:
+                exists = conn.execute(
+                    text("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = :name"), {"name": name}
+                ).first()
+                if not exists:
+                    conn.execute(text(statement))
+                    created += 1
+        except Exception as e:
+            print(f"[WARN] Could not create index {name}: {e}")
+    if created:
+        try:
+            with engine.begin() as conn:
+                conn.execute(text("ANALYZE"))
+            print(f"[DB] Created {created} realtime index(es)")
+        except Exception as e:
+            print(f"[WARN] Could not analyze database: {e}")
+
+
+def ensure_rt_reaction_counts(engine):
+    """
+    Backfill rt_message_reaction_counts from rt_message_reactions once.
+    
+    Only runs while the counts table is empty and reactions exist (first start
+    after the table was added); afterwards react/unreact keep it current.
+    """
+    try:
+        with engine.begin() as conn:
+            if conn.execute(text("SELECT 1 FROM rt_message_reaction_counts LIMIT 1")).first():
+                return
+            if not conn.execute(text("SELECT 1 FROM rt_message_reactions LIMIT 1")).first():
+                return
+            result = conn.execute(text(
+                "INSERT INTO rt_message_reaction_counts (message_id, emoji, count, sample_user_ids) "
+                "SELECT r.message_id, r.emoji, COUNT(*), ("
+                "  SELECT json_group_array(s.user_id) FROM ("
+                "    SELECT user_id FROM rt_message_reactions"
+                "    WHERE message_id = r.message_id AND emoji = r.emoji"
+                "    ORDER BY created_at LIMIT :sample"
+                "  ) s"
+                ") FROM rt_message_reactions r GROUP BY r.message_id, r.emoji"
+            ), {"sample": REACTION_SAMPLE_SIZE})
+            print(f"[DB] Backfilled {result.rowcount} reaction count row(s)")
+    except Exception as e:
+        print(f"[WARN] Could not backfill reaction counts: {e}")
+
+
 def init_db():
     Base.metadata.create_all(bind=engine)
     ensure_stock_transaction_columns(engine)
     ensure_rt_message_unique_constraint(engine)
+    ensure_rt_indexes(engine)
+    ensure_rt_reaction_counts(engine)
     print(f"Database initialized at {DATABASE_URL}")
 
 init_db()
\ No newline at end of file
@@ -3,18 +3,21 @@ export_service.py - Service xuất phiếu nhập/xuất kho ra Excel và PDF
 
 Flow:
 1. Nhận VoucherExportData (JSON)
-2. Load template Excel (.xlsx)
+2. Load template Excel (.xlsx) - parse 1 lần, cache theo loại phiếu (ExcelTemplateCache)
 3. Fill data vào template
-4. Trả về file Excel hoặc convert sang PDF
+4. Trả về file Excel hoặc convert sang PDF (font/style PDF khởi tạo 1 lần, PdfVoucherRenderer)
 """
 
 import os
 import io
+import threading
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Optional, List
+from typing import Any, Dict, Iterator, NamedTuple, Optional, List, Tuple
 from copy import copy
 
 from openpyxl import load_workbook
+from openpyxl.workbook import Workbook
 from openpyxl.styles import Font, Alignment, Border, Side
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4
@@ -111,15 +114,15 @@ def _format_number(num: float) -> str:
     return f"{num:,.0f}".replace(",", ".")
 
 
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates')
+
+
 def _get_template_path(voucher_type: str) -> str:
     """Get template file path based on voucher type"""
-    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    template_dir = os.path.join(base_dir, 'templates')
-    
     if voucher_type == 'PN':
-        return os.path.join(template_dir, 'Mau_Phieu_Nhap_TEMPLATE.xlsx')
+        return os.path.join(TEMPLATE_DIR, 'Mau_Phieu_Nhap_TEMPLATE.xlsx')
     else:
-        return os.path.join(template_dir, 'Mau_Phieu_Xuat_TEMPLATE.xlsx')
+        return os.path.join(TEMPLATE_DIR, 'Mau_Phieu_Xuat_TEMPLATE.xlsx')
 
 
 def _generate_filename(data: VoucherExportRequest, extension: str) -> str:
@@ -142,6 +145,87 @@ def _generate_filename(data: VoucherExportRequest, extension: str) -> str:
     return f"{data.voucher_type}_{warehouse_safe}_{yyyy}{mm}_{voucher_no_safe}.{extension}"
 
 
+# ============================================
+# EXCEL TEMPLATE CACHE
+# ============================================
+
+class _TemplateSheet:
+    """
+    Worksheet của template dùng chung: ghi giá trị như ws['F7'] = ...,
+    nhớ giá trị gốc của mọi ô đã ghi để restore() trả template về nguyên trạng.
+    """
+
+    def __init__(self, ws):
+        self._ws = ws
+        self._original: Dict[str, Any] = {}
+
+    def __setitem__(self, coordinate: str, value):
+        cell = self._ws[coordinate]
+        if coordinate not in self._original:
+            self._original[coordinate] = cell.value
+        cell.value = value
+
+    def __getitem__(self, coordinate: str):
+        return self._ws[coordinate]
+
+    def restore(self):
+        for coordinate, value in self._original.items():
+            self._ws[coordinate].value = value
+        self._original.clear()
+
+
+class _CachedTemplate(NamedTuple):
+    mtime_ns: int
+    workbook: Workbook
+    lock: threading.Lock
+
+
+class ExcelTemplateCache:
+    """
+    Template phiếu đã parse, 1 workbook cho mỗi loại phiếu (PN/PX).
+
+    load_workbook() parse lại toàn bộ .xlsx (styles, merged cells) - chậm hơn
+    cả bước điền dữ liệu + save. Ở đây template chỉ parse 1 lần; mỗi lần xuất
+    điền vào workbook đã cache, save ra buffer rồi restore các ô đã ghi.
+    Mỗi workbook có lock riêng (xuất song song cùng loại phiếu thì chờ nhau).
+    Sửa file template (mtime đổi) -> tự parse lại ở lần xuất kế tiếp.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, _CachedTemplate] = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _entry(self, voucher_type: str) -> _CachedTemplate:
+        template_path = _get_template_path(voucher_type)
+        if not os.path.exists(template_path):
+            raise FileNotFoundError(f"Template not found: {template_path}")
+        mtime_ns = os.stat(template_path).st_mtime_ns
+        with self._lock:
+            entry = self._entries.get(template_path)
+            if entry is None or entry.mtime_ns != mtime_ns:
+                entry = _CachedTemplate(mtime_ns, load_workbook(template_path), threading.Lock())
+                self._entries[template_path] = entry
+            return entry
+
+    @contextmanager
+    def checkout(self, voucher_type: str) -> Iterator[Tuple[Workbook, _TemplateSheet]]:
+        """(workbook, active sheet) dùng riêng trong block; ô đã ghi được restore khi ra khỏi block."""
+        entry = self._entry(voucher_type)
+        with entry.lock:
+            sheet = _TemplateSheet(entry.workbook.active)
+            try:
+                yield entry.workbook, sheet
+            finally:
+                sheet.restore()
+
+
+template_cache = ExcelTemplateCache()
+
+
 # ============================================
 # EXCEL EXPORT
 # ============================================
@@ -182,15 +266,24 @@ def export_to_excel(data: VoucherExportRequest) -> tuple[io.BytesIO, str]:
         - F: THỦ KHO
         - H: GIÁM ĐỐC
     """
-    template_path = _get_template_path(data.voucher_type)
-    
-    if not os.path.exists(template_path):
-        raise FileNotFoundError(f"Template not found: {template_path}")
+    # Template đã parse sẵn (cache); các ô ghi vào được trả lại sau khi save
+    with template_cache.checkout(data.voucher_type) as (wb, ws):
+        _fill_excel_voucher(ws, data)
+        
+        # ============================================
+        # SAVE TO BUFFER
+        # ============================================
+        buffer = io.BytesIO()
+        wb.save(buffer)
+    buffer.seek(0)
     
-    # Load template
-    wb = load_workbook(template_path)
-    ws = wb.active
+    filename = _generate_filename(data, 'xlsx')
     
+    return buffer, filename
+
+
+def _fill_excel_voucher(ws: _TemplateSheet, data: VoucherExportRequest):
+    """Điền dữ liệu phiếu vào sheet template (xem Template Contract ở export_to_excel)"""
     # ============================================
     # FILL HEADER
     # ============================================
@@ -281,28 +374,242 @@ def export_to_excel(data: VoucherExportRequest) -> tuple[io.BytesIO, str]:
         ws['F43'] = data.storekeeper
     if data.director:
         ws['H43'] = data.director
-    
-    # ============================================
-    # SAVE TO BUFFER
-    # ============================================
-    buffer = io.BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-    
-    filename = _generate_filename(data, 'xlsx')
-    
-    return buffer, filename
 
 
 # ============================================
 # PDF EXPORT
 # ============================================
 
+class PdfVoucherRenderer:
+    """
+    Renderer PDF dùng chung: font, ParagraphStyle và TableStyle được khởi tạo
+    một lần (lần render đầu tiên hoặc warm_up()), sau đó chỉ dùng để đọc.
+    Mỗi request chỉ còn dựng layout (Paragraph/Table theo dữ liệu phiếu) và vẽ.
+    """
+
+    FONTS = ('Helvetica', 'Helvetica-Bold', 'Helvetica-Oblique')
+    INFO_COL_WIDTHS = [70, 150, 60, 150]
+    ITEM_COL_WIDTHS = [25, 120, 50, 35, 40, 40, 60, 70]
+    SIG_COL_WIDTHS = [110, 110, 110, 110]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def warm_up(self):
+        """Nạp font và tạo style (idempotent, thread-safe)"""
+        if self._ready:
+            return
+        with self._lock:
+            if self._ready:
+                return
+            # Font Type1 chuẩn: nạp metrics trước để request đầu không phải chờ
+            for font_name in self.FONTS:
+                pdfmetrics.getFont(font_name)
+
+            styles = getSampleStyleSheet()
+            # Custom styles (ASCII-safe for compatibility)
+            self.title_style = ParagraphStyle(
+                'CustomTitle',
+                parent=styles['Heading1'],
+                fontSize=14,
+                alignment=1,  # Center
+                spaceAfter=10
+            )
+            self.normal_style = ParagraphStyle(
+                'CustomNormal',
+                parent=styles['Normal'],
+                fontSize=10,
+                spaceAfter=5
+            )
+            self.header_style = ParagraphStyle(
+                'CustomHeader',
+                parent=styles['Normal'],
+                fontSize=12,
+                alignment=1,
+                spaceAfter=3
+            )
+
+            # Table styles chỉ dùng chỉ số tương đối (-1...) nên dùng lại được cho mọi phiếu
+            self.info_table_style = TableStyle([
+                ('FONTSIZE', (0, 0), (-1, -1), 9),
+                ('ALIGN', (0, 0), (0, -1), 'RIGHT'),
+                ('ALIGN', (2, 0), (2, -1), 'RIGHT'),
+                ('BOTTOMPADDING', (0, 0), (-1, -1), 5),
+            ])
+            self.items_table_style = TableStyle([
+                # Header style
+                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+                ('FONTSIZE', (0, 0), (-1, 0), 9),
+                ('FONTSIZE', (0, 1), (-1, -1), 8),
+                ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+                # Data alignment
+                ('ALIGN', (0, 1), (0, -1), 'CENTER'),  # STT
+                ('ALIGN', (4, 1), (-1, -1), 'RIGHT'),  # Numbers
+                # Borders
+                ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+                ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
+                ('TOPPADDING', (0, 0), (-1, -1), 4),
+            ])
+            self.summary_table_style = TableStyle([
+                ('FONTSIZE', (0, 0), (-1, -1), 9),
+                ('ALIGN', (-2, 0), (-1, -1), 'RIGHT'),
+                ('FONTNAME', (-2, -1), (-1, -1), 'Helvetica-Bold'),  # Bold last row (TONG CONG)
+            ])
+            self.sig_table_style = TableStyle([
+                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+                ('FONTSIZE', (0, 0), (-1, 0), 10),
+                ('FONTSIZE', (0, 1), (-1, 1), 8),
+                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+                ('FONTNAME', (0, 1), (-1, 1), 'Helvetica-Oblique'),
+                ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
+            ])
+            self._ready = True
+
+    def render(self, data: VoucherExportRequest) -> io.BytesIO:
+        """Dựng layout và vẽ phiếu, trả về buffer PDF"""
+        self.warm_up()
+        buffer = io.BytesIO()
+        
+        # Create PDF document
+        doc = SimpleDocTemplate(
+            buffer,
+            pagesize=A4,
+            rightMargin=15*mm,
+            leftMargin=15*mm,
+            topMargin=15*mm,
+            bottomMargin=15*mm
+        )
+        
+        # Build document content
+        elements = []
+        
+        # ============================================
+        # HEADER
+        # ============================================
+        elements.append(Paragraph("CONG TY TNHH QUAN LY KHO N3T", self.header_style))
+        elements.append(Paragraph("Dia chi: Duong Dai hoc, P. Linh Trung, TP. Thu Duc", self.normal_style))
+        elements.append(Spacer(1, 10))
+        
+        # Title
+        title = "PHIEU NHAP KHO" if data.voucher_type == 'PN' else "PHIEU XUAT KHO"
+        elements.append(Paragraph(f"<b>{title}</b>", self.title_style))
+        elements.append(Spacer(1, 5))
+        
+        # ============================================
+        # VOUCHER INFO
+        # ============================================
+        info_data = [
+            ['So phieu:', data.voucher_no, 'Ngay:', _format_date(data.voucher_date)],
+            ['Doi tac:', data.partner_name, 'Kho:', data.warehouse_code],
+        ]
+        
+        if data.invoice_no:
+            info_data.append(['So hoa don:', data.invoice_no, 'Ngay HD:', _format_date(data.invoice_date) if data.invoice_date else ''])
+        
+        info_table = Table(info_data, colWidths=self.INFO_COL_WIDTHS)
+        info_table.setStyle(self.info_table_style)
+        elements.append(info_table)
+        elements.append(Spacer(1, 15))
+        
+        # ============================================
+        # ITEMS TABLE
+        # ============================================
+        # Header
+        table_header = ['STT', 'Ten hang hoa', 'Ma hang', 'DVT', 'SL CT', 'SL TT', 'Don gia', 'Thanh tien']
+        
+        # Data rows
+        table_data = [table_header]
+        total_amount = 0
+        
+        for i, item in enumerate(data.items):
+            line_total = item.qty_actual * item.unit_price
+            total_amount += line_total
+            
+            table_data.append([
+                str(i + 1),
+                item.name[:30] + '...' if len(item.name) > 30 else item.name,  # Truncate long names
+                item.sku,
+                item.unit,
+                _format_number(item.qty_doc),
+                _format_number(item.qty_actual),
+                _format_number(item.unit_price),
+                _format_number(line_total)
+            ])
+        
+        # Create table
+        items_table = Table(table_data, colWidths=self.ITEM_COL_WIDTHS)
+        items_table.setStyle(self.items_table_style)
+        elements.append(items_table)
+        elements.append(Spacer(1, 10))
+        
+        # ============================================
+        # SUMMARY WITH TAX
+        # ============================================
+        tax_rate = data.tax_rate or 0
+        tax_amount = total_amount * tax_rate / 100
+        grand_total = total_amount + tax_amount
+        
+        # Subtotal row
+        summary_data = [
+            ['', '', '', '', '', '', 'Cong:', _format_number(total_amount)],
+        ]
+        
+        # Tax row (only if tax_rate > 0)
+        if tax_rate > 0:
+            summary_data.append(['', '', '', '', '', '', f'Thue ({tax_rate:.0f}%):', _format_number(tax_amount)])
+            summary_data.append(['', '', '', '', '', '', 'TONG CONG:', _format_number(grand_total)])
+        else:
+            summary_data.append(['', '', '', '', '', '', 'TONG CONG:', _format_number(total_amount)])
+        
+        summary_table = Table(summary_data, colWidths=self.ITEM_COL_WIDTHS)
+        summary_table.setStyle(self.summary_table_style)
+        elements.append(summary_table)
+        elements.append(Spacer(1, 5))
+        
+        # Total in words (use grand_total)
+        total_in_words = amount_to_vietnamese_words(grand_total)
+        elements.append(Paragraph(f"<i>Bang chu: {total_in_words}</i>", self.normal_style))
+        elements.append(Spacer(1, 20))
+        
+        # ============================================
+        # SIGNATURE
+        # ============================================
+        sig_data = [
+            ['Nguoi lap phieu', 'Nguoi giao/nhan', 'Thu kho', 'Giam doc'],
+            ['(Ky, ghi ro ho ten)', '(Ky, ghi ro ho ten)', '(Ky, ghi ro ho ten)', '(Ky, ghi ro ho ten)'],
+            ['', '', '', ''],
+            ['', '', '', ''],
+            [data.prepared_by or '', data.receiver or '', data.storekeeper or '', data.director or ''],
+        ]
+        sig_table = Table(sig_data, colWidths=self.SIG_COL_WIDTHS)
+        sig_table.setStyle(self.sig_table_style)
+        elements.append(sig_table)
+        
+        # Build PDF
+        doc.build(elements)
+        buffer.seek(0)
+        return buffer
+
+
+pdf_renderer = PdfVoucherRenderer()
+
+
+def warm_up():
+    """Khởi tạo trước renderer PDF và template Excel (VD: khi một worker process khởi động)"""
+    pdf_renderer.warm_up()
+    for voucher_type in ('PN', 'PX'):
+        with template_cache.checkout(voucher_type):
+            pass
+
+
 def export_to_pdf(data: VoucherExportRequest) -> tuple[io.BytesIO, str]:
     """
     Export voucher data to PDF
     
     Sử dụng reportlab để tạo PDF với layout tương tự phiếu
+    (font/style dùng chung trong pdf_renderer)
     
     Args:
         data: VoucherExportRequest with all voucher data
@@ -310,185 +617,7 @@ def export_to_pdf(data: VoucherExportRequest) -> tuple[io.BytesIO, str]:
     Returns:
         Tuple of (BytesIO buffer, filename)
     """
-    buffer = io.BytesIO()
-    
-    # Create PDF document
-    doc = SimpleDocTemplate(
-        buffer,
-        pagesize=A4,
-        rightMargin=15*mm,
-        leftMargin=15*mm,
-        topMargin=15*mm,
-        bottomMargin=15*mm
-    )
-    
-    # Styles
-    styles = getSampleStyleSheet()
-    
-    # Custom styles (ASCII-safe for compatibility)
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=14,
-        alignment=1,  # Center
-        spaceAfter=10
-    )
-    
-    normal_style = ParagraphStyle(
-        'CustomNormal',
-        parent=styles['Normal'],
-        fontSize=10,
-        spaceAfter=5
-    )
-    
-    header_style = ParagraphStyle(
-        'CustomHeader',
-        parent=styles['Normal'],
-        fontSize=12,
-        alignment=1,
-        spaceAfter=3
-    )
-    
-    # Build document content
-    elements = []
-    
-    # ============================================
-    # HEADER
-    # ============================================
-    elements.append(Paragraph("CONG TY TNHH QUAN LY KHO N3T", header_style))
-    elements.append(Paragraph("Dia chi: Duong Dai hoc, P. Linh Trung, TP. Thu Duc", normal_style))
-    elements.append(Spacer(1, 10))
-    
-    # Title
-    title = "PHIEU NHAP KHO" if data.voucher_type == 'PN' else "PHIEU XUAT KHO"
-    elements.append(Paragraph(f"<b>{title}</b>", title_style))
-    elements.append(Spacer(1, 5))
-    
-    # ============================================
-    # VOUCHER INFO
-    # ============================================
-    info_data = [
-        ['So phieu:', data.voucher_no, 'Ngay:', _format_date(data.voucher_date)],
-        ['Doi tac:', data.partner_name, 'Kho:', data.warehouse_code],
-    ]
-    
-    if data.invoice_no:
-        info_data.append(['So hoa don:', data.invoice_no, 'Ngay HD:', _format_date(data.invoice_date) if data.invoice_date else ''])
-    
-    info_table = Table(info_data, colWidths=[70, 150, 60, 150])
-    info_table.setStyle(TableStyle([
-        ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ('ALIGN', (0, 0), (0, -1), 'RIGHT'),
-        ('ALIGN', (2, 0), (2, -1), 'RIGHT'),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 5),
-    ]))
-    elements.append(info_table)
-    elements.append(Spacer(1, 15))
-    
-    # ============================================
-    # ITEMS TABLE
-    # ============================================
-    # Header
-    table_header = ['STT', 'Ten hang hoa', 'Ma hang', 'DVT', 'SL CT', 'SL TT', 'Don gia', 'Thanh tien']
-    
-    # Data rows
-    table_data = [table_header]
-    total_amount = 0
-    
-    for i, item in enumerate(data.items):
-        line_total = item.qty_actual * item.unit_price
-        total_amount += line_total
-        
-        table_data.append([
-            str(i + 1),
-            item.name[:30] + '...' if len(item.name) > 30 else item.name,  # Truncate long names
-            item.sku,
-            item.unit,
-            _format_number(item.qty_doc),
-            _format_number(item.qty_actual),
-            _format_number(item.unit_price),
-            _format_number(line_total)
-        ])
-    
-    # Create table
-    col_widths = [25, 120, 50, 35, 40, 40, 60, 70]
-    items_table = Table(table_data, colWidths=col_widths)
-    items_table.setStyle(TableStyle([
-        # Header style
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('FONTSIZE', (0, 0), (-1, 0), 9),
-        ('FONTSIZE', (0, 1), (-1, -1), 8),
-        ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
-        # Data alignment
-        ('ALIGN', (0, 1), (0, -1), 'CENTER'),  # STT
-        ('ALIGN', (4, 1), (-1, -1), 'RIGHT'),  # Numbers
-        # Borders
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
-        ('TOPPADDING', (0, 0), (-1, -1), 4),
-    ]))
-    elements.append(items_table)
-    elements.append(Spacer(1, 10))
-    
-    # ============================================
-    # SUMMARY WITH TAX
-    # ============================================
-    tax_rate = data.tax_rate or 0
-    tax_amount = total_amount * tax_rate / 100
-    grand_total = total_amount + tax_amount
-    
-    # Subtotal row
-    summary_data = [
-        ['', '', '', '', '', '', 'Cong:', _format_number(total_amount)],
-    ]
-    
-    # Tax row (only if tax_rate > 0)
-    if tax_rate > 0:
-        summary_data.append(['', '', '', '', '', '', f'Thue ({tax_rate:.0f}%):', _format_number(tax_amount)])
-        summary_data.append(['', '', '', '', '', '', 'TONG CONG:', _format_number(grand_total)])
-    else:
-        summary_data.append(['', '', '', '', '', '', 'TONG CONG:', _format_number(total_amount)])
-    
-    summary_table = Table(summary_data, colWidths=col_widths)
-    summary_table.setStyle(TableStyle([
-        ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ('ALIGN', (-2, 0), (-1, -1), 'RIGHT'),
-        ('FONTNAME', (-2, -1), (-1, -1), 'Helvetica-Bold'),  # Bold last row (TONG CONG)
-    ]))
-    elements.append(summary_table)
-    elements.append(Spacer(1, 5))
-    
-    # Total in words (use grand_total)
-    total_in_words = amount_to_vietnamese_words(grand_total)
-    elements.append(Paragraph(f"<i>Bang chu: {total_in_words}</i>", normal_style))
-    elements.append(Spacer(1, 20))
-    
-    # ============================================
-    # SIGNATURE
-    # ============================================
-    sig_data = [
-        ['Nguoi lap phieu', 'Nguoi giao/nhan', 'Thu kho', 'Giam doc'],
-        ['(Ky, ghi ro ho ten)', '(Ky, ghi ro ho ten)', '(Ky, ghi ro ho ten)', '(Ky, ghi ro ho ten)'],
-        ['', '', '', ''],
-        ['', '', '', ''],
-        [data.prepared_by or '', data.receiver or '', data.storekeeper or '', data.director or ''],
-    ]
-    sig_table = Table(sig_data, colWidths=[110, 110, 110, 110])
-    sig_table.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTSIZE', (0, 0), (-1, 0), 10),
-        ('FONTSIZE', (0, 1), (-1, 1), 8),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTNAME', (0, 1), (-1, 1), 'Helvetica-Oblique'),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
-    ]))
-    elements.append(sig_table)
-    
-    # Build PDF
-    doc.build(elements)
-    buffer.seek(0)
-    
+    buffer = pdf_renderer.render(data)
     filename = _generate_filename(data, 'pdf')
     
     return buffer, filename
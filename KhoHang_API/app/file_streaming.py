@@ -0,0 +1,123 @@
+# app/file_streaming.py
+"""
+Streaming file responses with HTTP validators and byte ranges.
+
+file_response() never holds more than one chunk of the file in memory:
+- ETag (size + mtime) and Last-Modified on every response
+- If-None-Match / If-Modified-Since -> 304 Not Modified
+- Range: bytes=a-b (one range) -> 206 Partial Content, If-Range honoured;
+  unsatisfiable ranges -> 416, multiple ranges -> whole file (200)
+"""
+
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Optional, Tuple
+from urllib.parse import quote
+import mimetypes
+import os
+
+import aiofiles
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+CHUNK_SIZE = 64 * 1024
+
+EXPOSED_HEADERS = "Content-Disposition, Content-Range, Accept-Ranges, ETag, Last-Modified"
+
+
+def file_etag(stat: os.stat_result) -> str:
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def content_disposition(filename: str, disposition: str = "attachment") -> str:
+    """ASCII fallback plus RFC 5987 filename* so Vietnamese names survive."""
+    fallback = filename.encode("ascii", "replace").decode("ascii").replace('"', "_").replace("?", "_")
+    return f"{disposition}; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """(start, end inclusive) of a single 'bytes=' range; None = serve whole file; raises ValueError if unsatisfiable."""
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            # Suffix range: last N bytes
+            start, end = max(size - int(last), 0), size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end or start < 0:
+        raise ValueError(header)
+    return start, min(end, size - 1)
+
+
+def _if_range_matches(request: Request, etag: str, last_modified: str) -> bool:
+    if_range = request.headers.get("if-range")
+    return if_range is None or if_range.strip() in (etag, last_modified)
+
+
+async def _read_range(path: Path, start: int, length: int):
+    async with aiofiles.open(path, "rb") as f:
+        await f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = await f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def file_response(request: Request, path: Path, filename: Optional[str] = None,
+                  media_type: Optional[str] = None, disposition: str = "attachment") -> Response:
+    """Stream `path` honouring conditional and Range headers of `request`."""
+    stat = path.stat()
+    size = stat.st_size
+    etag = file_etag(stat)
+    last_modified = formatdate(stat.st_mtime, usegmt=True)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": content_disposition(filename or path.name, disposition),
+        "Access-Control-Expose-Headers": EXPOSED_HEADERS,
+    }
+
+    if _not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    media_type = media_type or mimetypes.guess_type(str(path))[0] or "application/octet-stream"
+    start, end, status_code = 0, size - 1, 200
+    range_header = request.headers.get("range")
+    if range_header and _if_range_matches(request, etag, last_modified):
+        try:
+            byte_range = _parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        if byte_range:
+            start, end = byte_range
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    length = end - start + 1 if size else 0
+    headers["Content-Length"] = str(length)
+    return StreamingResponse(_read_range(path, start, length), status_code=status_code,
+                             media_type=media_type, headers=headers)
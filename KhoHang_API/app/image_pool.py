@@ -0,0 +1,108 @@
+# app/image_pool.py
+"""
+Image decoding / resizing off the event loop.
+
+PIL work (decode, LANCZOS resize, WebP encode) is CPU-bound and holds the GIL
+for most of its time, so running it inside async handlers stalls every
+WebSocket of the worker. The functions below run in a small process pool
+(IMAGE_POOL_WORKERS, 0 = threads in-process) and take / return plain bytes.
+
+Every uploaded image also gets variants generated once, at upload time:
+    small 128px, medium 512px, large 1280px (longest side, never upscaled)
+encoded as WebP (JPEG if this Pillow build has no WebP encoder). They are
+stored next to the original as <stem>.<size>.webp (see upload_store), so
+clients load the size they display instead of the original.
+"""
+
+from concurrent.futures import Executor, ProcessPoolExecutor
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+import asyncio
+import threading
+
+from PIL import Image, features
+
+from .config import IMAGE_POOL_WORKERS
+
+VARIANT_SIZES = {"small": 128, "medium": 512, "large": 1280}
+VARIANT_QUALITY = 80
+
+_pool: Optional[Executor] = None
+_pool_lock = threading.Lock()
+
+
+def _variant_format() -> Tuple[str, str]:
+    return ("WEBP", ".webp") if features.check("webp") else ("JPEG", ".jpg")
+
+
+def _flatten(image: Image.Image) -> Image.Image:
+    """RGB on a white background (WebP/JPEG variants, no transparency surprises)."""
+    if image.mode in ("RGBA", "LA", "P"):
+        if image.mode == "P":
+            image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        return background
+    return image if image.mode == "RGB" else image.convert("RGB")
+
+
+# ---------- work run in the pool (top-level so they pickle) ----------
+
+def inspect_image(data: bytes) -> Tuple[int, int, str]:
+    """(width, height, format) of an image; raises on invalid data."""
+    with Image.open(BytesIO(data)) as image:
+        image.verify()
+    with Image.open(BytesIO(data)) as image:
+        return image.width, image.height, (image.format or "").lower()
+
+
+def convert_to_webp(data: bytes, max_size: int, quality: int) -> bytes:
+    """Flatten, shrink to max_size (longest side) and encode as WebP."""
+    with Image.open(BytesIO(data)) as image:
+        image = _flatten(image)
+        if image.width > max_size or image.height > max_size:
+            image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+        output = BytesIO()
+        image.save(output, "WEBP", quality=quality, method=6)
+        return output.getvalue()
+
+
+def make_variants(data: bytes) -> Dict[str, Tuple[bytes, str]]:
+    """{size name: (encoded bytes, extension)} for every VARIANT_SIZES entry."""
+    fmt, ext = _variant_format()
+    variants = {}
+    with Image.open(BytesIO(data)) as source:
+        source.draft("RGB", (max(VARIANT_SIZES.values()),) * 2)  # JPEG: decode at reduced scale
+        image = _flatten(source)
+        # Largest first, each from the previous one: cheaper than resizing the original three times
+        for name, size in sorted(VARIANT_SIZES.items(), key=lambda item: -item[1]):
+            image.thumbnail((size, size), Image.Resampling.LANCZOS)
+            output = BytesIO()
+            image.save(output, fmt, quality=VARIANT_QUALITY)
+            variants[name] = (output.getvalue(), ext)
+    return variants
+
+
+# ---------- async entry points ----------
+
+def _executor() -> Optional[Executor]:
+    global _pool
+    if IMAGE_POOL_WORKERS <= 0:
+        return None  # loop's default thread pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=IMAGE_POOL_WORKERS)
+        return _pool
+
+
+async def run(fn, *args):
+    """Run one of the functions above in the pool and await its result."""
+    return await asyncio.get_running_loop().run_in_executor(_executor(), fn, *args)
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
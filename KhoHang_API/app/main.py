@@ -2,26 +2,25 @@
 from typing import List, Any, Dict, Optional
 import shutil
 from pathlib import Path
-import uuid
-import io
+import mimetypes
 import asyncio
 from datetime import datetime, timezone
 
-from fastapi import FastAPI, HTTPException, status, File, UploadFile, Depends, Query, Header
-from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi import FastAPI, HTTPException, status, File, UploadFile, Depends, Query, Header, Request
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 import requests
-from PIL import Image
 from sqlalchemy import func, or_
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError, OperationalError
 
 from . import schemas
-from .config import GEMINI_API_KEY  # Removed FIREBASE imports
+from .config import GEMINI_API_KEY, RT_BACKPLANE_URL, UPLOAD_GC_INTERVAL_HOURS  # Removed FIREBASE imports
 from .enums import TransactionType, RecordStatus
 from .gemini_client import generate_reply, is_configured as gemini_ready, MODEL_NAME, QuotaExceededError
 from .export_service import VoucherExportRequest, export_to_excel, export_to_pdf
+from . import voucher_export
+from .voucher_export import VoucherBatchExportRequest
 from .database import (
     get_db, SupplierModel, ItemModel, StockTransactionModel, WarehouseModel,
     CompanyInfoModel, StockInRecordModel, StockOutRecordModel, UserModel, get_datadir
@@ -33,6 +32,9 @@ from .inventory_service import (
     cancel_stock_out_record,
 )
 from .search_service import paginate_query, global_search
+from .file_streaming import file_response
+from . import image_pool, upload_gc, upload_store
+from .upload_store import UploadStaticFiles
 from .security import verify_password
 from .auth_middleware import get_current_user, get_current_user_optional
 
@@ -80,7 +82,9 @@ from .auth_routes import router as auth_router
 from .user_routes import router as user_router
 from .chatbot_routes import router as chatbot_router
 from .rt_chat_routes import router as rt_chat_router
-from .rt_chat_ws import websocket_endpoint
+from .rt_chat_ws import websocket_endpoint, manager as rt_manager
+from .rt_backplane import create_backplane
+from .rate_limiter import rate_limit, configure_shared_store, UPLOAD_LIMITER
 
 DATA_DIR = get_datadir()
 UPLOADS_DIR = DATA_DIR / "uploads"
@@ -104,7 +108,8 @@ print(f"[Startup] Directories created successfully")
 
 app = FastAPI(title="N3T KhoHang API", version="0.1.0")
 
-app.mount("/uploads", StaticFiles(directory=str(UPLOADS_DIR)), name="uploads")
+# Legacy files from disk, newer uploads through the content-addressed blob store
+app.mount("/uploads", UploadStaticFiles(directory=str(UPLOADS_DIR)), name="uploads")
 
 app.add_middleware(
     CORSMiddleware,
@@ -123,6 +128,30 @@ app.include_router(rt_chat_router)
 # WebSocket endpoint for realtime chat
 app.websocket("/ws/rt")(websocket_endpoint)
 
+
+@app.on_event("startup")
+async def start_realtime_backplane():
+    """Connect the realtime ConnectionManager and rate limiters to the cross-worker backplane."""
+    await configure_shared_store(RT_BACKPLANE_URL)
+    await rt_manager.start(create_backplane(RT_BACKPLANE_URL))
+
+
+@app.on_event("startup")
+async def start_upload_gc():
+    """Sweep orphaned uploads every UPLOAD_GC_INTERVAL_HOURS (0 = off)."""
+    if UPLOAD_GC_INTERVAL_HOURS > 0:
+        app.state.upload_gc_task = asyncio.create_task(upload_gc.run_periodically(UPLOAD_GC_INTERVAL_HOURS))
+
+
+@app.on_event("shutdown")
+async def stop_realtime_backplane():
+    await rt_manager.stop()
+    image_pool.shutdown()
+    voucher_export.shutdown()
+    task = getattr(app.state, "upload_gc_task", None)
+    if task is not None:
+        task.cancel()
+
 # -------------------------------------------------
 # ROOT
 # -------------------------------------------------
@@ -146,38 +175,49 @@ def debug_paths():
     }
 
 @app.get("/download/{folder}/{filename}")
-async def download_file(folder: str, filename: str):
+async def download_file(folder: str, filename: str, request: Request):
     """
     Force download endpoint with Content-Disposition header.
     Supports folders: rt_files, chat_files, chatbot, logos, avatars
+    Streams the file in chunks (constant memory); supports Range (resume),
+    ETag / Last-Modified and 304 Not Modified (see file_streaming).
     """
     # Validate folder to prevent directory traversal
     allowed_folders = ["rt_files", "chat_files", "chatbot", "logos", "avatars"]
     if folder not in allowed_folders:
         raise HTTPException(status_code=400, detail="Invalid folder")
     
-    file_path = UPLOADS_DIR / folder / filename
+    file_path = upload_store.resolve(folder, filename)
     
-    if not file_path.exists() or not file_path.is_file():
+    if file_path is None:
         raise HTTPException(status_code=404, detail="File not found")
     
-    # Read file content
-    with open(file_path, "rb") as f:
-        content = f.read()
-    
-    # Determine media type
-    import mimetypes
-    media_type = mimetypes.guess_type(str(file_path))[0] or "application/octet-stream"
-    
-    # Return with Content-Disposition header to force download
-    return StreamingResponse(
-        io.BytesIO(content),
-        media_type=media_type,
-        headers={
-            "Content-Disposition": f'attachment; filename="{filename}"',
-            "Access-Control-Expose-Headers": "Content-Disposition"
-        }
-    )
+    # Content-Disposition: attachment forces the download; type from the URL name (blobs keep
+    # the extension of their first upload)
+    media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    return file_response(request, file_path, filename, media_type)
+
+
+@app.post("/admin/uploads/gc")
+async def run_upload_gc(
+    dry_run: bool = Query(True),
+    grace_hours: Optional[float] = Query(None, ge=0),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    API: POST /admin/uploads/gc?dry_run=&grace_hours=
+    Purpose: Delete uploads no message, avatar, chatbot config or company logo references
+    Request (JSON): null
+    Response (JSON) [200]: { dryRun, graceHours, refs, legacyFiles, blobs, tmpFiles, bytes, folders, sample, kept? }
+    Response Errors:
+    - 401: { "detail": "Unauthorized" }
+    - 403: { "detail": "Only admin can collect uploads" }
+    Notes: dry_run defaults to true (report only); grace_hours defaults to UPLOAD_GC_GRACE_HOURS;
+    the same sweep runs in the background every UPLOAD_GC_INTERVAL_HOURS when that is set (see upload_gc)
+    """
+    if current_user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Only admin can collect uploads")
+    return await asyncio.to_thread(upload_gc.run_once, grace_hours, dry_run)
 
 # -------------------------------------------------
 # OLD AUTH ROUTES (DEPRECATED - KEPT FOR REFERENCE)
@@ -713,6 +753,30 @@ def get_stock_in_record(record_id: str, db: Session = Depends(get_db)):
     return stock_in_record_model_to_schema(record)
 
 
+@app.get("/stock/in/{record_id}/export.{fmt}")
+async def export_stock_in_record(
+    record_id: str,
+    fmt: str,
+    db: Session = Depends(get_db),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    API: GET /stock/in/{record_id}/export.pdf | export.xlsx
+    Purpose: Phiếu nhập kho as PDF / Excel, built from the stored record
+    Response [200]: File stream, Content-Disposition attachment, ETag
+    Response [304]: If-None-Match matches (voucher unchanged)
+    Response Errors:
+    - 400: { "detail": "Template chỉ hỗ trợ tối đa 18 dòng hàng hóa" } (xlsx)
+    - 404: { "detail": "Không tìm thấy phiếu nhập kho" } (or unknown format)
+    Notes: rendered files are cached by record id + content hash (see voucher_export)
+    """
+    record = db.query(StockInRecordModel).filter(StockInRecordModel.id == record_id).first()
+    if not record or fmt not in voucher_export.VOUCHER_FORMATS:
+        raise HTTPException(status_code=404, detail="Không tìm thấy phiếu nhập kho")
+    data = voucher_export.voucher_from_stock_in(record, voucher_export.warehouse_location(db, record.warehouse_code))
+    return await _record_export_response(record_id, data, fmt, if_none_match)
+
+
 @app.post("/stock/in", response_model=schemas.StockInRecord, status_code=201)
 async def create_stock_in(
     data: schemas.StockInBatchCreate, 
@@ -846,6 +910,30 @@ def get_stock_out_record(record_id: str, db: Session = Depends(get_db)):
     return stock_out_record_model_to_schema(record)
 
 
+@app.get("/stock/out/{record_id}/export.{fmt}")
+async def export_stock_out_record(
+    record_id: str,
+    fmt: str,
+    db: Session = Depends(get_db),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    API: GET /stock/out/{record_id}/export.pdf | export.xlsx
+    Purpose: Phiếu xuất kho as PDF / Excel, built from the stored record
+    Response [200]: File stream, Content-Disposition attachment, ETag
+    Response [304]: If-None-Match matches (voucher unchanged)
+    Response Errors:
+    - 400: { "detail": "Template chỉ hỗ trợ tối đa 18 dòng hàng hóa" } (xlsx)
+    - 404: { "detail": "Không tìm thấy phiếu xuất kho" } (or unknown format)
+    Notes: rendered files are cached by record id + content hash (see voucher_export)
+    """
+    record = db.query(StockOutRecordModel).filter(StockOutRecordModel.id == record_id).first()
+    if not record or fmt not in voucher_export.VOUCHER_FORMATS:
+        raise HTTPException(status_code=404, detail="Không tìm thấy phiếu xuất kho")
+    data = voucher_export.voucher_from_stock_out(record, voucher_export.warehouse_location(db, record.warehouse_code))
+    return await _record_export_response(record_id, data, fmt, if_none_match)
+
+
 @app.post("/stock/out", response_model=schemas.StockOutRecord, status_code=201)
 async def create_stock_out(
     data: schemas.StockOutBatchCreate, 
@@ -895,6 +983,29 @@ async def delete_stock_out(
 # EXPORT
 # -------------------------------------------------
 
+EXPORT_MEDIA_TYPES = {
+    "pdf": "application/pdf",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+async def _record_export_response(record_id: str, data: VoucherExportRequest, fmt: str,
+                                  if_none_match: Optional[str]) -> Response:
+    if fmt == "xlsx" and len(data.items) > voucher_export.MAX_EXCEL_ITEMS:
+        raise HTTPException(status_code=400, detail="Template chỉ hỗ trợ tối đa 18 dòng hàng hóa")
+    digest = voucher_export.content_hash(data)
+    etag = f'"{digest[:32]}-{fmt}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Access-Control-Expose-Headers": "Content-Disposition, ETag"}
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+    try:
+        rendered = await voucher_export.render_record(record_id, data, fmt, digest)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Export {fmt.upper()} error: {str(e)}")
+    headers["Content-Disposition"] = f'attachment; filename="{rendered.filename}"'
+    return Response(rendered.content, media_type=EXPORT_MEDIA_TYPES[fmt], headers=headers)
+
+
 @app.post("/export/excel")
 def export_voucher_excel(data: VoucherExportRequest):
     try:
@@ -935,12 +1046,48 @@ def export_voucher_pdf(data: VoucherExportRequest):
         raise HTTPException(status_code=500, detail=f"Export PDF error: {str(e)}")
 
 
+@app.post("/export/batch")
+def export_voucher_batch(request: VoucherBatchExportRequest, db: Session = Depends(get_db)):
+    """
+    API: POST /export/batch
+    Purpose: Export many vouchers at once (month-end closing) as one ZIP
+    Request (JSON): { voucher_ids?: [...], date_from?: "2025-12-01", date_to?: "2025-12-31",
+                      types: ["PN", "PX"], formats: ["pdf", "xlsx"] }
+    Response [200]: application/zip stream: PN/*.pdf|xlsx, PX/*.pdf|xlsx (+ LOI.txt for vouchers that failed)
+    Response Errors:
+    - 400: { "detail": "Cần chọn danh sách phiếu hoặc khoảng ngày" }
+    - 404: { "detail": "Không có phiếu nào để xuất" }
+    Notes: cancelled records are skipped; vouchers are rendered in the export pool and
+    written to the ZIP as they finish (see voucher_export)
+    """
+    if not request.voucher_ids and not (request.date_from or request.date_to):
+        raise HTTPException(status_code=400, detail="Cần chọn danh sách phiếu hoặc khoảng ngày")
+    if not request.formats or not request.types:
+        raise HTTPException(status_code=400, detail="Cần chọn loại phiếu và định dạng xuất")
+
+    selection = (request.voucher_ids, request.date_from, request.date_to, set(request.types))
+    if next(voucher_export.collect_vouchers(db, *selection), None) is None:
+        raise HTTPException(status_code=404, detail="Không có phiếu nào để xuất")
+
+    filename = voucher_export.batch_filename(request.date_from, request.date_to)
+    # Read again while streaming, on a session of its own: this one closes with the request
+    vouchers = voucher_export.stream_vouchers(db.get_bind(), *selection)
+    return StreamingResponse(
+        voucher_export.stream_zip(vouchers, list(dict.fromkeys(request.formats))),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Access-Control-Expose-Headers": "Content-Disposition"
+        }
+    )
+
+
 # -------------------------------------------------
 # COMPANY INFO
 # -------------------------------------------------
 
-@app.post("/company/upload-logo")
-async def upload_company_logo(file: UploadFile = File(...)):
+@app.post("/company/upload-logo", dependencies=[Depends(rate_limit(UPLOAD_LIMITER))])
+async def upload_company_logo(file: UploadFile = File(...), db: Session = Depends(get_db)):
     try:
         MAX_SIZE = 10 * 1024 * 1024
         contents = await file.read()
@@ -949,26 +1096,24 @@ async def upload_company_logo(file: UploadFile = File(...)):
             raise HTTPException(status_code=400, detail="Kích thước file vượt quá 10MB")
         
         try:
-            image = Image.open(io.BytesIO(contents))
-            width, height = image.size
-            if width != height:
-                raise HTTPException(status_code=400, detail=f"Ảnh phải vuông (1:1). Hiện tại: {width}x{height}")
-            if image.format.lower() not in ['png', 'jpg', 'jpeg', 'webp']:
-                raise HTTPException(status_code=400, detail="Chỉ hỗ trợ PNG, JPG, JPEG, WEBP")
-        except Exception as e:
-            if isinstance(e, HTTPException): raise e
+            # Decoding runs in the image pool, not on the event loop
+            width, height, image_format = await image_pool.run(image_pool.inspect_image, contents)
+        except Exception:
             raise HTTPException(status_code=400, detail="File không phải ảnh hợp lệ")
+        if width != height:
+            raise HTTPException(status_code=400, detail=f"Ảnh phải vuông (1:1). Hiện tại: {width}x{height}")
+        if image_format not in ['png', 'jpg', 'jpeg', 'webp']:
+            raise HTTPException(status_code=400, detail="Chỉ hỗ trợ PNG, JPG, JPEG, WEBP")
         
         file_ext = file.filename.split('.')[-1].lower() if file.filename else 'png'
-        new_filename = f"{uuid.uuid4()}.{file_ext}"
-        file_path = LOGO_DIR / new_filename
-        
-        with open(file_path, "wb") as f:
-            f.write(contents)
+        stored = upload_store.save_bytes(db, contents, "logos", f".{file_ext}", file.filename, file.content_type)
+        thumbnails = await upload_store.add_image_variants(db, stored, "logos", source=contents)
+        db.commit()
         
         return {
-            "logo_url": f"/uploads/logos/{new_filename}",
-            "filename": new_filename,
+            "logo_url": stored.url,
+            "thumbnails": thumbnails,
+            "filename": stored.name,
             "size": len(contents),
             "dimensions": f"{width}x{height}"
         }
@@ -0,0 +1,243 @@
+# app/rate_limiter.py
+"""
+Token-bucket rate limiting shared by WebSocket handlers and HTTP routes.
+
+Each TokenBucketLimiter keeps O(1) state per key (tokens + last refill time) in
+an LRU-ordered dict. A bucket that has been idle long enough to refill
+completely is indistinguishable from a new one, so it is evicted; memory is
+bounded by active keys (and hard-capped by max_keys).
+
+When RT_BACKPLANE_URL points at Redis, configure_shared_store() makes every
+limiter check a shared bucket (atomic Lua script) so limits hold across
+uvicorn workers. It is probed once at startup: a server without EVAL (the
+bundled stand-in hub) disables it; while Redis is unreachable the local
+bucket is used and Redis is retried every SHARED_STORE_RETRY_SECONDS.
+
+Per-IP limits key on the socket peer. X-Forwarded-For is only read when the
+peer is one of TRUSTED_PROXIES, and then the right-most hop that is not a
+trusted proxy is the client (a client can prepend anything it likes).
+
+HTTP usage (FastAPI dependency):
+    @router.post("/login", dependencies=[Depends(rate_limit(LOGIN_LIMITER))])
+"""
+
+from collections import OrderedDict
+from typing import List, Optional, Union
+from time import monotonic
+import asyncio
+import ipaddress
+
+from fastapi import Depends, HTTPException, Request
+
+from .auth_middleware import get_current_user
+from .config import TRUSTED_PROXIES
+from .rt_backplane import RespClient, RespError
+
+DEFAULT_MAX_KEYS = 100_000
+SHARED_STORE_RETRY_SECONDS = 30
+
+
+class TokenBucketLimiter:
+    """Token bucket: `capacity` burst, refilled at `rate` tokens per second."""
+
+    def __init__(self, name: str, rate: float, capacity: float, max_keys: int = DEFAULT_MAX_KEYS):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        # Seconds until an empty bucket is full again; idle longer => evictable
+        self.idle_ttl = capacity / rate
+        # key -> [tokens, last_refill]; oldest access first
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def _evict(self, now: float):
+        buckets = self._buckets
+        while buckets:
+            _, (_, last) = next(iter(buckets.items()))
+            if now - last < self.idle_ttl and len(buckets) <= self.max_keys:
+                break
+            buckets.popitem(last=False)
+
+    def allow_local(self, key: str, cost: float = 1.0, now: Optional[float] = None) -> bool:
+        """Take `cost` tokens from this process's bucket for key."""
+        now = monotonic() if now is None else now
+        self._evict(now)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            tokens = self.capacity
+        else:
+            tokens = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+            self._buckets.move_to_end(key)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        self._buckets[key] = [tokens, now]
+        return allowed
+
+    async def allow(self, key: str, cost: float = 1.0) -> bool:
+        """Take tokens from the shared bucket if configured, else the local one."""
+        if _shared_store is not None:
+            result = await _shared_store.take(f"{self.name}:{key}", self.rate, self.capacity, cost)
+            if result is not None:
+                return result
+        return self.allow_local(key, cost)
+
+
+# =============================================================
+# SHARED STORE (cross-worker)
+# =============================================================
+
+_TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * rate)
+local allowed = 0
+if tokens >= cost then
+  tokens = tokens - cost
+  allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return allowed
+"""
+
+
+class RespBucketStore:
+    """Token buckets kept in Redis; idle keys expire via PEXPIRE."""
+
+    def __init__(self, url: str, prefix: str = "khohang:rl:"):
+        self.client = RespClient(url)
+        self.prefix = prefix
+        self._warned = False
+        # monotonic() before which Redis is not tried again after a failure
+        self._retry_at = 0.0
+
+    async def probe(self) -> Optional[bool]:
+        """True if the server runs Lua, False if it rejects EVAL, None if unreachable."""
+        try:
+            return await self.client.execute("EVAL", "return 1", 0) == 1
+        except RespError:
+            return False
+        except (ConnectionError, OSError, asyncio.IncompleteReadError):
+            self._retry_at = monotonic() + SHARED_STORE_RETRY_SECONDS
+            return None
+
+    async def take(self, key: str, rate: float, capacity: float, cost: float) -> Optional[bool]:
+        """Returns True/False, or None when Redis is unreachable (caller falls back)."""
+        if monotonic() < self._retry_at:
+            return None
+        try:
+            reply = await self.client.execute(
+                "EVAL", _TOKEN_BUCKET_LUA, 1, self.prefix + key, rate, capacity, cost
+            )
+            self._warned = False
+            return reply == 1
+        except (ConnectionError, OSError, asyncio.IncompleteReadError, RespError) as e:
+            # Back off instead of paying a failed round trip / reconnect on every check
+            self._retry_at = monotonic() + SHARED_STORE_RETRY_SECONDS
+            if not self._warned:
+                print(f"[RateLimit] Shared store unavailable, using per-worker buckets: {e}")
+                self._warned = True
+            return None
+
+    def close(self):
+        self.client.close()
+
+
+_shared_store: Optional[RespBucketStore] = None
+
+
+async def configure_shared_store(url: Optional[str]):
+    """Use Redis-backed buckets for redis:// URLs that support EVAL (called on app startup)."""
+    global _shared_store
+    if _shared_store is not None:
+        _shared_store.close()
+        _shared_store = None
+    if not (url and url.startswith("redis://")):
+        return
+    store = RespBucketStore(url)
+    supported = await store.probe()
+    if supported is False:
+        print("[RateLimit] Backplane has no EVAL (stand-in hub?): using per-worker buckets")
+        store.close()
+        return
+    if supported is None:
+        print(f"[RateLimit] Redis unreachable, retrying in {SHARED_STORE_RETRY_SECONDS}s")
+    _shared_store = store
+
+
+# =============================================================
+# LIMITERS
+# =============================================================
+
+# WebSocket msg:send: 5 messages/second per user
+MSG_SEND_LIMITER = TokenBucketLimiter("msg_send", rate=5, capacity=5)
+# /rt/users/lookup: 10 requests/minute per user
+USER_LOOKUP_LIMITER = TokenBucketLimiter("user_lookup", rate=10 / 60, capacity=10)
+# /auth/login: bursts of 10, then 1 attempt every 6 seconds per client IP
+LOGIN_LIMITER = TokenBucketLimiter("login", rate=1 / 6, capacity=10)
+# OTP requests (register/password/passkey): 5 per 10 minutes per client IP
+OTP_LIMITER = TokenBucketLimiter("otp", rate=5 / 600, capacity=5)
+# File/avatar/logo uploads: bursts of 20, then 1 per 3 seconds per user
+UPLOAD_LIMITER = TokenBucketLimiter("upload", rate=1 / 3, capacity=20)
+
+
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+
+def _parse_networks(entries: List[str]) -> List[Network]:
+    networks = []
+    for entry in entries:
+        try:
+            networks.append(ipaddress.ip_network(entry, strict=False))
+        except ValueError:
+            print(f"[RateLimit] Ignoring invalid TRUSTED_PROXIES entry: {entry}")
+    return networks
+
+
+_trusted_proxies = _parse_networks(TRUSTED_PROXIES)
+
+
+def _is_trusted(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in _trusted_proxies)
+
+
+def _client_ip(request: Request) -> str:
+    peer = request.client.host if request.client else "unknown"
+    if not _is_trusted(peer):
+        return peer  # Direct client: its X-Forwarded-For is whatever it chose to send
+    hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    # Each trusted proxy appends the address it received from: walk back to the first untrusted one
+    for hop in reversed(hops):
+        if not _is_trusted(hop):
+            return hop
+    return hops[0] if hops else peer
+
+
+def rate_limit(limiter: TokenBucketLimiter, key: str = "ip"):
+    """
+    FastAPI dependency enforcing limiter per client IP (key="ip") or per
+    authenticated user (key="user"). Raises 429 when the bucket is empty.
+    """
+    if key == "user":
+        async def dependency(current_user: dict = Depends(get_current_user)):
+            if not await limiter.allow(current_user["id"]):
+                raise HTTPException(status_code=429, detail="Too many requests")
+    else:
+        async def dependency(request: Request):
+            if not await limiter.allow(_client_ip(request)):
+                raise HTTPException(status_code=429, detail="Too many requests")
+    return dependency
@@ -0,0 +1,257 @@
+# app/rt_archive.py
+"""
+Cold storage for old realtime chat messages.
+
+Messages older than RT_ARCHIVE_AFTER_DAYS are moved out of rt_messages /
+rt_message_receipts / rt_message_reactions / rt_message_reaction_counts into one SQLite file per month
+(data/archive/rt_messages_YYYY-MM.db). Each archived message is a single row
+holding its rt_message_cache record (content, receipts, reaction counts) as
+zlib-compressed JSON, keyed by (conversation_id, created_at) for paging. The
+live tables and their indexes stay small; history paging falls through to the
+archive once the live rows of a conversation are exhausted (see
+get_conversation_messages in rt_chat_routes).
+
+The newest message of each conversation stays live regardless of age
+(conversation list previews), so a conversation's live rows are always newer
+than its archived ones. Archived messages are read-only: pinned ones are still
+listed (get_pinned_messages falls back to the archive), but edit / delete /
+react / pin on them answer NOT_FOUND.
+
+Run it from the admin endpoint POST /rt/archive/run or from the command line:
+    python -m app.rt_archive [--days 180] [--dry-run]
+"""
+
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import argparse
+import json
+import sqlite3
+import threading
+import zlib
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session, aliased, selectinload
+
+from .config import RT_ARCHIVE_AFTER_DAYS
+from .database import (
+    DATA_DIR,
+    RTMessageModel,
+    RTMessageReceiptModel,
+    RTMessageReactionModel,
+    RTMessageReactionCountModel,
+    ensure_utc,
+)
+from .rt_message_cache import message_cache, record_from_model
+
+ARCHIVE_DIR = DATA_DIR / "archive"
+ARCHIVE_BATCH_SIZE = 500
+COMPRESS_LEVEL = 6
+
+# Fixed-width UTC timestamps so the TEXT column sorts chronologically
+_TS_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archived_messages (
+    id TEXT PRIMARY KEY,
+    conversation_id TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    deleted INTEGER NOT NULL DEFAULT 0,
+    payload BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_archived_conv_created ON archived_messages(conversation_id, created_at);
+"""
+
+
+def _ts(dt: datetime) -> str:
+    return ensure_utc(dt).strftime(_TS_FORMAT)
+
+
+def _encode(record: dict) -> bytes:
+    def default(value):
+        if isinstance(value, datetime):
+            return ensure_utc(value).isoformat()
+        raise TypeError(f"Not serializable: {type(value)}")
+    return zlib.compress(json.dumps(record, default=default, ensure_ascii=False).encode("utf-8"), COMPRESS_LEVEL)
+
+
+def _decode(payload: bytes) -> dict:
+    record = json.loads(zlib.decompress(payload))
+    for key in ("created_at", "edited_at", "deleted_at"):
+        if record.get(key):
+            record[key] = datetime.fromisoformat(record[key])
+    for receipt in record["receipts"].values():
+        for key in ("delivered_at", "read_at"):
+            if receipt.get(key):
+                receipt[key] = datetime.fromisoformat(receipt[key])
+    return record
+
+
+class MessageArchive:
+    """Monthly archive files under one directory."""
+
+    def __init__(self, directory: Path = ARCHIVE_DIR):
+        self.directory = Path(directory)
+        self._lock = threading.Lock()
+
+    def _path(self, month: str) -> Path:
+        return self.directory / f"rt_messages_{month}.db"
+
+    def months(self) -> List[str]:
+        """Archived months, newest first ('YYYY-MM')."""
+        if not self.directory.exists():
+            return []
+        return sorted((p.stem[len("rt_messages_"):] for p in self.directory.glob("rt_messages_*.db")), reverse=True)
+
+    def _connect(self, month: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(self._path(month))
+        conn.executescript(_SCHEMA)
+        return conn
+
+    # ---------- writes ----------
+
+    def store(self, records: List[dict]) -> Dict[str, int]:
+        """Write records into their month files (idempotent); returns count per month."""
+        by_month: Dict[str, List[dict]] = {}
+        for record in records:
+            by_month.setdefault(ensure_utc(record["created_at"]).strftime("%Y-%m"), []).append(record)
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            for month, items in by_month.items():
+                conn = self._connect(month)
+                try:
+                    with conn:
+                        conn.executemany(
+                            "INSERT OR REPLACE INTO archived_messages (id, conversation_id, created_at, deleted, payload) "
+                            "VALUES (?, ?, ?, ?, ?)",
+                            [(r["id"], r["conversation_id"], _ts(r["created_at"]), int(r["deleted_at"] is not None),
+                              _encode(r)) for r in items]
+                        )
+                finally:
+                    conn.close()
+        return {month: len(items) for month, items in by_month.items()}
+
+    # ---------- reads ----------
+
+    def get(self, message_id: str) -> Optional[dict]:
+        for month in self.months():
+            conn = self._connect(month)
+            try:
+                row = conn.execute("SELECT payload FROM archived_messages WHERE id = ?", (message_id,)).fetchone()
+            finally:
+                conn.close()
+            if row:
+                return _decode(row[0])
+        return None
+
+    def older(self, conversation_id: str, before: Optional[datetime], limit: int) -> Tuple[List[dict], bool]:
+        """Non-deleted archived messages older than `before`, newest first, and has_more."""
+        before_key = _ts(before) if before else None
+        records: List[dict] = []
+        for month in self.months():
+            if before_key and month > before_key[:7]:
+                continue
+            conn = self._connect(month)
+            try:
+                rows = conn.execute(
+                    "SELECT payload FROM archived_messages "
+                    "WHERE conversation_id = ? AND deleted = 0 AND (? IS NULL OR created_at < ?) "
+                    "ORDER BY created_at DESC LIMIT ?",
+                    (conversation_id, before_key, before_key, limit + 1 - len(records))
+                ).fetchall()
+            finally:
+                conn.close()
+            records.extend(_decode(row[0]) for row in rows)
+            if len(records) > limit:
+                return records[:limit], True
+        return records, False
+
+    def iter_records(self):
+        """Every archived message, month by month (maintenance scans such as upload_gc)."""
+        for month in self.months():
+            conn = self._connect(month)
+            try:
+                for (payload,) in conn.execute("SELECT payload FROM archived_messages"):
+                    yield _decode(payload)
+            finally:
+                conn.close()
+
+    def stats(self) -> dict:
+        files = [self._path(m) for m in self.months()]
+        return {"months": len(files), "bytes": sum(f.stat().st_size for f in files)}
+
+
+archive = MessageArchive()
+
+
+def archive_messages(db: Session, older_than_days: int, now: Optional[datetime] = None,
+                     dry_run: bool = False, store: MessageArchive = archive) -> dict:
+    """
+    Move messages created more than older_than_days ago into the monthly archive.
+
+    Batches of ARCHIVE_BATCH_SIZE: each batch is written to the archive first,
+    then deleted from the live tables in one transaction, so an interrupted run
+    only leaves rows that the next run archives again (INSERT OR REPLACE).
+    """
+    cutoff = (now or datetime.now(timezone.utc)) - timedelta(days=older_than_days)
+    newer = aliased(RTMessageModel)
+    candidates = db.query(RTMessageModel).filter(
+        RTMessageModel.created_at < cutoff,
+        # Not the newest message of its conversation
+        db.query(newer.id).filter(
+            newer.conversation_id == RTMessageModel.conversation_id,
+            newer.created_at > RTMessageModel.created_at
+        ).exists()
+    )
+    if dry_run:
+        by_month = db.query(
+            func.strftime("%Y-%m", RTMessageModel.created_at), func.count(RTMessageModel.id)
+        ).filter(RTMessageModel.id.in_(candidates.with_entities(RTMessageModel.id))).group_by(
+            func.strftime("%Y-%m", RTMessageModel.created_at)
+        ).all()
+        return {"dryRun": True, "cutoff": cutoff.isoformat(), "messages": sum(n for _, n in by_month),
+                "months": dict(by_month)}
+
+    moved = 0
+    months: Dict[str, int] = {}
+    conversations = set()
+    while True:
+        batch = candidates.options(
+            selectinload(RTMessageModel.receipts),
+            selectinload(RTMessageModel.reaction_counts)
+        ).order_by(RTMessageModel.created_at.asc()).limit(ARCHIVE_BATCH_SIZE).all()
+        if not batch:
+            break
+        for month, count in store.store([record_from_model(m) for m in batch]).items():
+            months[month] = months.get(month, 0) + count
+        ids = [m.id for m in batch]
+        conversations.update(m.conversation_id for m in batch)
+        db.expunge_all()
+        db.query(RTMessageReceiptModel).filter(RTMessageReceiptModel.message_id.in_(ids)).delete(synchronize_session=False)
+        db.query(RTMessageReactionModel).filter(RTMessageReactionModel.message_id.in_(ids)).delete(synchronize_session=False)
+        db.query(RTMessageReactionCountModel).filter(
+            RTMessageReactionCountModel.message_id.in_(ids)
+        ).delete(synchronize_session=False)
+        db.query(RTMessageModel).filter(RTMessageModel.id.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+        moved += len(ids)
+
+    for conversation_id in conversations:
+        message_cache.invalidate(conversation_id)
+    if moved:
+        print(f"[Archive] Moved {moved} messages older than {cutoff:%Y-%m-%d} into {len(months)} month file(s)")
+    return {"dryRun": False, "cutoff": cutoff.isoformat(), "messages": moved, "months": months}
+
+
+if __name__ == "__main__":
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Move old realtime chat messages into monthly archive files")
+    parser.add_argument("--days", type=int, default=RT_ARCHIVE_AFTER_DAYS or 180)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    session = SessionLocal()
+    try:
+        print(archive_messages(session, args.days, dry_run=args.dry_run))
+    finally:
+        session.close()
@@ -0,0 +1,342 @@
+# app/rt_backplane.py
+"""
+Pub/sub backplane for realtime fan-out across uvicorn workers.
+
+ConnectionManager delivers every event to the sockets it owns locally and
+publishes an envelope here; other workers deliver the same envelope to their
+own sockets. Envelopes are plain dicts:
+    { kind: "user" | "room" | "broadcast" | "presence" | ..., origin: node_id, ... }
+
+Implementations:
+- InProcessBackplane: single worker (default), nothing to forward.
+- RespBackplane: Redis protocol (RESP) PUBLISH/SUBSCRIBE over TCP or a unix
+  socket. Works against a real Redis server or the bundled stand-in hub:
+      python -m app.rt_backplane --listen unix:///tmp/khohang_rt.sock
+      python -m app.rt_backplane --listen redis://127.0.0.1:6390
+
+Configure with RT_BACKPLANE_URL (see config.py).
+"""
+
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+import argparse
+import asyncio
+import json
+import uuid
+
+EnvelopeHandler = Callable[[dict], Awaitable[None]]
+
+DEFAULT_CHANNEL = "khohang:rt"
+RECONNECT_DELAY_SECONDS = 1.0
+
+
+class Backplane:
+    """Base interface: publish envelopes to other workers, receive theirs."""
+
+    def __init__(self):
+        # Unique id of this worker; used to ignore our own envelopes
+        self.node_id = uuid.uuid4().hex
+        self._handler: Optional[EnvelopeHandler] = None
+
+    @property
+    def is_distributed(self) -> bool:
+        return False
+
+    async def start(self, handler: EnvelopeHandler):
+        self._handler = handler
+
+    async def publish(self, envelope: dict):
+        raise NotImplementedError
+
+    async def stop(self):
+        self._handler = None
+
+
+class InProcessBackplane(Backplane):
+    """Single-process backplane: local delivery already reached every socket."""
+
+    async def publish(self, envelope: dict):
+        return None
+
+
+# =============================================================
+# RESP (Redis protocol) helpers
+# =============================================================
+
+def encode_command(*parts) -> bytes:
+    """Encode a command as a RESP array of bulk strings."""
+    out = [f"*{len(parts)}\r\n".encode()]
+    for part in parts:
+        data = part if isinstance(part, bytes) else str(part).encode()
+        out.append(f"${len(data)}\r\n".encode())
+        out.append(data)
+        out.append(b"\r\n")
+    return b"".join(out)
+
+
+def _encode_reply(value) -> bytes:
+    """Encode a server reply (used by the stand-in hub)."""
+    if isinstance(value, int):
+        return f":{value}\r\n".encode()
+    if isinstance(value, list):
+        return f"*{len(value)}\r\n".encode() + b"".join(_encode_reply(v) for v in value)
+    data = value if isinstance(value, bytes) else str(value).encode()
+    return f"${len(data)}\r\n".encode() + data + b"\r\n"
+
+
+class RespError(Exception):
+    pass
+
+
+async def read_reply(reader: asyncio.StreamReader):
+    """Read one RESP value from the stream."""
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Backplane connection closed")
+    prefix, payload = line[:1], line[1:-2]
+    if prefix == b"+":
+        return payload.decode()
+    if prefix == b"-":
+        raise RespError(payload.decode())
+    if prefix == b":":
+        return int(payload)
+    if prefix == b"$":
+        length = int(payload)
+        if length < 0:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2]
+    if prefix == b"*":
+        count = int(payload)
+        if count < 0:
+            return None
+        return [await read_reply(reader) for _ in range(count)]
+    raise RespError(f"Unexpected RESP prefix: {prefix!r}")
+
+
+async def open_connection(url: str) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """Open a stream for redis://host:port or unix:///path URLs."""
+    parsed = urlparse(url)
+    if parsed.scheme == "unix":
+        return await asyncio.open_unix_connection(parsed.path)
+    return await asyncio.open_connection(parsed.hostname or "127.0.0.1", parsed.port or 6379)
+
+
+class RespClient:
+    """Request/reply RESP connection (PUBLISH, EVAL, ...) that reconnects once on failure."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self._password = urlparse(url).password
+        self._conn: Optional[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = None
+        self._lock = asyncio.Lock()
+
+    async def connect(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        reader, writer = await open_connection(self.url)
+        if self._password:
+            writer.write(encode_command("AUTH", self._password))
+            await writer.drain()
+            await read_reply(reader)
+        return reader, writer
+
+    async def execute(self, *parts):
+        """Send one command and return its reply (RespError is raised as-is)."""
+        async with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._conn is None:
+                        self._conn = await self.connect()
+                    reader, writer = self._conn
+                    writer.write(encode_command(*parts))
+                    await writer.drain()
+                    return await read_reply(reader)
+                except (ConnectionError, OSError, asyncio.IncompleteReadError):
+                    self.close()
+                    if attempt:
+                        raise
+
+    def close(self):
+        if self._conn:
+            self._conn[1].close()
+            self._conn = None
+
+
+class RespBackplane(Backplane):
+    """Cross-process backplane over Redis PUBLISH/SUBSCRIBE (or the stand-in hub)."""
+
+    def __init__(self, url: str, channel: str = DEFAULT_CHANNEL):
+        super().__init__()
+        self.url = url
+        self.channel = channel
+        self._pub = RespClient(url)
+        self._reader_task: Optional[asyncio.Task] = None
+        self._subscribed = asyncio.Event()
+        self._closing = False
+        self._resubscribing = False
+
+    @property
+    def is_distributed(self) -> bool:
+        return True
+
+    async def start(self, handler: EnvelopeHandler):
+        await super().start(handler)
+        self._closing = False
+        self._reader_task = asyncio.create_task(self._subscribe_loop())
+        await asyncio.wait_for(self._subscribed.wait(), timeout=5)
+
+    async def _subscribe_loop(self):
+        while not self._closing:
+            writer = None
+            try:
+                reader, writer = await self._pub.connect()
+                writer.write(encode_command("SUBSCRIBE", self.channel))
+                await writer.drain()
+                while True:
+                    reply = await read_reply(reader)
+                    if not isinstance(reply, list) or not reply:
+                        continue
+                    kind = reply[0]
+                    if kind == b"subscribe":
+                        self._subscribed.set()
+                        if self._resubscribing:
+                            # Envelopes published while we were away are lost: let caches resync
+                            self._resubscribing = False
+                            if self._handler is not None:
+                                await self._handler({"kind": "backplane:resync"})
+                    elif kind == b"message" and len(reply) == 3:
+                        await self._dispatch(reply[2])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self._closing:
+                    break
+                print(f"[Backplane] Subscriber error: {e}; reconnecting")
+                self._resubscribing = True
+                await asyncio.sleep(RECONNECT_DELAY_SECONDS)
+            finally:
+                if writer is not None:
+                    writer.close()
+
+    async def _dispatch(self, payload: bytes):
+        try:
+            envelope = json.loads(payload)
+        except (ValueError, TypeError):
+            return
+        if envelope.get("origin") == self.node_id or self._handler is None:
+            return
+        try:
+            await self._handler(envelope)
+        except Exception as e:
+            print(f"[Backplane] Error handling envelope: {e}")
+
+    async def publish(self, envelope: dict):
+        payload = json.dumps({**envelope, "origin": self.node_id})
+        try:
+            await self._pub.execute("PUBLISH", self.channel, payload)
+        except (ConnectionError, OSError, asyncio.IncompleteReadError, RespError) as e:
+            print(f"[Backplane] Publish failed: {e}")
+
+    async def stop(self):
+        self._closing = True
+        if self._reader_task:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._reader_task = None
+        self._pub.close()
+        await super().stop()
+
+
+def create_backplane(url: Optional[str]) -> Backplane:
+    """Build the backplane for RT_BACKPLANE_URL ("" -> in-process)."""
+    if not url:
+        return InProcessBackplane()
+    scheme = urlparse(url).scheme
+    if scheme in ("redis", "unix"):
+        return RespBackplane(url)
+    raise ValueError(f"Unsupported RT_BACKPLANE_URL scheme: {scheme}")
+
+
+# =============================================================
+# STAND-IN HUB (subset of Redis pub/sub for dev machines)
+# =============================================================
+
+class RespHub:
+    """Tiny RESP server implementing PING/AUTH/SELECT/SUBSCRIBE/UNSUBSCRIBE/PUBLISH."""
+
+    def __init__(self):
+        self.subscribers: Dict[bytes, Set[asyncio.StreamWriter]] = {}
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, url: str):
+        parsed = urlparse(url)
+        if parsed.scheme == "unix":
+            self.server = await asyncio.start_unix_server(self._handle_client, path=parsed.path)
+        else:
+            self.server = await asyncio.start_server(
+                self._handle_client, parsed.hostname or "127.0.0.1", parsed.port or 6379
+            )
+        return self.server
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        channels: List[bytes] = []
+        try:
+            while True:
+                command = await read_reply(reader)
+                if not isinstance(command, list) or not command:
+                    continue
+                name = command[0].upper()
+                args = command[1:]
+                if name == b"PING":
+                    writer.write(b"+PONG\r\n")
+                elif name in (b"AUTH", b"SELECT"):
+                    writer.write(b"+OK\r\n")
+                elif name == b"SUBSCRIBE":
+                    for channel in args:
+                        self.subscribers.setdefault(channel, set()).add(writer)
+                        channels.append(channel)
+                        writer.write(_encode_reply([b"subscribe", channel, len(channels)]))
+                elif name == b"UNSUBSCRIBE":
+                    for channel in args or list(channels):
+                        self.subscribers.get(channel, set()).discard(writer)
+                        if channel in channels:
+                            channels.remove(channel)
+                        writer.write(_encode_reply([b"unsubscribe", channel, len(channels)]))
+                elif name == b"PUBLISH" and len(args) == 2:
+                    channel, payload = args
+                    frame = _encode_reply([b"message", channel, payload])
+                    targets = list(self.subscribers.get(channel, ()))
+                    for target in targets:
+                        target.write(frame)
+                    writer.write(_encode_reply(len(targets)))
+                else:
+                    writer.write(f"-ERR unknown command '{name.decode(errors='replace')}'\r\n".encode())
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, RespError):
+            pass
+        finally:
+            for channel in channels:
+                self.subscribers.get(channel, set()).discard(writer)
+            writer.close()
+
+
+async def _serve(url: str):
+    hub = RespHub()
+    await hub.start(url)
+    print(f"[Backplane] Stand-in hub listening on {url}")
+    async with hub.server:
+        await hub.server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Redis-protocol pub/sub stand-in for RT_BACKPLANE_URL")
+    parser.add_argument("--listen", default="redis://127.0.0.1:6390")
+    asyncio.run(_serve(parser.parse_args().listen))
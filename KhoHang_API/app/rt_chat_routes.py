@@ -4,16 +4,15 @@ REST API routes for realtime user-to-user chat.
 Prefix: /rt
 """
 
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query
-from sqlalchemy.orm import Session, joinedload
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query, Request
+from sqlalchemy import false, func, select
+from sqlalchemy.orm import Session, aliased, joinedload
+from typing import Dict, List, Optional
 from datetime import datetime, timezone
 from pathlib import Path
 import uuid
-import aiofiles
+import sqlite3
 import shutil
-from collections import defaultdict
-from time import time
 
 from .database import (
     get_db, 
@@ -23,12 +22,19 @@ from .database import (
     RTMessageModel,
     RTMessageReceiptModel,
     RTMessageReactionModel,
+    RTMessageReactionCountModel,
     RTPinnedMessageModel,
     DATA_DIR,
     ensure_utc,  # Import timezone utility
     to_utc_iso   # Import ISO string helper
 )
 from .auth_middleware import get_current_user
+from .rate_limiter import rate_limit, UPLOAD_LIMITER, USER_LOOKUP_LIMITER
+from . import rt_reactions, upload_sessions, upload_store
+from .rt_directory import directory
+from .rt_message_cache import message_cache, record_from_model
+from .rt_archive import archive, archive_messages
+from .config import RT_ARCHIVE_AFTER_DAYS
 from pydantic import BaseModel, EmailStr, Field
 
 router = APIRouter(prefix="/rt", tags=["realtime-chat"])
@@ -37,23 +43,9 @@ UPLOAD_DIR = DATA_DIR / "uploads" / "rt_files"
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
 ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.pdf', '.doc', '.docx', '.xls', '.xlsx', '.txt', '.zip'}
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 
-# Rate limiting (in-memory, simple)
-_rate_limit_store = defaultdict(list)
-
-def check_rate_limit(user_id: str, limit: int = 10, window: int = 60) -> bool:
-    """Simple sliding window rate limiter. Returns True if allowed."""
-    now = time()
-    timestamps = _rate_limit_store[user_id]
-    # Remove expired
-    timestamps[:] = [ts for ts in timestamps if now - ts < window]
-    if len(timestamps) >= limit:
-        return False
-    timestamps.append(now)
-    return True
-
-
 # ========== SCHEMAS ==========
 
 class ConversationMemberDTO(BaseModel):
@@ -90,9 +82,11 @@ class MessageReceiptDTO(BaseModel):
 
 
 class MessageReactionDTO(BaseModel):
-    user_id: str = Field(..., serialization_alias="userId")
+    """Reaction count of one emoji; the per-user list is GET /rt/messages/{id}/reactions"""
     emoji: str
-    created_at: datetime = Field(..., serialization_alias="createdAt")
+    count: int
+    user_ids: List[str] = Field(default_factory=list, serialization_alias="userIds")  # First few reactors
+    reacted_by_me: bool = Field(False, serialization_alias="reactedByMe")
     
     model_config = {"populate_by_name": True}
 
@@ -117,6 +111,34 @@ class MessageDTO(BaseModel):
     
     model_config = {"populate_by_name": True}
 
+def message_dto_from_record(record: dict, sender=None, my_emojis=()) -> MessageDTO:
+    """Build MessageDTO from a rt_message_cache record + cached sender info (+ viewer's emojis)."""
+    return MessageDTO(
+        id=record["id"],
+        conversation_id=record["conversation_id"],
+        sender_id=record["sender_id"],
+        client_message_id=record["client_message_id"],
+        content=record["content"],
+        content_type=record["content_type"],
+        attachments=record["attachments"],
+        reply_to_id=record["reply_to_id"],
+        created_at=record["created_at"],
+        edited_at=record["edited_at"],
+        deleted_at=record["deleted_at"],
+        sender_email=sender.email if sender else None,
+        sender_display_name=sender.display_name if sender else None,
+        sender_avatar_url=sender.avatar_url if sender else None,
+        receipts=[
+            MessageReceiptDTO(user_id=uid, delivered_at=r["delivered_at"], read_at=r["read_at"])
+            for uid, r in record["receipts"].items()
+        ],
+        reactions=[
+            MessageReactionDTO(emoji=r["emoji"], count=r["count"], user_ids=r["user_ids"],
+                               reacted_by_me=r["emoji"] in my_emojis)
+            for r in record["reactions"]
+        ]
+    )
+
 class CreateDirectConversationRequest(BaseModel):
     email: Optional[EmailStr] = None
     other_user_id: Optional[str] = None
@@ -127,10 +149,139 @@ class FileUploadResponse(BaseModel):
     name: str
     size: int
     mime_type: str
+    thumbnail_url: Optional[str] = None  # medium variant (images only)
+    thumbnails: Optional[Dict[str, str]] = None  # { small, medium, large } -> url (images only)
+
+
+class UploadSessionCreate(BaseModel):
+    name: str = Field(..., min_length=1, max_length=255)
+    size: int = Field(..., gt=0)
+    mime_type: Optional[str] = None
+    sha256: Optional[str] = Field(None, pattern="^[0-9a-fA-F]{64}$")  # Verified on complete
+
+
+class UploadSessionDTO(BaseModel):
+    upload_id: str
+    offset: int  # Bytes received = where the next chunk starts
+    size: int
+    chunk_size: int
+    expires_at: datetime
 
 
 # ========== ENDPOINTS ==========
 
+def _list_conversations_flat(db: Session, user_id: str, accepted: bool) -> List[ConversationDTO]:
+    """
+    Conversations where user_id is an accepted (or pending) member, in ONE statement:
+    each conversation's latest non-deleted message is picked with ROW_NUMBER(),
+    unread counts come from one grouped receipts subquery (same definition as the
+    unreadCount sent with msg:send), and members + user columns are joined flat,
+    one row per (conversation, member).
+    """
+    mine = select(RTConversationMemberModel.conversation_id).where(
+        RTConversationMemberModel.user_id == user_id,
+        RTConversationMemberModel.is_accepted == accepted
+    ).cte("mine")
+    
+    ranked = select(
+        RTMessageModel.conversation_id,
+        RTMessageModel.id,
+        RTMessageModel.content,
+        RTMessageModel.sender_id,
+        RTMessageModel.created_at,
+        func.row_number().over(
+            partition_by=RTMessageModel.conversation_id,
+            order_by=(RTMessageModel.created_at.desc(), RTMessageModel.id.desc())
+        ).label("rn")
+    ).where(
+        RTMessageModel.conversation_id.in_(select(mine.c.conversation_id)),
+        RTMessageModel.deleted_at.is_(None)
+    ).subquery("ranked")
+    last = select(ranked).where(ranked.c.rn == 1).cte("last_msg")
+    if sqlite3.sqlite_version_info >= (3, 35):
+        # Otherwise SQLite flattens it into the join and re-scans every message per member row
+        last = last.prefix_with("MATERIALIZED")
+    
+    unread = select(
+        RTMessageModel.conversation_id,
+        func.count(RTMessageModel.id).label("unread")
+    ).join(
+        RTMessageReceiptModel, RTMessageReceiptModel.message_id == RTMessageModel.id
+    ).where(
+        RTMessageModel.conversation_id.in_(select(mine.c.conversation_id)),
+        RTMessageReceiptModel.user_id == user_id,
+        RTMessageReceiptModel.read_at.is_(None),
+        RTMessageModel.sender_id != user_id,
+        RTMessageModel.deleted_at.is_(None)
+    ).group_by(RTMessageModel.conversation_id).subquery("unread")
+    
+    member = aliased(RTConversationMemberModel)
+    stmt = select(
+        RTConversationModel.id,
+        RTConversationModel.type,
+        RTConversationModel.title,
+        RTConversationModel.related_entity_type,
+        RTConversationModel.related_entity_id,
+        RTConversationModel.created_at,
+        RTConversationModel.updated_at,
+        last.c.id.label("last_id"),
+        last.c.content.label("last_content"),
+        last.c.sender_id.label("last_sender_id"),
+        last.c.created_at.label("last_created_at"),
+        func.coalesce(unread.c.unread, 0).label("unread"),
+        member.user_id.label("member_user_id"),
+        member.role.label("member_role"),
+        member.joined_at.label("member_joined_at"),
+        member.is_accepted.label("member_is_accepted"),
+        UserModel.email.label("member_email"),
+        UserModel.display_name.label("member_display_name"),
+        UserModel.avatar_url.label("member_avatar_url")
+    ).select_from(RTConversationModel).join(
+        mine, mine.c.conversation_id == RTConversationModel.id
+    ).join(
+        member, member.conversation_id == RTConversationModel.id
+    ).outerjoin(
+        UserModel, UserModel.id == member.user_id
+    ).outerjoin(
+        last, last.c.conversation_id == RTConversationModel.id
+    ).outerjoin(
+        unread, unread.c.conversation_id == RTConversationModel.id
+    ).order_by(
+        RTConversationModel.updated_at.desc(), RTConversationModel.id, member.joined_at, member.user_id
+    )
+    
+    result: List[ConversationDTO] = []
+    for row in db.execute(stmt):
+        if not result or result[-1].id != row.id:
+            result.append(ConversationDTO(
+                id=row.id,
+                type=row.type,
+                title=row.title,
+                related_entity_type=row.related_entity_type,
+                related_entity_id=row.related_entity_id,
+                created_at=ensure_utc(row.created_at),
+                updated_at=ensure_utc(row.updated_at),
+                members=[],
+                last_message={
+                    "id": row.last_id,
+                    "content": row.last_content,
+                    "senderId": row.last_sender_id,
+                    "createdAt": to_utc_iso(row.last_created_at)
+                } if row.last_id else None,
+                unread_count=row.unread
+            ))
+        result[-1].members.append(ConversationMemberDTO(
+            user_id=row.member_user_id,
+            role=row.member_role,
+            joined_at=row.member_joined_at,
+            is_accepted=row.member_is_accepted,
+            user_email=row.member_email,
+            user_display_name=row.member_display_name,
+            user_avatar_url=row.member_avatar_url
+        ))
+    return result
+
+
 @router.get("/conversations", response_model=List[ConversationDTO], response_model_by_alias=True)
 def list_conversations(
     current_user: dict = Depends(get_current_user),
@@ -144,97 +295,10 @@ def list_conversations(
     Response Errors:
     - 401: { "detail": "Unauthorized" }
     - 500: { "detail": "Internal Server Error" }
-    Notes: Only returns accepted conversations (is_accepted=True)
+    Notes: Only returns accepted conversations (is_accepted=True), newest activity first;
+    one SQL statement (see _list_conversations_flat)
     """
-    # Get only ACCEPTED memberships
-    memberships = db.query(RTConversationMemberModel).filter(
-        RTConversationMemberModel.user_id == current_user["id"],
-        RTConversationMemberModel.is_accepted == True
-    ).all()
-    
-    conv_ids = [m.conversation_id for m in memberships]
-    if not conv_ids:
-        return []
-    
-    conversations = db.query(RTConversationModel).filter(
-        RTConversationModel.id.in_(conv_ids)
-    ).options(
-        joinedload(RTConversationModel.members).joinedload(RTConversationMemberModel.user)
-    ).order_by(RTConversationModel.updated_at.desc()).all()
-    
-    result = []
-    for conv in conversations:
-        # Get last message
-        last_msg = db.query(RTMessageModel).filter(
-            RTMessageModel.conversation_id == conv.id,
-            RTMessageModel.deleted_at.is_(None)
-        ).order_by(RTMessageModel.created_at.desc()).first()
-        
-        # Get unread count
-        if last_msg:
-            last_read_receipt = db.query(RTMessageReceiptModel).filter(
-                RTMessageReceiptModel.user_id == current_user["id"],
-                RTMessageReceiptModel.read_at.isnot(None)
-            ).join(RTMessageModel).filter(
-                RTMessageModel.conversation_id == conv.id
-            ).order_by(RTMessageReceiptModel.read_at.desc()).first()
-            
-            if last_read_receipt:
-                last_read_msg = db.query(RTMessageModel).filter(
-                    RTMessageModel.id == last_read_receipt.message_id
-                ).first()
-                last_read_timestamp = last_read_msg.created_at if last_read_msg else None
-            else:
-                last_read_timestamp = None
-            
-            if last_read_timestamp:
-                unread = db.query(RTMessageModel).filter(
-                    RTMessageModel.conversation_id == conv.id,
-                    RTMessageModel.sender_id != current_user["id"],
-                    RTMessageModel.deleted_at.is_(None),
-                    RTMessageModel.created_at > last_read_timestamp
-                ).count()
-            else:
-                unread = db.query(RTMessageModel).filter(
-                    RTMessageModel.conversation_id == conv.id,
-                    RTMessageModel.sender_id != current_user["id"],
-                    RTMessageModel.deleted_at.is_(None)
-                ).count()
-        else:
-            unread = 0
-        
-        members_dto = [
-            ConversationMemberDTO(
-                user_id=m.user_id,
-                role=m.role,
-                joined_at=m.joined_at,
-                is_accepted=m.is_accepted,
-                user_email=m.user.email if m.user else None,
-                user_display_name=m.user.display_name if m.user else None,
-                user_avatar_url=m.user.avatar_url if m.user else None
-            )
-            for m in conv.members
-        ]
-        
-        result.append(ConversationDTO(
-            id=conv.id,
-            type=conv.type,
-            title=conv.title,
-            related_entity_type=conv.related_entity_type,
-            related_entity_id=conv.related_entity_id,
-            created_at=ensure_utc(conv.created_at),
-            updated_at=ensure_utc(conv.updated_at),
-            members=members_dto,
-            last_message={
-                "id": last_msg.id,
-                "content": last_msg.content,
-                "senderId": last_msg.sender_id,
-                "createdAt": to_utc_iso(last_msg.created_at)
-            } if last_msg else None,
-            unread_count=unread
-        ))
-    
-    return result
+    return _list_conversations_flat(db, current_user["id"], accepted=True)
 
 
 @router.get("/conversations/pending", response_model=List[ConversationDTO], response_model_by_alias=True)
@@ -250,74 +314,10 @@ def list_pending_conversations(
     Response Errors:
     - 401: { "detail": "Unauthorized" }
     - 500: { "detail": "Internal Server Error" }
-    Notes: Only returns pending conversations (is_accepted=False)
+    Notes: Only returns pending conversations (is_accepted=False), newest activity first;
+    one SQL statement (see _list_conversations_flat)
     """
-    # Get only PENDING memberships
-    memberships = db.query(RTConversationMemberModel).filter(
-        RTConversationMemberModel.user_id == current_user["id"],
-        RTConversationMemberModel.is_accepted == False
-    ).all()
-    
-    conv_ids = [m.conversation_id for m in memberships]
-    if not conv_ids:
-        return []
-    
-    conversations = db.query(RTConversationModel).filter(
-        RTConversationModel.id.in_(conv_ids)
-    ).options(joinedload(RTConversationModel.members).joinedload(RTConversationMemberModel.user)).all()
-    
-    result = []
-    for conv in conversations:
-        # Get last message
-        last_msg = db.query(RTMessageModel).filter(
-            RTMessageModel.conversation_id == conv.id,
-            RTMessageModel.deleted_at.is_(None)
-        ).order_by(RTMessageModel.created_at.desc()).first()
-        
-        # Count unread messages
-        unread = db.query(RTMessageModel).filter(
-            RTMessageModel.conversation_id == conv.id,
-            RTMessageModel.sender_id != current_user["id"],
-            RTMessageModel.deleted_at.is_(None),
-            ~db.query(RTMessageReceiptModel).filter(
-                RTMessageReceiptModel.message_id == RTMessageModel.id,
-                RTMessageReceiptModel.user_id == current_user["id"],
-                RTMessageReceiptModel.read_at.isnot(None)
-            ).exists()
-        ).count()
-        
-        members_dto = [
-            ConversationMemberDTO(
-                user_id=m.user_id,
-                role=m.role,
-                joined_at=m.joined_at,
-                is_accepted=m.is_accepted,
-                user_email=m.user.email if m.user else None,
-                user_display_name=m.user.display_name if m.user else None,
-                user_avatar_url=m.user.avatar_url if m.user else None
-            )
-            for m in conv.members
-        ]
-        
-        result.append(ConversationDTO(
-            id=conv.id,
-            type=conv.type,
-            title=conv.title,
-            related_entity_type=conv.related_entity_type,
-            related_entity_id=conv.related_entity_id,
-            created_at=ensure_utc(conv.created_at),
-            updated_at=ensure_utc(conv.updated_at),
-            members=members_dto,
-            last_message={
-                "id": last_msg.id,
-                "content": last_msg.content,
-                "senderId": last_msg.sender_id,
-                "createdAt": to_utc_iso(last_msg.created_at)
-            } if last_msg else None,
-            unread_count=unread
-        ))
-    
-    return result
+    return _list_conversations_flat(db, current_user["id"], accepted=False)
 
 
 @router.post("/conversations/direct", response_model=dict)
@@ -389,6 +389,7 @@ def create_or_get_direct_conversation(
         db.add(member)
     
     db.commit()
+    directory.invalidate_conversation(conv_id)
     
     return {"conversation_id": conv_id}
 
@@ -412,87 +413,83 @@ def get_conversation_messages(
     - 403: { "detail": "Not a member" }
     - 404: { "detail": "Conversation not found" }
     - 500: { "detail": "Internal Server Error" }
-    Notes: Pagination via after/before message id
+    Notes: Pagination via after/before message id; first page and "before" pages continue
+    into the cold-storage archive (rt_archive) once the live rows are exhausted; reactions are
+    per-emoji counts ({ emoji, count, userIds, reactedByMe }), the per-user list is
+    GET /rt/messages/{id}/reactions
     """
-    conv = db.query(RTConversationModel).filter(RTConversationModel.id == conversation_id).first()
+    conv = directory.conversation(db, conversation_id)
     if not conv:
         raise HTTPException(404, "Conversation not found")
     
-    is_member = db.query(RTConversationMemberModel).filter(
-        RTConversationMemberModel.conversation_id == conversation_id,
-        RTConversationMemberModel.user_id == current_user["id"]
-    ).first()
-    if not is_member:
+    if current_user["id"] not in conv.members:
         raise HTTPException(403, "Not a member")
     
-    query = db.query(RTMessageModel).filter(
-        RTMessageModel.conversation_id == conversation_id,
-        RTMessageModel.deleted_at.is_(None)
-    ).options(
-        joinedload(RTMessageModel.sender),
-        joinedload(RTMessageModel.receipts),
-        joinedload(RTMessageModel.reactions)
-    )
+    # First page and short "after" deltas come from the hot-conversation cache
+    cached = None
+    boundary = None
+    if not after and not before:
+        cached = message_cache.latest(db, conversation_id, limit)
+    elif after:
+        cached = message_cache.after(conversation_id, after, limit)
     
-    if after:
-        after_msg = db.query(RTMessageModel).filter(RTMessageModel.id == after).first()
-        if after_msg:
-            query = query.filter(RTMessageModel.created_at > after_msg.created_at)
-        query = query.order_by(RTMessageModel.created_at.asc())
-    elif before:
-        before_msg = db.query(RTMessageModel).filter(RTMessageModel.id == before).first()
-        if before_msg:
-            query = query.filter(RTMessageModel.created_at < before_msg.created_at)
-        query = query.order_by(RTMessageModel.created_at.desc())
+    if cached is not None:
+        records, has_more = cached
     else:
-        query = query.order_by(RTMessageModel.created_at.desc())
-    
-    messages = query.limit(limit + 1).all()
-    has_more = len(messages) > limit
-    if has_more:
-        messages = messages[:limit]
-    
-    if not after and not before:
-        messages = list(reversed(messages))
-    
-    result_messages = []
-    for msg in messages:
-        receipts_dto = [
-            MessageReceiptDTO(
-                user_id=r.user_id,
-                delivered_at=r.delivered_at,
-                read_at=r.read_at
-            )
-            for r in msg.receipts
-        ]
+        query = db.query(RTMessageModel).filter(
+            RTMessageModel.conversation_id == conversation_id,
+            RTMessageModel.deleted_at.is_(None)
+        ).options(
+            joinedload(RTMessageModel.receipts),
+            joinedload(RTMessageModel.reaction_counts)
+        )
         
-        reactions_dto = [
-            MessageReactionDTO(
-                user_id=r.user_id,
-                emoji=r.emoji,
-                created_at=r.created_at
-            )
-            for r in (msg.reactions if hasattr(msg, 'reactions') and msg.reactions else [])
-        ]
+        if after:
+            after_msg = db.query(RTMessageModel).filter(RTMessageModel.id == after).first()
+            if after_msg:
+                query = query.filter(RTMessageModel.created_at > after_msg.created_at)
+            query = query.order_by(RTMessageModel.created_at.asc())
+        else:
+            before_msg = db.query(RTMessageModel).filter(RTMessageModel.id == before).first()
+            if before_msg:
+                boundary = before_msg.created_at
+            else:
+                # Cursor already moved to cold storage: every live row is newer
+                archived = archive.get(before)
+                if archived:
+                    boundary = archived["created_at"]
+                    query = query.filter(false())
+            if boundary:
+                query = query.filter(RTMessageModel.created_at < boundary)
+            query = query.order_by(RTMessageModel.created_at.desc())
         
-        result_messages.append(MessageDTO(
-            id=msg.id,
-            conversation_id=msg.conversation_id,
-            sender_id=msg.sender_id,
-            client_message_id=msg.client_message_id,
-            content=msg.content,
-            content_type=msg.content_type,
-            attachments=msg.attachments_json,
-            reply_to_id=msg.reply_to_id,  # NEW: Include reply reference
-            created_at=ensure_utc(msg.created_at),  # FIX: Ensure UTC timezone
-            edited_at=ensure_utc(msg.edited_at),    # FIX: Ensure UTC timezone
-            deleted_at=ensure_utc(msg.deleted_at),  # FIX: Ensure UTC timezone
-            sender_email=msg.sender.email if msg.sender else None,
-            sender_display_name=msg.sender.display_name if msg.sender else None,
-            sender_avatar_url=msg.sender.avatar_url if msg.sender else None,
-            receipts=receipts_dto,
-            reactions=reactions_dto
-        ))
+        messages = query.limit(limit + 1).all()
+        has_more = len(messages) > limit
+        if has_more:
+            messages = messages[:limit]
+        
+        records = [record_from_model(msg) for msg in messages]
+    
+    # Live rows exhausted while paging back: continue in the archive
+    if not after and not has_more and len(records) < limit and archive.months():
+        if before:
+            # Newest first
+            older, has_more = archive.older(
+                conversation_id, records[-1]["created_at"] if records else boundary, limit - len(records)
+            )
+            records = records + older
+        else:
+            # First page, oldest first
+            older, has_more = archive.older(
+                conversation_id, records[0]["created_at"] if records else None, limit - len(records)
+            )
+            records = older[::-1] + records
+    
+    senders = directory.users(db, {r["sender_id"] for r in records})
+    reacted = rt_reactions.mine(db, current_user["id"], [r["id"] for r in records if r["reactions"]])
+    result_messages = [
+        message_dto_from_record(r, senders.get(r["sender_id"]), reacted.get(r["id"], ())) for r in records
+    ]
     
     return {"messages": [m.model_dump(by_alias=True) for m in result_messages], "has_more": has_more}
 
@@ -526,6 +523,7 @@ def accept_conversation(
     # Accept the conversation
     member.is_accepted = True
     db.commit()
+    directory.invalidate_conversation(conversation_id)
     
     return {"success": True}
 
@@ -574,6 +572,13 @@ def reject_conversation(
             db.query(RTMessageReceiptModel).filter(
                 RTMessageReceiptModel.message_id.in_(message_ids)
             ).delete(synchronize_session=False)
+            db.query(RTMessageReactionModel).filter(
+                RTMessageReactionModel.message_id.in_(message_ids)
+            ).delete(synchronize_session=False)
+            db.query(RTMessageReactionCountModel).filter(
+                RTMessageReactionCountModel.message_id.in_(message_ids)
+            ).delete(synchronize_session=False)
+            upload_store.forget_mentions(db, message_ids)
         
         # Now safe to delete all messages
         db.query(RTMessageModel).filter(
@@ -594,11 +599,14 @@ def reject_conversation(
         db.delete(member)
     
     db.commit()
+    directory.invalidate_conversation(conversation_id)
+    if request.delete_history:
+        message_cache.invalidate(conversation_id)
     
     return {"success": True}
 
 
-@router.post("/files", response_model=FileUploadResponse)
+@router.post("/files", response_model=FileUploadResponse, dependencies=[Depends(rate_limit(UPLOAD_LIMITER, key="user"))])
 async def upload_file(
     file: UploadFile = File(...),
     current_user: dict = Depends(get_current_user),
@@ -608,49 +616,185 @@ async def upload_file(
     API: POST /rt/files
     Purpose: Upload file/image for realtime chat
     Request (JSON): multipart/form-data with file
-    Response (JSON) [200]: { file_id, url, name, size, mime_type }
+    Response (JSON) [200]: { file_id, url, name, size, mime_type, thumbnail_url?, thumbnails? }
     Response Errors:
     - 400: { "detail": "..." }
     - 401: { "detail": "Unauthorized" }
     - 413: { "detail": "File too large" }
+    - 429: { "detail": "Too many requests" }
     - 500: { "detail": "Internal Server Error" }
-    Notes: Max 10MB, allowed extensions: jpg, png, gif, pdf, doc, xls, txt, zip
+    Notes: Max 10MB (larger files: chunked upload, POST /rt/files/uploads), allowed extensions: jpg, png, gif, pdf, doc, xls, txt, zip;
+    content is deduplicated by SHA-256, every upload still gets its own URL; images also get
+    small/medium/large variants (generated in the image pool, off the event loop)
     """
-    if not file.filename:
-        raise HTTPException(400, "Filename required")
+    ext = _allowed_extension(file.filename)
     
-    ext = Path(file.filename).suffix.lower()
+    # Hashed while streaming; identical content is stored once (upload_store)
+    stored = await upload_store.save_upload(db, file, "rt_files", ext, MAX_FILE_SIZE)
+    return await _finish_upload(db, stored, ext, file.filename, file.content_type)
+
+
+def _allowed_extension(filename: Optional[str]) -> str:
+    if not filename:
+        raise HTTPException(400, "Filename required")
+    ext = Path(filename).suffix.lower()
     if ext not in ALLOWED_EXTENSIONS:
         raise HTTPException(400, f"File type not allowed. Allowed: {', '.join(ALLOWED_EXTENSIONS)}")
+    return ext
+
+
+async def _finish_upload(db: Session, stored: upload_store.StoredUpload, ext: str, name: str,
+                         mime_type: Optional[str]) -> FileUploadResponse:
+    """Image variants, commit, response - shared by /files and chunked uploads."""
+    thumbnails = await upload_store.add_image_variants(db, stored, "rt_files") if ext in IMAGE_EXTENSIONS else {}
+    db.commit()
     
-    file_id = str(uuid.uuid4())
-    safe_filename = f"{file_id}{ext}"
-    file_path = UPLOAD_DIR / safe_filename
-    
-    size = 0
-    async with aiofiles.open(file_path, 'wb') as f:
-        while chunk := await file.read(8192):
-            size += len(chunk)
-            if size > MAX_FILE_SIZE:
-                await f.close()
-                file_path.unlink(missing_ok=True)
-                raise HTTPException(413, "File too large (max 10MB)")
-            await f.write(chunk)
-    
-    print(f"[RT Upload] File saved: {file_path} (exists: {file_path.exists()})")
-    
-    url = f"/uploads/rt_files/{safe_filename}"
+    print(f"[RT Upload] File saved: {stored.url} ({stored.size} bytes{', deduplicated' if stored.deduplicated else ''})")
     
     return FileUploadResponse(
-        file_id=file_id,
-        url=url,
-        name=file.filename,
-        size=size,
-        mime_type=file.content_type or "application/octet-stream"
+        file_id=Path(stored.name).stem,
+        url=stored.url,
+        name=name,
+        size=stored.size,
+        mime_type=mime_type or "application/octet-stream",
+        thumbnail_url=thumbnails.get("medium"),
+        thumbnails=thumbnails or None
+    )
+
+
+def _session_dto(upload) -> UploadSessionDTO:
+    return UploadSessionDTO(
+        upload_id=upload.id,
+        offset=upload.received,
+        size=upload.size,
+        chunk_size=upload_sessions.CHUNK_SIZE,
+        expires_at=upload_sessions.expires_at(upload)
+    )
+
+
+@router.post("/files/uploads", response_model=UploadSessionDTO, dependencies=[Depends(rate_limit(UPLOAD_LIMITER, key="user"))])
+def create_upload_session(
+    request: UploadSessionCreate,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    API: POST /rt/files/uploads
+    Purpose: Start a resumable chunked upload (large files, unreliable links)
+    Request (JSON): { name, size, mime_type?, sha256? }
+    Response (JSON) [200]: { upload_id, offset, size, chunk_size, expires_at }
+    Response Errors:
+    - 400: { "detail": "File type not allowed..." }
+    - 401: { "detail": "Unauthorized" }
+    - 413: { "detail": "File too large (max ...MB)" }
+    - 429: { "detail": "Too many requests" }
+    Notes: Then PUT /rt/files/uploads/{upload_id}?offset=N with raw chunk bytes, and
+    POST /rt/files/uploads/{upload_id}/complete. Max size RT_UPLOAD_MAX_SIZE_MB (default 200MB);
+    idle sessions expire after 24h
+    """
+    ext = _allowed_extension(request.name)
+    upload = upload_sessions.create(
+        db, current_user["id"], "rt_files", request.name, ext, request.size,
+        mime_type=request.mime_type, sha256=request.sha256
     )
+    db.commit()
+    return _session_dto(upload)
+
+
+@router.get("/files/uploads/{upload_id}", response_model=UploadSessionDTO)
+def get_upload_session(
+    upload_id: str,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    API: GET /rt/files/uploads/{upload_id}
+    Purpose: Where to resume an interrupted chunked upload
+    Response (JSON) [200]: { upload_id, offset, size, chunk_size, expires_at }
+    Response Errors:
+    - 401: { "detail": "Unauthorized" }
+    - 404: { "detail": "Upload session not found" }
+    """
+    return _session_dto(upload_sessions.get(db, upload_id, current_user["id"]))
+
+
+@router.put("/files/uploads/{upload_id}", response_model=UploadSessionDTO)
+async def put_upload_chunk(
+    upload_id: str,
+    http_request: Request,
+    offset: int = Query(..., ge=0),
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    API: PUT /rt/files/uploads/{upload_id}?offset=N
+    Purpose: Append one chunk (raw request body, application/octet-stream)
+    Response (JSON) [200]: { upload_id, offset, size, chunk_size, expires_at }
+    Response Errors:
+    - 400: { "detail": "Chunk goes past the announced file size" }
+    - 401: { "detail": "Unauthorized" }
+    - 404: { "detail": "Upload session not found" }
+    - 409: { "detail": "Expected offset N" } (header Upload-Offset: N)
+    - 413: { "detail": "Chunk too large (max ...MB)" }
+    Notes: offset must equal the bytes already received; after a broken connection
+    resend from the offset returned by GET (a partly received chunk is simply overwritten)
+    """
+    upload = upload_sessions.get(db, upload_id, current_user["id"])
+    await upload_sessions.write_chunk(db, upload, offset, http_request)
+    db.commit()
+    return _session_dto(upload)
 
 
-@router.get("/users/lookup")
+@router.post("/files/uploads/{upload_id}/complete", response_model=FileUploadResponse)
+async def complete_upload_session(
+    upload_id: str,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    API: POST /rt/files/uploads/{upload_id}/complete
+    Purpose: Verify the assembled file and turn it into a chat attachment
+    Response (JSON) [200]: { file_id, url, name, size, mime_type, thumbnail_url?, thumbnails? }
+    Response Errors:
+    - 401: { "detail": "Unauthorized" }
+    - 404: { "detail": "Upload session not found" }
+    - 409: { "detail": "Upload incomplete: received/size bytes" } (header Upload-Offset)
+    - 422: { "detail": "Checksum mismatch, upload the file again" } (session discarded)
+    Notes: Size and SHA-256 (if announced) are checked; the file is then stored exactly
+    like POST /rt/files (deduplicated, image variants)
+    """
+    upload = upload_sessions.get(db, upload_id, current_user["id"])
+    name, mime_type, ext = upload.original_name, upload.mime_type, upload.ext
+    try:
+        stored = await upload_sessions.complete(db, upload)
+    except upload_sessions.ChecksumMismatch as e:
+        print(f"[RT Upload] Chunked upload {upload_id} rejected: {e}")
+        upload_sessions.discard(db, upload)
+        db.commit()
+        raise HTTPException(422, "Checksum mismatch, upload the file again")
+    return await _finish_upload(db, stored, ext, name, mime_type)
+
+
+@router.delete("/files/uploads/{upload_id}")
+def abort_upload_session(
+    upload_id: str,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    API: DELETE /rt/files/uploads/{upload_id}
+    Purpose: Cancel a chunked upload and drop the received bytes
+    Response (JSON) [200]: { "success": true }
+    Response Errors:
+    - 401: { "detail": "Unauthorized" }
+    - 404: { "detail": "Upload session not found" }
+    """
+    upload_sessions.discard(db, upload_sessions.get(db, upload_id, current_user["id"]))
+    db.commit()
+    return {"success": True}
+
+
+@router.get("/users/lookup", dependencies=[Depends(rate_limit(USER_LOOKUP_LIMITER, key="user"))])
 def lookup_user_by_email(
     email: EmailStr = Query(...),
     current_user: dict = Depends(get_current_user),
@@ -668,9 +812,6 @@ def lookup_user_by_email(
     - 500: { "detail": "Internal Server Error" }
     Notes: Rate limited 10 req/min per user; exact match only
     """
-    if not check_rate_limit(current_user["id"], limit=10, window=60):
-        raise HTTPException(429, "Too many requests")
-    
     normalized_email = email.lower().strip()
     user = db.query(UserModel).filter(UserModel.email == normalized_email).first()
     
@@ -734,30 +875,19 @@ def add_reaction_to_message(
     if not membership:
         raise HTTPException(403, "Not a conversation member")
     
-    # Check if reaction already exists (duplicate prevention)
-    existing = db.query(RTMessageReactionModel).filter(
-        RTMessageReactionModel.message_id == message_id,
-        RTMessageReactionModel.user_id == current_user["id"],
-        RTMessageReactionModel.emoji == reaction_req.emoji
-    ).first()
-    if existing:
+    # Insert reaction + count delta (duplicate insert does nothing)
+    created_at = datetime.now(timezone.utc)
+    summary = rt_reactions.add(db, message_id, current_user["id"], reaction_req.emoji, created_at)
+    if summary is None:
         raise HTTPException(409, "Reaction already exists")
-    
-    # Create reaction
-    reaction = RTMessageReactionModel(
-        message_id=message_id,
-        user_id=current_user["id"],
-        emoji=reaction_req.emoji,
-        created_at=datetime.now(timezone.utc)
-    )
-    db.add(reaction)
     db.commit()
+    message_cache.set_reaction(message.conversation_id, message_id, summary)
     
     return {
         "message_id": message_id,
         "user_id": current_user["id"],
         "emoji": reaction_req.emoji,
-        "created_at": to_utc_iso(reaction.created_at)
+        "created_at": to_utc_iso(created_at)
     }
 
 
@@ -792,17 +922,12 @@ def remove_reaction_from_message(
     if not membership:
         raise HTTPException(403, "Not a conversation member")
     
-    # Find and delete reaction
-    reaction = db.query(RTMessageReactionModel).filter(
-        RTMessageReactionModel.message_id == message_id,
-        RTMessageReactionModel.user_id == current_user["id"],
-        RTMessageReactionModel.emoji == emoji
-    ).first()
-    if not reaction:
+    # Delete reaction + count delta
+    summary = rt_reactions.remove(db, message_id, current_user["id"], emoji)
+    if summary is None:
         raise HTTPException(404, "Reaction not found")
-    
-    db.delete(reaction)
     db.commit()
+    message_cache.set_reaction(message.conversation_id, message_id, summary)
     
     return {"message": "Reaction removed"}
 
@@ -810,19 +935,23 @@ def remove_reaction_from_message(
 @router.get("/messages/{message_id}/reactions", response_model=List[ReactionResponse])
 def get_message_reactions(
     message_id: str,
+    emoji: Optional[str] = Query(None),
+    limit: int = Query(100, ge=1, le=500),
+    offset: int = Query(0, ge=0),
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
     """
-    API: GET /rt/messages/{message_id}/reactions
-    Purpose: Get all reactions for a message
+    API: GET /rt/messages/{message_id}/reactions?emoji=&limit=&offset=
+    Purpose: Get who reacted to a message (on demand, e.g. when the reaction badge is opened)
     Request (JSON): null
     Response (JSON) [200]: [{ "message_id": "...", "user_id": "...", "emoji": "👍", "created_at": "..." }, ...]
     Response Errors:
     - 403: { "detail": "Not a conversation member" }
     - 404: { "detail": "Message not found" }
     - 500: { "detail": "Internal Server Error" }
-    Notes: Returns array of all reactions with user_id; empty array if no reactions
+    Notes: One row per user per emoji, oldest first, optionally for one emoji; message lists
+    only carry the per-emoji counts
     """
     # Validate message exists
     message = db.query(RTMessageModel).filter(RTMessageModel.id == message_id).first()
@@ -837,10 +966,13 @@ def get_message_reactions(
     if not membership:
         raise HTTPException(403, "Not a conversation member")
     
-    # Get all reactions for this message
-    reactions = db.query(RTMessageReactionModel).filter(
-        RTMessageReactionModel.message_id == message_id
-    ).all()
+    # Reactions for this message, one page
+    query = db.query(RTMessageReactionModel).filter(RTMessageReactionModel.message_id == message_id)
+    if emoji:
+        query = query.filter(RTMessageReactionModel.emoji == emoji)
+    reactions = query.order_by(
+        RTMessageReactionModel.created_at.asc(), RTMessageReactionModel.user_id
+    ).offset(offset).limit(limit).all()
     
     return [
         {
@@ -889,39 +1021,29 @@ def get_pinned_messages(
     if not membership:
         raise HTTPException(403, "Not a conversation member")
     
-    pinned = db.query(RTPinnedMessageModel).filter(
-        RTPinnedMessageModel.conversation_id == conversation_id
-    ).options(
-        joinedload(RTPinnedMessageModel.message).joinedload(RTMessageModel.sender)
-    ).order_by(RTPinnedMessageModel.pinned_at.desc()).all()
+    pinned = message_cache.pinned(db, conversation_id)
+    for p in pinned:
+        if p["message"] is None:
+            p["message"] = archive.get(p["message_id"])
+    senders = directory.users(db, {p["message"]["sender_id"] for p in pinned if p["message"]})
     
     result = []
     for p in pinned:
-        msg = p.message
+        record = p["message"]
         message_dto = None
-        if msg:
-            message_dto = MessageDTO(
-                id=msg.id,
-                conversation_id=msg.conversation_id,
-                sender_id=msg.sender_id,
-                client_message_id=msg.client_message_id,
-                content=msg.content if not msg.deleted_at else "Tin nhắn đã bị thu hồi",
-                content_type=msg.content_type,
-                attachments=msg.attachments_json,
-                reply_to_id=msg.reply_to_id,
-                created_at=ensure_utc(msg.created_at),
-                edited_at=ensure_utc(msg.edited_at),
-                deleted_at=ensure_utc(msg.deleted_at),
-                sender_email=msg.sender.email if msg.sender else None,
-                sender_display_name=msg.sender.display_name if msg.sender else None,
-                sender_avatar_url=msg.sender.avatar_url if msg.sender else None
+        if record:
+            message_dto = message_dto_from_record(
+                {**record, "content": record["content"] if not record["deleted_at"] else "Tin nhắn đã bị thu hồi"},
+                senders.get(record["sender_id"])
             )
+            message_dto.receipts = None
+            message_dto.reactions = None
         
         result.append(PinnedMessageDTO(
-            message_id=p.message_id,
-            conversation_id=p.conversation_id,
-            pinned_by=p.pinned_by,
-            pinned_at=ensure_utc(p.pinned_at),
+            message_id=p["message_id"],
+            conversation_id=conversation_id,
+            pinned_by=p["pinned_by"],
+            pinned_at=p["pinned_at"],
             message=message_dto
         ))
     
@@ -977,6 +1099,7 @@ def pin_message(
     )
     db.add(pinned)
     db.commit()
+    message_cache.pin(conversation_id, message_id, current_user["id"], pinned_at)
     
     return {"success": True, "pinnedAt": to_utc_iso(pinned_at)}
 
@@ -1015,5 +1138,55 @@ def unpin_message(
     
     db.delete(pinned)
     db.commit()
+    message_cache.unpin(conversation_id, message_id)
     
     return {"success": True}
+
+
+# ========== CACHE STATS ==========
+
+@router.get("/cache/stats")
+def get_cache_stats(current_user: dict = Depends(get_current_user)):
+    """
+    API: GET /rt/cache/stats
+    Purpose: Hit ratio and memory use of this worker's realtime caches
+    Request (JSON): null
+    Response (JSON) [200]: { messages: { conversations, messages, approxBytes, hits, misses, hitRatio }, directory: {...} }
+    Response Errors:
+    - 401: { "detail": "Unauthorized" }
+    - 403: { "detail": "Only admin can view cache stats" }
+    Notes: Per worker; counters reset on restart
+    """
+    if current_user.get("role") != "admin":
+        raise HTTPException(403, "Only admin can view cache stats")
+    
+    return {"messages": message_cache.stats(), "directory": directory.stats()}
+
+
+@router.post("/archive/run")
+def run_message_archive(
+    days: Optional[int] = Query(None, ge=1),
+    dry_run: bool = Query(False),
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    API: POST /rt/archive/run?days=&dry_run=
+    Purpose: Move realtime chat messages older than `days` into the monthly cold-storage files
+    Request (JSON): null
+    Response (JSON) [200]: { dryRun, cutoff, messages, months: { "YYYY-MM": count } }
+    Response Errors:
+    - 400: { "detail": "Archiving is disabled (RT_ARCHIVE_AFTER_DAYS=0) and no days given" }
+    - 401: { "detail": "Unauthorized" }
+    - 403: { "detail": "Only admin can archive messages" }
+    Notes: days defaults to RT_ARCHIVE_AFTER_DAYS; the newest message of each conversation
+    stays live; dry_run only counts per month
+    """
+    if current_user.get("role") != "admin":
+        raise HTTPException(403, "Only admin can archive messages")
+    
+    days = days or RT_ARCHIVE_AFTER_DAYS
+    if not days:
+        raise HTTPException(400, "Archiving is disabled (RT_ARCHIVE_AFTER_DAYS=0) and no days given")
+    
+    return archive_messages(db, days, dry_run=dry_run)
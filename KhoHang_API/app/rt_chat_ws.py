@@ -5,31 +5,82 @@ Endpoint: /ws/rt?token=<JWT>
 """
 
 from fastapi import WebSocket, WebSocketDisconnect, Query, HTTPException
-from sqlalchemy.orm import Session, joinedload
-from typing import Dict, Set, Optional
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from typing import Dict, Set, Optional, List
 from datetime import datetime, timezone
-from collections import defaultdict
-from time import time
+from collections import defaultdict, deque
+from time import time, monotonic
 import json
 import uuid
 import asyncio
 
 from .database import (
     SessionLocal,
-    UserModel,
     RTConversationModel,
-    RTConversationMemberModel,
     RTMessageModel,
     RTMessageReceiptModel,
-    RTMessageReactionModel,
     RTPinnedMessageModel,
     to_utc_iso  # Import timezone utility
 )
 from .security import verify_token
+from .rt_backplane import Backplane, InProcessBackplane
+from .rate_limiter import MSG_SEND_LIMITER
+from .rt_scheduler import HeartbeatScheduler, HEARTBEAT_INTERVAL_SECONDS
+from .rt_directory import directory
+from .rt_message_cache import message_cache, record_from_model
+from .rt_coalesce import TypingCoalescer, PresenceDiffer
+from .rt_codec import FrameCodec, JSON_CODEC, available_encodings, decode_frame, encode_cached, negotiate, send_frame
+from . import rt_outbox, rt_reactions, upload_store
+
+
+# Resumable sessions: how many outbound events are kept per user, and how long
+# a user's buffer survives after their last socket closes.
+REPLAY_BUFFER_SIZE = 256
+REPLAY_RETENTION_SECONDS = 300
+# Offline presence entries are forgotten after this long
+PRESENCE_RETENTION_SECONDS = 3600
+# A worker that has not been heard from for this long is treated as gone
+NODE_TIMEOUT_SECONDS = 3 * HEARTBEAT_INTERVAL_SECONDS
+
+
+class EventReplayBuffer:
+    """Bounded ring buffer of recent outbound events for one user.
+
+    Every event gets a monotonically increasing ``eventId``. ``stream_id``
+    identifies this buffer instance so a client holding ids from a previous
+    server process (or an expired buffer) is told to resync instead of
+    silently missing events.
+    """
+
+    def __init__(self, maxlen: int = REPLAY_BUFFER_SIZE):
+        self.stream_id = uuid.uuid4().hex
+        self.last_event_id = 0
+        self.events: deque = deque(maxlen=maxlen)
+        self.expires_at: Optional[float] = None
+
+    def append(self, message: dict) -> dict:
+        """Stamp message with the next eventId and remember it."""
+        self.last_event_id += 1
+        stamped = {**message, "eventId": self.last_event_id}
+        self.events.append(stamped)
+        return stamped
+
+    def since(self, last_event_id: int) -> Optional[List[dict]]:
+        """Return events after last_event_id, or None if the buffer was overrun."""
+        if last_event_id > self.last_event_id or last_event_id < 0:
+            return None
+        if last_event_id == self.last_event_id:
+            return []
+        oldest_id = self.events[0]["eventId"] if self.events else self.last_event_id + 1
+        if last_event_id + 1 < oldest_id:
+            return None
+        return [event for event in self.events if event["eventId"] > last_event_id]
 
 
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, backplane: Optional[Backplane] = None):
         # user_id -> set of WebSocket connections
         self.user_connections: Dict[str, Set[WebSocket]] = defaultdict(set)
         
@@ -42,20 +93,163 @@ class ConnectionManager:
         # WebSocket -> set of conversation_ids (rooms this socket joined)
         self.ws_to_rooms: Dict[WebSocket, Set[str]] = defaultdict(set)
         
+        # WebSocket -> wire codec negotiated in client:hello (absent = JSON text)
+        self.ws_codecs: Dict[WebSocket, FrameCodec] = {}
+        
         # Presence: user_id -> { is_online, last_seen_at }
         self.presence: Dict[str, dict] = {}
         
-        # Rate limiting for msg:send (user_id -> list of timestamps)
-        self.rate_limit_send: Dict[str, list] = defaultdict(list)
+        # Resumable sessions: user_id -> replay buffer of recent outbound events
+        self.replay_buffers: Dict[str, EventReplayBuffer] = {}
+        
+        # Cross-worker fan-out; other workers' online users: user_id -> set of node_ids
+        self.backplane: Backplane = backplane or InProcessBackplane()
+        self.remote_online: Dict[str, Set[str]] = defaultdict(set)
+        # node_id -> time() of the last envelope received from that worker
+        self.remote_nodes: Dict[str, float] = {}
+        self._pending_publishes: Set[asyncio.Task] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        
+        # One timer wheel pings every socket; no per-connection heartbeat tasks
+        self.heartbeats = HeartbeatScheduler(self)
+        
+        # Typing / presence coalescing, flushed on every heartbeat tick
+        self.typing = TypingCoalescer()
+        self.presence_diffs = PresenceDiffer()
+    
+    # ---------- backplane ----------
+    
+    async def start(self, backplane: Optional[Backplane] = None):
+        """Attach and start the backplane (called on app startup)."""
+        if backplane is not None:
+            self.backplane = backplane
+        self._loop = asyncio.get_running_loop()
+        # Membership/profile cache invalidations must reach every worker
+        directory.on_invalidate = self._publish_soon
+        message_cache.on_change = self._publish_soon
+        await self.backplane.start(self._on_backplane_envelope)
+        # Ask running workers to announce who is online on their side
+        await self.backplane.publish({"kind": "presence:sync"})
+        await self.heartbeats.start()
+    
+    async def stop(self):
+        if directory.on_invalidate == self._publish_soon:
+            directory.on_invalidate = None
+        if message_cache.on_change == self._publish_soon:
+            message_cache.on_change = None
+        await self.heartbeats.stop()
+        await self.backplane.publish({"kind": "node:bye"})
+        await self.backplane.stop()
+    
+    def _publish_soon(self, envelope: dict):
+        """Publish from sync code paths (disconnect, REST routes in the threadpool) without awaiting."""
+        if not self.backplane.is_distributed:
+            return
+        try:
+            task = asyncio.get_running_loop().create_task(self.backplane.publish(envelope))
+        except RuntimeError:
+            # Not on the event loop thread
+            if self._loop is not None and not self._loop.is_closed():
+                asyncio.run_coroutine_threadsafe(self.backplane.publish(envelope), self._loop)
+            return
+        self._pending_publishes.add(task)
+        task.add_done_callback(self._pending_publishes.discard)
+    
+    async def _on_backplane_envelope(self, envelope: dict):
+        """Deliver an envelope published by another worker to our local sockets."""
+        kind = envelope.get("kind")
+        origin = envelope.get("origin")
+        if origin and kind != "node:bye":
+            self.remote_nodes[origin] = time()
+        if kind == "user":
+            await self._deliver_to_user(envelope["userId"], envelope["message"])
+        elif kind == "room":
+            await self._deliver_to_room(envelope["conversationId"], envelope["message"])
+        elif kind == "fanout":
+            await self._deliver_fan_out(envelope["events"], envelope["conversation"], envelope["unreadCounts"])
+        elif kind == "broadcast":
+            await self._deliver_to_all(envelope["message"])
+        elif kind == "presence":
+            self._apply_remote_presence(origin, envelope["userId"], envelope["isOnline"], envelope.get("lastSeenAt"))
+        elif kind == "presence:snapshot":
+            for uid in envelope.get("userIds", []):
+                self._apply_remote_presence(origin, uid, True, envelope.get("lastSeenAt"))
+        elif kind == "presence:sync":
+            await self.backplane.publish({
+                "kind": "presence:snapshot",
+                "userIds": list(self.user_connections.keys()),
+                "lastSeenAt": datetime.now(timezone.utc).isoformat()
+            })
+        elif kind == "node:bye":
+            self._forget_node(origin)
+        elif kind == "directory:invalidate":
+            if envelope.get("conversationId"):
+                directory.invalidate_conversation(envelope["conversationId"], propagate=False)
+            if envelope.get("userId"):
+                directory.invalidate_user(envelope["userId"], propagate=False)
+        elif kind == "msgcache:apply":
+            message_cache.apply_remote(envelope)
+        elif kind == "msgcache:invalidate":
+            message_cache.invalidate(envelope["conversationId"], propagate=False)
+        elif kind == "backplane:resync":
+            # Our subscription dropped: deltas may have been missed, rebuild from the DB
+            message_cache.clear()
+            directory.clear()
+    
+    def _forget_node(self, node_id: str):
+        """Mark every user seen only through node_id as offline."""
+        self.remote_nodes.pop(node_id, None)
+        for uid in [uid for uid, nodes in self.remote_online.items() if node_id in nodes]:
+            self._apply_remote_presence(node_id, uid, False, datetime.now(timezone.utc).isoformat())
+    
+    def _apply_remote_presence(self, node_id: str, user_id: str, is_online: bool, last_seen_at: Optional[str]):
+        nodes = self.remote_online[user_id]
+        if is_online:
+            nodes.add(node_id)
+        else:
+            nodes.discard(node_id)
+        if not nodes:
+            del self.remote_online[user_id]
+        self.presence_diffs.mark(user_id, monotonic())
+        self.presence[user_id] = {
+            "is_online": self.is_online(user_id),
+            "last_seen_at": last_seen_at or datetime.now(timezone.utc).isoformat()
+        }
+    
+    def is_online(self, user_id: str) -> bool:
+        """True if the user has an open socket on this or any other worker."""
+        return user_id in self.user_connections or bool(self.remote_online.get(user_id))
+    
+    def offline(self, user_ids, exclude: Optional[str] = None) -> List[str]:
+        """Users without a socket anywhere; their events go to the durable outbox."""
+        return [uid for uid in user_ids if uid != exclude and not self.is_online(uid)]
+    
+    # ---------- connections ----------
     
     async def connect(self, websocket: WebSocket, user_id: str):
         await websocket.accept()
+        self._prune_replay_buffers()
+        buffer = self.replay_buffers.get(user_id)
+        if buffer is None:
+            self.replay_buffers[user_id] = EventReplayBuffer()
+        else:
+            buffer.expires_at = None
+        first_local = user_id not in self.user_connections
         self.user_connections[user_id].add(websocket)
         self.ws_to_user[websocket] = user_id
+        self.heartbeats.register(websocket)
         self.presence[user_id] = {
             "is_online": True,
             "last_seen_at": datetime.now(timezone.utc).isoformat()
         }
+        if first_local:
+            self.presence_diffs.mark(user_id, monotonic())
+            await self.backplane.publish({
+                "kind": "presence",
+                "userId": user_id,
+                "isOnline": True,
+                "lastSeenAt": self.presence[user_id]["last_seen_at"]
+            })
         print(f"[WS] User {user_id} connected")
     
     def disconnect(self, websocket: WebSocket):
@@ -63,13 +257,28 @@ class ConnectionManager:
         if not user_id:
             return
         
+        self.heartbeats.unregister(websocket)
+        self.typing.release_socket(websocket, monotonic())
+        self.presence_diffs.unwatch_all(websocket)
         self.user_connections[user_id].discard(websocket)
         if not self.user_connections[user_id]:
             del self.user_connections[user_id]
+            self.presence_diffs.mark(user_id, monotonic())
+            last_seen_at = datetime.now(timezone.utc).isoformat()
             self.presence[user_id] = {
-                "is_online": False,
-                "last_seen_at": datetime.now(timezone.utc).isoformat()
+                "is_online": self.is_online(user_id),
+                "last_seen_at": last_seen_at
             }
+            # Keep buffering for a while so a quick reconnect can resume
+            buffer = self.replay_buffers.get(user_id)
+            if buffer:
+                buffer.expires_at = time() + REPLAY_RETENTION_SECONDS
+            self._publish_soon({
+                "kind": "presence",
+                "userId": user_id,
+                "isOnline": False,
+                "lastSeenAt": last_seen_at
+            })
         
         for room_id in self.ws_to_rooms[websocket]:
             self.room_connections[room_id].discard(websocket)
@@ -78,87 +287,233 @@ class ConnectionManager:
         
         del self.ws_to_user[websocket]
         del self.ws_to_rooms[websocket]
+        self.ws_codecs.pop(websocket, None)
         print(f"[WS] User {user_id} disconnected")
     
     def join_room(self, websocket: WebSocket, conversation_id: str):
         self.room_connections[conversation_id].add(websocket)
         self.ws_to_rooms[websocket].add(conversation_id)
     
-    async def send_to_user(self, user_id: str, message: dict):
-        """Send message to all connections of a user."""
-        if user_id not in self.user_connections:
-            return
+    def _prune_replay_buffers(self):
+        """Drop replay buffers of users who have been offline past the retention window."""
+        now = time()
+        expired = [
+            uid for uid, buffer in self.replay_buffers.items()
+            if buffer.expires_at is not None and buffer.expires_at <= now
+        ]
+        for uid in expired:
+            del self.replay_buffers[uid]
+    
+    async def close_idle(self, websocket: WebSocket, code: int):
+        """Drop a socket that stopped answering heartbeats."""
+        user_id = self.ws_to_user.get(websocket)
+        self.disconnect(websocket)
+        try:
+            await websocket.close(code=code, reason="Heartbeat timeout")
+        except Exception:
+            pass
+        print(f"[WS] Closed idle connection of user {user_id}")
+    
+    def _expire_presence(self):
+        """Forget presence of users who have been offline past the retention window."""
+        cutoff = datetime.now(timezone.utc).timestamp() - PRESENCE_RETENTION_SECONDS
+        expired = []
+        for uid, entry in self.presence.items():
+            if entry["is_online"] or self.is_online(uid):
+                continue
+            try:
+                last_seen = datetime.fromisoformat(entry["last_seen_at"]).timestamp()
+            except (TypeError, ValueError):
+                last_seen = 0
+            if last_seen <= cutoff:
+                expired.append(uid)
+        for uid in expired:
+            del self.presence[uid]
+            self.presence_diffs.forget(uid)
+    
+    async def run_maintenance(self):
+        """Periodic housekeeping, run once per heartbeat interval by the scheduler."""
+        self._prune_replay_buffers()
+        self._expire_presence()
+        if self.backplane.is_distributed:
+            # Liveness beacon; workers that go silent (crash, kill -9) are dropped
+            await self.backplane.publish({"kind": "node:alive"})
+            cutoff = time() - NODE_TIMEOUT_SECONDS
+            for node_id in [n for n, seen in self.remote_nodes.items() if seen < cutoff]:
+                print(f"[WS] Worker {node_id} timed out; clearing its presence")
+                self._forget_node(node_id)
+    
+    # ---------- coalesced typing / presence ----------
+    
+    async def watch_presence(self, websocket: WebSocket, user_ids):
+        """Subscribe a socket to presence:diff for user_ids; newly watched users are sent right away."""
+        added = self.presence_diffs.watch(websocket, user_ids)
+        snapshot = [
+            {"userId": uid, "isOnline": self.is_online(uid), "lastSeenAt": self.presence[uid]["last_seen_at"]}
+            for uid in added if uid in self.presence
+        ]
+        if snapshot:
+            await self.send_to_socket(websocket, {"type": "presence:diff", "data": {"users": snapshot}})
+    
+    async def flush_coalesced(self, now: float):
+        """Send coalesced typing changes (one frame per room) and due presence diffs; every scheduler tick."""
+        by_room = defaultdict(list)
+        for conversation_id, user_id, is_typing, websocket in self.typing.due(now):
+            by_room[conversation_id].append((user_id, is_typing, websocket))
+        for conversation_id, changes in by_room.items():
+            events = [
+                ({"type": "typing", "data": {"conversationId": conversation_id, "userId": uid, "isTyping": is_typing}},
+                 websocket)
+                for uid, is_typing, websocket in changes
+            ]
+            message = _typing_frame([event for event, _ in events])
+            senders = {websocket for _, websocket in events}
+            room = self.room_connections.get(conversation_id, set())
+            await self._send_many([ws for ws in room if ws not in senders], message, f"room {conversation_id}")
+            # Typers get the others' changes, never an echo of their own
+            for sender in senders & room:
+                own = _typing_frame([event for event, websocket in events if websocket is not sender])
+                if own is not None:
+                    await self._send_many([sender], own, f"room {conversation_id}")
+            await self.backplane.publish({"kind": "room", "conversationId": conversation_id, "message": message})
         
-        data = json.dumps(message)
+        if self.presence_diffs.is_due(now):
+            diffs = self.presence_diffs.collect(
+                now, self.is_online, lambda uid: self.presence.get(uid, {}).get("last_seen_at")
+            )
+            for websocket, users in diffs.items():
+                await self.send_to_socket(websocket, {"type": "presence:diff", "data": {"users": users}})
+    
+    def get_replay(self, user_id: str, stream_id: Optional[str], last_event_id: Optional[int]) -> Optional[List[dict]]:
+        """
+        Events a resuming client missed, or None when a full resync is required
+        (unknown stream, expired buffer or overrun ring).
+        """
+        buffer = self.replay_buffers.get(user_id)
+        if buffer is None or stream_id != buffer.stream_id or last_event_id is None:
+            return None
+        return buffer.since(last_event_id)
+    
+    # ---------- sending ----------
+    
+    def codec_for(self, websocket: WebSocket) -> FrameCodec:
+        return self.ws_codecs.get(websocket, JSON_CODEC)
+    
+    def set_codec(self, websocket: WebSocket, codec: FrameCodec):
+        if codec is JSON_CODEC:
+            self.ws_codecs.pop(websocket, None)
+        else:
+            self.ws_codecs[websocket] = codec
+    
+    async def _send_many(self, sockets, message: Optional[dict], label: str, text: Optional[str] = None):
+        """Send to sockets, encoding once per negotiated codec (text = message's JSON, if known)."""
         dead_sockets = []
-        for ws in self.user_connections[user_id]:
+        frames = {}
+        for ws in list(sockets):
             try:
-                await ws.send_text(data)
+                await send_frame(ws, encode_cached(frames, self.codec_for(ws), message, text))
             except Exception as e:
-                print(f"[WS] Error sending to user {user_id}: {e}")
+                print(f"[WS] Error sending to {label}: {e}")
                 dead_sockets.append(ws)
         
         for ws in dead_sockets:
             self.disconnect(ws)
     
-    async def send_to_room(self, conversation_id: str, message: dict, exclude_ws: Optional[WebSocket] = None):
-        """Broadcast message to all connections in a room."""
+    async def _deliver_to_user(self, user_id: str, message: dict):
+        buffer = self.replay_buffers.get(user_id)
+        if buffer is not None:
+            message = buffer.append(message)
+        
+        if user_id not in self.user_connections:
+            return
+        
+        await self._send_many(self.user_connections[user_id], message, f"user {user_id}")
+    
+    async def _deliver_to_room(self, conversation_id: str, message: dict, exclude_ws: Optional[WebSocket] = None):
         if conversation_id not in self.room_connections:
             return
         
-        data = json.dumps(message)
-        dead_sockets = []
-        for ws in self.room_connections[conversation_id]:
-            if ws == exclude_ws:
+        sockets = [ws for ws in self.room_connections[conversation_id] if ws != exclude_ws]
+        await self._send_many(sockets, message, f"room {conversation_id}")
+    
+    async def _deliver_to_all(self, message: dict):
+        sockets = [ws for connections in self.user_connections.values() for ws in connections]
+        await self._send_many(sockets, message, "all users")
+    
+    async def _deliver_fan_out(self, events: List[dict], conversation: dict, unread_counts: Dict[str, int]):
+        """
+        Deliver one combined frame per recipient: the shared events followed by
+        conv:upsert with that recipient's unreadCount (and eventId, when the
+        recipient has a replay buffer), encoded once per codec in use.
+        """
+        conv_fields = {k: v for k, v in conversation.items() if k != "unreadCount"}
+        for uid, unread in unread_counts.items():
+            buffer = self.replay_buffers.get(uid)
+            connections = self.user_connections.get(uid)
+            if buffer is None and not connections:
                 continue
-            try:
-                await ws.send_text(data)
-            except Exception as e:
-                print(f"[WS] Error sending to room {conversation_id}: {e}")
-                dead_sockets.append(ws)
-        
-        for ws in dead_sockets:
-            self.disconnect(ws)
+            message = {
+                "type": "batch",
+                "data": {"events": [
+                    *events,
+                    {"type": "conv:upsert", "data": {"conversation": {**conv_fields, "unreadCount": unread}}}
+                ]}
+            }
+            if buffer is not None:
+                message = buffer.append(message)
+            if connections:
+                await self._send_many(connections, message, f"user {uid}")
+    
+    async def fan_out_to_members(self, events: List[dict], conversation: dict, unread_counts: Dict[str, int]):
+        """
+        Send events + a per-member conv:upsert to every member in unread_counts
+        (member user_id -> unreadCount), as one frame per recipient on every worker.
+        """
+        await self._deliver_fan_out(events, conversation, unread_counts)
+        await self.backplane.publish({
+            "kind": "fanout",
+            "events": events,
+            "conversation": conversation,
+            "unreadCounts": unread_counts
+        })
+    
+    async def send_to_user(self, user_id: str, message: dict):
+        """Send message to all connections of a user on every worker (buffered for replay on resume)."""
+        await self._deliver_to_user(user_id, message)
+        await self.backplane.publish({"kind": "user", "userId": user_id, "message": message})
+    
+    async def send_to_room(self, conversation_id: str, message: dict, exclude_ws: Optional[WebSocket] = None):
+        """Broadcast message to all connections in a room on every worker."""
+        await self._deliver_to_room(conversation_id, message, exclude_ws)
+        await self.backplane.publish({"kind": "room", "conversationId": conversation_id, "message": message})
     
     async def send_to_socket(self, websocket: WebSocket, message: dict):
         """Send message to a specific socket."""
         try:
-            await websocket.send_text(json.dumps(message))
+            await send_frame(websocket, self.codec_for(websocket).encode(message))
         except Exception as e:
             print(f"[WS] Error sending to socket: {e}")
             self.disconnect(websocket)
     
     async def broadcast_system_event(self, event_type: str, data: dict):
-        """Broadcast system event to all connected WebSocket clients."""
+        """Broadcast system event to all connected WebSocket clients on every worker."""
         message = {
             "type": event_type,
             "data": data
         }
-        data_json = json.dumps(message)
-        dead_sockets = []
-        
-        # Iterate through all user connections
-        for user_id, connections in self.user_connections.items():
-            for ws in connections:
-                try:
-                    await ws.send_text(data_json)
-                except Exception as e:
-                    print(f"[WS] Error broadcasting to user {user_id}: {e}")
-                    dead_sockets.append(ws)
-        
-        # Clean up dead sockets
-        for ws in dead_sockets:
-            self.disconnect(ws)
+        await self._deliver_to_all(message)
+        await self.backplane.publish({"kind": "broadcast", "message": message})
     
-    def check_rate_limit_send(self, user_id: str, limit: int = 5, window: int = 1) -> bool:
-        """Check if user exceeded send rate limit (5 msg/s)."""
-        now = time()
-        timestamps = self.rate_limit_send[user_id]
-        timestamps[:] = [ts for ts in timestamps if now - ts < window]
-        if len(timestamps) >= limit:
-            return False
-        timestamps.append(now)
-        return True
+    async def check_rate_limit_send(self, user_id: str) -> bool:
+        """Check if user exceeded send rate limit (5 msg/s, token bucket shared across workers)."""
+        return await MSG_SEND_LIMITER.allow(user_id)
+
+
+def _typing_frame(events: List[dict]) -> Optional[dict]:
+    """One typing event as is, several as a batch (None when there are none)."""
+    if not events:
+        return None
+    return events[0] if len(events) == 1 else {"type": "batch", "data": {"events": events}}
 
 
 manager = ConnectionManager()
@@ -167,11 +522,43 @@ manager = ConnectionManager()
 async def handle_client_hello(websocket: WebSocket, user_id: str, data: dict, db: Session):
     """
     Handle client:hello event.
-    Expected data: { deviceId, appVersion, lastSync: { conversationId: lastServerMessageId } }
+    Expected data: { deviceId, appVersion, lastSync: { conversationId: lastServerMessageId }, streamId?, lastEventId?,
+                     encoding?: "json" | "msgpack", compression?: "deflate" }
+    
+    When streamId/lastEventId are given and the user's replay buffer still holds
+    every event after lastEventId, only those events are re-sent after
+    server:hello. Otherwise server:hello carries resyncRequired=true and the
+    durable outbox (see rt_outbox) follows as one outbox:drain frame; the
+    client only falls back to REST + conv:sync for what that does not cover.
+    Without streamId the client loads everything over REST anyway, so the
+    outbox is simply dropped.
+    
+    encoding/compression select the wire codec (see rt_codec); server:hello is
+    the first frame sent with it and reports what was accepted. Unsupported
+    values fall back to JSON text.
     """
     device_id = data.get("deviceId")
     app_version = data.get("appVersion")
     last_sync = data.get("lastSync", {})
+    stream_id = data.get("streamId")
+    last_event_id = data.get("lastEventId")
+    
+    wants_resume = last_event_id is not None
+    if wants_resume and not isinstance(last_event_id, int):
+        try:
+            last_event_id = int(last_event_id)
+        except (TypeError, ValueError):
+            last_event_id = None
+    
+    replay = manager.get_replay(user_id, stream_id, last_event_id) if wants_resume else None
+    buffer = manager.replay_buffers.get(user_id)
+    if wants_resume and replay is None:
+        drained = rt_outbox.drain(db, user_id)
+    else:
+        drained = None
+        rt_outbox.discard(db, user_id)
+    codec = negotiate(data)
+    manager.set_codec(websocket, codec)
     
     response = {
         "type": "server:hello",
@@ -179,10 +566,25 @@ async def handle_client_hello(websocket: WebSocket, user_id: str, data: dict, db
         "data": {
             "userId": user_id,
             "serverTime": datetime.now(timezone.utc).isoformat(),
-            "heartbeatIntervalMs": 30000
+            "heartbeatIntervalMs": int(HEARTBEAT_INTERVAL_SECONDS * 1000),
+            "streamId": buffer.stream_id if buffer else None,
+            "lastEventId": buffer.last_event_id if buffer else 0,
+            "resumed": replay is not None,
+            "replayedCount": len(replay) if replay else 0,
+            "resyncRequired": wants_resume and replay is None,
+            "outboxCount": drained["eventCount"] if drained else 0,
+            "encoding": codec.encoding,
+            "compression": codec.compression,
+            "supportedEncodings": available_encodings()
         }
     }
     await manager.send_to_socket(websocket, response)
+    
+    for event in replay or []:
+        await manager.send_to_socket(websocket, event)
+    
+    if drained:
+        await manager.send_to_socket(websocket, {"type": "outbox:drain", "data": drained})
 
 
 async def handle_conv_join(websocket: WebSocket, user_id: str, data: dict, db: Session):
@@ -200,10 +602,7 @@ async def handle_conv_join(websocket: WebSocket, user_id: str, data: dict, db: S
         return
     
     # Check membership
-    is_member = db.query(RTConversationMemberModel).filter(
-        RTConversationMemberModel.conversation_id == conversation_id,
-        RTConversationMemberModel.user_id == user_id
-    ).first()
+    is_member = directory.is_member(db, conversation_id, user_id)
     
     if not is_member:
         await manager.send_to_socket(websocket, {
@@ -214,6 +613,9 @@ async def handle_conv_join(websocket: WebSocket, user_id: str, data: dict, db: S
         return
     
     manager.join_room(websocket, conversation_id)
+    await manager.watch_presence(
+        websocket, [uid for uid in directory.members(db, conversation_id) if uid != user_id]
+    )
     print(f"[WS] User {user_id} joined room {conversation_id}")
 
 
@@ -240,7 +642,7 @@ async def handle_msg_send(websocket: WebSocket, user_id: str, data: dict, db: Se
         return
     
     # Rate limit
-    if not manager.check_rate_limit_send(user_id):
+    if not await manager.check_rate_limit_send(user_id):
         await manager.send_to_socket(websocket, {
             "type": "error",
             "reqId": req_id,
@@ -248,13 +650,10 @@ async def handle_msg_send(websocket: WebSocket, user_id: str, data: dict, db: Se
         })
         return
     
-    # Check membership
-    is_member = db.query(RTConversationMemberModel).filter(
-        RTConversationMemberModel.conversation_id == conversation_id,
-        RTConversationMemberModel.user_id == user_id
-    ).first()
+    # Check membership (cached conversation + members; no query on a hit)
+    conv = directory.conversation(db, conversation_id)
     
-    if not is_member:
+    if not conv or user_id not in conv.members:
         await manager.send_to_socket(websocket, {
             "type": "error",
             "reqId": req_id,
@@ -271,13 +670,31 @@ async def handle_msg_send(websocket: WebSocket, user_id: str, data: dict, db: Se
         })
         return
     
-    # Check idempotency
-    existing_msg = db.query(RTMessageModel).filter(
-        RTMessageModel.sender_id == user_id,
-        RTMessageModel.client_message_id == client_message_id
-    ).first()
+    # Create message; a retried clientMessageId hits idx_rt_messages_sender_client
+    # and inserts nothing (one statement instead of SELECT-then-INSERT)
+    server_message_id = str(uuid.uuid4())
+    created_at_server = datetime.now(timezone.utc)
     
-    if existing_msg:
+    inserted = db.execute(
+        sqlite_insert(RTMessageModel).values(
+            id=server_message_id,
+            conversation_id=conversation_id,
+            sender_id=user_id,
+            client_message_id=client_message_id,
+            content=content,
+            content_type=content_type,
+            attachments_json=attachments,
+            reply_to_id=reply_to_id,  # NEW: Store reply reference
+            created_at=created_at_server
+        ).on_conflict_do_nothing(index_elements=["sender_id", "client_message_id"])
+    ).rowcount
+    
+    if not inserted:
+        db.rollback()
+        existing_msg = db.query(RTMessageModel).filter(
+            RTMessageModel.sender_id == user_id,
+            RTMessageModel.client_message_id == client_message_id
+        ).first()
         # Resend ACK
         await manager.send_to_socket(websocket, {
             "type": "msg:ack",
@@ -291,50 +708,48 @@ async def handle_msg_send(websocket: WebSocket, user_id: str, data: dict, db: Se
         })
         return
     
-    # Create message
-    server_message_id = str(uuid.uuid4())
-    created_at_server = datetime.now(timezone.utc)
-    
-    new_msg = RTMessageModel(
-        id=server_message_id,
-        conversation_id=conversation_id,
-        sender_id=user_id,
-        client_message_id=client_message_id,
-        content=content,
-        content_type=content_type,
-        attachments_json=attachments,
-        reply_to_id=reply_to_id,  # NEW: Store reply reference
-        created_at=created_at_server
-    )
-    db.add(new_msg)
+    upload_store.record_mentions(db, server_message_id, attachments, created_at_server)
     
     # Create receipts for all members
-    members = db.query(RTConversationMemberModel).filter(
-        RTConversationMemberModel.conversation_id == conversation_id
-    ).all()
-    
-    for member in members:
+    for member_id in conv.members:
         receipt = RTMessageReceiptModel(
             message_id=server_message_id,
-            user_id=member.user_id,
-            delivered_at=None if member.user_id != user_id else created_at_server,
+            user_id=member_id,
+            delivered_at=None if member_id != user_id else created_at_server,
             read_at=None
         )
         db.add(receipt)
     
-    # Update conversation updated_at
-    conv = db.query(RTConversationModel).filter(RTConversationModel.id == conversation_id).first()
-    if conv:
-        conv.updated_at = created_at_server
+    # Update conversation updated_at (write only, no load)
+    db.query(RTConversationModel).filter(
+        RTConversationModel.id == conversation_id
+    ).update({RTConversationModel.updated_at: created_at_server}, synchronize_session=False)
     
+    rt_outbox.record_message(db, manager.offline(conv.members, exclude=user_id), conversation_id, server_message_id)
     db.commit()
-    db.refresh(new_msg)
     
-    # Load sender info and all members with user info
-    sender = db.query(UserModel).filter(UserModel.id == user_id).first()
-    members_with_users = db.query(RTConversationMemberModel).filter(
-        RTConversationMemberModel.conversation_id == conversation_id
-    ).options(joinedload(RTConversationMemberModel.user)).all()
+    message_cache.add_message({
+        "id": server_message_id,
+        "conversation_id": conversation_id,
+        "sender_id": user_id,
+        "client_message_id": client_message_id,
+        "content": content,
+        "content_type": content_type,
+        "attachments": attachments,
+        "reply_to_id": reply_to_id,
+        "created_at": created_at_server,
+        "edited_at": None,
+        "deleted_at": None,
+        "receipts": {
+            member_id: {"delivered_at": created_at_server if member_id == user_id else None, "read_at": None}
+            for member_id in conv.members
+        },
+        "reactions": []
+    })
+    
+    # Sender and member display info from the directory cache
+    member_users = directory.users(db, conv.members)
+    sender = member_users.get(user_id)
     
     # Send ACK to sender
     await manager.send_to_socket(websocket, {
@@ -366,24 +781,18 @@ async def handle_msg_send(websocket: WebSocket, user_id: str, data: dict, db: Se
         "senderAvatarUrl": sender.avatar_url if sender else None
     }
     
-    # Broadcast msg:new to ALL members (including sender for multi-device support)
-    for member in members_with_users:
-        await manager.send_to_user(member.user_id, {
-            "type": "msg:new",
-            "data": {"message": message_dto}
-        })
-    
-    # Build conversation DTO and broadcast conv:upsert to all members
+    # Build conversation DTO once; only unreadCount differs per member
     members_dto = []
-    for m in members_with_users:
+    for m in conv.members.values():
+        member_user = member_users.get(m.user_id)
         members_dto.append({
             "userId": m.user_id,
             "role": m.role,
             "joinedAt": to_utc_iso(m.joined_at),
             "isAccepted": m.is_accepted,
-            "userEmail": m.user.email if m.user else None,
-            "userDisplayName": m.user.display_name if m.user else None,
-            "userAvatarUrl": m.user.avatar_url if m.user else None
+            "userEmail": member_user.email if member_user else None,
+            "userDisplayName": member_user.display_name if member_user else None,
+            "userAvatarUrl": member_user.avatar_url if member_user else None
         })
     
     last_message_dto = {
@@ -393,64 +802,67 @@ async def handle_msg_send(websocket: WebSocket, user_id: str, data: dict, db: Se
         "createdAt": to_utc_iso(created_at_server)
     }
     
-    # Calculate unreadCount for each member
-    for member in members_with_users:
-        unread = 0
-        if member.user_id != user_id:
-            # Count unread messages for this member
-            unread = db.query(RTMessageModel).filter(
-                RTMessageModel.conversation_id == conversation_id,
-                RTMessageModel.sender_id != member.user_id,
-                RTMessageModel.deleted_at.is_(None)
-            ).join(
-                RTMessageReceiptModel,
-                (RTMessageReceiptModel.message_id == RTMessageModel.id) &
-                (RTMessageReceiptModel.user_id == member.user_id)
-            ).filter(
-                RTMessageReceiptModel.read_at.is_(None)
-            ).count()
-        
-        conv_dto = {
-            "id": conv.id,
-            "type": conv.type,
-            "title": conv.title,
-            "relatedEntityType": conv.related_entity_type,
-            "relatedEntityId": conv.related_entity_id,
-            "createdAt": to_utc_iso(conv.created_at),
-            "updatedAt": to_utc_iso(conv.updated_at),
-            "members": members_dto,
-            "lastMessage": last_message_dto,
-            "unreadCount": unread
-        }
-        
-        await manager.send_to_user(member.user_id, {
-            "type": "conv:upsert",
-            "data": {"conversation": conv_dto}
-        })
+    conv_dto = {
+        "id": conv.id,
+        "type": conv.type,
+        "title": conv.title,
+        "relatedEntityType": conv.related_entity_type,
+        "relatedEntityId": conv.related_entity_id,
+        "createdAt": to_utc_iso(conv.created_at),
+        "updatedAt": to_utc_iso(created_at_server),
+        "members": members_dto,
+        "lastMessage": last_message_dto
+    }
+    
+    # Unread counts for every member in one grouped query (sender stays 0)
+    unread_rows = db.query(
+        RTMessageReceiptModel.user_id,
+        func.count(RTMessageModel.id)
+    ).join(
+        RTMessageModel, RTMessageModel.id == RTMessageReceiptModel.message_id
+    ).filter(
+        RTMessageModel.conversation_id == conversation_id,
+        RTMessageModel.sender_id != RTMessageReceiptModel.user_id,
+        RTMessageModel.deleted_at.is_(None),
+        RTMessageReceiptModel.read_at.is_(None)
+    ).group_by(RTMessageReceiptModel.user_id).all()
+    unread_by_user = dict(unread_rows)
+    unread_counts = {
+        member_id: 0 if member_id == user_id else unread_by_user.get(member_id, 0)
+        for member_id in conv.members
+    }
+    
+    # msg:new + conv:upsert to ALL members (including sender for multi-device
+    # support) as one combined frame each; shared JSON is encoded once
+    await manager.fan_out_to_members(
+        [{"type": "msg:new", "data": {"message": message_dto}}],
+        conv_dto,
+        unread_counts
+    )
     
-    # Mark delivered for online members
-    for member in members_with_users:
-        if member.user_id == user_id:
-            continue
+    # Mark delivered for online members: one UPDATE, one commit, one event
+    online_ids = [
+        member_id for member_id in conv.members
+        if member_id != user_id and manager.is_online(member_id)
+    ]
+    if online_ids:
+        delivered_at = datetime.now(timezone.utc)
+        db.query(RTMessageReceiptModel).filter(
+            RTMessageReceiptModel.message_id == server_message_id,
+            RTMessageReceiptModel.user_id.in_(online_ids)
+        ).update({RTMessageReceiptModel.delivered_at: delivered_at}, synchronize_session=False)
+        db.commit()
+        message_cache.set_receipts(conversation_id, [server_message_id], online_ids, delivered_at=delivered_at)
         
-        if member.user_id in manager.user_connections:
-            receipt = db.query(RTMessageReceiptModel).filter(
-                RTMessageReceiptModel.message_id == server_message_id,
-                RTMessageReceiptModel.user_id == member.user_id
-            ).first()
-            if receipt:
-                receipt.delivered_at = datetime.now(timezone.utc)
-                db.commit()
-                
-                await manager.send_to_user(user_id, {
-                    "type": "msg:delivered",
-                    "data": {
-                        "conversationId": conversation_id,
-                        "messageId": server_message_id,
-                        "userId": member.user_id,
-                        "deliveredAt": to_utc_iso(receipt.delivered_at)
-                    }
-                })
+        await manager.send_to_user(user_id, {
+            "type": "msg:delivered",
+            "data": {
+                "conversationId": conversation_id,
+                "messageId": server_message_id,
+                "userIds": online_ids,
+                "deliveredAt": to_utc_iso(delivered_at)
+            }
+        })
 
 
 async def handle_msg_read(websocket: WebSocket, user_id: str, data: dict, db: Session):
@@ -488,6 +900,8 @@ async def handle_msg_read(websocket: WebSocket, user_id: str, data: dict, db: Se
     ).all()
     
     read_at = datetime.now(timezone.utc)
+    marked_ids = []
+    offline_senders = set()
     
     for msg in messages_to_mark:
         receipt = db.query(RTMessageReceiptModel).filter(
@@ -497,6 +911,9 @@ async def handle_msg_read(websocket: WebSocket, user_id: str, data: dict, db: Se
         
         if receipt and not receipt.read_at:
             receipt.read_at = read_at
+            marked_ids.append(msg.id)
+            if not manager.is_online(msg.sender_id):
+                offline_senders.add(msg.sender_id)
             
             await manager.send_to_user(msg.sender_id, {
                 "type": "msg:read",
@@ -508,13 +925,21 @@ async def handle_msg_read(websocket: WebSocket, user_id: str, data: dict, db: Se
                 }
             })
     
+    if offline_senders:
+        rt_outbox.record_read(db, offline_senders, conversation_id, user_id, last_read_message_id, read_at)
     db.commit()
+    if marked_ids:
+        message_cache.set_receipts(conversation_id, marked_ids, [user_id], read_at=read_at)
 
 
 async def handle_typing(websocket: WebSocket, user_id: str, data: dict, db: Session):
     """
     Handle typing event.
     Expected data: { conversationId, isTyping }
+    
+    Only recorded here; manager.flush_coalesced sends the net change per
+    room on the next heartbeat tick (repeated starts and short start/stop
+    flaps never reach the room).
     """
     conversation_id = data.get("conversationId")
     is_typing = data.get("isTyping", False)
@@ -522,15 +947,7 @@ async def handle_typing(websocket: WebSocket, user_id: str, data: dict, db: Sess
     if not conversation_id:
         return
     
-    # Broadcast to room (exclude sender)
-    await manager.send_to_room(conversation_id, {
-        "type": "typing",
-        "data": {
-            "conversationId": conversation_id,
-            "userId": user_id,
-            "isTyping": is_typing
-        }
-    }, exclude_ws=websocket)
+    manager.typing.offer(conversation_id, user_id, bool(is_typing), websocket, monotonic())
 
 
 async def handle_msg_pin(websocket: WebSocket, user_id: str, data: dict, db: Session):
@@ -551,10 +968,7 @@ async def handle_msg_pin(websocket: WebSocket, user_id: str, data: dict, db: Ses
         })
         return
     
-    membership = db.query(RTConversationMemberModel).filter(
-        RTConversationMemberModel.conversation_id == conversation_id,
-        RTConversationMemberModel.user_id == user_id
-    ).first()
+    membership = directory.is_member(db, conversation_id, user_id)
     if not membership:
         await manager.send_to_socket(websocket, {
             "type": "error",
@@ -595,7 +1009,10 @@ async def handle_msg_pin(websocket: WebSocket, user_id: str, data: dict, db: Ses
         pinned_at=pinned_at
     )
     db.add(pinned)
+    rt_outbox.record_pin(db, manager.offline(directory.members(db, conversation_id)), conversation_id, message_id,
+                         True, user_id, pinned_at)
     db.commit()
+    message_cache.pin(conversation_id, message_id, user_id, pinned_at)
     
     await manager.send_to_socket(websocket, {
         "type": "msg:pin:ack",
@@ -603,12 +1020,8 @@ async def handle_msg_pin(websocket: WebSocket, user_id: str, data: dict, db: Ses
         "data": {"success": True, "pinnedAt": to_utc_iso(pinned_at)}
     })
     
-    members = db.query(RTConversationMemberModel).filter(
-        RTConversationMemberModel.conversation_id == conversation_id
-    ).all()
-    
-    for member in members:
-        await manager.send_to_user(member.user_id, {
+    for member_id in directory.members(db, conversation_id):
+        await manager.send_to_user(member_id, {
             "type": "msg:pinned",
             "data": {
                 "conversationId": conversation_id,
@@ -637,10 +1050,7 @@ async def handle_msg_unpin(websocket: WebSocket, user_id: str, data: dict, db: S
         })
         return
     
-    membership = db.query(RTConversationMemberModel).filter(
-        RTConversationMemberModel.conversation_id == conversation_id,
-        RTConversationMemberModel.user_id == user_id
-    ).first()
+    membership = directory.is_member(db, conversation_id, user_id)
     if not membership:
         await manager.send_to_socket(websocket, {
             "type": "error",
@@ -662,7 +1072,9 @@ async def handle_msg_unpin(websocket: WebSocket, user_id: str, data: dict, db: S
         return
     
     db.delete(pinned)
+    rt_outbox.record_pin(db, manager.offline(directory.members(db, conversation_id)), conversation_id, message_id, False)
     db.commit()
+    message_cache.unpin(conversation_id, message_id)
     
     await manager.send_to_socket(websocket, {
         "type": "msg:unpin:ack",
@@ -670,12 +1082,8 @@ async def handle_msg_unpin(websocket: WebSocket, user_id: str, data: dict, db: S
         "data": {"success": True}
     })
     
-    members = db.query(RTConversationMemberModel).filter(
-        RTConversationMemberModel.conversation_id == conversation_id
-    ).all()
-    
-    for member in members:
-        await manager.send_to_user(member.user_id, {
+    for member_id in directory.members(db, conversation_id):
+        await manager.send_to_user(member_id, {
             "type": "msg:unpinned",
             "data": {
                 "conversationId": conversation_id,
@@ -745,11 +1153,13 @@ async def handle_msg_edit(websocket: WebSocket, user_id: str, data: dict, db: Se
     # Update message
     msg.content = new_content
     msg.edited_at = datetime.now(timezone.utc)
+    rt_outbox.record_message(db, manager.offline(directory.members(db, conversation_id)), conversation_id, message_id)
     db.commit()
     db.refresh(msg)
+    message_cache.edit_message(conversation_id, message_id, msg.content, msg.edited_at)
     
     # Load sender info
-    sender = db.query(UserModel).filter(UserModel.id == user_id).first()
+    sender = directory.user(db, user_id)
     
     # Build updated message DTO
     message_dto = {
@@ -780,12 +1190,8 @@ async def handle_msg_edit(websocket: WebSocket, user_id: str, data: dict, db: Se
     })
     
     # Broadcast msg:edit to all members
-    members = db.query(RTConversationMemberModel).filter(
-        RTConversationMemberModel.conversation_id == conversation_id
-    ).all()
-    
-    for member in members:
-        await manager.send_to_user(member.user_id, {
+    for member_id in directory.members(db, conversation_id):
+        await manager.send_to_user(member_id, {
             "type": "msg:edit",
             "data": {"message": message_dto}
         })
@@ -836,11 +1242,14 @@ async def handle_msg_delete(websocket: WebSocket, user_id: str, data: dict, db:
         # Soft delete: mark deleted_at and replace content
         msg.deleted_at = datetime.now(timezone.utc)
         msg.content = "Tin nhắn đã bị thu hồi"
+        upload_store.forget_mentions(db, [message_id])
+        rt_outbox.record_message(db, manager.offline(directory.members(db, conversation_id)), conversation_id, message_id)
         db.commit()
         db.refresh(msg)
+        message_cache.delete_message(conversation_id, message_id, msg.content, msg.deleted_at)
         
         # Load sender info
-        sender = db.query(UserModel).filter(UserModel.id == user_id).first()
+        sender = directory.user(db, user_id)
         
         # Build updated message DTO
         message_dto = {
@@ -871,12 +1280,8 @@ async def handle_msg_delete(websocket: WebSocket, user_id: str, data: dict, db:
         })
         
         # Broadcast msg:delete to all members
-        members = db.query(RTConversationMemberModel).filter(
-            RTConversationMemberModel.conversation_id == conversation_id
-        ).all()
-        
-        for member in members:
-            await manager.send_to_user(member.user_id, {
+        for member_id in directory.members(db, conversation_id):
+            await manager.send_to_user(member_id, {
                 "type": "msg:delete",
                 "data": {"message": message_dto}
             })
@@ -935,10 +1340,7 @@ async def handle_msg_react(websocket: WebSocket, user_id: str, data: dict, db: S
         return
     
     # Check membership
-    is_member = db.query(RTConversationMemberModel).filter(
-        RTConversationMemberModel.conversation_id == conversation_id,
-        RTConversationMemberModel.user_id == user_id
-    ).first()
+    is_member = directory.is_member(db, conversation_id, user_id)
     
     if not is_member:
         await manager.send_to_socket(websocket, {
@@ -948,30 +1350,17 @@ async def handle_msg_react(websocket: WebSocket, user_id: str, data: dict, db: S
         })
         return
     
-    # Check if reaction already exists (toggle behavior)
-    existing = db.query(RTMessageReactionModel).filter(
-        RTMessageReactionModel.message_id == message_id,
-        RTMessageReactionModel.user_id == user_id,
-        RTMessageReactionModel.emoji == emoji
-    ).first()
-    
-    action = "removed" if existing else "added"
-    
-    if existing:
-        # Remove reaction
-        db.delete(existing)
-        db.commit()
-    else:
-        # Add reaction
-        reaction = RTMessageReactionModel(
-            message_id=message_id,
-            user_id=user_id,
-            emoji=emoji,
-            created_at=datetime.now(timezone.utc)
-        )
-        db.add(reaction)
-        db.commit()
-        db.refresh(reaction)
+    # Toggle: delete the user's reaction, or insert it if there was none; the emoji count
+    # moves by one in the same transaction (no re-read of the message's reactions)
+    created_at = datetime.now(timezone.utc)
+    summary = rt_reactions.remove(db, message_id, user_id, emoji)
+    action = "removed"
+    if summary is None:
+        summary = rt_reactions.add(db, message_id, user_id, emoji, created_at)
+        action = "added"
+    rt_outbox.record_message(db, manager.offline(directory.members(db, conversation_id)), conversation_id, message_id)
+    db.commit()
+    message_cache.set_reaction(conversation_id, message_id, summary)
     
     # Send ACK to sender
     await manager.send_to_socket(websocket, {
@@ -982,17 +1371,15 @@ async def handle_msg_react(websocket: WebSocket, user_id: str, data: dict, db: S
             "messageId": message_id,
             "emoji": emoji,
             "action": action,
-            "userId": user_id
+            "userId": user_id,
+            "count": summary["count"],
+            "userIds": summary["user_ids"]
         }
     })
     
-    # Broadcast to all members in conversation
-    members = db.query(RTConversationMemberModel).filter(
-        RTConversationMemberModel.conversation_id == conversation_id
-    ).all()
-    
-    for member in members:
-        await manager.send_to_user(member.user_id, {
+    # Broadcast to all members in conversation: the new count replaces the emoji's summary
+    for member_id in directory.members(db, conversation_id):
+        await manager.send_to_user(member_id, {
             "type": "msg:react",
             "data": {
                 "conversationId": conversation_id,
@@ -1000,7 +1387,9 @@ async def handle_msg_react(websocket: WebSocket, user_id: str, data: dict, db: S
                 "emoji": emoji,
                 "userId": user_id,
                 "action": action,
-                "createdAt": datetime.now(timezone.utc).isoformat()
+                "count": summary["count"],
+                "userIds": summary["user_ids"],
+                "createdAt": created_at.isoformat()
             }
         })
 
@@ -1024,10 +1413,7 @@ async def handle_conv_sync(websocket: WebSocket, user_id: str, data: dict, db: S
         })
         return
     
-    is_member = db.query(RTConversationMemberModel).filter(
-        RTConversationMemberModel.conversation_id == conversation_id,
-        RTConversationMemberModel.user_id == user_id
-    ).first()
+    is_member = directory.is_member(db, conversation_id, user_id)
     
     if not is_member:
         await manager.send_to_socket(websocket, {
@@ -1037,41 +1423,53 @@ async def handle_conv_sync(websocket: WebSocket, user_id: str, data: dict, db: S
         })
         return
     
-    query = db.query(RTMessageModel).filter(
-        RTMessageModel.conversation_id == conversation_id,
-        RTMessageModel.deleted_at.is_(None)
-    ).options(joinedload(RTMessageModel.sender))
-    
+    # Short deltas (and fully cached conversations) are answered from the hot-conversation cache
     if after_message_id:
-        after_msg = db.query(RTMessageModel).filter(
-            RTMessageModel.id == after_message_id
-        ).first()
-        if after_msg:
-            query = query.filter(RTMessageModel.created_at > after_msg.created_at)
-    
-    query = query.order_by(RTMessageModel.created_at.asc())
-    messages = query.limit(limit + 1).all()
+        cached = message_cache.after(conversation_id, after_message_id, limit)
+    else:
+        cached = message_cache.oldest(conversation_id, limit)
     
-    has_more = len(messages) > limit
-    if has_more:
-        messages = messages[:limit]
+    if cached is not None:
+        records, has_more = cached
+    else:
+        query = db.query(RTMessageModel).filter(
+            RTMessageModel.conversation_id == conversation_id,
+            RTMessageModel.deleted_at.is_(None)
+        )
+        
+        if after_message_id:
+            after_msg = db.query(RTMessageModel).filter(
+                RTMessageModel.id == after_message_id
+            ).first()
+            if after_msg:
+                query = query.filter(RTMessageModel.created_at > after_msg.created_at)
+        
+        query = query.order_by(RTMessageModel.created_at.asc())
+        messages = query.limit(limit + 1).all()
+        
+        has_more = len(messages) > limit
+        if has_more:
+            messages = messages[:limit]
+        records = [record_from_model(msg, with_relations=False) for msg in messages]
     
+    senders = directory.users(db, {r["sender_id"] for r in records})
     messages_dto = []
-    for msg in messages:
+    for r in records:
+        sender = senders.get(r["sender_id"])
         messages_dto.append({
-            "id": msg.id,
-            "conversationId": msg.conversation_id,
-            "senderId": msg.sender_id,
-            "clientMessageId": msg.client_message_id,
-            "content": msg.content,
-            "contentType": msg.content_type,
-            "attachments": msg.attachments_json,
-            "createdAt": to_utc_iso(msg.created_at),
-            "editedAt": to_utc_iso(msg.edited_at),
-            "deletedAt": to_utc_iso(msg.deleted_at),
-            "senderEmail": msg.sender.email if msg.sender else None,
-            "senderDisplayName": msg.sender.display_name if msg.sender else None,
-            "senderAvatarUrl": msg.sender.avatar_url if msg.sender else None
+            "id": r["id"],
+            "conversationId": r["conversation_id"],
+            "senderId": r["sender_id"],
+            "clientMessageId": r["client_message_id"],
+            "content": r["content"],
+            "contentType": r["content_type"],
+            "attachments": r["attachments"],
+            "createdAt": to_utc_iso(r["created_at"]),
+            "editedAt": to_utc_iso(r["edited_at"]),
+            "deletedAt": to_utc_iso(r["deleted_at"]),
+            "senderEmail": sender.email if sender else None,
+            "senderDisplayName": sender.display_name if sender else None,
+            "senderAvatarUrl": sender.avatar_url if sender else None
         })
     
     await manager.send_to_socket(websocket, {
@@ -1108,23 +1506,33 @@ async def websocket_endpoint(websocket: WebSocket, token: str = Query(...)):
     # Connect
     await manager.connect(websocket, user_id)
     
-    # Start heartbeat task
-    async def heartbeat():
-        try:
-            while True:
-                await asyncio.sleep(30)
-                await manager.send_to_socket(websocket, {"type": "ping"})
-        except:
-            pass
-    
-    heartbeat_task = asyncio.create_task(heartbeat())
-    
+    # Heartbeats (ping / idle close) are driven by manager.heartbeats
     try:
         while True:
-            data_raw = await websocket.receive_text()
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            manager.heartbeats.touch(websocket)
+            
+            try:
+                # Text frames are JSON; binary frames carry the rt_codec flag byte
+                text = frame.get("text")
+                data = decode_frame(text if text is not None else frame.get("bytes") or b"",
+                                    manager.codec_for(websocket))
+            except json.JSONDecodeError:
+                await manager.send_to_socket(websocket, {
+                    "type": "error",
+                    "data": {"code": "INVALID_JSON", "message": "Invalid JSON"}
+                })
+                continue
+            except ValueError as e:
+                await manager.send_to_socket(websocket, {
+                    "type": "error",
+                    "data": {"code": "INVALID_FRAME", "message": str(e)}
+                })
+                continue
             
             try:
-                data = json.loads(data_raw)
                 event_type = data.get("type")
                 req_id = data.get("reqId")
                 event_data = data.get("data", {})
@@ -1177,11 +1585,6 @@ async def websocket_endpoint(websocket: WebSocket, token: str = Query(...)):
                 finally:
                     db.close()
             
-            except json.JSONDecodeError:
-                await manager.send_to_socket(websocket, {
-                    "type": "error",
-                    "data": {"code": "INVALID_JSON", "message": "Invalid JSON"}
-                })
             except Exception as e:
                 print(f"[WS] Error handling event: {e}")
                 await manager.send_to_socket(websocket, {
@@ -1194,5 +1597,4 @@ async def websocket_endpoint(websocket: WebSocket, token: str = Query(...)):
     except Exception as e:
         print(f"[WS] Connection error: {e}")
     finally:
-        heartbeat_task.cancel()
         manager.disconnect(websocket)
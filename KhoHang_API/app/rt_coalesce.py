@@ -0,0 +1,172 @@
+# app/rt_coalesce.py
+"""
+Coalescing of low-priority realtime traffic: typing indicators and presence.
+
+Typing: the desktop client sends isTyping=true on the first keystroke and
+isTyping=false after 1 s without one, so a user typing in bursts produces a
+start/stop pair every second or two, each fanned out to the whole room.
+TypingCoalescer only records the latest state per (conversation, user); once
+per TYPING_FLUSH_SECONDS the manager sends one frame per room with the net
+changes:
+- a start when the user is not shown as typing yet, or when the last
+  announcement is older than TYPING_REFRESH_SECONDS (receivers time out the
+  indicator after TYPING_INDICATOR_TIMEOUT_MS in rt_chat_store.ts);
+- a stop once no new start arrived for TYPING_STOP_GRACE_SECONDS.
+A start + stop inside one window is never sent at all.
+
+Presence: PresenceDiffer collects users whose online state changed and, once
+per PRESENCE_FLUSH_SECONDS, sends each watching socket one presence:diff with
+the net changes. Going offline is only announced after it has lasted
+PRESENCE_OFFLINE_GRACE_SECONDS, so quick reconnects are never seen by watchers.
+
+Both are flushed by the heartbeat scheduler tick (see rt_scheduler).
+"""
+
+from collections import defaultdict
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+TYPING_FLUSH_SECONDS = 2.0
+TYPING_REFRESH_SECONDS = 10.0
+TYPING_STOP_GRACE_SECONDS = 2.0
+PRESENCE_FLUSH_SECONDS = 5.0
+PRESENCE_OFFLINE_GRACE_SECONDS = 10.0
+
+
+class _TypingState:
+    __slots__ = ("shown", "typing", "announced_at", "stopped_at", "websocket")
+
+    def __init__(self, websocket):
+        # What receivers were last told / what the client last said
+        self.shown = False
+        self.typing = False
+        self.announced_at = 0.0
+        self.stopped_at: Optional[float] = None
+        self.websocket = websocket
+
+
+class TypingCoalescer:
+    """Latest typing state per (conversation, user); due() yields what receivers must be told."""
+
+    def __init__(
+        self,
+        interval: float = TYPING_FLUSH_SECONDS,
+        refresh: float = TYPING_REFRESH_SECONDS,
+        stop_grace: float = TYPING_STOP_GRACE_SECONDS,
+    ):
+        self.interval = interval
+        self.refresh = refresh
+        self.stop_grace = stop_grace
+        self.next_flush = 0.0
+        self._state: Dict[Tuple[str, str], _TypingState] = {}
+        self.received = 0
+        self.emitted = 0
+
+    def offer(self, conversation_id: str, user_id: str, is_typing: bool, websocket, now: float):
+        """Record a client typing event; nothing is sent until the next flush."""
+        self.received += 1
+        key = (conversation_id, user_id)
+        state = self._state.get(key)
+        if state is None:
+            if not is_typing:
+                return
+            state = self._state[key] = _TypingState(websocket)
+        state.websocket = websocket
+        state.typing = is_typing
+        state.stopped_at = None if is_typing else now
+
+    def due(self, now: float) -> List[Tuple[str, str, bool, object]]:
+        """Changes to announce now: (conversation_id, user_id, is_typing, websocket)."""
+        changes = []
+        if now < self.next_flush:
+            return changes
+        self.next_flush = now + self.interval
+        for key, state in list(self._state.items()):
+            if state.typing:
+                if not state.shown or now - state.announced_at >= self.refresh:
+                    state.shown = True
+                    state.announced_at = now
+                    changes.append((key[0], key[1], True, state.websocket))
+            elif not state.shown:
+                del self._state[key]
+            elif now - state.stopped_at >= self.stop_grace:
+                del self._state[key]
+                changes.append((key[0], key[1], False, state.websocket))
+        self.emitted += len(changes)
+        return changes
+
+    def release_socket(self, websocket, now: float):
+        """A socket closed: its indicators are stopped on the next flush."""
+        for state in self._state.values():
+            if state.websocket is websocket:
+                state.typing = False
+                state.stopped_at = now - self.stop_grace
+
+    def __len__(self) -> int:
+        return len(self._state)
+
+
+class PresenceDiffer:
+    """Pending presence changes and who watches whom, flushed as one diff per socket."""
+
+    def __init__(self, interval: float = PRESENCE_FLUSH_SECONDS, offline_grace: float = PRESENCE_OFFLINE_GRACE_SECONDS):
+        self.interval = interval
+        self.offline_grace = offline_grace
+        self.next_flush = 0.0
+        # watched user_id -> sockets that want their presence
+        self.watchers: Dict[str, Set[Hashable]] = defaultdict(set)
+        self.watching: Dict[Hashable, Set[str]] = defaultdict(set)
+        # user_id -> time of its latest change
+        self._dirty: Dict[str, float] = {}
+        # user_id -> isOnline last sent to watchers
+        self._sent: Dict[str, bool] = {}
+        self.changes = 0
+        self.frames = 0
+
+    def watch(self, websocket, user_ids) -> List[str]:
+        """Subscribe websocket to user_ids; returns the ones it was not watching yet."""
+        added = [uid for uid in user_ids if uid not in self.watching[websocket]]
+        for uid in added:
+            self.watching[websocket].add(uid)
+            self.watchers[uid].add(websocket)
+        return added
+
+    def unwatch_all(self, websocket):
+        for uid in self.watching.pop(websocket, ()):
+            sockets = self.watchers.get(uid)
+            if sockets is not None:
+                sockets.discard(websocket)
+                if not sockets:
+                    del self.watchers[uid]
+
+    def mark(self, user_id: str, now: float):
+        self.changes += 1
+        self._dirty[user_id] = now
+
+    def forget(self, user_id: str):
+        self._sent.pop(user_id, None)
+
+    def is_due(self, now: float) -> bool:
+        return now >= self.next_flush
+
+    def collect(self, now: float, is_online, last_seen_at) -> Dict[Hashable, List[dict]]:
+        """Net changes since the last flush, grouped per watching socket."""
+        self.next_flush = now + self.interval
+        dirty, self._dirty = self._dirty, {}
+        diffs: Dict[Hashable, List[dict]] = defaultdict(list)
+        for uid, changed_at in dirty.items():
+            online = is_online(uid)
+            if self._sent.get(uid) == online:
+                continue
+            if not online and now - changed_at < self.offline_grace:
+                # May still be a reconnect; decide on a later flush
+                self._dirty.setdefault(uid, changed_at)
+                continue
+            self._sent[uid] = online
+            sockets = self.watchers.get(uid)
+            if not sockets:
+                continue
+            entry = {"userId": uid, "isOnline": online, "lastSeenAt": last_seen_at(uid)}
+            for ws in sockets:
+                diffs[ws].append(entry)
+        self.frames += len(diffs)
+        return diffs
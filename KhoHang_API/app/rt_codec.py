@@ -0,0 +1,146 @@
+# app/rt_codec.py
+"""
+Wire encodings for the realtime WebSocket, negotiated per socket in client:hello.
+
+Default is JSON text frames, exactly as before. A client may ask for:
+    { "encoding": "msgpack" }      -> MessagePack binary frames (needs msgpack installed)
+    { "compression": "deflate" }   -> frames of COMPRESS_MIN_BYTES or more are deflated
+
+Binary frames (both directions) start with one flag byte:
+    0x01 FLAG_MSGPACK   payload is MessagePack (otherwise UTF-8 JSON)
+    0x02 FLAG_DEFLATE   payload is raw deflate (RFC 1951, DecompressionStream('deflate-raw'))
+Text frames are always plain JSON, so small JSON frames stay text even with
+compression on. Inbound, a socket may only use the flags it negotiated, and a
+deflated payload may inflate to MAX_INFLATED_BYTES at most (deflate bombs).
+
+Transport-level permessage-deflate (RFC 7692) is negotiated by uvicorn during
+the HTTP upgrade, before client:hello, and is enabled by default; a client that
+already has it should not also ask for "compression" here.
+"""
+
+from typing import Dict, Optional, Union
+import json
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+FLAG_MSGPACK = 0x01
+FLAG_DEFLATE = 0x02
+
+# Smaller frames (acks, typing, presence) do not shrink enough to pay for deflate
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_LEVEL = 6
+# Largest inbound payload after inflating; client events are small (content <= 4000 chars)
+MAX_INFLATED_BYTES = 1024 * 1024
+
+Frame = Union[str, bytes]
+
+
+def _deflate(payload: bytes) -> bytes:
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -15)
+    return compressor.compress(payload) + compressor.flush()
+
+
+def _inflate(payload: bytes) -> bytes:
+    decompressor = zlib.decompressobj(-15)
+    inflated = decompressor.decompress(payload, MAX_INFLATED_BYTES)
+    if decompressor.unconsumed_tail:
+        raise ValueError(f"Frame inflates past {MAX_INFLATED_BYTES} bytes")
+    return inflated
+
+
+class FrameCodec:
+    """Encodes outbound messages for one (encoding, compression) combination."""
+
+    def __init__(self, encoding: str = "json", compression: Optional[str] = None):
+        self.encoding = encoding
+        self.compression = compression
+
+    @property
+    def key(self) -> tuple:
+        return (self.encoding, self.compression)
+
+    def encode(self, message: Optional[dict] = None, text: Optional[str] = None) -> Frame:
+        """
+        Frame for message. ``text`` is its JSON encoding when the caller already
+        has it (JSON codecs reuse it instead of dumping the dict again).
+        """
+        if self.encoding == "msgpack":
+            if message is None:
+                message = json.loads(text)
+            flags = FLAG_MSGPACK
+            payload = msgpack.packb(message)
+        else:
+            if text is None:
+                text = json.dumps(message)
+            if self.compression is None or len(text) < COMPRESS_MIN_BYTES:
+                return text
+            flags = 0
+            payload = text.encode("utf-8")
+
+        if self.compression == "deflate" and len(payload) >= COMPRESS_MIN_BYTES:
+            flags |= FLAG_DEFLATE
+            payload = _deflate(payload)
+        return bytes((flags,)) + payload
+
+
+JSON_CODEC = FrameCodec()
+
+
+def available_encodings() -> list:
+    return ["json", "msgpack"] if msgpack is not None else ["json"]
+
+
+def negotiate(data: dict) -> FrameCodec:
+    """Codec for the encoding/compression requested in client:hello (unsupported -> JSON / none)."""
+    encoding = data.get("encoding")
+    if encoding not in available_encodings():
+        encoding = "json"
+    compression = "deflate" if data.get("compression") == "deflate" else None
+    if encoding == "json" and compression is None:
+        return JSON_CODEC
+    return FrameCodec(encoding, compression)
+
+
+def decode_frame(frame: Frame, codec: FrameCodec = JSON_CODEC) -> dict:
+    """Inbound frame of a socket using codec -> message dict. Raises ValueError on malformed input."""
+    if isinstance(frame, str):
+        return json.loads(frame)
+    if not frame:
+        raise ValueError("Empty frame")
+    flags, payload = frame[0], frame[1:]
+    if flags & FLAG_DEFLATE and codec.compression != "deflate":
+        raise ValueError("Compression was not negotiated")
+    if flags & FLAG_MSGPACK and codec.encoding != "msgpack":
+        raise ValueError("MessagePack was not negotiated")
+    if flags & FLAG_DEFLATE:
+        try:
+            payload = _inflate(payload)
+        except zlib.error as e:
+            raise ValueError(f"Bad deflate payload: {e}")
+    if flags & FLAG_MSGPACK:
+        if msgpack is None:
+            raise ValueError("MessagePack is not available")
+        try:
+            return msgpack.unpackb(payload)
+        except Exception as e:
+            raise ValueError(f"Bad MessagePack payload: {e}")
+    return json.loads(payload.decode("utf-8"))
+
+
+async def send_frame(websocket, frame: Frame):
+    if isinstance(frame, str):
+        await websocket.send_text(frame)
+    else:
+        await websocket.send_bytes(frame)
+
+
+def encode_cached(cache: Dict[tuple, Frame], codec: FrameCodec, message: Optional[dict], text: Optional[str]) -> Frame:
+    """Encode once per codec when the same message goes to many sockets."""
+    frame = cache.get(codec.key)
+    if frame is None:
+        frame = cache[codec.key] = codec.encode(message, text)
+    return frame
@@ -0,0 +1,223 @@
+# app/rt_directory.py
+"""
+Process-level cache of conversation membership and user display info.
+
+Realtime handlers ask this directory "is user X a member of conversation Y",
+"who are the members" and "what are the sender's email / display name /
+avatar" instead of querying rt_conversation_members and users on every event.
+Each miss costs one query; hits cost none.
+
+Invalidation:
+- rt_chat_routes: create-direct, accept, reject -> invalidate_conversation()
+- user_routes: profile / avatar updates          -> invalidate_user()
+The realtime manager forwards invalidations to other workers over the
+backplane (see on_invalidate). Entries also expire after a TTL so writes
+that bypass these hooks are picked up eventually.
+"""
+
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, Iterable, NamedTuple, Optional
+from time import monotonic
+import threading
+
+from sqlalchemy.orm import Session
+
+from .database import RTConversationModel, RTConversationMemberModel, UserModel
+
+DIRECTORY_TTL_SECONDS = 300
+MAX_CACHED_CONVERSATIONS = 20_000
+MAX_CACHED_USERS = 50_000
+
+
+class MemberInfo(NamedTuple):
+    user_id: str
+    role: str
+    joined_at: Optional[datetime]
+    is_accepted: bool
+
+
+class UserInfo(NamedTuple):
+    id: str
+    email: Optional[str]
+    display_name: Optional[str]
+    avatar_url: Optional[str]
+
+
+class ConversationInfo(NamedTuple):
+    id: str
+    type: str
+    title: Optional[str]
+    related_entity_type: Optional[str]
+    related_entity_id: Optional[str]
+    created_at: Optional[datetime]
+    # user_id -> MemberInfo, in insertion order
+    members: Dict[str, MemberInfo]
+
+
+class _LRUCache:
+    """Size-bounded LRU with per-entry expiry (not thread-safe; caller locks)."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str, now: float):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= now:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key: str, value, now: float):
+        self._data[key] = (now + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def pop(self, key: str):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+
+class ChatDirectory:
+    """Cached membership + user display info for realtime handlers."""
+
+    def __init__(
+        self,
+        ttl: float = DIRECTORY_TTL_SECONDS,
+        max_conversations: int = MAX_CACHED_CONVERSATIONS,
+        max_users: int = MAX_CACHED_USERS,
+    ):
+        self._conversations = _LRUCache(max_conversations, ttl)
+        self._users = _LRUCache(max_users, ttl)
+        # REST routes run in the threadpool, WS handlers on the event loop
+        self._lock = threading.Lock()
+        # Bumped on every invalidation; a fill that raced with one is not stored
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        # Set by the realtime manager to forward invalidations to other workers
+        self.on_invalidate: Optional[Callable[[dict], None]] = None
+
+    # ---------- conversations ----------
+
+    def conversation(self, db: Session, conversation_id: str) -> Optional[ConversationInfo]:
+        """Conversation metadata + members, or None if it does not exist."""
+        with self._lock:
+            info = self._conversations.get(conversation_id, monotonic())
+            generation = self._generation
+            if info is not None:
+                self.hits += 1
+                return info
+            self.misses += 1
+
+        conv = db.query(RTConversationModel).filter(RTConversationModel.id == conversation_id).first()
+        if conv is None:
+            return None
+        rows = db.query(RTConversationMemberModel).filter(
+            RTConversationMemberModel.conversation_id == conversation_id
+        ).all()
+        info = ConversationInfo(
+            id=conv.id,
+            type=conv.type,
+            title=conv.title,
+            related_entity_type=conv.related_entity_type,
+            related_entity_id=conv.related_entity_id,
+            created_at=conv.created_at,
+            members={
+                m.user_id: MemberInfo(m.user_id, m.role, m.joined_at, bool(m.is_accepted))
+                for m in rows
+            },
+        )
+        with self._lock:
+            if generation == self._generation:
+                self._conversations.put(conversation_id, info, monotonic())
+        return info
+
+    def members(self, db: Session, conversation_id: str) -> Dict[str, MemberInfo]:
+        info = self.conversation(db, conversation_id)
+        return info.members if info else {}
+
+    def is_member(self, db: Session, conversation_id: str, user_id: str) -> bool:
+        return user_id in self.members(db, conversation_id)
+
+    # ---------- users ----------
+
+    def users(self, db: Session, user_ids: Iterable[str]) -> Dict[str, UserInfo]:
+        """Display info for user_ids; all misses are loaded with one IN query."""
+        result: Dict[str, UserInfo] = {}
+        missing = []
+        with self._lock:
+            now = monotonic()
+            generation = self._generation
+            for uid in user_ids:
+                info = self._users.get(uid, now)
+                if info is None:
+                    missing.append(uid)
+                else:
+                    result[uid] = info
+            self.hits += len(result)
+            self.misses += len(missing)
+
+        if missing:
+            rows = db.query(
+                UserModel.id, UserModel.email, UserModel.display_name, UserModel.avatar_url
+            ).filter(UserModel.id.in_(missing)).all()
+            loaded = {row.id: UserInfo(row.id, row.email, row.display_name, row.avatar_url) for row in rows}
+            result.update(loaded)
+            with self._lock:
+                if generation == self._generation:
+                    now = monotonic()
+                    for uid, info in loaded.items():
+                        self._users.put(uid, info, now)
+        return result
+
+    def user(self, db: Session, user_id: str) -> Optional[UserInfo]:
+        return self.users(db, [user_id]).get(user_id)
+
+    # ---------- invalidation ----------
+
+    def invalidate_conversation(self, conversation_id: str, propagate: bool = True):
+        with self._lock:
+            self._generation += 1
+            self._conversations.pop(conversation_id)
+        if propagate and self.on_invalidate:
+            self.on_invalidate({"kind": "directory:invalidate", "conversationId": conversation_id})
+
+    def invalidate_user(self, user_id: str, propagate: bool = True):
+        with self._lock:
+            self._generation += 1
+            self._users.pop(user_id)
+        if propagate and self.on_invalidate:
+            self.on_invalidate({"kind": "directory:invalidate", "userId": user_id})
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._conversations.clear()
+            self._users.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "conversations": len(self._conversations),
+            "users": len(self._users),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRatio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+# Shared by all realtime handlers and REST routes of this worker
+directory = ChatDirectory()
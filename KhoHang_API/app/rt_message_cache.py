@@ -0,0 +1,434 @@
+# app/rt_message_cache.py
+"""
+LRU cache of the newest messages of hot conversations.
+
+For each cached conversation we keep a window of its newest non-deleted
+messages (with receipts and reaction summaries, see rt_reactions) plus, lazily, its pinned list. The
+window is filled with one query on the first open and then kept current in
+place by the write paths (send, edit, delete, react, read/delivered receipts,
+pin, unpin), so re-opening a busy chat or a short conv:sync delta does not
+touch the database.
+
+Records are plain dicts (see record_from_model); sender display info is not
+stored here but joined from rt_directory when serving, so profile changes
+show up without invalidating message windows.
+
+Multi-worker: each mutation here is also published via on_change as a
+"msgcache:apply" delta (operation name + JSON-safe arguments) that other
+workers replay on their own windows with apply_remote(); only changes the
+cache cannot express (archiving, membership edits) publish
+"msgcache:invalidate" and drop the window everywhere.
+
+A window fill (latest / pinned) runs its query outside the lock; if the same
+conversation changes meanwhile the result is discarded. Changes are tracked
+per conversation, and only while a fill of it is in flight.
+"""
+
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import json
+import threading
+
+from sqlalchemy.orm import Session, joinedload
+
+from .database import RTMessageModel, RTPinnedMessageModel, ensure_utc
+from .rt_reactions import summaries_from_counts
+
+# Newest messages kept per conversation (first page is 50, max page 100)
+WINDOW_SIZE = 100
+MAX_CACHED_CONVERSATIONS = 500
+
+
+def record_from_model(msg: RTMessageModel, with_relations: bool = True) -> dict:
+    """Cacheable snapshot of a message row (receipts/reaction_counts must be loaded)."""
+    return {
+        "id": msg.id,
+        "conversation_id": msg.conversation_id,
+        "sender_id": msg.sender_id,
+        "client_message_id": msg.client_message_id,
+        "content": msg.content,
+        "content_type": msg.content_type,
+        "attachments": msg.attachments_json,
+        "reply_to_id": msg.reply_to_id,
+        "created_at": ensure_utc(msg.created_at),
+        "edited_at": ensure_utc(msg.edited_at),
+        "deleted_at": ensure_utc(msg.deleted_at),
+        "receipts": {
+            r.user_id: {"delivered_at": ensure_utc(r.delivered_at), "read_at": ensure_utc(r.read_at)}
+            for r in (msg.receipts if with_relations else [])
+        },
+        "reactions": summaries_from_counts(msg.reaction_counts or []) if with_relations else [],
+    }
+
+
+def _to_json(value):
+    """Datetimes -> ISO strings, recursively (backplane envelopes are plain JSON)."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return {k: _to_json(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_json(v) for v in value]
+    return value
+
+
+def _as_datetime(value) -> Optional[datetime]:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return ensure_utc(value)
+
+
+def _record_from_json(record: dict) -> dict:
+    return {
+        **record,
+        "created_at": _as_datetime(record["created_at"]),
+        "edited_at": _as_datetime(record["edited_at"]),
+        "deleted_at": _as_datetime(record["deleted_at"]),
+        "receipts": {
+            uid: {"delivered_at": _as_datetime(r["delivered_at"]), "read_at": _as_datetime(r["read_at"])}
+            for uid, r in record["receipts"].items()
+        },
+    }
+
+
+def _copy_record(record: dict) -> dict:
+    return {
+        **record,
+        "receipts": {uid: dict(r) for uid, r in record["receipts"].items()},
+        "reactions": [{**r, "user_ids": list(r["user_ids"])} for r in record["reactions"]],
+    }
+
+
+class _ConversationEntry:
+    __slots__ = ("window", "complete", "pinned", "records")
+
+    def __init__(self):
+        # message_id -> record, oldest first (non-deleted only)
+        self.window: "OrderedDict[str, dict]" = OrderedDict()
+        # True when the window holds every non-deleted message of the conversation
+        self.complete = False
+        # [{message_id, pinned_by, pinned_at}] newest first; None = not loaded
+        self.pinned: Optional[List[dict]] = None
+        # Every record referenced by window or pinned (edits apply to both)
+        self.records: Dict[str, dict] = {}
+
+
+class MessageCache:
+    """Per-conversation windows of recent messages, LRU-evicted by conversation."""
+
+    def __init__(self, max_conversations: int = MAX_CACHED_CONVERSATIONS, window_size: int = WINDOW_SIZE):
+        self.max_conversations = max_conversations
+        self.window_size = window_size
+        self._entries: "OrderedDict[str, _ConversationEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        # conversation_id -> [fills in flight, generation]; only while a fill runs
+        self._fills: Dict[str, List[int]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.on_change: Optional[Callable[[dict], None]] = None
+
+    # ---------- internals ----------
+
+    def _entry(self, conversation_id: str) -> Optional[_ConversationEntry]:
+        entry = self._entries.get(conversation_id)
+        if entry is not None:
+            self._entries.move_to_end(conversation_id)
+        return entry
+
+    def _store(self, conversation_id: str, entry: _ConversationEntry):
+        self._entries[conversation_id] = entry
+        self._entries.move_to_end(conversation_id)
+        while len(self._entries) > self.max_conversations:
+            self._entries.popitem(last=False)
+
+    def _trim(self, entry: _ConversationEntry):
+        while len(entry.window) > self.window_size:
+            message_id, _ = entry.window.popitem(last=False)
+            entry.complete = False
+            if not any(p["message_id"] == message_id for p in entry.pinned or []):
+                entry.records.pop(message_id, None)
+
+    def _begin_fill(self, conversation_id: str) -> int:
+        """Register a fill about to query the DB (lock held); returns its generation."""
+        fill = self._fills.setdefault(conversation_id, [0, 0])
+        fill[0] += 1
+        return fill[1]
+
+    def _end_fill(self, conversation_id: str, generation: int) -> bool:
+        """Unregister a fill (lock held); True if the conversation did not change meanwhile."""
+        fill = self._fills[conversation_id]
+        fill[0] -= 1
+        if fill[0] == 0:
+            del self._fills[conversation_id]
+        return fill[1] == generation
+
+    def _changed(self, conversation_id: str, op: str, args: dict, propagate: bool):
+        fill = self._fills.get(conversation_id)
+        if fill is not None:
+            fill[1] += 1
+        if propagate and self.on_change:
+            self.on_change({"kind": "msgcache:apply", "conversationId": conversation_id,
+                            "op": op, "args": _to_json(args)})
+
+    def _load_window(self, db: Session, conversation_id: str) -> Tuple["OrderedDict[str, dict]", bool]:
+        rows = db.query(RTMessageModel).filter(
+            RTMessageModel.conversation_id == conversation_id,
+            RTMessageModel.deleted_at.is_(None)
+        ).options(
+            joinedload(RTMessageModel.receipts),
+            joinedload(RTMessageModel.reaction_counts)
+        ).order_by(RTMessageModel.created_at.desc()).limit(self.window_size + 1).all()
+        complete = len(rows) <= self.window_size
+        window = OrderedDict((m.id, record_from_model(m)) for m in reversed(rows[:self.window_size]))
+        return window, complete
+
+    # ---------- reads ----------
+
+    def latest(self, db: Session, conversation_id: str, limit: int) -> Tuple[List[dict], bool]:
+        """Newest `limit` messages (oldest first) and has_more; fills the window on a miss."""
+        with self._lock:
+            entry = self._entry(conversation_id)
+            if entry is not None and (len(entry.window) > limit or entry.complete):
+                self.hits += 1
+                records = list(entry.window.values())[-limit:]
+                has_more = len(entry.window) > limit or not entry.complete
+                return [_copy_record(r) for r in records], has_more
+            self.misses += 1
+            generation = self._begin_fill(conversation_id)
+
+        try:
+            window, complete = self._load_window(db, conversation_id)
+        except Exception:
+            with self._lock:
+                self._end_fill(conversation_id, generation)
+            raise
+        with self._lock:
+            if self._end_fill(conversation_id, generation):
+                entry = self._entry(conversation_id) or _ConversationEntry()
+                for message_id in entry.window:
+                    if not any(p["message_id"] == message_id for p in entry.pinned or []):
+                        entry.records.pop(message_id, None)
+                entry.window = window
+                entry.records.update(window)
+                entry.complete = complete
+                self._store(conversation_id, entry)
+            records = list(window.values())[-limit:]
+            has_more = len(window) > limit or not complete
+            return [_copy_record(r) for r in records], has_more
+
+    def after(self, conversation_id: str, after_message_id: str, limit: int) -> Optional[Tuple[List[dict], bool]]:
+        """Messages newer than after_message_id, or None if the window cannot answer."""
+        with self._lock:
+            entry = self._entry(conversation_id)
+            if entry is None or after_message_id not in entry.window:
+                self.misses += 1
+                return None
+            self.hits += 1
+            ids = list(entry.window)
+            newer = ids[ids.index(after_message_id) + 1:]
+            return [_copy_record(entry.window[i]) for i in newer[:limit]], len(newer) > limit
+
+    def oldest(self, conversation_id: str, limit: int) -> Optional[Tuple[List[dict], bool]]:
+        """First messages of the conversation, only if the whole history is cached."""
+        with self._lock:
+            entry = self._entry(conversation_id)
+            if entry is None or not entry.complete:
+                self.misses += 1
+                return None
+            self.hits += 1
+            records = list(entry.window.values())
+            return [_copy_record(r) for r in records[:limit]], len(records) > limit
+
+    def pinned(self, db: Session, conversation_id: str) -> List[dict]:
+        """Pinned rows newest first: {message_id, pinned_by, pinned_at, message: record|None}."""
+        with self._lock:
+            entry = self._entry(conversation_id)
+            if entry is not None and entry.pinned is not None:
+                self.hits += 1
+                return [
+                    {**p, "message": _copy_record(entry.records[p["message_id"]]) if p["message_id"] in entry.records else None}
+                    for p in entry.pinned
+                ]
+            self.misses += 1
+            generation = self._begin_fill(conversation_id)
+
+        try:
+            rows = db.query(RTPinnedMessageModel).filter(
+                RTPinnedMessageModel.conversation_id == conversation_id
+            ).options(
+                joinedload(RTPinnedMessageModel.message)
+            ).order_by(RTPinnedMessageModel.pinned_at.desc()).all()
+        except Exception:
+            with self._lock:
+                self._end_fill(conversation_id, generation)
+            raise
+        pinned = [
+            {"message_id": p.message_id, "pinned_by": p.pinned_by, "pinned_at": ensure_utc(p.pinned_at)}
+            for p in rows
+        ]
+        messages = {p.message_id: record_from_model(p.message, with_relations=False) for p in rows if p.message}
+        with self._lock:
+            if self._end_fill(conversation_id, generation):
+                entry = self._entry(conversation_id) or _ConversationEntry()
+                for message_id, record in messages.items():
+                    entry.records.setdefault(message_id, record)
+                entry.pinned = pinned
+                self._store(conversation_id, entry)
+        return [{**p, "message": _copy_record(messages[p["message_id"]]) if p["message_id"] in messages else None} for p in pinned]
+
+    # ---------- in-place updates ----------
+
+    def add_message(self, record: dict, propagate: bool = True):
+        conversation_id = record["conversation_id"]
+        with self._lock:
+            entry = self._entry(conversation_id)
+            if entry is not None and record["deleted_at"] is None:
+                last = next(reversed(entry.window.values()), None)
+                entry.window[record["id"]] = record
+                entry.records[record["id"]] = record
+                if last is not None and ensure_utc(last["created_at"]) > ensure_utc(record["created_at"]):
+                    # Sent on another worker and relayed after a newer local one
+                    entry.window = OrderedDict(sorted(entry.window.items(), key=lambda item: item[1]["created_at"]))
+                self._trim(entry)
+            self._changed(conversation_id, "add_message", {"record": record}, propagate)
+
+    def edit_message(self, conversation_id: str, message_id: str, content: str, edited_at, propagate: bool = True):
+        with self._lock:
+            entry = self._entry(conversation_id)
+            record = entry.records.get(message_id) if entry else None
+            if record is not None:
+                record["content"] = content
+                record["edited_at"] = ensure_utc(edited_at)
+            self._changed(conversation_id, "edit_message",
+                          {"message_id": message_id, "content": content, "edited_at": edited_at}, propagate)
+
+    def delete_message(self, conversation_id: str, message_id: str, content: str, deleted_at, propagate: bool = True):
+        with self._lock:
+            entry = self._entry(conversation_id)
+            if entry is not None:
+                entry.window.pop(message_id, None)
+                record = entry.records.get(message_id)
+                if record is not None:
+                    record["content"] = content
+                    record["deleted_at"] = ensure_utc(deleted_at)
+            self._changed(conversation_id, "delete_message",
+                          {"message_id": message_id, "content": content, "deleted_at": deleted_at}, propagate)
+
+    def set_receipts(self, conversation_id: str, message_ids: Iterable[str], user_ids: Iterable[str],
+                     delivered_at=None, read_at=None, propagate: bool = True):
+        """Stamp delivered_at / read_at for user_ids on message_ids."""
+        message_ids, user_ids = list(message_ids), list(user_ids)
+        with self._lock:
+            entry = self._entry(conversation_id)
+            if entry is not None:
+                for message_id in message_ids:
+                    record = entry.records.get(message_id)
+                    if record is None:
+                        continue
+                    for uid in user_ids:
+                        receipt = record["receipts"].setdefault(uid, {"delivered_at": None, "read_at": None})
+                        if delivered_at is not None:
+                            receipt["delivered_at"] = ensure_utc(delivered_at)
+                        if read_at is not None:
+                            receipt["read_at"] = ensure_utc(read_at)
+            self._changed(conversation_id, "set_receipts",
+                          {"message_ids": message_ids, "user_ids": user_ids,
+                           "delivered_at": delivered_at, "read_at": read_at}, propagate)
+
+    def set_reaction(self, conversation_id: str, message_id: str, summary: dict, propagate: bool = True):
+        """Replace one emoji summary {emoji, count, user_ids} (count 0 removes it)."""
+        with self._lock:
+            entry = self._entry(conversation_id)
+            record = entry.records.get(message_id) if entry else None
+            if record is not None:
+                reactions = [r for r in record["reactions"] if r["emoji"] != summary["emoji"]]
+                if summary["count"] > 0:
+                    reactions.append({**summary, "user_ids": list(summary["user_ids"])})
+                record["reactions"] = sorted(reactions, key=lambda r: (-r["count"], r["emoji"]))
+            self._changed(conversation_id, "set_reaction", {"message_id": message_id, "summary": summary}, propagate)
+
+    def pin(self, conversation_id: str, message_id: str, pinned_by: str, pinned_at, propagate: bool = True):
+        with self._lock:
+            entry = self._entry(conversation_id)
+            if entry is not None and entry.pinned is not None:
+                if message_id in entry.records:
+                    entry.pinned = [p for p in entry.pinned if p["message_id"] != message_id]
+                    entry.pinned.insert(0, {"message_id": message_id, "pinned_by": pinned_by,
+                                            "pinned_at": ensure_utc(pinned_at)})
+                else:
+                    # Message outside the window: reload the pinned list on next read
+                    entry.pinned = None
+            self._changed(conversation_id, "pin",
+                          {"message_id": message_id, "pinned_by": pinned_by, "pinned_at": pinned_at}, propagate)
+
+    def unpin(self, conversation_id: str, message_id: str, propagate: bool = True):
+        with self._lock:
+            entry = self._entry(conversation_id)
+            if entry is not None and entry.pinned is not None:
+                entry.pinned = [p for p in entry.pinned if p["message_id"] != message_id]
+                if message_id not in entry.window:
+                    entry.records.pop(message_id, None)
+            self._changed(conversation_id, "unpin", {"message_id": message_id}, propagate)
+
+    def apply_remote(self, envelope: dict):
+        """Replay a "msgcache:apply" delta published by another worker."""
+        conversation_id, args = envelope["conversationId"], envelope["args"]
+        op = envelope["op"]
+        if op == "add_message":
+            self.add_message(_record_from_json(args["record"]), propagate=False)
+        elif op == "edit_message":
+            self.edit_message(conversation_id, args["message_id"], args["content"],
+                              _as_datetime(args["edited_at"]), propagate=False)
+        elif op == "delete_message":
+            self.delete_message(conversation_id, args["message_id"], args["content"],
+                                _as_datetime(args["deleted_at"]), propagate=False)
+        elif op == "set_receipts":
+            self.set_receipts(conversation_id, args["message_ids"], args["user_ids"],
+                              _as_datetime(args["delivered_at"]), _as_datetime(args["read_at"]), propagate=False)
+        elif op == "set_reaction":
+            self.set_reaction(conversation_id, args["message_id"], args["summary"], propagate=False)
+        elif op == "pin":
+            self.pin(conversation_id, args["message_id"], args["pinned_by"],
+                     _as_datetime(args["pinned_at"]), propagate=False)
+        elif op == "unpin":
+            self.unpin(conversation_id, args["message_id"], propagate=False)
+        else:
+            # Unknown to this (older/newer) worker: be safe
+            self.invalidate(conversation_id, propagate=False)
+
+    def invalidate(self, conversation_id: str, propagate: bool = True):
+        with self._lock:
+            self._entries.pop(conversation_id, None)
+            fill = self._fills.get(conversation_id)
+            if fill is not None:
+                fill[1] += 1
+        if propagate and self.on_change:
+            self.on_change({"kind": "msgcache:invalidate", "conversationId": conversation_id})
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for fill in self._fills.values():
+                fill[1] += 1
+
+    # ---------- metrics ----------
+
+    def stats(self) -> dict:
+        """Hit ratio and approximate memory use (JSON size of cached records)."""
+        with self._lock:
+            records = [r for entry in self._entries.values() for r in entry.records.values()]
+            total = self.hits + self.misses
+            approx_bytes = sum(len(json.dumps(r, default=str)) for r in records)
+            return {
+                "conversations": len(self._entries),
+                "messages": len(records),
+                "approxBytes": approx_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRatio": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+# Shared by realtime handlers and REST routes of this worker
+message_cache = MessageCache()
@@ -0,0 +1,192 @@
+# app/rt_outbox.py
+"""
+Durable per-user outbox of realtime events missed while offline.
+
+send_to_user() only reaches open sockets (plus the in-memory replay buffer,
+which is lost on restart and expires after a few minutes). For members with
+no socket anywhere the handlers also record a compact entry here, in the same
+transaction as the change itself. On the next client:hello that cannot resume,
+the whole outbox is drained into one outbox:drain frame instead of the client
+re-listing conversations and re-loading every message page.
+
+Entries are compacted per (user, dedupe_key), later events replacing earlier ones:
+- "message"   m:{message_id}        new / edited / deleted / reacted message;
+                                    hydrated to its current state when drained
+- "read"      r:{conv}:{reader}     reader's latest read position
+- "pin"       p:{conv}:{message_id} latest pin state
+- "truncated" t:{conv}              too many messages queued for this conversation;
+                                    the client reloads it instead
+"""
+
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session, selectinload
+
+from . import rt_reactions
+from .database import RTOutboxEventModel, RTMessageModel, RTMessageReceiptModel, ensure_utc
+from .rt_directory import directory
+from .rt_message_cache import record_from_model
+from .rt_chat_routes import message_dto_from_record
+
+# Message entries kept per (user, conversation) before it is marked truncated
+OUTBOX_MAX_MESSAGES_PER_CONVERSATION = 200
+
+
+def record(db: Session, user_ids: Iterable[str], conversation_id: str, kind: str, key: str,
+           payload: Optional[dict] = None):
+    """Queue (or replace) one entry for each offline user; committed by the caller."""
+    now = datetime.now(timezone.utc)
+    rows = [
+        {"user_id": uid, "conversation_id": conversation_id, "kind": kind,
+         "dedupe_key": key, "payload": payload, "created_at": now}
+        for uid in dict.fromkeys(user_ids)
+    ]
+    if not rows:
+        return
+    stmt = insert(RTOutboxEventModel).values(rows)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["user_id", "dedupe_key"],
+        set_={"kind": stmt.excluded.kind, "payload": stmt.excluded.payload, "created_at": stmt.excluded.created_at},
+    ))
+
+
+def record_message(db: Session, user_ids: Iterable[str], conversation_id: str, message_id: str):
+    """Queue a message reference, truncating conversations that grew past the cap."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    record(db, user_ids, conversation_id, "message", f"m:{message_id}")
+    over_cap = [uid for (uid,) in db.query(RTOutboxEventModel.user_id).filter(
+        RTOutboxEventModel.user_id.in_(user_ids),
+        RTOutboxEventModel.conversation_id == conversation_id,
+        RTOutboxEventModel.kind == "message"
+    ).group_by(RTOutboxEventModel.user_id).having(
+        func.count(RTOutboxEventModel.id) > OUTBOX_MAX_MESSAGES_PER_CONVERSATION
+    ).all()]
+    if over_cap:
+        db.query(RTOutboxEventModel).filter(
+            RTOutboxEventModel.user_id.in_(over_cap),
+            RTOutboxEventModel.conversation_id == conversation_id,
+            RTOutboxEventModel.kind == "message"
+        ).delete(synchronize_session=False)
+        record(db, over_cap, conversation_id, "truncated", f"t:{conversation_id}")
+
+
+def record_read(db: Session, user_ids: Iterable[str], conversation_id: str, reader_id: str,
+                last_read_message_id: str, read_at: datetime):
+    record(db, user_ids, conversation_id, "read", f"r:{conversation_id}:{reader_id}", {
+        "userId": reader_id,
+        "lastReadMessageId": last_read_message_id,
+        "readAt": ensure_utc(read_at).isoformat(),
+    })
+
+
+def record_pin(db: Session, user_ids: Iterable[str], conversation_id: str, message_id: str,
+               pinned: bool, pinned_by: Optional[str] = None, pinned_at: Optional[datetime] = None):
+    record(db, user_ids, conversation_id, "pin", f"p:{conversation_id}:{message_id}", {
+        "messageId": message_id,
+        "pinned": pinned,
+        "pinnedBy": pinned_by,
+        "pinnedAt": ensure_utc(pinned_at).isoformat() if pinned_at else None,
+    })
+
+
+def discard(db: Session, user_id: str) -> int:
+    """Drop the user's outbox (a resumed session already replayed these events)."""
+    deleted = db.query(RTOutboxEventModel).filter(
+        RTOutboxEventModel.user_id == user_id
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+
+def drain(db: Session, user_id: str) -> Optional[dict]:
+    """
+    Collect and delete the user's outbox; None when it is empty.
+
+    Returns the outbox:drain payload: current message DTOs (oldest first), read
+    positions, pin states, conversations to reload, and the unread count of
+    every conversation touched.
+    """
+    rows = db.query(RTOutboxEventModel).filter(
+        RTOutboxEventModel.user_id == user_id
+    ).order_by(RTOutboxEventModel.created_at.asc(), RTOutboxEventModel.id.asc()).all()
+    if not rows:
+        return None
+    row_ids = [row.id for row in rows]
+
+    # Conversations the user has left since are skipped
+    allowed = {
+        cid for cid in {row.conversation_id for row in rows}
+        if directory.is_member(db, cid, user_id)
+    }
+    truncated = {row.conversation_id for row in rows if row.kind == "truncated" and row.conversation_id in allowed}
+
+    message_ids = [
+        row.dedupe_key[2:] for row in rows
+        if row.kind == "message" and row.conversation_id in allowed and row.conversation_id not in truncated
+    ]
+    messages = []
+    if message_ids:
+        found = db.query(RTMessageModel).options(
+            selectinload(RTMessageModel.receipts),
+            selectinload(RTMessageModel.reaction_counts)
+        ).filter(RTMessageModel.id.in_(message_ids)).order_by(RTMessageModel.created_at.asc()).all()
+        records = [record_from_model(msg) for msg in found]
+        senders = directory.users(db, {r["sender_id"] for r in records})
+        reacted = rt_reactions.mine(db, user_id, [r["id"] for r in records if r["reactions"]])
+        messages = [
+            message_dto_from_record(r, senders.get(r["sender_id"]), reacted.get(r["id"], ())).model_dump(
+                by_alias=True, mode="json"
+            )
+            for r in records
+        ]
+
+    reads: List[dict] = []
+    pins: List[dict] = []
+    for row in rows:
+        if row.conversation_id not in allowed or row.conversation_id in truncated:
+            continue
+        if row.kind == "read":
+            reads.append({"conversationId": row.conversation_id, **row.payload})
+        elif row.kind == "pin":
+            pins.append({"conversationId": row.conversation_id, **row.payload})
+
+    conversations = _unread_counts(db, user_id, allowed)
+
+    db.query(RTOutboxEventModel).filter(
+        RTOutboxEventModel.id.in_(row_ids)
+    ).delete(synchronize_session=False)
+    db.commit()
+
+    return {
+        "messages": messages,
+        "reads": reads,
+        "pins": pins,
+        "conversations": conversations,
+        "resyncConversationIds": sorted(truncated),
+        "eventCount": len(rows),
+    }
+
+
+def _unread_counts(db: Session, user_id: str, conversation_ids: set) -> List[dict]:
+    """Current unread count of each touched conversation, in one grouped query."""
+    if not conversation_ids:
+        return []
+    unread_rows = db.query(
+        RTMessageModel.conversation_id,
+        func.count(RTMessageModel.id)
+    ).join(
+        RTMessageReceiptModel, RTMessageReceiptModel.message_id == RTMessageModel.id
+    ).filter(
+        RTMessageModel.conversation_id.in_(conversation_ids),
+        RTMessageReceiptModel.user_id == user_id,
+        RTMessageModel.sender_id != user_id,
+        RTMessageModel.deleted_at.is_(None),
+        RTMessageReceiptModel.read_at.is_(None)
+    ).group_by(RTMessageModel.conversation_id).all()
+    unread = dict(unread_rows)
+    return [{"conversationId": cid, "unreadCount": unread.get(cid, 0)} for cid in sorted(conversation_ids)]
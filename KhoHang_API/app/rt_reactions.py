@@ -0,0 +1,101 @@
+# app/rt_reactions.py
+"""
+Aggregated emoji reactions of realtime chat messages.
+
+rt_message_reactions keeps one row per (message, user, emoji); that list is
+only read on demand (GET /rt/messages/{id}/reactions). Everything else (the
+message list, the hot-conversation cache, msg:react broadcasts) works with
+rt_message_reaction_counts: one row per (message, emoji) holding the count and
+a small sample of reactors, updated with a single-row delta on react/unreact.
+
+Summaries are plain dicts {emoji, count, user_ids}; whether the viewer has
+reacted is looked up per request with mine().
+"""
+
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import case, func, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from .database import REACTION_SAMPLE_SIZE, RTMessageReactionModel, RTMessageReactionCountModel
+
+Counts = RTMessageReactionCountModel
+
+
+def summaries_from_counts(rows: Iterable[RTMessageReactionCountModel]) -> List[dict]:
+    """Summaries of one message, most used emoji first."""
+    return sorted(
+        ({"emoji": r.emoji, "count": r.count, "user_ids": list(r.sample_user_ids or [])} for r in rows if r.count > 0),
+        key=lambda s: (-s["count"], s["emoji"])
+    )
+
+
+def add(db: Session, message_id: str, user_id: str, emoji: str,
+        created_at: Optional[datetime] = None) -> Optional[dict]:
+    """Add user's reaction; returns the new emoji summary, or None if it already existed."""
+    inserted = db.execute(insert(RTMessageReactionModel).values(
+        message_id=message_id, user_id=user_id, emoji=emoji,
+        created_at=created_at or datetime.now(timezone.utc)
+    ).on_conflict_do_nothing())
+    if inserted.rowcount == 0:
+        return None
+
+    stmt = insert(Counts).values(message_id=message_id, emoji=emoji, count=1, sample_user_ids=[user_id])
+    count, sample = db.execute(stmt.on_conflict_do_update(
+        index_elements=["message_id", "emoji"],
+        set_={
+            "count": Counts.count + 1,
+            "sample_user_ids": case(
+                (func.json_array_length(Counts.sample_user_ids) < REACTION_SAMPLE_SIZE,
+                 func.json_insert(Counts.sample_user_ids, "$[#]", user_id)),
+                else_=Counts.sample_user_ids
+            ),
+        },
+    ).returning(Counts.count, Counts.sample_user_ids)).one()
+    return {"emoji": emoji, "count": count, "user_ids": sample}
+
+
+def remove(db: Session, message_id: str, user_id: str, emoji: str) -> Optional[dict]:
+    """Remove user's reaction; returns the new emoji summary (count 0 = gone), or None if absent."""
+    deleted = db.query(RTMessageReactionModel).filter(
+        RTMessageReactionModel.message_id == message_id,
+        RTMessageReactionModel.user_id == user_id,
+        RTMessageReactionModel.emoji == emoji
+    ).delete(synchronize_session=False)
+    if deleted == 0:
+        return None
+
+    key = (Counts.message_id == message_id, Counts.emoji == emoji)
+    row = db.query(Counts).filter(*key).first()
+    if row is None or row.count <= 1:
+        db.query(Counts).filter(*key).delete(synchronize_session=False)
+        return {"emoji": emoji, "count": 0, "user_ids": []}
+
+    sample = list(row.sample_user_ids or [])
+    if user_id in sample:
+        # Refill from the oldest remaining reactors (bounded by the sample size)
+        sample = [uid for (uid,) in db.query(RTMessageReactionModel.user_id).filter(
+            RTMessageReactionModel.message_id == message_id,
+            RTMessageReactionModel.emoji == emoji
+        ).order_by(RTMessageReactionModel.created_at.asc()).limit(REACTION_SAMPLE_SIZE)]
+    count = db.execute(
+        update(Counts).where(*key).values(count=Counts.count - 1, sample_user_ids=sample).returning(Counts.count)
+    ).scalar_one()
+    return {"emoji": emoji, "count": count, "user_ids": sample}
+
+
+def mine(db: Session, user_id: str, message_ids: Iterable[str]) -> Dict[str, set]:
+    """Emojis user_id reacted with, per message id (one indexed query)."""
+    message_ids = list(message_ids)
+    result: Dict[str, set] = {}
+    if not message_ids:
+        return result
+    rows = db.query(RTMessageReactionModel.message_id, RTMessageReactionModel.emoji).filter(
+        RTMessageReactionModel.message_id.in_(message_ids),
+        RTMessageReactionModel.user_id == user_id
+    ).all()
+    for message_id, emoji in rows:
+        result.setdefault(message_id, set()).add(emoji)
+    return result
@@ -0,0 +1,154 @@
+# app/rt_scheduler.py
+"""
+Single scheduler for WebSocket heartbeats and presence housekeeping.
+
+Instead of one sleeping heartbeat task per socket, every socket is placed in a
+hashed timer wheel. One task advances the wheel each tick and pings the whole
+slot in a batch, so the task count stays constant regardless of how many
+sockets are open. Sockets whose last inbound frame (pong or any event) is
+older than idle_timeout are closed. Once per revolution the manager's
+maintenance hook runs (presence expiry, replay-buffer pruning, dead workers).
+Every tick also flushes coalesced typing / presence events (see rt_coalesce).
+"""
+
+from typing import Dict, Hashable, List, Optional, Set
+from time import monotonic
+import asyncio
+
+from .rt_codec import send_frame, encode_cached
+
+HEARTBEAT_INTERVAL_SECONDS = 30.0
+IDLE_TIMEOUT_SECONDS = 90.0
+WHEEL_SLOTS = 30
+PING_SEND_TIMEOUT_SECONDS = 5.0
+IDLE_CLOSE_CODE = 4408  # App-specific: heartbeat timeout
+
+
+class TimerWheel:
+    """Hashed timer wheel: an item scheduled `ticks` ahead lands in slot (cursor + ticks) % n."""
+
+    def __init__(self, slots: int):
+        self.slots: List[Set[Hashable]] = [set() for _ in range(slots)]
+        self.cursor = 0
+        self._slot_of: Dict[Hashable, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    def schedule(self, item: Hashable, ticks: int):
+        self.cancel(item)
+        ticks = max(1, min(ticks, len(self.slots)))
+        slot = (self.cursor + ticks) % len(self.slots)
+        self.slots[slot].add(item)
+        self._slot_of[item] = slot
+
+    def cancel(self, item: Hashable):
+        slot = self._slot_of.pop(item, None)
+        if slot is not None:
+            self.slots[slot].discard(item)
+
+    def advance(self) -> Set[Hashable]:
+        """Move to the next slot and return (and clear) the items due there."""
+        self.cursor = (self.cursor + 1) % len(self.slots)
+        due = self.slots[self.cursor]
+        self.slots[self.cursor] = set()
+        for item in due:
+            self._slot_of.pop(item, None)
+        return due
+
+
+class HeartbeatScheduler:
+    """Pings sockets in batches, closes idle ones and runs periodic maintenance."""
+
+    def __init__(
+        self,
+        manager,
+        interval: float = HEARTBEAT_INTERVAL_SECONDS,
+        idle_timeout: float = IDLE_TIMEOUT_SECONDS,
+        slots: int = WHEEL_SLOTS,
+    ):
+        self.manager = manager
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.tick_seconds = interval / slots
+        self.wheel = TimerWheel(slots)
+        # WebSocket -> monotonic time of last inbound frame
+        self.last_seen: Dict[object, float] = {}
+        self._ping = {"type": "ping"}
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, websocket):
+        self.last_seen[websocket] = monotonic()
+        self.wheel.schedule(websocket, len(self.wheel.slots))
+
+    def unregister(self, websocket):
+        self.last_seen.pop(websocket, None)
+        self.wheel.cancel(websocket)
+
+    def touch(self, websocket):
+        """Record inbound activity (pong or any client event)."""
+        if websocket in self.last_seen:
+            self.last_seen[websocket] = monotonic()
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        next_tick = monotonic()
+        while True:
+            next_tick += self.tick_seconds
+            await asyncio.sleep(max(0.0, next_tick - monotonic()))
+            try:
+                await self.tick()
+            except Exception as e:
+                print(f"[WS] Heartbeat tick failed: {e}")
+
+    async def tick(self, now: Optional[float] = None):
+        """Process one wheel slot: close idle sockets, ping the rest."""
+        now = monotonic() if now is None else now
+        due = self.wheel.advance()
+        idle, alive = [], []
+        for ws in due:
+            if ws not in self.last_seen:
+                continue
+            (idle if now - self.last_seen[ws] > self.idle_timeout else alive).append(ws)
+
+        for ws in alive:
+            self.wheel.schedule(ws, len(self.wheel.slots))
+
+        for ws in idle:
+            await self.manager.close_idle(ws, IDLE_CLOSE_CODE)
+
+        if alive:
+            # Encoded once per negotiated codec, not per socket
+            frames = {}
+            results = await asyncio.gather(
+                *(asyncio.wait_for(
+                    send_frame(ws, encode_cached(frames, self.manager.codec_for(ws), self._ping, None)),
+                    PING_SEND_TIMEOUT_SECONDS,
+                ) for ws in alive),
+                return_exceptions=True,
+            )
+            # Stuck or broken: unregister and close, so the receive loop ends too
+            failed = [ws for ws, result in zip(alive, results) if isinstance(result, BaseException)]
+            await asyncio.gather(
+                *(asyncio.wait_for(self.manager.close_idle(ws, IDLE_CLOSE_CODE), PING_SEND_TIMEOUT_SECONDS)
+                  for ws in failed),
+                return_exceptions=True,
+            )
+
+        # Held-back typing stops and presence diffs ride on the same tick
+        await self.manager.flush_coalesced(now)
+
+        if self.wheel.cursor == 0:
+            await self.manager.run_maintenance()
@@ -0,0 +1,253 @@
+# app/upload_gc.py
+"""
+Garbage collector for uploads nothing points at any more.
+
+Upload URLs (/uploads/<folder>/<name>) are referenced from:
+- realtime messages (not recalled), live or archived: the upload_mentions
+  index kept by upload_store.record_mentions / forget_mentions; filled once
+  from rt_messages and the archive by the first sweep (ensure_mentions)
+- users.avatar_url, chatbot_config.avatar_url, company_info.logo
+- chat_messages.text (a pasted upload URL counts)
+An upload is kept while one of these mentions its URL, or the URL of one of
+its image variants (same stem), and while it is younger than the grace
+period. chat_files get CHAT_FILES_GRACE at least: chatbot attachments are
+only kept in the client's chat history, the server never sees them again.
+
+Swept, committing every GC_BATCH_SIZE items:
+- upload_refs rows -> upload_store.release
+- legacy files in data/uploads/<folder>/ (saved before the blob store),
+  except chatbot/: it ships the default bot avatar (chatbot_avatar.png) that
+  the client uses while chatbot_config.avatar_url is empty
+- blob rows without refs (last URL released) -> upload_store.delete_blobs,
+  blob files without a row (rolled back uploads)
+- data/blobs/tmp leftovers that belong to no open upload session
+Messages sent while a sweep runs are re-read before every batch.
+
+Runs on demand, or every UPLOAD_GC_INTERVAL_HOURS in the server if set:
+    POST /admin/uploads/gc?dry_run=true
+    python -m app.upload_gc [--grace-hours 48] [--dry-run]
+A dry run changes nothing and reports what would be removed.
+"""
+
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import List, Optional, Set, Tuple
+import argparse
+import asyncio
+import os
+import weakref
+
+from sqlalchemy.orm import Session
+
+from . import rt_archive, upload_sessions, upload_store
+from .config import UPLOAD_GC_GRACE_HOURS
+from .database import (
+    ChatbotConfigModel,
+    ChatMessageModel,
+    CompanyInfoModel,
+    RTMessageModel,
+    SessionLocal,
+    UploadBlobModel,
+    UploadMentionModel,
+    UploadRefModel,
+    UploadSessionModel,
+    UserModel,
+    ensure_utc,
+)
+
+LEGACY_FOLDERS = ("rt_files", "chat_files", "avatars", "logos")  # not chatbot/, see above
+CHAT_FILES_GRACE = timedelta(days=30)
+GC_BATCH_SIZE = 200
+SAMPLE_SIZE = 20
+
+_key = upload_store.upload_key
+_indexed_engines = weakref.WeakSet()  # upload_mentions known to be filled
+
+
+def ensure_mentions(db: Session):
+    """
+    Fill upload_mentions from rt_messages and the archive once (databases from
+    before the index); afterwards send / recall keep it current.
+    """
+    engine = db.get_bind()
+    if engine in _indexed_engines:
+        return
+    if db.query(UploadMentionModel).first() is None:
+        rows = [
+            (message_id, attachments, created_at)
+            for message_id, attachments, created_at in db.query(
+                RTMessageModel.id, RTMessageModel.attachments_json, RTMessageModel.created_at
+            ).filter(
+                RTMessageModel.attachments_json.isnot(None),
+                RTMessageModel.deleted_at.is_(None)  # Recalled messages no longer show their files
+            ).yield_per(1000)
+        ]
+        rows += [
+            (record["id"], record["attachments"], record["created_at"])
+            for record in rt_archive.archive.iter_records()
+            if record["deleted_at"] is None and record["attachments"]
+        ]
+        for message_id, attachments, created_at in rows:
+            upload_store.record_mentions(db, message_id, attachments, created_at)
+        db.commit()
+        if rows:
+            print(f"[UploadGC] Indexed uploads of {len(rows)} message(s)")
+    _indexed_engines.add(engine)
+
+
+def referenced_uploads(db: Session, since: Optional[datetime] = None) -> Set[Tuple[str, str]]:
+    """(folder, stem) of every upload mentioned in the DB; since = only messages created after it."""
+    mentions = db.query(UploadMentionModel.folder, UploadMentionModel.stem).distinct()
+    chat = db.query(ChatMessageModel.text).filter(ChatMessageModel.text.like("%/uploads/%"))
+    if since is not None:
+        mentions = mentions.filter(UploadMentionModel.created_at >= since)
+        chat = chat.filter(ChatMessageModel.created_at >= since)
+    keys: Set[Tuple[str, str]] = {(folder, stem) for folder, stem in mentions}
+    for (text,) in chat.yield_per(1000):
+        keys |= upload_store.mentioned_keys(text)
+    for column in (UserModel.avatar_url, ChatbotConfigModel.avatar_url, CompanyInfoModel.logo):
+        for (url,) in db.query(column).filter(column.isnot(None)):
+            keys |= upload_store.mentioned_keys(url)
+    return keys
+
+
+def _old_files(directory: Path, cutoff: datetime) -> List[os.DirEntry]:
+    if not directory.is_dir():
+        return []
+    return [entry for entry in os.scandir(directory)
+            if entry.is_file() and entry.stat().st_mtime < cutoff.timestamp()]
+
+
+def collect_orphans(db: Session, grace_hours: Optional[float] = None, dry_run: bool = False,
+                    now: Optional[datetime] = None) -> dict:
+    """Find (and unless dry_run, delete) unreferenced uploads older than the grace period."""
+    scan_started = datetime.now(timezone.utc)
+    now = now or scan_started
+    grace_hours = UPLOAD_GC_GRACE_HOURS if grace_hours is None else grace_hours
+    grace = timedelta(hours=grace_hours)
+
+    def cutoff(folder: Optional[str] = None) -> datetime:
+        return now - (max(grace, CHAT_FILES_GRACE) if folder == "chat_files" else grace)
+
+    ensure_mentions(db)
+    referenced = referenced_uploads(db)
+
+    # URLs in the blob store
+    orphan_refs: List[Tuple[str, str]] = []
+    orphan_refs_by_blob = {}
+    for folder, name, sha256, created_at in db.query(
+        UploadRefModel.folder, UploadRefModel.name, UploadRefModel.sha256, UploadRefModel.created_at
+    ).yield_per(1000):
+        if _key(folder, name) not in referenced and ensure_utc(created_at) < cutoff(folder):
+            orphan_refs.append((folder, name))
+            orphan_refs_by_blob[sha256] = orphan_refs_by_blob.get(sha256, 0) + 1
+    freed = 0
+    shas = list(orphan_refs_by_blob)
+    for i in range(0, len(shas), 500):
+        for blob in db.query(UploadBlobModel).filter(UploadBlobModel.sha256.in_(shas[i:i + 500])):
+            if orphan_refs_by_blob[blob.sha256] >= blob.ref_count:
+                freed += blob.size
+
+    # Files saved before the blob store
+    legacy: List[Tuple[str, os.DirEntry]] = []
+    for folder in LEGACY_FOLDERS:
+        for entry in _old_files(upload_store.UPLOADS_DIR / folder, cutoff(folder)):
+            if _key(folder, entry.name) not in referenced:
+                legacy.append((folder, entry))
+                freed += entry.stat().st_size
+
+    # Blob store leftovers
+    def unreferenced_blobs_query():
+        return db.query(UploadBlobModel).filter(
+            ~db.query(UploadRefModel.sha256).filter(UploadRefModel.sha256 == UploadBlobModel.sha256).exists()
+        )
+
+    unreferenced_blobs = unreferenced_blobs_query().all()
+    freed += sum(blob.size for blob in unreferenced_blobs)
+    known = {path for (path,) in db.query(UploadBlobModel.path)}
+    stray_blobs = []
+    if upload_store.BLOB_DIR.is_dir():
+        for shard in os.scandir(upload_store.BLOB_DIR):
+            if not shard.is_dir() or Path(shard.path) == upload_store.TMP_DIR:
+                continue
+            for entry in _old_files(Path(shard.path), cutoff()):
+                relative = f"{shard.name}/{entry.name}"
+                if relative.removesuffix(".gz") not in known:
+                    stray_blobs.append(entry)
+                    freed += entry.stat().st_size
+    open_sessions = {f"{upload_id}.upload" for (upload_id,) in db.query(UploadSessionModel.id)}
+    stray_tmp = [entry for entry in _old_files(upload_store.TMP_DIR, cutoff()) if entry.name not in open_sessions]
+    freed += sum(entry.stat().st_size for entry in stray_tmp)
+
+    folders = {}
+    for folder, _ in orphan_refs + [(folder, entry.name) for folder, entry in legacy]:
+        folders[folder] = folders.get(folder, 0) + 1
+    report = {
+        "dryRun": dry_run,
+        "graceHours": grace_hours,
+        "refs": len(orphan_refs),
+        "legacyFiles": len(legacy),
+        "blobs": len(unreferenced_blobs) + len(stray_blobs),
+        "tmpFiles": len(stray_tmp),
+        "bytes": freed,
+        "folders": folders,
+        "sample": [f"/uploads/{folder}/{name}" for folder, name in orphan_refs[:SAMPLE_SIZE]]
+                  + [f"/uploads/{folder}/{entry.name}" for folder, entry in legacy[:max(SAMPLE_SIZE - len(orphan_refs), 0)]],
+    }
+    if dry_run:
+        return report
+
+    kept = 0
+    items = [("ref", folder, name) for folder, name in orphan_refs] + \
+            [("legacy", folder, entry) for folder, entry in legacy]
+    for i in range(0, len(items), GC_BATCH_SIZE):
+        fresh = referenced_uploads(db, since=scan_started)
+        for kind, folder, item in items[i:i + GC_BATCH_SIZE]:
+            name = item if kind == "ref" else item.name
+            if _key(folder, name) in fresh:
+                kept += 1
+            elif kind == "ref":
+                upload_store.release(db, f"/uploads/{folder}/{name}")
+            else:
+                Path(item.path).unlink(missing_ok=True)
+        db.commit()
+
+    # Including the blobs whose last URL was released above
+    unreferenced_blobs = unreferenced_blobs_query().all()
+    for i in range(0, len(unreferenced_blobs), GC_BATCH_SIZE):
+        upload_store.delete_blobs(db, unreferenced_blobs[i:i + GC_BATCH_SIZE])
+    for entry in stray_blobs + stray_tmp:
+        Path(entry.path).unlink(missing_ok=True)
+    upload_sessions.purge_expired(db, now)
+    db.commit()
+
+    report["kept"] = kept  # Referenced by a message sent during the sweep
+    print(f"[UploadGC] Removed {report['refs'] + report['legacyFiles'] - kept} upload(s), "
+          f"{report['blobs']} blob(s), {report['tmpFiles']} temp file(s), ~{freed // 1024} KiB")
+    return report
+
+
+def run_once(grace_hours: Optional[float] = None, dry_run: bool = False) -> dict:
+    db = SessionLocal()
+    try:
+        return collect_orphans(db, grace_hours, dry_run)
+    finally:
+        db.close()
+
+
+async def run_periodically(interval_hours: float):
+    """Background sweeper (started by main): one sweep every interval, off the event loop."""
+    while True:
+        await asyncio.sleep(interval_hours * 3600)
+        try:
+            await asyncio.to_thread(run_once)
+        except Exception as e:
+            print(f"[UploadGC] Sweep failed: {e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Delete uploads that nothing in the database references")
+    parser.add_argument("--grace-hours", type=float, default=None)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    print(run_once(args.grace_hours, args.dry_run))
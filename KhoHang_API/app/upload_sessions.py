@@ -0,0 +1,164 @@
+# app/upload_sessions.py
+"""
+Resumable chunked uploads.
+
+A multipart POST to /rt/files starts over from byte 0 whenever a warehouse
+site's link drops. A large file is sent as an upload session instead:
+    create   -> upload id, offset 0, suggested chunk size
+    PUT      -> raw bytes at ?offset=N (N must equal the bytes received so far)
+    status   -> current offset, to resume after a broken connection
+    complete -> size and SHA-256 of the assembled file are verified, then it
+                is stored through upload_store like any other upload
+Chunks are written straight into data/blobs/tmp/<id>.upload; the session row
+records how many bytes are in. Sessions idle longer than SESSION_TTL are
+purged together with their temp file.
+
+Functions only stage DB changes: the caller commits.
+"""
+
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Optional, Tuple
+import asyncio
+import hashlib
+import uuid
+
+import aiofiles
+from fastapi import HTTPException, Request
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from . import upload_store
+from .config import RT_UPLOAD_CHUNK_SIZE_MB, RT_UPLOAD_MAX_SIZE_MB
+from .database import UploadSessionModel
+
+MAX_SIZE = RT_UPLOAD_MAX_SIZE_MB * 1024 * 1024
+CHUNK_SIZE = RT_UPLOAD_CHUNK_SIZE_MB * 1024 * 1024  # Suggested to clients
+MAX_CHUNK_SIZE = 4 * CHUNK_SIZE  # Largest body accepted by one PUT
+SESSION_TTL = timedelta(hours=24)
+
+
+class ChecksumMismatch(ValueError):
+    """Assembled file does not match the announced size / SHA-256."""
+
+
+def temp_path(upload_id: str) -> Path:
+    return upload_store.TMP_DIR / f"{upload_id}.upload"
+
+
+def expires_at(upload: UploadSessionModel) -> datetime:
+    updated = upload.updated_at
+    if updated.tzinfo is None:
+        updated = updated.replace(tzinfo=timezone.utc)
+    return updated + SESSION_TTL
+
+
+def _offset_conflict(upload: UploadSessionModel, detail: str) -> HTTPException:
+    # Upload-Offset tells the client where to resume without another round trip
+    return HTTPException(409, detail, headers={"Upload-Offset": str(upload.received)})
+
+
+def create(db: Session, user_id: str, folder: str, original_name: str, ext: str, size: int,
+           mime_type: Optional[str] = None, sha256: Optional[str] = None) -> UploadSessionModel:
+    """Open a session and its (empty) temp file; 413 past MAX_SIZE."""
+    if size > MAX_SIZE:
+        raise HTTPException(413, f"File too large (max {MAX_SIZE // (1024 * 1024)}MB)")
+    purge_expired(db)
+
+    upload_store.TMP_DIR.mkdir(parents=True, exist_ok=True)
+    upload = UploadSessionModel(
+        id=uuid.uuid4().hex, user_id=user_id, folder=folder, original_name=original_name,
+        ext=ext, mime_type=mime_type, size=size, received=0,
+        sha256=sha256.lower() if sha256 else None
+    )
+    temp_path(upload.id).touch()
+    db.add(upload)
+    db.flush()
+    return upload
+
+
+def get(db: Session, upload_id: str, user_id: str) -> UploadSessionModel:
+    """The caller's session; 404 for unknown, expired or someone else's."""
+    upload = db.get(UploadSessionModel, upload_id)
+    if upload is None or upload.user_id != user_id or expires_at(upload) < datetime.now(timezone.utc):
+        raise HTTPException(404, "Upload session not found")
+    return upload
+
+
+async def write_chunk(db: Session, upload: UploadSessionModel, offset: int, request: Request) -> int:
+    """Write the request body at `offset`; returns the new offset."""
+    if offset != upload.received:
+        raise _offset_conflict(upload, f"Expected offset {upload.received}")
+
+    written = 0
+    buffer = bytearray()
+    async with aiofiles.open(temp_path(upload.id), "r+b") as f:
+        await f.seek(offset)
+        async for data in request.stream():
+            written += len(data)
+            if written > MAX_CHUNK_SIZE:
+                raise HTTPException(413, f"Chunk too large (max {MAX_CHUNK_SIZE // (1024 * 1024)}MB)")
+            if offset + written > upload.size:
+                raise HTTPException(400, "Chunk goes past the announced file size")
+            buffer += data
+            # Network reads are small; write in upload_store.CHUNK_SIZE blocks
+            if len(buffer) >= upload_store.CHUNK_SIZE:
+                await f.write(bytes(buffer))
+                buffer.clear()
+        if buffer:
+            await f.write(bytes(buffer))
+
+    if not written:
+        return offset
+    # Guarded by the old offset: of two racing PUTs for the same range, one wins
+    result = db.execute(
+        update(UploadSessionModel)
+        .where(UploadSessionModel.id == upload.id, UploadSessionModel.received == offset)
+        .values(received=offset + written, updated_at=datetime.now(timezone.utc))
+        .execution_options(synchronize_session=False)
+    )
+    db.refresh(upload)
+    if result.rowcount == 0:
+        raise _offset_conflict(upload, f"Expected offset {upload.received}")
+    return upload.received
+
+
+def _hash_file(path: Path) -> Tuple[str, int]:
+    sha = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(upload_store.CHUNK_SIZE):
+            sha.update(chunk)
+            size += len(chunk)
+    return sha.hexdigest(), size
+
+
+async def complete(db: Session, upload: UploadSessionModel) -> upload_store.StoredUpload:
+    """Verify the assembled file and store it; raises ChecksumMismatch (session left for discard)."""
+    if upload.received != upload.size:
+        raise _offset_conflict(upload, f"Upload incomplete: {upload.received}/{upload.size} bytes")
+
+    path = temp_path(upload.id)
+    digest, size = await asyncio.to_thread(_hash_file, path)
+    if size != upload.size or (upload.sha256 and digest != upload.sha256):
+        raise ChecksumMismatch(f"expected {upload.sha256 or upload.size}, got {digest} ({size} bytes)")
+
+    stored = upload_store.save_file(db, path, digest, upload.folder, upload.ext,
+                                    upload.original_name, upload.mime_type)
+    db.delete(upload)
+    await upload_store.precompress(stored)
+    return stored
+
+
+def discard(db: Session, upload: UploadSessionModel):
+    temp_path(upload.id).unlink(missing_ok=True)
+    db.delete(upload)
+
+
+def purge_expired(db: Session, now: Optional[datetime] = None) -> int:
+    """Drop sessions idle longer than SESSION_TTL and their temp files."""
+    cutoff = (now or datetime.now(timezone.utc)) - SESSION_TTL
+    expired = db.query(UploadSessionModel).filter(UploadSessionModel.updated_at < cutoff).all()
+    for upload in expired:
+        discard(db, upload)
+    return len(expired)
@@ -0,0 +1,443 @@
+# app/upload_store.py
+"""
+Content-addressed, deduplicated storage for uploaded files.
+
+Uploads are hashed (SHA-256) while they are streamed to a temp file and each
+distinct content is stored once as a blob:
+    data/blobs/<sha[:2]>/<sha><ext>
+The public URLs keep their old shape, /uploads/<folder>/<name>; each URL is a
+row of upload_refs pointing at its blob, and upload_blobs.ref_count counts the
+URLs of a blob. The same price list forwarded to 30 chats is 30 refs, 1 blob.
+
+Images also get small/medium/large variants (image_pool), stored as refs named
+<stem>.<size><ext> next to the original; they go away with it.
+
+URLs are resolved by UploadStaticFiles (the /uploads mount) and by
+/download/{folder}/{name}; files saved before this module existed are still
+served straight from data/uploads/<folder>/.
+
+Caching: a URL never changes content (a new upload is a new name), so blob
+URLs are served with Cache-Control immutable; legacy files on disk may be
+replaced by hand and get no-cache (revalidated through ETag -> 304).
+Compressible blobs (text, old Office formats, ...) get a <blob>.gz written
+once at upload time, served with Content-Encoding: gzip to clients that
+accept it.
+
+save_upload / save_file / save_bytes / release only stage DB changes: the caller commits.
+A blob written for a transaction that never commits has no row and is removed
+by the orphan collector. release never deletes blobs: the last URL leaves the
+row at ref_count 0 for the collector (delete_blobs), and legacy files are
+unlinked only once the caller's commit went through.
+
+Realtime messages record the uploads they mention in upload_mentions
+(record_mentions on send, forget_mentions on recall / history delete); the
+collector reads that index instead of every message and the archive.
+
+Dedupe vs. collector: a new upload claims the blob row (upsert) before it
+looks at the file, and delete_blobs moves files aside before deleting rows
+that still have no refs, restoring any that got claimed meanwhile.
+"""
+
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, NamedTuple, Optional, Set, Tuple
+import asyncio
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import uuid
+
+import aiofiles
+from fastapi import HTTPException, UploadFile
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse
+from sqlalchemy import event
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from . import image_pool
+from .database import DATA_DIR, SessionLocal, UploadBlobModel, UploadMentionModel, UploadRefModel
+
+UPLOADS_DIR = DATA_DIR / "uploads"
+BLOB_DIR = DATA_DIR / "blobs"
+TMP_DIR = BLOB_DIR / "tmp"
+CHUNK_SIZE = 1024 * 1024  # read/write buffer; fewer syscalls per upload than small chunks
+
+# Precompressed .gz copies: only where gzip pays off (images, zip, docx/xlsx, pdf already are compressed)
+COMPRESSIBLE_EXTENSIONS = {'.txt', '.csv', '.json', '.xml', '.svg', '.html', '.doc', '.xls', '.bmp', '.log'}
+PRECOMPRESS_MIN_SIZE = 1024
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+_PENDING_UNLINKS = "upload_store.pending_unlinks"  # Session.info key
+
+_UPLOAD_URL = re.compile(r"/uploads/([\w-]+)/([^/\s\"'?#\\]+)")
+
+
+class StoredUpload(NamedTuple):
+    name: str          # file name inside the folder (URL path segment)
+    url: str           # /uploads/<folder>/<name>
+    sha256: str
+    size: int
+    deduplicated: bool  # content was already stored
+    path: Path         # blob file
+
+
+def blob_path(relative: str) -> Path:
+    return BLOB_DIR / relative
+
+
+def precompressed_path(path: Path) -> Path:
+    return path.with_name(path.name + ".gz")
+
+
+def _precompress(path: Path):
+    """Write <path>.gz next to a compressible blob, kept only if it saves at least 10%."""
+    if path.suffix.lower() not in COMPRESSIBLE_EXTENSIONS or not path.is_file():
+        return
+    size = path.stat().st_size
+    target = precompressed_path(path)
+    if size < PRECOMPRESS_MIN_SIZE or target.exists():
+        return
+    tmp_path = TMP_DIR / f"{uuid.uuid4().hex}.gz.part"
+    try:
+        with open(path, "rb") as src, open(tmp_path, "wb") as raw:
+            with gzip.GzipFile(filename="", mode="wb", fileobj=raw, compresslevel=9, mtime=0) as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        if tmp_path.stat().st_size <= size * 0.9:
+            os.replace(tmp_path, target)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+async def precompress(stored: "StoredUpload"):
+    """gzip a newly stored blob off the event loop (deduplicated content already has its .gz)."""
+    if not stored.deduplicated:
+        await asyncio.to_thread(_precompress, stored.path)
+
+
+def _commit_blob(db: Session, tmp_path: Path, digest: str, size: int, ext: str) -> Tuple[bool, str]:
+    """Move tmp_path into the blob store (or drop it if the content exists); returns (deduplicated, path)."""
+    relative = f"{digest[:2]}/{digest}{ext}"
+    existing = db.get(UploadBlobModel, digest)
+    if existing is not None:
+        relative = existing.path
+
+    # Claim the row first (see module docstring): the collector cannot drop it from now on
+    stmt = insert(UploadBlobModel).values(
+        sha256=digest, size=size, path=relative, ref_count=1, created_at=datetime.now(timezone.utc)
+    )
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["sha256"],
+        set_={"ref_count": UploadBlobModel.ref_count + 1, "path": relative},
+    ))
+
+    target = blob_path(relative)
+    if target.exists():
+        tmp_path.unlink(missing_ok=True)
+        deduplicated = True
+    else:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp_path, target)
+        deduplicated = False
+    return deduplicated, relative
+
+
+def _new_name(ext: str, prefix: str = "") -> str:
+    return f"{prefix}{uuid.uuid4().hex if prefix else uuid.uuid4()}{ext}"
+
+
+def _add_ref(db: Session, folder: str, name: str, digest: str, size: int, blob: Tuple[bool, str],
+             original_name: Optional[str], mime_type: Optional[str]) -> StoredUpload:
+    db.add(UploadRefModel(
+        folder=folder, name=name, sha256=digest, original_name=original_name,
+        mime_type=mime_type, created_at=datetime.now(timezone.utc)
+    ))
+    deduplicated, relative = blob
+    return StoredUpload(name, f"/uploads/{folder}/{name}", digest, size, deduplicated, blob_path(relative))
+
+
+async def save_upload(db: Session, file: UploadFile, folder: str, ext: str, max_size: int,
+                      prefix: str = "") -> StoredUpload:
+    """Stream an upload to a temp file while hashing it, then store it once; 413 past max_size."""
+    TMP_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = TMP_DIR / f"{uuid.uuid4().hex}.part"
+    sha = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(tmp_path, "wb") as f:
+            while chunk := await file.read(CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_size:
+                    raise HTTPException(413, f"File too large (max {max_size // (1024 * 1024)}MB)")
+                sha.update(chunk)
+                await f.write(chunk)
+        digest = sha.hexdigest()
+        blob = _commit_blob(db, tmp_path, digest, size, ext)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    stored = _add_ref(db, folder, _new_name(ext, prefix), digest, size, blob, file.filename, file.content_type)
+    await precompress(stored)
+    return stored
+
+
+def save_file(db: Session, path: Path, digest: str, folder: str, ext: str,
+              original_name: Optional[str] = None, mime_type: Optional[str] = None) -> StoredUpload:
+    """Store a complete file already on disk (assembled chunked upload); path is moved or removed."""
+    size = path.stat().st_size
+    try:
+        blob = _commit_blob(db, path, digest, size, ext)
+    finally:
+        path.unlink(missing_ok=True)
+    return _add_ref(db, folder, _new_name(ext), digest, size, blob, original_name, mime_type)
+
+
+def save_bytes(db: Session, data: bytes, folder: str, ext: str, original_name: Optional[str] = None,
+               mime_type: Optional[str] = None, prefix: str = "", name: Optional[str] = None) -> StoredUpload:
+    """Store content that is already in memory (processed images)."""
+    TMP_DIR.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256(data).hexdigest()
+    tmp_path = TMP_DIR / f"{uuid.uuid4().hex}.part"
+    try:
+        tmp_path.write_bytes(data)
+        blob = _commit_blob(db, tmp_path, digest, len(data), ext)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return _add_ref(db, folder, name or _new_name(ext, prefix), digest, len(data), blob, original_name, mime_type)
+
+
+# ---------- image variants ----------
+
+def _variant_refs(db: Session, folder: str, name: str) -> Dict[str, UploadRefModel]:
+    """Variant refs of an upload: {size name: ref} (names '<stem>.<size><ext>')."""
+    stem = Path(name).stem
+    refs = db.query(UploadRefModel).filter(
+        UploadRefModel.folder == folder,
+        UploadRefModel.name.like(f"{stem}.%"),
+        UploadRefModel.name != name
+    ).all()
+    found = {}
+    for ref in refs:
+        size = ref.name[len(stem) + 1:].split(".")[0]
+        if size in image_pool.VARIANT_SIZES:
+            found[size] = ref
+    return found
+
+
+def _reuse_variants(db: Session, stored: StoredUpload, folder: str) -> Optional[Dict[str, str]]:
+    """Same image uploaded before: point new variant URLs at the existing variant blobs."""
+    others = db.query(UploadRefModel.name).filter(
+        UploadRefModel.folder == folder,
+        UploadRefModel.sha256 == stored.sha256,
+        UploadRefModel.name != stored.name
+    ).limit(5).all()
+    stem = Path(stored.name).stem
+    for (other,) in others:
+        refs = _variant_refs(db, folder, other)
+        if set(refs) != set(image_pool.VARIANT_SIZES):
+            continue
+        urls = {}
+        for size, ref in refs.items():
+            name = f"{stem}.{size}{Path(ref.name).suffix}"
+            db.add(UploadRefModel(folder=folder, name=name, sha256=ref.sha256, mime_type=ref.mime_type,
+                                  created_at=datetime.now(timezone.utc)))
+            db.query(UploadBlobModel).filter(UploadBlobModel.sha256 == ref.sha256).update(
+                {UploadBlobModel.ref_count: UploadBlobModel.ref_count + 1}, synchronize_session=False
+            )
+            urls[size] = f"/uploads/{folder}/{name}"
+        return urls
+    return None
+
+
+async def add_image_variants(db: Session, stored: StoredUpload, folder: str,
+                             source: Optional[bytes] = None) -> Dict[str, str]:
+    """Generate (in the image pool) and store small/medium/large variants; returns {size: url}."""
+    if stored.deduplicated:
+        reused = _reuse_variants(db, stored, folder)
+        if reused is not None:
+            return reused
+    if source is None:
+        source = await asyncio.to_thread(stored.path.read_bytes)
+    try:
+        variants = await image_pool.run(image_pool.make_variants, source)
+    except Exception as e:
+        # Not decodable by PIL (corrupt / unusual file): the original is still served
+        print(f"[Upload] No image variants for {stored.url}: {e}")
+        return {}
+    stem = Path(stored.name).stem
+    urls = {}
+    for size, (data, ext) in variants.items():
+        mime_type = "image/webp" if ext == ".webp" else "image/jpeg"
+        urls[size] = save_bytes(db, data, folder, ext, mime_type=mime_type, name=f"{stem}.{size}{ext}").url
+    return urls
+
+
+def release(db: Session, url: Optional[str]):
+    """Drop one URL (and its variants); a legacy file is unlinked after the caller commits."""
+    if not url or not url.startswith("/uploads/"):
+        return
+    folder, _, name = url[len("/uploads/"):].partition("/")
+    if not folder or not name or "/" in name:
+        return
+    ref = db.get(UploadRefModel, (folder, name))
+    if ref is None:
+        legacy = UPLOADS_DIR / folder / name
+        if legacy.is_file():
+            db.info.setdefault(_PENDING_UNLINKS, []).append(legacy)
+        return
+
+    for each in [ref, *_variant_refs(db, folder, name).values()]:
+        db.query(UploadBlobModel).filter(UploadBlobModel.sha256 == each.sha256).update(
+            {UploadBlobModel.ref_count: UploadBlobModel.ref_count - 1}, synchronize_session=False
+        )
+        db.delete(each)
+
+
+@event.listens_for(Session, "after_commit")
+def _unlink_committed(session: Session):
+    for path in session.info.pop(_PENDING_UNLINKS, ()):
+        try:
+            path.unlink(missing_ok=True)
+        except OSError:
+            pass
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _keep_rolled_back(session: Session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop(_PENDING_UNLINKS, None)
+
+
+def delete_blobs(db: Session, blobs) -> int:
+    """
+    Delete blob rows that have no refs, with their files; commits. Used by the
+    collector. Files are moved aside first and put back when an upload claimed
+    the row in the meantime. Returns the number of blobs deleted.
+    """
+    TMP_DIR.mkdir(parents=True, exist_ok=True)
+    parked = []
+    for blob in blobs:
+        path = blob_path(blob.path)
+        for original in (path, precompressed_path(path)):
+            aside = TMP_DIR / f"{uuid.uuid4().hex}.gc"
+            try:
+                os.replace(original, aside)
+            except FileNotFoundError:
+                continue
+            parked.append((blob.sha256, original, aside))
+    shas = [blob.sha256 for blob in blobs]
+    try:
+        deleted = db.query(UploadBlobModel).filter(
+            UploadBlobModel.sha256.in_(shas),
+            ~db.query(UploadRefModel.sha256).filter(UploadRefModel.sha256 == UploadBlobModel.sha256).exists()
+        ).delete(synchronize_session=False)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        claimed = {sha for (sha,) in db.query(UploadBlobModel.sha256).filter(UploadBlobModel.sha256.in_(shas))}
+        for sha, original, aside in parked:
+            if sha in claimed and not original.exists():
+                os.replace(aside, original)
+            else:
+                aside.unlink(missing_ok=True)
+    return deleted
+
+
+# ---------- mentions ----------
+
+def upload_key(folder: str, name: str) -> Tuple[str, str]:
+    # Variants are <stem>.<size><ext>: keeping the original keeps them, and the other way round
+    return folder, name.split(".", 1)[0]
+
+
+def mentioned_keys(value) -> Set[Tuple[str, str]]:
+    """upload_key of every /uploads URL in a string or JSON value (attachments, text)."""
+    if not value:
+        return set()
+    text = value if isinstance(value, str) else json.dumps(value)
+    return {upload_key(folder, name) for folder, name in _UPLOAD_URL.findall(text)}
+
+
+def record_mentions(db: Session, message_id: str, attachments, created_at: Optional[datetime] = None):
+    """Index the uploads a realtime message shows (staged; the caller commits)."""
+    rows = [{"folder": folder, "stem": stem, "message_id": message_id,
+             "created_at": created_at or datetime.now(timezone.utc)}
+            for folder, stem in mentioned_keys(attachments)]
+    if rows:
+        db.execute(insert(UploadMentionModel).values(rows).on_conflict_do_nothing())
+
+
+def forget_mentions(db: Session, message_ids: Iterable[str]):
+    """Messages recalled or deleted: their uploads are no longer shown (staged)."""
+    message_ids = list(message_ids)
+    for i in range(0, len(message_ids), 500):
+        db.query(UploadMentionModel).filter(
+            UploadMentionModel.message_id.in_(message_ids[i:i + 500])
+        ).delete(synchronize_session=False)
+
+
+def resolve(folder: str, name: str) -> Optional[Path]:
+    """Path serving /uploads/<folder>/<name>: legacy file first, then the blob store."""
+    legacy = UPLOADS_DIR / folder / name
+    if legacy.is_file():
+        return legacy
+    db = SessionLocal()
+    try:
+        row = db.query(UploadBlobModel.path).join(
+            UploadRefModel, UploadRefModel.sha256 == UploadBlobModel.sha256
+        ).filter(UploadRefModel.folder == folder, UploadRefModel.name == name).first()
+    finally:
+        db.close()
+    if row is None:
+        return None
+    path = blob_path(row.path)
+    return path if path.is_file() else None
+
+
+def _accepts_gzip(accept_encoding: str) -> bool:
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        if coding.strip().lower() in ("gzip", "*"):
+            return params.replace(" ", "").lower() not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+
+class UploadStaticFiles(StaticFiles):
+    """/uploads mount: files on disk as before, otherwise the blob behind the URL (see Caching above)."""
+
+    def lookup_path(self, path: str):
+        full_path, stat_result = super().lookup_path(path)
+        if stat_result is None:
+            folder, _, name = path.replace("\\", "/").partition("/")
+            if folder and name and "/" not in name:
+                resolved = resolve(folder, name)
+                if resolved is not None:
+                    return str(resolved), os.stat(resolved)
+        return full_path, stat_result
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope, status_code: int = 200) -> Response:
+        path = Path(full_path)
+        request_headers = Headers(scope=scope)
+        compressible = path.suffix.lower() in COMPRESSIBLE_EXTENSIONS
+        gz_path = precompressed_path(path)
+        if compressible and _accepts_gzip(request_headers.get("accept-encoding", "")) and gz_path.is_file():
+            media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+            response = FileResponse(gz_path, status_code=status_code, stat_result=os.stat(gz_path),
+                                    media_type=media_type)
+            response.headers["Content-Encoding"] = "gzip"
+        else:
+            response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+        if compressible:
+            response.headers["Vary"] = "Accept-Encoding"
+        is_blob = path.is_relative_to(BLOB_DIR)
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL if is_blob else REVALIDATE_CACHE_CONTROL
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
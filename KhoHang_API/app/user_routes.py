@@ -1,18 +1,17 @@
 """user_routes.py - User profile management endpoints"""
 
 import os
-import uuid
-from pathlib import Path
 from typing import Optional, List
-from io import BytesIO
 from fastapi import APIRouter, Depends, HTTPException, File, UploadFile, Query
 from sqlalchemy.orm import Session
 from sqlalchemy import or_
 from pydantic import BaseModel, Field
-from PIL import Image
 
 from .database import get_db, UserModel, get_datadir
 from .auth_middleware import get_current_user
+from .rate_limiter import rate_limit, UPLOAD_LIMITER
+from .rt_directory import directory
+from . import image_pool, upload_store
 
 router = APIRouter(prefix="/users", tags=["Users"])
 
@@ -132,6 +131,7 @@ def update_profile(
     
     db.commit()
     db.refresh(user)
+    directory.invalidate_user(user.id)
     
     return {
         "message": "Profile updated successfully",
@@ -146,13 +146,13 @@ def update_profile(
     }
 
 
-@router.post("/me/avatar")
+@router.post("/me/avatar", dependencies=[Depends(rate_limit(UPLOAD_LIMITER, key="user"))])
 async def upload_avatar(
     file: UploadFile = File(...),
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Upload user avatar - converts to WebP format"""
+    """Upload user avatar - converts to WebP format (in the image pool) and adds small/medium/large variants"""
     
     # Validate file type
     allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/gif", "image/webp", "image/bmp"]
@@ -167,34 +167,8 @@ async def upload_avatar(
         raise HTTPException(status_code=400, detail="File too large. Max 10MB allowed.")
     
     try:
-        # Open image with PIL
-        image = Image.open(BytesIO(contents))
-        
-        # Convert to RGB if necessary (WebP doesn't support all modes)
-        if image.mode in ('RGBA', 'LA', 'P'):
-            # Create white background for transparency
-            background = Image.new('RGB', image.size, (255, 255, 255))
-            if image.mode == 'P':
-                image = image.convert('RGBA')
-            background.paste(image, mask=image.split()[-1] if image.mode in ('RGBA', 'LA') else None)
-            image = background
-        elif image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        # Resize if image is too large
-        if image.width > MAX_AVATAR_SIZE or image.height > MAX_AVATAR_SIZE:
-            # Calculate new size maintaining aspect ratio
-            ratio = min(MAX_AVATAR_SIZE / image.width, MAX_AVATAR_SIZE / image.height)
-            new_size = (int(image.width * ratio), int(image.height * ratio))
-            image = image.resize(new_size, Image.Resampling.LANCZOS)
-        
-        # Generate unique filename with .webp extension
-        filename = f"{uuid.uuid4()}.webp"
-        file_path = UPLOAD_DIR / filename
-        
-        # Save as WebP
-        image.save(file_path, 'WEBP', quality=WEBP_QUALITY, method=6)
-        
+        # Flatten, resize to MAX_AVATAR_SIZE and encode as WebP - off the event loop
+        webp = await image_pool.run(image_pool.convert_to_webp, contents, MAX_AVATAR_SIZE, WEBP_QUALITY)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to process image: {str(e)}")
     
@@ -203,24 +177,24 @@ async def upload_avatar(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
+    # Store once by content (same picture uploaded again reuses the blob)
+    stored = upload_store.save_bytes(db, webp, "avatars", ".webp", file.filename, "image/webp")
+    thumbnails = await upload_store.add_image_variants(db, stored, "avatars", source=webp)
+    
     # Delete old avatar if exists
     if user.avatar_url and user.avatar_url.startswith("/uploads/avatars/"):
-        old_filename = user.avatar_url.split("/")[-1]
-        old_file = UPLOAD_DIR / old_filename
-        if old_file.exists():
-            try:
-                old_file.unlink()
-            except:
-                pass  # Ignore errors when deleting old file
+        upload_store.release(db, user.avatar_url)
     
     # Update URL
-    avatar_url = f"/uploads/avatars/{filename}"
+    avatar_url = stored.url
     user.avatar_url = avatar_url
     db.commit()
+    directory.invalidate_user(user.id)
     
     return {
         "message": "Avatar uploaded successfully",
-        "avatar_url": avatar_url
+        "avatar_url": avatar_url,
+        "thumbnails": thumbnails
     }
 
 
@@ -236,11 +210,10 @@ def delete_avatar(
     
     # Delete file if exists
     if user.avatar_url and user.avatar_url.startswith("/uploads/avatars/"):
-        file_path = Path(user.avatar_url.lstrip("/"))
-        if file_path.exists():
-            file_path.unlink()
+        upload_store.release(db, user.avatar_url)
     
     user.avatar_url = None
     db.commit()
+    directory.invalidate_user(user.id)
     
     return {"message": "Avatar deleted successfully"}
@@ -0,0 +1,353 @@
+# app/voucher_export.py
+"""
+Vouchers (phiếu nhập / phiếu xuất) built and rendered on the server.
+
+voucher_from_stock_in / voucher_from_stock_out turn a stock record into the
+VoucherExportRequest the client used to assemble itself (voucherConverter.ts),
+with the voucher number = record id and the location from the warehouse row.
+
+Single vouchers (GET /stock/{in,out}/{id}/export.{pdf,xlsx}) are rendered in
+the same pool and kept in artifact_cache, keyed by record id + format and the
+SHA-256 of the voucher data: re-printing an unchanged voucher is served from
+memory, any change to the record (or its warehouse) renders it again.
+
+Batch export (POST /export/batch): month-end closing prints every voucher of a
+period. Each voucher x format is rendered by export_to_pdf / export_to_excel
+in a process pool (EXPORT_POOL_WORKERS, 0 = threads in-process; every worker
+runs export_service.warm_up first and keeps its own renderer and template
+cache) and written into a ZIP that is streamed to the client as renders
+finish, not in request order. Records are read lazily (yield_per, on a
+session of their own: the response outlives the request's) as the pool asks
+for work, at most PENDING_PER_WORKER renders per worker are in flight and the
+ZIP is written without seeking (data descriptors), so memory stays flat
+whatever the number of vouchers (only their file names are kept, to avoid
+duplicates). Vouchers that cannot be rendered are listed in LOI.txt inside
+the ZIP instead of failing the whole download.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import datetime
+from typing import AsyncIterator, Iterable, Iterator, List, Literal, NamedTuple, Optional, Tuple
+import asyncio
+import hashlib
+import threading
+import zipfile
+
+from pydantic import BaseModel
+from sqlalchemy import func
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .config import EXPORT_CACHE_MB, EXPORT_POOL_WORKERS
+from .database import StockInRecordModel, StockOutRecordModel, WarehouseModel
+from .enums import RecordStatus
+from .export_service import VoucherExportRequest, VoucherItem, export_to_excel, export_to_pdf, warm_up
+
+VOUCHER_FORMATS = ("pdf", "xlsx")
+MAX_EXCEL_ITEMS = 18  # Rows 16-33 of the Excel template
+PENDING_PER_WORKER = 2
+ERRORS_FILE = "LOI.txt"
+
+_pool: Optional[Executor] = None
+_pool_lock = threading.Lock()
+
+
+class VoucherBatchExportRequest(BaseModel):
+    """Body of POST /export/batch: voucher ids, or a date range (YYYY-MM-DD)."""
+    voucher_ids: Optional[List[str]] = None
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+    types: List[Literal["PN", "PX"]] = ["PN", "PX"]
+    formats: List[Literal["pdf", "xlsx"]] = ["pdf"]
+
+
+# ---------- stock record -> voucher ----------
+
+def warehouse_location(db: Session, code: str, cache: Optional[dict] = None) -> Optional[str]:
+    if cache is not None and code in cache:
+        return cache[code]
+    warehouse = db.query(WarehouseModel).filter(WarehouseModel.code == code).first()
+    location = (warehouse.address or warehouse.name) if warehouse else None
+    if cache is not None:
+        cache[code] = location
+    return location
+
+
+def voucher_from_stock_in(record: StockInRecordModel, warehouse_location: Optional[str] = None) -> VoucherExportRequest:
+    return VoucherExportRequest(
+        voucher_type="PN",
+        voucher_no=record.id,
+        voucher_date=record.date,
+        partner_name=record.supplier,
+        warehouse_code=record.warehouse_code,
+        warehouse_location=warehouse_location,
+        attachments=f"Ghi chú: {record.note}" if record.note else None,
+        tax_rate=record.tax_rate or 0,
+        items=[
+            VoucherItem(
+                sku=item.get("item_code", ""),
+                name=item.get("item_name", ""),
+                unit=item.get("unit", ""),
+                qty_doc=item.get("quantity", 0),
+                qty_actual=item.get("quantity", 0),
+                unit_price=item.get("price") or 0,
+            )
+            for item in record.items or []
+        ],
+    )
+
+
+def voucher_from_stock_out(record: StockOutRecordModel, warehouse_location: Optional[str] = None) -> VoucherExportRequest:
+    if record.purpose and record.note:
+        attachments = f"Mục đích: {record.purpose}. {record.note}"
+    else:
+        attachments = record.purpose or record.note or None
+    return VoucherExportRequest(
+        voucher_type="PX",
+        voucher_no=record.id,
+        voucher_date=record.date,
+        partner_name=record.recipient,
+        warehouse_code=record.warehouse_code,
+        warehouse_location=warehouse_location,
+        attachments=attachments,
+        tax_rate=record.tax_rate or 0,
+        items=[
+            VoucherItem(
+                sku=item.get("item_code", ""),
+                name=item.get("item_name", ""),
+                unit=item.get("unit", ""),
+                qty_doc=item.get("quantity", 0),
+                qty_actual=item.get("quantity", 0),
+                unit_price=item.get("sell_price") or 0,
+            )
+            for item in record.items or []
+        ],
+    )
+
+
+def collect_vouchers(db: Session, voucher_ids: Optional[List[str]] = None, date_from: Optional[str] = None,
+                     date_to: Optional[str] = None, types: Iterable[str] = ("PN", "PX")) -> Iterator[VoucherExportRequest]:
+    """Vouchers of the given ids, or of a date range (YYYY-MM-DD, inclusive), read as they are consumed; cancelled records are skipped."""
+    locations = {}
+    for voucher_type, model, build in (("PN", StockInRecordModel, voucher_from_stock_in),
+                                       ("PX", StockOutRecordModel, voucher_from_stock_out)):
+        if voucher_type not in types:
+            continue
+        query = db.query(model).filter(model.status != RecordStatus.CANCELLED.value)
+        if voucher_ids:
+            query = query.filter(model.id.in_(voucher_ids))
+        # Compare the day only: record dates may carry a time part
+        if date_from:
+            query = query.filter(func.substr(model.date, 1, 10) >= date_from[:10])
+        if date_to:
+            query = query.filter(func.substr(model.date, 1, 10) <= date_to[:10])
+        for record in query.order_by(model.date, model.id).yield_per(200):
+            yield build(record, warehouse_location(db, record.warehouse_code, locations))
+
+
+def stream_vouchers(bind: Engine, *args, **kwargs) -> Iterator[VoucherExportRequest]:
+    """collect_vouchers on a session of its own, closed once the vouchers are consumed (or abandoned)."""
+    db = Session(bind=bind)
+    try:
+        yield from collect_vouchers(db, *args, **kwargs)
+    finally:
+        db.close()
+
+
+# ---------- rendering (top-level so it pickles) ----------
+
+def render_voucher(data: VoucherExportRequest, fmt: str) -> Tuple[str, bytes]:
+    """(file name, content) of one voucher as PDF or XLSX."""
+    buffer, filename = export_to_pdf(data) if fmt == "pdf" else export_to_excel(data)
+    return filename, buffer.getvalue()
+
+
+def content_hash(data: VoucherExportRequest) -> str:
+    """SHA-256 of everything that ends up on the rendered voucher."""
+    return hashlib.sha256(data.model_dump_json().encode("utf-8")).hexdigest()
+
+
+def _executor() -> Optional[Executor]:
+    global _pool
+    if EXPORT_POOL_WORKERS <= 0:
+        return None  # loop's default thread pool
+    with _pool_lock:
+        if _pool is None:
+            # Workers load fonts, PDF styles and Excel templates once, before their first voucher
+            _pool = ProcessPoolExecutor(max_workers=EXPORT_POOL_WORKERS, initializer=warm_up)
+        return _pool
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+# ---------- rendered artifacts ----------
+
+class RenderedVoucher(NamedTuple):
+    digest: str
+    filename: str
+    content: bytes
+
+
+class ArtifactCache:
+    """LRU of rendered vouchers, (record id, format) -> RenderedVoucher, bounded in bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, str], RenderedVoucher]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, record_id: str, fmt: str, digest: str) -> Optional[RenderedVoucher]:
+        with self._lock:
+            entry = self._entries.get((record_id, fmt))
+            if entry is None or entry.digest != digest:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((record_id, fmt))
+            self.hits += 1
+            return entry
+
+    def put(self, record_id: str, fmt: str, entry: RenderedVoucher):
+        if len(entry.content) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop((record_id, fmt), None)
+            if old is not None:
+                self._bytes -= len(old.content)
+            self._entries[(record_id, fmt)] = entry
+            self._bytes += len(entry.content)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.content)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRatio": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+artifact_cache = ArtifactCache(EXPORT_CACHE_MB * 1024 * 1024)
+
+
+async def render_record(record_id: str, data: VoucherExportRequest, fmt: str,
+                        digest: Optional[str] = None) -> RenderedVoucher:
+    """Rendered voucher of a stock record, from artifact_cache when its data has not changed."""
+    digest = digest or content_hash(data)
+    cached = artifact_cache.get(record_id, fmt, digest)
+    if cached is not None:
+        return cached
+    filename, content = await asyncio.get_running_loop().run_in_executor(_executor(), render_voucher, data, fmt)
+    rendered = RenderedVoucher(digest, filename, content)
+    artifact_cache.put(record_id, fmt, rendered)
+    return rendered
+
+
+# ---------- streamed ZIP ----------
+
+class _ZipSink:
+    """Write-only, unseekable file for ZipFile: bytes are handed out with drain()."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def write(self, data) -> int:
+        self._buffer += data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def batch_filename(date_from: Optional[str] = None, date_to: Optional[str] = None) -> str:
+    if date_from and date_to:
+        return f"Phieu_{date_from[:10]}_{date_to[:10]}.zip"
+    return f"Phieu_{datetime.now():%Y%m%d_%H%M%S}.zip"
+
+
+async def stream_zip(vouchers: Iterable[VoucherExportRequest], formats: Iterable[str] = VOUCHER_FORMATS) -> AsyncIterator[bytes]:
+    """ZIP of every voucher in every format, PN/... and PX/..., yielded as renders complete."""
+    loop = asyncio.get_running_loop()
+    executor = _executor()
+    limit = max(EXPORT_POOL_WORKERS, 1) * PENDING_PER_WORKER
+    formats = list(formats)
+    jobs = ((voucher, fmt) for voucher in vouchers for fmt in formats)
+    pending = {}
+    errors = []
+    names = set()
+    sink = _ZipSink()
+    try:
+        with zipfile.ZipFile(sink, "w") as archive:
+            while True:
+                while len(pending) < limit:
+                    # vouchers may be reading the DB: not on the event loop
+                    job = await loop.run_in_executor(None, next, jobs, None)
+                    if job is None:
+                        break
+                    voucher, fmt = job
+                    if fmt == "xlsx" and len(voucher.items) > MAX_EXCEL_ITEMS:
+                        errors.append(f"{voucher.voucher_no}.xlsx: Template chỉ hỗ trợ tối đa {MAX_EXCEL_ITEMS} dòng hàng hóa")
+                        continue
+                    pending[loop.run_in_executor(executor, render_voucher, voucher, fmt)] = job
+                if not pending:
+                    break
+
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    voucher, fmt = pending.pop(future)
+                    try:
+                        filename, content = future.result()
+                    except Exception as e:
+                        errors.append(f"{voucher.voucher_no}.{fmt}: {e}")
+                        continue
+                    name = f"{voucher.voucher_type}/{filename}"
+                    if name in names:
+                        name = f"{voucher.voucher_type}/{len(names)}_{filename}"
+                    names.add(name)
+                    entry = zipfile.ZipInfo(name, datetime.now().timetuple()[:6])
+                    # XLSX is already a deflated ZIP: store it as is
+                    entry.compress_type = zipfile.ZIP_DEFLATED if fmt == "pdf" else zipfile.ZIP_STORED
+                    archive.writestr(entry, content)
+                chunk = sink.drain()
+                if chunk:
+                    yield chunk
+
+            if errors:
+                print(f"[Export] Batch: {len(errors)} voucher file(s) failed")
+                archive.writestr(ERRORS_FILE, "\n".join(errors) + "\n")
+        yield sink.drain()
+    finally:
+        # Client went away: don't keep the workers busy for nothing
+        for future in pending:
+            future.cancel()
+        if not jobs.gi_running:  # else a worker thread is inside next(); the generator is collected after it
+            jobs.close()
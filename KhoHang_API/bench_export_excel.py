@@ -0,0 +1,57 @@
+"""Benchmark: Excel voucher export with and without the parsed-template cache
+
+File: bench_export_excel.py
+Location: KhoHang_API/
+Description: Exports the same mix of stock-in / stock-out vouchers twice:
+once parsing the .xlsx template for every voucher (what export_to_excel did
+before the cache, load_workbook per call) and once from ExcelTemplateCache.
+Prints exports per second for both.
+
+Usage:
+    python bench_export_excel.py [--vouchers 200] [--lines 12]
+"""
+
+import argparse
+import time
+
+from app.export_service import VoucherExportRequest, VoucherItem, export_to_excel, template_cache
+
+
+def _vouchers(count: int, lines: int):
+    return [
+        VoucherExportRequest(
+            voucher_type="PN" if n % 2 == 0 else "PX", voucher_no=f"P-{n:06}", voucher_date="2025-06-30",
+            partner_name="Cong ty TNHH Vat lieu Xay dung Ha Tien", invoice_no=f"HD{n}", warehouse_code="K01",
+            warehouse_location="Kho Thu Duc", tax_rate=8, prepared_by="Nguyen Van A", receiver="Tran Van B",
+            items=[VoucherItem(sku=f"SP{i:03}", name=f"Xi mang PCB40 loai {i}", unit="Bao", qty_doc=10 * i,
+                               qty_actual=10 * i, unit_price=91000 + i) for i in range(1, lines + 1)]
+        )
+        for n in range(count)
+    ]
+
+
+def run(vouchers, cached: bool) -> float:
+    template_cache.clear()
+    started = time.perf_counter()
+    for data in vouchers:
+        if not cached:
+            template_cache.clear()  # load_workbook on every export, as before
+        export_to_excel(data)
+    return len(vouchers) / (time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vouchers", type=int, default=200)
+    parser.add_argument("--lines", type=int, default=12, help="item lines per voucher (template max 18)")
+    args = parser.parse_args()
+
+    vouchers = _vouchers(args.vouchers, min(args.lines, 18))
+    export_to_excel(vouchers[0])  # warm imports
+    before = run(vouchers, cached=False)
+    after = run(vouchers, cached=True)
+    print(f"{args.vouchers} vouchers x {min(args.lines, 18)} lines")
+    print(f"{'':>16} {'exports/s':>10}")
+    print(f"{'parse per call':>16} {before:>10.1f}")
+    print(f"{'template cache':>16} {after:>10.1f}")
+    print(f"{'speedup':>16} {after / before:>9.1f}x")
@@ -0,0 +1,56 @@
+"""Benchmark: PDF voucher export with a fresh vs. the shared (warm) renderer
+
+File: bench_export_pdf.py
+Location: KhoHang_API/
+Description: Renders the same 100-line voucher (several pages) repeatedly:
+once with a new PdfVoucherRenderer per export (stylesheet, ParagraphStyle and
+TableStyle objects rebuilt every call, what export_to_pdf did before) and once
+with the shared pdf_renderer, where only layout and drawing are left per call.
+Prints milliseconds per export for both.
+
+Usage:
+    python bench_export_pdf.py [--exports 50] [--lines 100]
+"""
+
+import argparse
+import time
+
+from app.export_service import PdfVoucherRenderer, VoucherExportRequest, VoucherItem, pdf_renderer
+
+
+def _voucher(lines: int) -> VoucherExportRequest:
+    return VoucherExportRequest(
+        voucher_type="PN", voucher_no="PN-000100", voucher_date="2025-06-30",
+        partner_name="Cong ty TNHH Vat lieu Xay dung Ha Tien", invoice_no="HD100", warehouse_code="K01",
+        warehouse_location="Kho Thu Duc", tax_rate=8, prepared_by="Nguyen Van A", receiver="Tran Van B",
+        items=[VoucherItem(sku=f"SP{i:03}", name=f"Xi mang PCB40 loai {i}", unit="Bao", qty_doc=10 * i,
+                           qty_actual=10 * i, unit_price=91000 + i) for i in range(1, lines + 1)]
+    )
+
+
+def run(data: VoucherExportRequest, exports: int, warm: bool) -> float:
+    started = time.perf_counter()
+    for _ in range(exports):
+        renderer = pdf_renderer if warm else PdfVoucherRenderer()  # fresh = set up per call, as before
+        renderer.render(data)
+    return (time.perf_counter() - started) * 1000 / exports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--exports", type=int, default=50)
+    parser.add_argument("--lines", type=int, default=100)
+    args = parser.parse_args()
+
+    data = _voucher(args.lines)
+    started = time.perf_counter()
+    pdf_renderer.render(data)  # first export in the process: fonts, imports
+    first = (time.perf_counter() - started) * 1000
+    before = run(data, args.exports, warm=False)
+    after = run(data, args.exports, warm=True)
+    print(f"{args.exports} exports x {args.lines} lines")
+    print(f"{'':>16} {'ms/export':>10}")
+    print(f"{'first export':>16} {first:>10.2f}")
+    print(f"{'fresh renderer':>16} {before:>10.2f}")
+    print(f"{'warm renderer':>16} {after:>10.2f}")
+    print(f"{'saved':>16} {before - after:>10.2f} ({(before - after) / before:.1%})")
@@ -0,0 +1,143 @@
+"""Benchmark: typing / presence traffic at peak hours
+
+File: bench_rt_coalesce.py
+Location: KhoHang_API/
+Description: Simulates busy group chats on one worker with a virtual clock:
+every member has the room open, a share of them type in bursts (the desktop
+client sends start on the first keystroke and stop after 1 s idle) and some
+reconnect. Counts typing / presence frames delivered to sockets with
+coalescing against the one-frame-per-event-per-recipient baseline.
+
+Usage:
+    python bench_rt_coalesce.py [--rooms 20] [--members 25] [--seconds 120] [--typers 0.3] [--flappers 0.1]
+"""
+
+import argparse
+import asyncio
+import heapq
+import json
+import random
+
+from app import rt_chat_ws
+from app.rt_chat_ws import ConnectionManager, handle_typing
+
+TICK_SECONDS = 1.0
+
+
+class CountingWebSocket:
+    """Stand-in socket that counts low-priority frames by type."""
+
+    def __init__(self):
+        self.counts = {}
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        kind = json.loads(data)["type"]
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _typing_schedule(rng, seconds):
+    """Client-side typing events of one user: bursts of keystrokes, stop after 1 s idle."""
+    events, t = [], rng.uniform(0, 5)
+    while t < seconds:
+        burst = rng.uniform(0.5, 3.0)
+        events.append((t, True))
+        events.append((t + burst + 1.0, False))
+        t += burst + 1.0 + rng.uniform(0.3, 2.5)
+        if rng.random() < 0.2:
+            t += rng.uniform(5, 20)  # sends the message, reads replies
+    return events
+
+
+def run(rooms: int, members: int, seconds: float, typers: float, flappers: float):
+    clock = Clock()
+    rt_chat_ws.monotonic = clock
+    manager = rt_chat_ws.manager = ConnectionManager()
+    rng = random.Random(11)
+    sockets = {}
+    watch_lists = {}
+    queue = []
+    raw = {"typing": 0, "presence": 0}
+
+    async def scenario():
+        for r in range(rooms):
+            room_users = [f"r{r}-u{i}" for i in range(members)]
+            for uid in room_users:
+                ws = CountingWebSocket()
+                await manager.connect(ws, uid)
+                manager.join_room(ws, f"conv-{r}")
+                watch_lists[uid] = [u for u in room_users if u != uid]
+                await manager.watch_presence(ws, watch_lists[uid])
+                sockets[uid] = ws
+                if rng.random() < typers:
+                    for t, is_typing in _typing_schedule(rng, seconds):
+                        heapq.heappush(queue, (t, "typing", uid, f"conv-{r}", is_typing))
+                if rng.random() < flappers:
+                    for _ in range(rng.randint(1, 3)):
+                        t = rng.uniform(0, seconds)
+                        heapq.heappush(queue, (t, "drop", uid, f"conv-{r}", None))
+                        heapq.heappush(queue, (t + rng.uniform(0.5, 4), "rejoin", uid, f"conv-{r}", None))
+        await manager.flush_coalesced(clock.now)
+        for ws in sockets.values():
+            ws.counts.clear()
+
+        next_tick = TICK_SECONDS
+        while queue or next_tick <= seconds:
+            if queue and queue[0][0] < next_tick:
+                clock.now, action, uid, conv, is_typing = heapq.heappop(queue)
+                ws = sockets[uid]
+                if action == "typing":
+                    if ws not in manager.ws_to_user:
+                        continue
+                    raw["typing"] += len(manager.room_connections.get(conv, ())) - 1
+                    await handle_typing(ws, uid, {"conversationId": conv, "isTyping": is_typing}, None)
+                elif action == "drop" and ws in manager.ws_to_user:
+                    raw["presence"] += len(manager.presence_diffs.watchers.get(uid, ()))
+                    manager.disconnect(ws)
+                elif action == "rejoin" and ws not in manager.ws_to_user:
+                    await manager.connect(ws, uid)
+                    manager.join_room(ws, conv)
+                    await manager.watch_presence(ws, watch_lists[uid])
+                    raw["presence"] += len(manager.presence_diffs.watchers.get(uid, ()))
+            else:
+                clock.now = next_tick
+                await manager.flush_coalesced(clock.now)
+                next_tick += TICK_SECONDS
+                if next_tick > seconds and not queue:
+                    break
+
+    asyncio.run(scenario())
+    sent = {"typing": 0, "presence": 0}
+    for ws in sockets.values():
+        sent["typing"] += ws.counts.get("typing", 0)
+        sent["presence"] += ws.counts.get("presence:diff", 0)
+    return raw, sent, manager.typing.received
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--members", type=int, default=25)
+    parser.add_argument("--seconds", type=float, default=120)
+    parser.add_argument("--typers", type=float, default=0.3, help="share of members typing in bursts")
+    parser.add_argument("--flappers", type=float, default=0.1, help="share of members reconnecting")
+    args = parser.parse_args()
+
+    raw, sent, typing_events = run(args.rooms, args.members, args.seconds, args.typers, args.flappers)
+    print(f"{args.rooms} rooms x {args.members} members, {args.seconds:.0f} s, {typing_events} client typing events")
+    print(f"{'frames':>10} {'per event':>10} {'coalesced':>10} {'reduction':>10}")
+    for kind in ("typing", "presence"):
+        ratio = raw[kind] / sent[kind] if sent[kind] else float("inf")
+        print(f"{kind:>10} {raw[kind]:>10} {sent[kind]:>10} {ratio:>9.1f}x")
+    total_raw, total_sent = sum(raw.values()), sum(sent.values())
+    print(f"{'total':>10} {total_raw:>10} {total_sent:>10} {total_raw / max(total_sent, 1):>9.1f}x")
@@ -0,0 +1,124 @@
+"""Benchmark: msg:send fan-out into large groups
+
+File: bench_rt_fanout.py
+Location: KhoHang_API/
+Description: Sends messages through handle_msg_send into groups of increasing
+size on an in-memory database with every member connected, and compares the
+per-recipient encoding of the previous layout (msg:new + conv:upsert, two
+json.dumps per member) with the encode-once combined frame.
+
+Usage:
+    python bench_rt_fanout.py [--sizes 50 200 1000] [--messages 20]
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.database import Base, UserModel, RTConversationModel, RTConversationMemberModel
+from app import rt_chat_ws
+from app.rt_chat_ws import ConnectionManager, handle_msg_send
+from app.rate_limiter import TokenBucketLimiter
+from app.rt_directory import directory
+
+
+class CountingWebSocket:
+    """Stand-in socket that only counts frames and bytes."""
+
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        self.frames += 1
+        self.bytes += len(data)
+
+
+def _setup(size: int):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    for i in range(size):
+        db.add(UserModel(id=f"u{i}", username=f"user{i}", email=f"u{i}@kho.vn",
+                         display_name=f"Nhan vien {i}", password_hash="x"))
+    db.add(RTConversationModel(id="conv-1", type="group", title="Kho tong"))
+    for i in range(size):
+        db.add(RTConversationMemberModel(conversation_id="conv-1", user_id=f"u{i}", is_accepted=True))
+    db.commit()
+    rt_chat_ws.manager = ConnectionManager()
+    directory.clear()
+    # Measure fan-out, not the 5 msg/s send limit
+    rt_chat_ws.MSG_SEND_LIMITER = TokenBucketLimiter("bench", rate=1e9, capacity=1e9)
+    sockets = [CountingWebSocket() for _ in range(size)]
+    for i, ws in enumerate(sockets):
+        asyncio.run(rt_chat_ws.manager.connect(ws, f"u{i}"))
+    return db, sockets
+
+
+def bench_send(size: int, messages: int):
+    db, sockets = _setup(size)
+
+    async def run():
+        start = time.perf_counter()
+        for n in range(messages):
+            await handle_msg_send(sockets[0], "u0", {
+                "conversationId": "conv-1",
+                "clientMessageId": f"bench-{n}",
+                "content": "Phieu nhap PN-0001 da duoc duyet",
+                "_reqId": str(n),
+            }, db)
+        return time.perf_counter() - start
+
+    elapsed = asyncio.run(run())
+    frames = sum(ws.frames for ws in sockets)
+    sent_bytes = sum(ws.bytes for ws in sockets)
+    db.close()
+    return elapsed / messages * 1000, frames / messages, sent_bytes / messages
+
+
+def bench_encoding(size: int, rounds: int = 20):
+    members = [{"userId": f"u{i}", "role": "member", "joinedAt": "2026-01-01T00:00:00Z",
+                "isAccepted": True, "userEmail": f"u{i}@kho.vn",
+                "userDisplayName": f"Nhan vien {i}", "userAvatarUrl": None} for i in range(size)]
+    conv = {"id": "conv-1", "type": "group", "title": "Kho tong", "members": members,
+            "lastMessage": {"id": "m", "content": "x", "senderId": "u0", "createdAt": "now"}}
+    msg_new = {"type": "msg:new", "data": {"message": {"id": "m", "content": "x"}}}
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for i in range(size):
+            json.dumps(msg_new)
+            json.dumps({"type": "conv:upsert", "data": {"conversation": {**conv, "unreadCount": i}}})
+    legacy = (time.perf_counter() - start) / rounds * 1000
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        events_json = json.dumps(msg_new)
+        conv_json = json.dumps(conv)
+        for i in range(size):
+            ('{"type": "batch", "data": {"events": [' + events_json
+             + ', {"type": "conv:upsert", "data": {"conversation": '
+             + conv_json[:-1] + ', "unreadCount": ' + str(i) + '}}}]}}')
+    encode_once = (time.perf_counter() - start) / rounds * 1000
+    return legacy, encode_once
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("--messages", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'members':>8} {'ms/send':>9} {'frames/send':>12} {'KB/send':>9} {'encode old ms':>14} {'encode new ms':>14}")
+    for size in args.sizes:
+        ms, frames, sent_bytes = bench_send(size, args.messages)
+        legacy, encode_once = bench_encoding(size)
+        print(f"{size:>8} {ms:>9.2f} {frames:>12.0f} {sent_bytes / 1024:>9.1f} {legacy:>14.2f} {encode_once:>14.2f}")
@@ -0,0 +1,198 @@
+"""Benchmark: realtime wire encodings on replayed traffic
+
+File: bench_rt_protocol.py
+Location: KhoHang_API/
+Description: Records the frames the realtime handlers actually emit, then
+re-encodes every recorded frame with each codec from app/rt_codec (JSON text,
+JSON+deflate, MessagePack, MessagePack+deflate) and reports bytes on the wire
+and encode/decode CPU time.
+
+Traffic source:
+    default    scripted session on an in-memory database: a group chat with
+               sends, reactions, reads and edits, then a cold conv:sync
+    --db PATH  an existing data.db (e.g. a copy of production): conv:sync of
+               every conversation, as a reconnecting client would request
+
+Usage:
+    python bench_rt_protocol.py [--db data/data.db] [--members 30] [--messages 200] [--rounds 20]
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.database import Base, UserModel, RTConversationModel, RTConversationMemberModel
+from app import rt_chat_ws
+from app.rt_chat_ws import (
+    ConnectionManager,
+    handle_msg_send,
+    handle_msg_react,
+    handle_msg_read,
+    handle_msg_edit,
+    handle_conv_sync,
+)
+from app.rate_limiter import TokenBucketLimiter
+from app.rt_directory import directory
+from app.rt_message_cache import message_cache
+from app.rt_codec import FrameCodec, decode_frame, msgpack
+
+CONTENTS = [
+    "Da nhan hang",
+    "Phieu nhap PN-{n:04d} da duoc duyet, kiem tra lai so luong thung giup minh nhe",
+    "Kho B con 120 thung nuoc suoi 500ml, 35 thung sua tuoi, 12 thung mi goi",
+    "Ok",
+    "Chieu nay 3h xe cua nha cung cap toi, ai truc kho thi ky nhan va chup anh bien ban giao hang gui len nhom",
+    "Ton kho cuoi thang: xi mang 420 bao, thep phi 10 1.2 tan, gach ong 18.000 vien. Can dat them xi mang truoc ngay 25",
+]
+
+
+class RecordingWebSocket:
+    """Stand-in socket that keeps every JSON text frame it is sent."""
+
+    def __init__(self):
+        self.frames = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        self.frames.append(data)
+
+
+def _fresh_state():
+    rt_chat_ws.manager = ConnectionManager()
+    rt_chat_ws.MSG_SEND_LIMITER = TokenBucketLimiter("bench", rate=1e9, capacity=1e9)
+    directory.clear()
+    message_cache.clear()
+
+
+def record_scripted(members: int, messages: int):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    for i in range(members):
+        db.add(UserModel(id=f"u{i}", username=f"user{i}", email=f"u{i}@kho.vn",
+                         display_name=f"Nhan vien {i}", avatar_url=f"/uploads/avatars/u{i}.webp",
+                         password_hash="x"))
+    db.add(RTConversationModel(id="conv-1", type="group", title="Kho tong"))
+    for i in range(members):
+        db.add(RTConversationMemberModel(conversation_id="conv-1", user_id=f"u{i}", is_accepted=True))
+    db.commit()
+    _fresh_state()
+    rng = random.Random(7)
+
+    async def run():
+        sockets = [RecordingWebSocket() for _ in range(members)]
+        for i, ws in enumerate(sockets):
+            await rt_chat_ws.manager.connect(ws, f"u{i}")
+        for n in range(messages):
+            sender = rng.randrange(members)
+            await handle_msg_send(sockets[sender], f"u{sender}", {
+                "conversationId": "conv-1", "clientMessageId": f"c-{n}",
+                "content": rng.choice(CONTENTS).format(n=n), "_reqId": str(n),
+            }, db)
+            last = message_cache.latest(db, "conv-1", 1)[0][-1]["id"]
+            roll = rng.random()
+            reader = rng.randrange(members)
+            if roll < 0.3:
+                await handle_msg_read(sockets[reader], f"u{reader}",
+                                      {"conversationId": "conv-1", "lastReadMessageId": last}, db)
+            elif roll < 0.4:
+                await handle_msg_react(sockets[reader], f"u{reader}",
+                                       {"conversationId": "conv-1", "messageId": last, "emoji": "👍"}, db)
+            elif roll < 0.45:
+                await handle_msg_edit(sockets[sender], f"u{sender}",
+                                      {"conversationId": "conv-1", "messageId": last, "content": "Sua lai: ok"}, db)
+        # A client coming back from sleep pulls the latest page
+        syncing = RecordingWebSocket()
+        await rt_chat_ws.manager.connect(syncing, "u1")
+        message_cache.clear()
+        await handle_conv_sync(syncing, "u1", {"conversationId": "conv-1", "limit": 100}, db, "sync")
+        # u1's view of the session is what one real client received
+        return sockets[1].frames + syncing.frames
+
+    frames = asyncio.run(run())
+    db.close()
+    return frames
+
+
+def record_database(path: str):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    db = sessionmaker(bind=engine)()
+    _fresh_state()
+    frames = []
+
+    async def run():
+        for conv in db.query(RTConversationModel).all():
+            member = db.query(RTConversationMemberModel).filter(
+                RTConversationMemberModel.conversation_id == conv.id).first()
+            if member is None:
+                continue
+            ws = RecordingWebSocket()
+            await rt_chat_ws.manager.connect(ws, member.user_id)
+            await handle_conv_sync(ws, member.user_id, {"conversationId": conv.id, "limit": 100}, db, "sync")
+            frames.extend(ws.frames)
+
+    asyncio.run(run())
+    db.close()
+    return frames
+
+
+def bench_codecs(frames, rounds: int):
+    messages = [json.loads(f) for f in frames]
+    codecs = [("json", None), ("json", "deflate")]
+    if msgpack is not None:
+        codecs += [("msgpack", None), ("msgpack", "deflate")]
+
+    rows = []
+    for encoding, compression in codecs:
+        codec = FrameCodec(encoding, compression)
+        encoded = [codec.encode(m) for m in messages]
+        size = sum(len(f.encode("utf-8")) if isinstance(f, str) else len(f) for f in encoded)
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for m in messages:
+                codec.encode(m)
+        encode_us = (time.perf_counter() - start) / rounds / len(messages) * 1e6
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for f in encoded:
+                decode_frame(f)
+        decode_us = (time.perf_counter() - start) / rounds / len(messages) * 1e6
+        rows.append((f"{encoding}{'+' + compression if compression else ''}", size, encode_us, decode_us))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", help="replay conv:sync against this SQLite database instead of the scripted session")
+    parser.add_argument("--members", type=int, default=30)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    frames = record_database(args.db) if args.db else record_scripted(args.members, args.messages)
+    by_type = {}
+    for f in frames:
+        kind = json.loads(f)["type"]
+        by_type[kind] = by_type.get(kind, 0) + 1
+    print(f"Recorded {len(frames)} frames: {by_type}")
+
+    rows = bench_codecs(frames, args.rounds)
+    baseline = rows[0][1]
+    print(f"{'codec':>17} {'KB':>9} {'vs json':>8} {'encode us/frame':>16} {'decode us/frame':>16}")
+    for name, size, encode_us, decode_us in rows:
+        print(f"{name:>17} {size / 1024:>9.1f} {size / baseline:>8.2f} {encode_us:>16.1f} {decode_us:>16.1f}")
+
+    largest = max(frames, key=len)
+    print(f"\nLargest frame ({json.loads(largest)['type']}, {len(largest) / 1024:.1f} KB JSON):")
+    for row in bench_codecs([largest], args.rounds * 10):
+        print(f"{row[0]:>17} {row[1] / 1024:>9.1f} KB {row[2]:>10.1f} us encode {row[3]:>10.1f} us decode")
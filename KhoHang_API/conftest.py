@@ -0,0 +1,155 @@
+"""Shared test fixtures
+
+File: conftest.py
+Location: KhoHang_API/
+Description: FakeWebSocket (records what the server sends); rt_session, a
+factory for an in-memory database seeded with users in one conversation,
+with a fresh ConnectionManager and empty directory / message caches;
+memory_db, upload_store_db (upload storage under tmp_path) and
+stock_records (warehouse K01 with stock in / out records) for the upload and
+voucher export tests
+"""
+
+import json
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.database import (
+    Base, UserModel, RTConversationModel, RTConversationMemberModel,
+    StockInRecordModel, StockOutRecordModel, WarehouseModel,
+)
+from app import image_pool, rt_chat_ws, upload_store
+from app.rt_chat_ws import ConnectionManager
+from app.rt_directory import directory
+from app.rt_message_cache import message_cache
+from app.rate_limiter import TokenBucketLimiter
+
+
+def _memory_engine():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def db_override(Session):
+    """get_db replacement handing out sessions of Session."""
+    def override_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+    return override_db
+
+
+class FakeWebSocket:
+    """Minimal stand-in for fastapi.WebSocket that records sent frames (JSON-decoded unless raw)."""
+
+    def __init__(self, raw: bool = False):
+        self.sent = []
+        self.raw = raw
+        self.closed_with = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        self.sent.append(data if self.raw else json.loads(data))
+
+    async def send_bytes(self, data: bytes):
+        self.sent.append(data)
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        self.closed_with = code
+
+
+@pytest.fixture
+def rt_session(monkeypatch):
+    """
+    rt_session(users, conversation_type="group", send_rate=None, seed=None) -> Session
+
+    users are members (accepted) of conversation "conv-1"; send_rate replaces
+    MSG_SEND_LIMITER (rate = burst); seed(session) adds rows before the commit.
+    """
+    opened = []
+
+    def make(users, conversation_type="group", send_rate=None, seed=None):
+        engine = _memory_engine()
+        session = sessionmaker(bind=engine)()
+        for uid in users:
+            session.add(UserModel(id=uid, username=uid, email=f"{uid}@kho.vn", password_hash="x"))
+            session.add(RTConversationMemberModel(conversation_id="conv-1", user_id=uid, is_accepted=True))
+        session.add(RTConversationModel(
+            id="conv-1", type=conversation_type, title="Kho" if conversation_type == "group" else None
+        ))
+        if seed is not None:
+            seed(session)
+        session.commit()
+        monkeypatch.setattr(rt_chat_ws, "manager", ConnectionManager())
+        if send_rate is not None:
+            monkeypatch.setattr(rt_chat_ws, "MSG_SEND_LIMITER", TokenBucketLimiter("test", rate=send_rate, capacity=send_rate))
+        directory.clear()
+        message_cache.clear()
+        opened.append((session, engine))
+        return session
+
+    yield make
+    directory.clear()
+    message_cache.clear()
+    for session, engine in opened:
+        session.close()
+        engine.dispose()
+
+
+@pytest.fixture
+def memory_db():
+    """sessionmaker of a fresh in-memory database with every table."""
+    engine = _memory_engine()
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def upload_store_db(memory_db, tmp_path, monkeypatch):
+    """Session on memory_db; upload_store keeps files under tmp_path, images are processed in-process."""
+    monkeypatch.setattr(upload_store, "UPLOADS_DIR", tmp_path / "uploads")
+    monkeypatch.setattr(upload_store, "BLOB_DIR", tmp_path / "blobs")
+    monkeypatch.setattr(upload_store, "TMP_DIR", tmp_path / "blobs" / "tmp")
+    monkeypatch.setattr(upload_store, "SessionLocal", memory_db)
+    monkeypatch.setattr(image_pool, "IMAGE_POOL_WORKERS", 0)
+    session = memory_db()
+    yield session
+    session.close()
+
+
+def stock_items(count, price_key="price"):
+    return [{"item_code": f"SP-{i:03d}", "item_name": f"Hàng {i}", "quantity": i + 1, "unit": "Cái", price_key: 1000}
+            for i in range(count)]
+
+
+@pytest.fixture
+def stock_records(memory_db):
+    """
+    memory_db seeded with warehouse K01 and its stock records: PN 1225_001..003
+    (003 cancelled, 002 with 25 lines), PN 0126_001, PX 1225_001.
+    """
+    db = memory_db()
+    db.add(WarehouseModel(name="Kho chính", code="K01", address="Kho chính Thủ Đức"))
+    db.add(StockInRecordModel(id="K01_PN_1225_001", warehouse_code="K01", supplier="NCC Minh Phát",
+                              date="2025-12-02", note="Hàng về đợt 1", tax_rate=8, items=stock_items(3)))
+    db.add(StockInRecordModel(id="K01_PN_1225_002", warehouse_code="K01", supplier="NCC Minh Phát",
+                              date="2025-12-20T09:30:00", items=stock_items(25)))
+    db.add(StockInRecordModel(id="K01_PN_1225_003", warehouse_code="K01", supplier="NCC Minh Phát",
+                              date="2025-12-21", items=stock_items(2), status="cancelled"))
+    db.add(StockInRecordModel(id="K01_PN_0126_001", warehouse_code="K01", supplier="NCC Minh Phát",
+                              date="2026-01-03", items=stock_items(2)))
+    db.add(StockOutRecordModel(id="K01_PX_1225_001", warehouse_code="K01", recipient="Cửa hàng Q1",
+                               purpose="Bán lẻ", date="2025-12-31", items=stock_items(4, "sell_price")))
+    db.commit()
+    db.close()
+    return memory_db
@@ -0,0 +1,42 @@
+"""Tests for the shared PDF voucher renderer
+
+File: test_export_pdf_renderer.py
+Location: KhoHang_API/
+Description: The warm, shared renderer produces exactly the PDF a freshly set
+up one does, voucher after voucher (multi-page ones included), so nothing of
+one voucher leaks into the next
+"""
+
+import pytest
+from reportlab import rl_config
+
+from app.export_service import PdfVoucherRenderer, VoucherExportRequest, VoucherItem, export_to_pdf, pdf_renderer
+
+
+def _voucher(voucher_type, lines, **extra):
+    return VoucherExportRequest(
+        voucher_type=voucher_type, voucher_no=f"{voucher_type}-{lines:06}", voucher_date="2025-06-30",
+        partner_name="NCC Ha Tien", warehouse_code="K01",
+        items=[VoucherItem(sku=f"SP{i:03}", name=f"Xi mang {i}", unit="Bao", qty_doc=i, qty_actual=i,
+                           unit_price=90000) for i in range(1, lines + 1)],
+        **extra
+    )
+
+
+@pytest.fixture(autouse=True)
+def invariant_pdfs(monkeypatch):
+    # No creation date / random document id: identical input gives identical bytes
+    monkeypatch.setattr(rl_config, "invariant", 1)
+
+
+def test_warm_renderer_matches_a_fresh_one():
+    vouchers = [
+        _voucher("PN", 100, tax_rate=8, invoice_no="HD100", prepared_by="Nguyen Van A"),
+        _voucher("PX", 3),
+        _voucher("PN", 18, director="Pham Van D"),
+    ]
+    for data in vouchers:
+        buffer, filename = export_to_pdf(data)
+        assert buffer.getvalue() == PdfVoucherRenderer().render(data).getvalue()
+        assert filename == f"{data.voucher_type}_K01_202506_{data.voucher_no}.pdf"
+    assert pdf_renderer.render(vouchers[1]).getvalue().startswith(b"%PDF")
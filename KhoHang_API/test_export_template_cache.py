@@ -0,0 +1,74 @@
+"""Tests for the parsed Excel template cache
+
+File: test_export_template_cache.py
+Location: KhoHang_API/
+Description: Exports from the cached template match a fresh load_workbook
+export cell for cell, leave nothing behind for the next voucher, and the
+template is parsed again when its file changes
+"""
+
+import io
+import os
+import shutil
+
+import pytest
+from openpyxl import load_workbook
+
+from app import export_service
+from app.export_service import VoucherExportRequest, VoucherItem, export_to_excel, template_cache
+
+
+def _voucher(voucher_no, lines, **extra):
+    return VoucherExportRequest(
+        voucher_type="PN", voucher_no=voucher_no, voucher_date="2025-06-30", partner_name="NCC Ha Tien",
+        warehouse_code="K01", tax_rate=8,
+        items=[VoucherItem(sku=f"SP{i:03}", name=f"Xi mang {i}", unit="Bao", qty_doc=i, qty_actual=i,
+                           unit_price=90000) for i in range(1, lines + 1)],
+        **extra
+    )
+
+
+def _cells(buffer):
+    ws = load_workbook(io.BytesIO(buffer.getvalue())).active
+    return {cell.coordinate: cell.value for row in ws.iter_rows() for cell in row}
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    template_cache.clear()
+    yield
+    template_cache.clear()
+
+
+def test_cached_export_matches_fresh_template():
+    full = _voucher("PN-000101", 18, invoice_no="HD-77", warehouse_location="Kho Thu Duc",
+                    attachments="2 chung tu", prepared_by="Nguyen Van A", director="Pham Van D")
+    small = _voucher("PN-000102", 2)
+
+    cached = [_cells(export_to_excel(v)[0]) for v in (full, small, full)]
+    template_cache.clear()
+    fresh_small = _cells(export_to_excel(small)[0])
+
+    assert cached[1] == fresh_small  # nothing of the 18-line voucher leaks into the next one
+    assert cached[0] == cached[2]
+    assert cached[1]["B17"] == "Xi mang 2" and cached[1]["B18"] is None and cached[1]["E10"] != "HD-77"
+    ws = load_workbook(export_service._get_template_path("PN")).active
+    assert cached[1]["D2"] != ws["D2"].value  # date written...
+    with template_cache.checkout("PN") as (wb, _):
+        assert wb.active["D2"].value == ws["D2"].value  # ...and the template's own value restored
+
+
+def test_template_is_reloaded_when_the_file_changes(tmp_path, monkeypatch):
+    for name in os.listdir(export_service.TEMPLATE_DIR):
+        shutil.copy(os.path.join(export_service.TEMPLATE_DIR, name), tmp_path / name)
+    monkeypatch.setattr(export_service, "TEMPLATE_DIR", str(tmp_path))
+    path = tmp_path / "Mau_Phieu_Nhap_TEMPLATE.xlsx"
+
+    assert _cells(export_to_excel(_voucher("PN-1", 1))[0])["A1"] != "MAU MOI"
+    wb = load_workbook(path)
+    wb.active["A1"] = "MAU MOI"
+    wb.save(path)
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    assert _cells(export_to_excel(_voucher("PN-2", 1))[0])["A1"] == "MAU MOI"
@@ -0,0 +1,58 @@
+"""Tests for streamed file downloads
+
+File: test_file_download.py
+Location: KhoHang_API/
+Description: file_response streams in chunks and answers Range (206/416),
+If-None-Match / If-Modified-Since (304) and If-Range correctly
+"""
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app import file_streaming
+from app.file_streaming import file_response
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_streaming, "CHUNK_SIZE", 1000)
+    path = tmp_path / "phieu_nhap.bin"
+    path.write_bytes(bytes(range(256)) * 40)  # 10240 bytes
+
+    app = FastAPI()
+
+    @app.get("/download/{filename}")
+    async def download(filename: str, request: Request):
+        return file_response(request, path, filename)
+
+    return TestClient(app)
+
+
+def test_full_download_and_conditional_requests(client):
+    res = client.get("/download/Phiếu nhập.bin")
+    assert res.status_code == 200 and len(res.content) == 10240
+    assert res.headers["accept-ranges"] == "bytes" and res.headers["content-length"] == "10240"
+    assert "filename*=UTF-8''Phi%E1%BA%BFu%20nh%E1%BA%ADp.bin" in res.headers["content-disposition"]
+    etag, last_modified = res.headers["etag"], res.headers["last-modified"]
+
+    assert client.get("/download/a.bin", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/download/a.bin", headers={"If-None-Match": f"W/{etag}, \"x\""}).status_code == 304
+    assert client.get("/download/a.bin", headers={"If-Modified-Since": last_modified}).status_code == 304
+    assert client.get("/download/a.bin", headers={"If-None-Match": '"old"'}).status_code == 200
+
+
+def test_range_requests_resume_a_download(client):
+    data = bytes(range(256)) * 40
+    part = client.get("/download/a.bin", headers={"Range": "bytes=1500-4999"})
+    assert part.status_code == 206 and part.content == data[1500:5000]
+    assert part.headers["content-range"] == "bytes 1500-4999/10240"
+
+    assert client.get("/download/a.bin", headers={"Range": "bytes=10000-"}).content == data[10000:]
+    assert client.get("/download/a.bin", headers={"Range": "bytes=-100"}).content == data[-100:]
+
+    bad = client.get("/download/a.bin", headers={"Range": "bytes=20000-"})
+    assert bad.status_code == 416 and bad.headers["content-range"] == "bytes */10240"
+    # File changed since the first part: If-Range fails and the whole file is sent
+    stale = client.get("/download/a.bin", headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert stale.status_code == 200 and len(stale.content) == 10240
@@ -0,0 +1,79 @@
+"""Tests for the image pool and upload variants
+
+File: test_image_pool.py
+Location: KhoHang_API/
+Description: Uploaded images get small/medium/large variants (never
+upscaled), a re-upload of the same image reuses them, they are released with
+the original, and the work really runs in worker processes
+"""
+
+import asyncio
+import io
+import os
+
+import pytest
+from PIL import Image
+
+from app import image_pool, upload_store
+from app.database import UploadBlobModel, UploadRefModel
+from app.upload_store import add_image_variants, release, save_bytes
+
+
+def _png(width, height):
+    output = io.BytesIO()
+    Image.new("RGBA", (width, height), (20, 120, 200, 128)).save(output, "PNG")
+    return output.getvalue()
+
+
+def _size(path):
+    with Image.open(path) as image:
+        return image.size
+
+
+@pytest.fixture
+def store(upload_store_db):
+    return upload_store_db
+
+
+def test_variants_are_generated_once_and_released_with_the_original(store):
+    data = _png(600, 300)
+    first = save_bytes(store, data, "rt_files", ".png")
+    urls = asyncio.run(add_image_variants(store, first, "rt_files"))
+    store.commit()
+
+    assert set(urls) == {"small", "medium", "large"}
+    sizes = {name: _size(upload_store.resolve("rt_files", url.rsplit("/", 1)[1])) for name, url in urls.items()}
+    assert sizes == {"small": (128, 64), "medium": (512, 256), "large": (600, 300)}  # never upscaled
+
+    # Same picture forwarded again: new URLs, no new blobs, no decoding
+    blobs = store.query(UploadBlobModel).count()
+    second = save_bytes(store, data, "rt_files", ".png")
+    again = asyncio.run(add_image_variants(store, second, "rt_files"))
+    store.commit()
+    assert set(again) == set(urls) and again["medium"] != urls["medium"]
+    assert store.query(UploadBlobModel).count() == blobs
+    assert {b.ref_count for b in store.query(UploadBlobModel)} == {2}
+
+    release(store, first.url)
+    release(store, second.url)
+    store.commit()
+    assert store.query(UploadRefModel).count() == 0
+    assert {b.ref_count for b in store.query(UploadBlobModel)} == {0}  # left to the collector
+
+    # Not an image: no variants, the upload itself is kept
+    text = save_bytes(store, b"khong phai anh", "rt_files", ".png")
+    assert asyncio.run(add_image_variants(store, text, "rt_files")) == {}
+
+
+def test_work_runs_in_worker_processes(monkeypatch):
+    monkeypatch.setattr(image_pool, "IMAGE_POOL_WORKERS", 1)
+    try:
+        width, height, fmt = asyncio.run(image_pool.run(image_pool.inspect_image, _png(40, 30)))
+        webp = asyncio.run(image_pool.run(image_pool.convert_to_webp, _png(2000, 1000), 800, 85))
+        pid = asyncio.run(image_pool.run(os.getpid))
+    finally:
+        image_pool.shutdown()
+    assert (width, height, fmt) == (40, 30, "png")
+    with Image.open(io.BytesIO(webp)) as image:
+        assert image.format == "WEBP" and image.size == (800, 400)
+    assert pid != os.getpid()
@@ -0,0 +1,125 @@
+"""Tests for the token-bucket rate limiter
+
+File: test_rate_limiter.py
+Location: KhoHang_API/
+Description: Burst/refill behaviour, idle-key eviction, the HTTP dependency
+(client IP from X-Forwarded-For only behind a trusted proxy) and the shared
+store falling back to local buckets without retrying Redis on every check
+"""
+
+import asyncio
+import socket
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from app import rate_limiter
+from app.rate_limiter import TokenBucketLimiter, rate_limit
+from app.rt_backplane import RespHub
+
+
+def test_burst_then_refill():
+    limiter = TokenBucketLimiter("t", rate=5, capacity=5)
+    assert all(limiter.allow_local("u1", now=100.0) for _ in range(5))
+    assert not limiter.allow_local("u1", now=100.0)
+    # 0.2s refills one token at 5 tokens/s
+    assert limiter.allow_local("u1", now=100.2)
+    assert not limiter.allow_local("u1", now=100.2)
+
+
+def test_keys_are_independent():
+    limiter = TokenBucketLimiter("t", rate=1, capacity=1)
+    assert limiter.allow_local("a", now=0.0)
+    assert not limiter.allow_local("a", now=0.0)
+    assert limiter.allow_local("b", now=0.0)
+
+
+def test_idle_keys_are_evicted():
+    limiter = TokenBucketLimiter("t", rate=1, capacity=2)
+    for i in range(1000):
+        limiter.allow_local(f"user-{i}", now=0.0)
+    assert len(limiter) == 1000
+    # After capacity/rate seconds every bucket is full again and can be dropped
+    limiter.allow_local("late", now=2.0)
+    assert len(limiter) == 1
+
+
+def test_max_keys_caps_memory():
+    limiter = TokenBucketLimiter("t", rate=1, capacity=100, max_keys=10)
+    for i in range(50):
+        limiter.allow_local(f"user-{i}", now=0.0)
+    assert len(limiter) <= 11
+
+
+def test_http_dependency_returns_429():
+    limiter = TokenBucketLimiter("login_test", rate=0.001, capacity=2)
+    dependency = rate_limit(limiter)
+    request = Request({"type": "http", "headers": [], "client": ("10.0.0.1", 1234)})
+
+    async def call_three_times():
+        await dependency(request)
+        await dependency(request)
+        await dependency(request)
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(call_three_times())
+    assert exc.value.status_code == 429
+
+
+def _request(peer, forwarded=None):
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return Request({"type": "http", "headers": headers, "client": (peer, 1234)})
+
+
+def test_forwarded_for_is_only_trusted_from_proxies(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "_trusted_proxies", rate_limiter._parse_networks(["10.0.0.0/8"]))
+    # Direct client: a made-up header does not buy a fresh bucket
+    assert rate_limiter._client_ip(_request("203.0.113.7", "1.2.3.4")) == "203.0.113.7"
+    # Behind the proxy: right-most hop the proxies did not add; spoofed left part ignored
+    assert rate_limiter._client_ip(_request("10.0.0.2", "1.2.3.4, 198.51.100.9, 10.0.0.5")) == "198.51.100.9"
+    assert rate_limiter._client_ip(_request("10.0.0.2")) == "10.0.0.2"
+
+    limiter = TokenBucketLimiter("login_xff_test", rate=0.001, capacity=1)
+    dependency = rate_limit(limiter)
+
+    async def spoofed_attempts():
+        for n in range(3):
+            await dependency(_request("203.0.113.7", f"192.0.2.{n}"))
+
+    with pytest.raises(HTTPException):
+        asyncio.run(spoofed_attempts())
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_shared_store_is_probed_and_backs_off(monkeypatch):
+    async def scenario():
+        # Stand-in hub has no EVAL: shared store disabled at startup
+        url = f"redis://127.0.0.1:{_free_port()}"
+        hub = RespHub()
+        await hub.start(url)
+        try:
+            await rate_limiter.configure_shared_store(url)
+            assert rate_limiter._shared_store is None
+        finally:
+            await hub.stop()
+
+        # Nothing listening: local buckets, and Redis is not retried on every check
+        await rate_limiter.configure_shared_store(f"redis://127.0.0.1:{_free_port()}")
+        store = rate_limiter._shared_store
+        calls = []
+        execute = store.client.execute
+        monkeypatch.setattr(store.client, "execute", lambda *parts: calls.append(parts) or execute(*parts))
+        limiter = TokenBucketLimiter("msg_send_backoff_test", rate=0.001, capacity=2)
+        results = [await limiter.allow("u1") for _ in range(3)]
+        await rate_limiter.configure_shared_store(None)
+        return results, calls
+
+    results, calls = asyncio.run(scenario())
+    assert results == [True, True, False]
+    assert calls == []  # still inside the back-off window from the startup probe
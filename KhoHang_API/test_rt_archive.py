@@ -0,0 +1,101 @@
+"""Tests for cold-storage archiving of old chat messages
+
+File: test_rt_archive.py
+Location: KhoHang_API/
+Description: Old messages move to compressed monthly SQLite files (the newest
+message stays live) and history paging and pinned lists read through to the archive
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.database import (
+    RTMessageModel,
+    RTMessageReceiptModel,
+    RTMessageReactionModel,
+    RTMessageReactionCountModel,
+    RTPinnedMessageModel,
+)
+from app import rt_chat_routes
+from app.rt_archive import MessageArchive, archive_messages
+from app.rt_chat_routes import get_conversation_messages
+
+NOW = datetime(2026, 6, 15, 12, 0, tzinfo=timezone.utc)
+
+
+def _seed_history(session):
+    # 40 messages, one every 3 days back from yesterday: spans four months
+    for n in range(40):
+        mid = f"m{n:02d}"
+        session.add(RTMessageModel(
+            id=mid, conversation_id="conv-1", sender_id="alice" if n % 2 else "bob", client_message_id=mid,
+            content=f"Phieu nhap {n}", created_at=NOW - timedelta(days=1 + 3 * (39 - n)),
+            deleted_at=NOW if n == 5 else None
+        ))
+        session.add(RTMessageReceiptModel(message_id=mid, user_id="bob" if n % 2 else "alice", read_at=NOW))
+    session.add(RTMessageReactionModel(message_id="m03", user_id="bob", emoji="👍", created_at=NOW))
+    session.add(RTMessageReactionCountModel(message_id="m03", emoji="👍", count=1, sample_user_ids=["bob"]))
+    session.add(RTPinnedMessageModel(conversation_id="conv-1", message_id="m01", pinned_by="bob", pinned_at=NOW))
+
+
+@pytest.fixture
+def db(rt_session):
+    return rt_session(("alice", "bob"), seed=_seed_history)
+
+
+def _page(db, before=None, limit=10):
+    return get_conversation_messages(
+        "conv-1", after=None, before=before, limit=limit, current_user={"id": "bob"}, db=db
+    )
+
+
+def test_old_messages_move_to_monthly_files(db, tmp_path):
+    store = MessageArchive(tmp_path)
+    preview = archive_messages(db, 30, now=NOW, dry_run=True, store=store)
+    result = archive_messages(db, 30, now=NOW, store=store)
+
+    # Everything older than 30 days: m00..m29
+    assert preview["messages"] == result["messages"] == 30
+    assert sum(result["months"].values()) == 30 and len(store.months()) == 4
+    live = {m.id for m in db.query(RTMessageModel).all()}
+    assert live == {f"m{n}" for n in range(30, 40)}
+    assert db.query(RTMessageReactionModel).count() == 0
+    assert db.query(RTMessageReactionCountModel).count() == 0
+    assert db.query(RTMessageReceiptModel).count() == 10
+
+    archived = store.get("m03")
+    assert archived["content"] == "Phieu nhap 3"
+    assert [r["emoji"] for r in archived["reactions"]] == ["👍"]
+    # Running again finds nothing left to move
+    assert archive_messages(db, 30, now=NOW, store=store)["messages"] == 0
+
+
+def test_history_paging_reads_through_to_archive(db, tmp_path, monkeypatch):
+    store = MessageArchive(tmp_path)
+    monkeypatch.setattr(rt_chat_routes, "archive", store)
+    expected = [f"m{n:02d}" for n in range(40) if n != 5]
+    archive_messages(db, 30, now=NOW, store=store)
+
+    first = _page(db, limit=15)
+    ids = [m["id"] for m in first["messages"]]
+    # 10 live rows are not enough for the first page: the newest archived ones fill it
+    assert ids == expected[-15:] and first["has_more"]
+
+    seen = list(reversed(ids))
+    while True:
+        page = _page(db, before=seen[-1])
+        seen += [m["id"] for m in page["messages"]]
+        if not page["has_more"]:
+            break
+    assert seen == list(reversed(expected))
+    reacted = _page(db, before="m04", limit=1)["messages"][0]
+    assert reacted["id"] == "m03" and reacted["reactions"][0]["emoji"] == "👍"
+    pinned = rt_chat_routes.get_pinned_messages("conv-1", db=db, current_user={"id": "bob"})
+    assert pinned[0].message.content == "Phieu nhap 1"
+
+
+def test_conversation_keeps_its_newest_message_live(db, tmp_path):
+    store = MessageArchive(tmp_path)
+    assert archive_messages(db, 0, now=NOW + timedelta(days=365), store=store)["messages"] == 39
+    assert [m.id for m in db.query(RTMessageModel).all()] == ["m39"]
@@ -0,0 +1,55 @@
+"""Tests for the cross-worker realtime backplane
+
+File: test_rt_backplane.py
+Location: KhoHang_API/
+Description: Two ConnectionManagers (simulated workers) exchanging user, room,
+broadcast and presence envelopes through the Redis-protocol stand-in hub
+"""
+
+import asyncio
+
+from app.rt_backplane import RespBackplane, RespHub
+from app.rt_chat_ws import ConnectionManager
+from conftest import FakeWebSocket
+
+
+async def _wait_for(predicate, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("condition not met before timeout")
+        await asyncio.sleep(0.01)
+
+
+def test_events_are_routed_between_workers(tmp_path):
+    url = f"unix://{tmp_path / 'rt.sock'}"
+
+    async def scenario():
+        hub = RespHub()
+        await hub.start(url)
+        worker_a, worker_b = ConnectionManager(), ConnectionManager()
+        await worker_a.start(RespBackplane(url))
+        await worker_b.start(RespBackplane(url))
+        try:
+            ws_b = FakeWebSocket()
+            await worker_b.connect(ws_b, "u1")
+            worker_b.join_room(ws_b, "conv-1")
+
+            # Presence from worker B becomes visible on worker A
+            await _wait_for(lambda: worker_a.is_online("u1"))
+
+            await worker_a.send_to_user("u1", {"type": "msg:new", "data": {"n": 1}})
+            await worker_a.send_to_room("conv-1", {"type": "typing", "data": {}})
+            await worker_a.broadcast_system_event("inventory:updated", {"type": "stock_in"})
+            await _wait_for(lambda: len(ws_b.sent) == 3)
+
+            worker_b.disconnect(ws_b)
+            await _wait_for(lambda: not worker_a.is_online("u1"))
+            return [frame["type"] for frame in ws_b.sent]
+        finally:
+            await worker_a.stop()
+            await worker_b.stop()
+            await hub.stop()
+
+    types = asyncio.run(scenario())
+    assert types == ["msg:new", "typing", "inventory:updated"]
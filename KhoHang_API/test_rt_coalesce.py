@@ -0,0 +1,137 @@
+"""Tests for typing / presence coalescing
+
+File: test_rt_coalesce.py
+Location: KhoHang_API/
+Description: Bursty typing collapses to one start + one delayed stop per room,
+and presence changes reach watchers as one net diff per flush
+"""
+
+import asyncio
+
+from app import rt_chat_ws
+from app.rt_chat_ws import ConnectionManager, handle_typing
+from app.rt_coalesce import (
+    TYPING_FLUSH_SECONDS,
+    TYPING_REFRESH_SECONDS,
+    TYPING_STOP_GRACE_SECONDS,
+    PRESENCE_FLUSH_SECONDS,
+    PRESENCE_OFFLINE_GRACE_SECONDS,
+)
+from conftest import FakeWebSocket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_typing_bursts_collapse_to_start_and_stop(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rt_chat_ws, "monotonic", clock)
+
+    async def scenario():
+        manager = ConnectionManager()
+        monkeypatch.setattr(rt_chat_ws, "manager", manager)
+        typer, watcher = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(typer, "alice")
+        await manager.connect(watcher, "bob")
+        for ws in (typer, watcher):
+            manager.join_room(ws, "conv-1")
+
+        async def typing(is_typing):
+            await handle_typing(typer, "alice", {"conversationId": "conv-1", "isTyping": is_typing}, None)
+
+        # Four seconds of bursty typing: start/stop every half second, flushed every tick
+        for step in range(8):
+            await typing(step % 2 == 0)
+            clock.now += 0.5
+            await manager.flush_coalesced(clock.now)
+        # Still typing past the refresh interval: announced once more
+        clock.now += TYPING_REFRESH_SECONDS
+        await typing(True)
+        await manager.flush_coalesced(clock.now)
+        await typing(False)
+        clock.now += 1.0
+        await typing(True)
+        await typing(False)
+        clock.now += TYPING_FLUSH_SECONDS - 1.0
+        # Stopped less than the grace period ago: held back
+        await manager.flush_coalesced(clock.now)
+        held = [f["data"]["isTyping"] for f in watcher.sent if f["type"] == "typing"]
+        clock.now += TYPING_STOP_GRACE_SECONDS
+        await manager.flush_coalesced(clock.now)
+        return manager, typer, watcher, held
+
+    manager, typer, watcher, held = asyncio.run(scenario())
+    typing = [f["data"]["isTyping"] for f in watcher.sent if f["type"] == "typing"]
+    assert held == [True, True]
+    assert typing == [True, True, False]
+    assert not [f for f in typer.sent if f["type"] == "typing"]
+    assert manager.typing.received == 12 and len(manager.typing) == 0
+
+
+def test_concurrent_typers_share_one_frame_per_room(monkeypatch):
+    async def scenario():
+        manager = ConnectionManager()
+        monkeypatch.setattr(rt_chat_ws, "manager", manager)
+        sockets = {uid: FakeWebSocket() for uid in ("alice", "bob", "carol")}
+        for uid, ws in sockets.items():
+            await manager.connect(ws, uid)
+            manager.join_room(ws, "conv-1")
+        for uid in ("alice", "bob"):
+            await handle_typing(sockets[uid], uid, {"conversationId": "conv-1", "isTyping": True}, None)
+        await manager.flush_coalesced(rt_chat_ws.monotonic())
+        return sockets
+
+    sockets = asyncio.run(scenario())
+    frames = sockets["carol"].sent
+    assert len(frames) == 1 and frames[0]["type"] == "batch"
+    assert sorted(e["data"]["userId"] for e in frames[0]["data"]["events"]) == ["alice", "bob"]
+    # Each typer only hears about the other one, never its own echo
+    assert [(f["type"], f["data"]["userId"]) for f in sockets["alice"].sent if f["type"] == "typing"] == [("typing", "bob")]
+    assert [(f["type"], f["data"]["userId"]) for f in sockets["bob"].sent if f["type"] == "typing"] == [("typing", "alice")]
+
+
+def test_presence_reaches_watchers_as_net_diffs(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rt_chat_ws, "monotonic", clock)
+
+    async def flush_after(seconds):
+        clock.now += seconds
+        await manager.flush_coalesced(clock.now)
+
+    async def scenario():
+        watcher = FakeWebSocket()
+        await manager.connect(watcher, "bob")
+        await manager.watch_presence(watcher, ["alice", "carol", "dave"])
+        await flush_after(0)
+        watcher.sent.clear()
+
+        # alice flaps (reconnect), carol and dave come online in the same window
+        sockets = {}
+        for uid in ("alice", "carol", "dave"):
+            sockets[uid] = FakeWebSocket()
+            await manager.connect(sockets[uid], uid)
+        await flush_after(PRESENCE_FLUSH_SECONDS)
+        manager.disconnect(sockets["alice"])
+        await manager.connect(FakeWebSocket(), "alice")
+        # carol leaves for good: announced only once the offline grace has passed
+        manager.disconnect(sockets["carol"])
+        await flush_after(PRESENCE_FLUSH_SECONDS)
+        before_grace = len(watcher.sent)
+        await flush_after(PRESENCE_OFFLINE_GRACE_SECONDS)
+        return watcher, before_grace
+
+    manager = ConnectionManager()
+    watcher, before_grace = asyncio.run(scenario())
+    diffs = [f["data"]["users"] for f in watcher.sent if f["type"] == "presence:diff"]
+    # One frame for three users; the disconnect + reconnect never showed up
+    assert before_grace == 1
+    assert sorted((u["userId"], u["isOnline"]) for u in diffs[0]) == [
+        ("alice", True), ("carol", True), ("dave", True)
+    ]
+    assert [(u["userId"], u["isOnline"]) for u in diffs[1]] == [("carol", False)]
+    assert len(diffs) == 2
@@ -0,0 +1,76 @@
+"""Tests for the negotiated realtime wire codecs
+
+File: test_rt_codec.py
+Location: KhoHang_API/
+Description: client:hello picks MessagePack / deflate per socket, JSON text stays
+the default, and frames round-trip through decode_frame; inbound frames may
+only use negotiated flags and cannot inflate past MAX_INFLATED_BYTES
+"""
+
+import asyncio
+import json
+import zlib
+
+import pytest
+
+from app.rt_chat_ws import ConnectionManager
+from app.rt_codec import (
+    FrameCodec, FLAG_DEFLATE, FLAG_MSGPACK, COMPRESS_MIN_BYTES, MAX_INFLATED_BYTES, decode_frame, negotiate
+)
+from conftest import FakeWebSocket
+
+
+def test_frames_round_trip_and_only_large_ones_are_deflated():
+    small = {"type": "typing", "data": {"conversationId": "c", "isTyping": True}}
+    large = {"type": "conv:sync:result", "data": {"messages": [{"content": "Nhap kho"} for _ in range(200)]}}
+    assert len(json.dumps(large)) > COMPRESS_MIN_BYTES
+
+    deflate_json = FrameCodec("json", "deflate")
+    assert isinstance(deflate_json.encode(small), str)
+    frame = deflate_json.encode(large)
+    assert frame[0] == FLAG_DEFLATE and len(frame) < len(json.dumps(large)) / 5
+    assert decode_frame(frame, deflate_json) == large
+
+    packed = FrameCodec("msgpack", "deflate")
+    assert packed.encode(small)[0] == FLAG_MSGPACK
+    assert packed.encode(large)[0] == FLAG_MSGPACK | FLAG_DEFLATE
+    assert decode_frame(packed.encode(large), packed) == large
+
+    assert negotiate({}).encoding == "json" and negotiate({}).compression is None
+    assert negotiate({"encoding": "cbor", "compression": "br"}).key == ("json", None)
+
+
+def test_each_socket_gets_its_negotiated_encoding():
+    async def scenario():
+        manager = ConnectionManager()
+        plain, packed = FakeWebSocket(raw=True), FakeWebSocket(raw=True)
+        await manager.connect(plain, "u1")
+        await manager.connect(packed, "u1")
+        manager.set_codec(packed, negotiate({"encoding": "msgpack"}))
+        await manager.send_to_user("u1", {"type": "msg:read", "data": {"userId": "u2"}})
+        manager.disconnect(packed)
+        return manager, plain, packed
+
+    manager, plain, packed = asyncio.run(scenario())
+    assert isinstance(plain.sent[0], str)
+    assert isinstance(packed.sent[0], bytes)
+    codec = negotiate({"encoding": "msgpack"})
+    assert decode_frame(packed.sent[0], codec) == json.loads(plain.sent[0])
+    assert decode_frame(packed.sent[0], codec)["eventId"] == 1
+    assert packed not in manager.ws_codecs
+
+
+def test_inbound_frames_are_limited_to_what_was_negotiated():
+    deflate_json = FrameCodec("json", "deflate")
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    bomb = '{"type": "msg:send", "data": {"content": "' + "a" * (MAX_INFLATED_BYTES * 4) + '"}}'
+    frame = bytes((FLAG_DEFLATE,)) + compressor.compress(bomb.encode()) + compressor.flush()
+    assert len(frame) < MAX_INFLATED_BYTES / 100
+    with pytest.raises(ValueError, match="inflates past"):
+        decode_frame(frame, deflate_json)
+
+    large = {"type": "conv:sync", "data": {"ids": ["x" * 20] * 200}}
+    with pytest.raises(ValueError, match="not negotiated"):
+        decode_frame(deflate_json.encode(large))  # socket on plain JSON
+    with pytest.raises(ValueError, match="not negotiated"):
+        decode_frame(bytes((FLAG_MSGPACK,)) + b"\x80", deflate_json)
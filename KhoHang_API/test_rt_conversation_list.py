@@ -0,0 +1,92 @@
+"""Tests for the conversation list endpoints
+
+File: test_rt_conversation_list.py
+Location: KhoHang_API/
+Description: GET /rt/conversations and /rt/conversations/pending are answered
+by one SQL statement with the same last message, unread counts and members
+as before
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.database import (
+    Base,
+    UserModel,
+    RTConversationModel,
+    RTConversationMemberModel,
+    RTMessageModel,
+    RTMessageReceiptModel,
+)
+from app.rt_chat_routes import list_conversations, list_pending_conversations
+
+T0 = datetime(2026, 1, 5, 8, 0, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def db():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    for uid in ("alice", "bob", "carol"):
+        session.add(UserModel(id=uid, username=uid, email=f"{uid}@kho.vn", display_name=uid.title(), password_hash="x"))
+    conversations = [("kho-a", ["alice", "bob", "carol"]), ("kho-b", ["alice", "bob"]), ("empty", ["alice", "carol"])]
+    for n, (cid, members) in enumerate(conversations):
+        session.add(RTConversationModel(id=cid, type="group", title=cid, updated_at=T0 + timedelta(hours=n)))
+        for uid in members:
+            session.add(RTConversationMemberModel(conversation_id=cid, user_id=uid, is_accepted=uid != "carol"))
+    session.flush()
+
+    def message(mid, cid, sender, minute, read_by=(), deleted=False):
+        session.add(RTMessageModel(
+            id=mid, conversation_id=cid, sender_id=sender, client_message_id=mid, content=f"noi dung {mid}",
+            created_at=T0 + timedelta(minutes=minute), deleted_at=T0 if deleted else None
+        ))
+        for uid in ("alice", "bob", "carol"):
+            if uid != sender:
+                session.add(RTMessageReceiptModel(
+                    message_id=mid, user_id=uid, read_at=T0 if uid in read_by else None
+                ))
+
+    message("a1", "kho-a", "alice", 1, read_by=("bob",))
+    message("a2", "kho-a", "bob", 2)
+    message("a3", "kho-a", "bob", 3)
+    message("a4", "kho-a", "bob", 4, deleted=True)
+    message("b1", "kho-b", "bob", 1, read_by=("alice",))
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def test_accepted_list_is_one_statement(db):
+    statements = []
+    event.listen(db.get_bind(), "before_cursor_execute", lambda *args: statements.append(args[2]))
+    result = list_conversations(current_user={"id": "alice"}, db=db)
+
+    assert len(statements) == 1
+    assert [c.id for c in result] == ["empty", "kho-b", "kho-a"]
+    empty, kho_b, kho_a = result
+    assert empty.last_message is None and empty.unread_count == 0
+    assert kho_b.last_message["id"] == "b1" and kho_b.unread_count == 0
+    # The deleted a4 is neither last message nor unread
+    assert kho_a.last_message == {
+        "id": "a3", "content": "noi dung a3", "senderId": "bob", "createdAt": "2026-01-05T08:03:00+00:00"
+    }
+    assert kho_a.unread_count == 2
+    assert [(m.user_id, m.is_accepted, m.user_display_name) for m in kho_a.members] == [
+        ("alice", True, "Alice"), ("bob", True, "Bob"), ("carol", False, "Carol")
+    ]
+
+
+def test_pending_list_only_has_unaccepted_memberships(db):
+    result = list_pending_conversations(current_user={"id": "carol"}, db=db)
+    assert [c.id for c in result] == ["empty", "kho-a"]
+    assert result[1].unread_count == 3 and result[1].last_message["id"] == "a3"
+    assert list_pending_conversations(current_user={"id": "alice"}, db=db) == []
@@ -0,0 +1,109 @@
+"""Tests for the timer-wheel heartbeat scheduler
+
+File: test_rt_heartbeat.py
+Location: KhoHang_API/
+Description: Batched pings, idle-socket closing (also of sockets whose ping
+hangs) and presence expiry driven by one scheduler instead of a task per
+connection
+"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from app.rt_chat_ws import ConnectionManager
+from app import rt_scheduler
+from app.rt_scheduler import TimerWheel, IDLE_CLOSE_CODE
+from conftest import FakeWebSocket
+
+
+def test_timer_wheel_returns_items_when_due():
+    wheel = TimerWheel(4)
+    wheel.schedule("a", 1)
+    wheel.schedule("b", 3)
+    assert wheel.advance() == {"a"}
+    assert wheel.advance() == set()
+    assert wheel.advance() == {"b"}
+    wheel.schedule("c", 2)
+    wheel.cancel("c")
+    assert wheel.advance() == set() and wheel.advance() == set()
+    assert len(wheel) == 0
+
+
+def test_one_revolution_pings_every_socket_once():
+    async def scenario():
+        manager = ConnectionManager()
+        sockets = [FakeWebSocket() for _ in range(100)]
+        for i, ws in enumerate(sockets):
+            await manager.connect(ws, f"u{i}")
+        scheduler = manager.heartbeats
+        for _ in range(len(scheduler.wheel.slots)):
+            await scheduler.tick()
+        return sockets, len(scheduler.wheel)
+
+    sockets, scheduled = asyncio.run(scenario())
+    assert all(ws.sent == [{"type": "ping"}] for ws in sockets)
+    # Live sockets are rescheduled for the next revolution
+    assert scheduled == 100
+
+
+def test_idle_socket_is_closed_and_active_one_kept():
+    async def scenario():
+        manager = ConnectionManager()
+        idle, active = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(idle, "idle-user")
+        await manager.connect(active, "active-user")
+        scheduler = manager.heartbeats
+        start = scheduler.last_seen[idle]
+        scheduler.last_seen[active] = start + 100
+        for _ in range(len(scheduler.wheel.slots)):
+            await scheduler.tick(now=start + 100)
+        return manager, idle, active
+
+    manager, idle, active = asyncio.run(scenario())
+    assert idle.closed_with == IDLE_CLOSE_CODE
+    assert not manager.is_online("idle-user")
+    assert active.closed_with is None
+    assert manager.is_online("active-user")
+
+
+def test_socket_whose_ping_hangs_is_closed(monkeypatch):
+    monkeypatch.setattr(rt_scheduler, "PING_SEND_TIMEOUT_SECONDS", 0.05)
+
+    class StuckWebSocket(FakeWebSocket):
+        async def send_text(self, data: str):
+            await asyncio.sleep(1)
+
+    async def scenario():
+        manager = ConnectionManager()
+        stuck = StuckWebSocket()
+        await manager.connect(stuck, "u1")
+        scheduler = manager.heartbeats
+        for _ in range(len(scheduler.wheel.slots)):
+            await scheduler.tick()
+        return manager, stuck
+
+    manager, stuck = asyncio.run(scenario())
+    assert stuck.closed_with == IDLE_CLOSE_CODE
+    assert not manager.is_online("u1")
+    assert stuck not in manager.heartbeats.last_seen
+
+
+def test_maintenance_expires_stale_offline_presence():
+    async def scenario():
+        manager = ConnectionManager()
+        ws = FakeWebSocket()
+        await manager.connect(ws, "u1")
+        manager.disconnect(ws)
+        manager.presence["u1"]["last_seen_at"] = (
+            datetime.now(timezone.utc) - timedelta(days=1)
+        ).isoformat()
+        manager.presence["u2"] = {
+            "is_online": False,
+            "last_seen_at": datetime.now(timezone.utc).isoformat(),
+        }
+        await manager.run_maintenance()
+        return manager.presence
+
+    presence = asyncio.run(scenario())
+    assert "u1" not in presence
+    assert "u2" in presence
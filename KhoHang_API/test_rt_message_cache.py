@@ -0,0 +1,139 @@
+"""Tests for the hot-conversation message cache
+
+File: test_rt_message_cache.py
+Location: KhoHang_API/
+Description: First-page loads and conv:sync deltas served from the cache, kept
+current in place by send/edit/react/delete/read, and identical to the DB path
+"""
+
+import asyncio
+
+import pytest
+from sqlalchemy import event
+
+from app import rt_chat_ws
+from app.rt_chat_ws import (
+    handle_msg_send,
+    handle_msg_edit,
+    handle_msg_react,
+    handle_msg_delete,
+    handle_msg_read,
+    handle_conv_sync,
+)
+from app.rt_chat_routes import get_conversation_messages
+from app.rt_message_cache import message_cache
+from conftest import FakeWebSocket
+
+ALICE = {"id": "alice", "role": "staff"}
+
+
+@pytest.fixture
+def db(rt_session):
+    return rt_session(("alice", "bob"), conversation_type="direct", send_rate=1000)
+
+
+def _send(db, ws, n):
+    asyncio.run(handle_msg_send(ws, "alice", {
+        "conversationId": "conv-1", "clientMessageId": f"c-{n}", "content": f"m{n}", "_reqId": str(n),
+    }, db))
+
+
+def _page(db, **kwargs):
+    return get_conversation_messages("conv-1", after=kwargs.get("after"), before=None,
+                                     limit=kwargs.get("limit", 50), current_user=ALICE, db=db)
+
+
+def _message_selects(db):
+    statements = []
+    event.listen(db.get_bind(), "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    return lambda: [s for s in statements if s.lstrip().upper().startswith("SELECT") and "rt_messages" in s]
+
+
+def test_reopen_is_served_from_cache_and_tracks_writes(db):
+    ws = FakeWebSocket()
+    asyncio.run(rt_chat_ws.manager.connect(ws, "alice"))
+    for n in range(3):
+        _send(db, ws, n)
+
+    first = _page(db)
+    assert [m["content"] for m in first["messages"]] == ["m0", "m1", "m2"]
+    selects = _message_selects(db)
+
+    _send(db, ws, 3)
+    message_id = first["messages"][1]["id"]
+    asyncio.run(handle_msg_edit(ws, "alice", {"conversationId": "conv-1", "messageId": message_id, "content": "sua"}, db))
+    asyncio.run(handle_msg_react(ws, "alice", {"conversationId": "conv-1", "messageId": message_id, "emoji": "👍"}, db))
+    asyncio.run(handle_msg_delete(ws, "alice", {"conversationId": "conv-1", "messageId": first["messages"][0]["id"],
+                                                "deleteForEveryone": True}, db))
+    asyncio.run(handle_msg_read(ws, "bob", {"conversationId": "conv-1", "lastReadMessageId": message_id}, db))
+    selects_before_open = len(selects())
+
+    cached = _page(db)
+    # Re-opening the chat did not query rt_messages at all
+    assert len(selects()) == selects_before_open
+    assert [m["content"] for m in cached["messages"]] == ["sua", "m2", "m3"]
+    edited = cached["messages"][0]
+    assert edited["reactions"][0]["emoji"] == "👍"
+    assert {r["userId"]: r["readAt"] is not None for r in edited["receipts"]} == {"alice": False, "bob": True}
+
+    # Same answer as a cold read from the database
+    message_cache.clear()
+    assert _page(db) == cached
+    assert message_cache.stats()["hitRatio"] < 1
+
+
+def test_short_sync_delta_comes_from_cache(db):
+    ws = FakeWebSocket()
+    asyncio.run(rt_chat_ws.manager.connect(ws, "alice"))
+    for n in range(5):
+        _send(db, ws, n)
+    page = _page(db, limit=2)
+    assert page["has_more"] is True
+    selects = _message_selects(db)
+
+    asyncio.run(handle_conv_sync(ws, "alice", {"conversationId": "conv-1",
+                                               "afterMessageId": page["messages"][0]["id"]}, db, "r"))
+    result = [f for f in ws.sent if f["type"] == "conv:sync:result"][-1]["data"]
+    assert [m["content"] for m in result["messages"]] == ["m4"]
+    assert selects() == []
+
+    stats = message_cache.stats()
+    assert stats["conversations"] == 1 and stats["messages"] == 5
+    assert stats["approxBytes"] > 0 and stats["hits"] >= 1
+
+
+def test_other_workers_replay_deltas_and_unrelated_changes_keep_fills(db, monkeypatch):
+    import json
+    from app.rt_message_cache import MessageCache
+
+    ws = FakeWebSocket()
+    asyncio.run(rt_chat_ws.manager.connect(ws, "alice"))
+    _send(db, ws, 0)
+    replica = MessageCache()  # another worker's cache, fed only through the backplane
+    load_window = replica._load_window
+
+    def busy_load(session, conversation_id):
+        replica.add_message({**message_cache.latest(db, "conv-1", 1)[0][0], "conversation_id": "conv-2"})
+        return load_window(session, conversation_id)
+
+    monkeypatch.setattr(replica, "_load_window", busy_load)
+    replica.latest(db, "conv-1", 50)
+    monkeypatch.undo()
+    # A change in conv-2 during the fill did not throw the conv-1 window away
+    assert replica.stats()["conversations"] == 1
+
+    published = []
+    monkeypatch.setattr(message_cache, "on_change", published.append)
+    _send(db, ws, 1)
+    message_id = message_cache.latest(db, "conv-1", 50)[0][0]["id"]
+    asyncio.run(handle_msg_edit(ws, "alice", {"conversationId": "conv-1", "messageId": message_id, "content": "sua"}, db))
+    asyncio.run(handle_msg_react(ws, "alice", {"conversationId": "conv-1", "messageId": message_id, "emoji": "👍"}, db))
+    asyncio.run(handle_msg_read(ws, "bob", {"conversationId": "conv-1", "lastReadMessageId": message_id}, db))
+
+    assert published and all(e["kind"] == "msgcache:apply" for e in published)
+    for envelope in published:
+        replica.apply_remote(json.loads(json.dumps(envelope)))
+    selects = _message_selects(db)
+    assert replica.latest(db, "conv-1", 50) == message_cache.latest(db, "conv-1", 50)
+    assert selects() == []
@@ -0,0 +1,137 @@
+"""Tests for the msg:send hot path
+
+File: test_rt_msg_send.py
+Location: KhoHang_API/
+Description: Sends into a 50-member group on an in-memory database and checks
+commit count and delivery-receipt aggregation
+"""
+
+import asyncio
+import json
+
+import pytest
+from sqlalchemy import event, text
+
+from app.database import UserModel, RTMessageModel, RTMessageReceiptModel, ensure_rt_message_unique_constraint
+from app import rt_chat_ws
+from app.rt_chat_ws import handle_msg_send
+from app.rt_directory import directory
+from conftest import FakeWebSocket
+
+GROUP_SIZE = 50
+
+
+@pytest.fixture
+def db(rt_session):
+    return rt_session([f"u{i}" for i in range(GROUP_SIZE)], send_rate=5)
+
+
+def _connect_all(manager):
+    sockets = {}
+    for i in range(GROUP_SIZE):
+        ws = FakeWebSocket()
+        asyncio.run(manager.connect(ws, f"u{i}"))
+        sockets[f"u{i}"] = ws
+    return sockets
+
+
+def test_send_to_group_commits_once_for_receipts(db):
+    sockets = _connect_all(rt_chat_ws.manager)
+    commits = []
+    event.listen(db, "after_commit", lambda session: commits.append(1))
+
+    asyncio.run(handle_msg_send(sockets["u0"], "u0", {
+        "conversationId": "conv-1",
+        "clientMessageId": "c-1",
+        "content": "Nhap kho xong",
+        "_reqId": "r1",
+    }, db))
+
+    # One commit for the message + receipts, one for the bulk delivered update
+    assert len(commits) == 2
+    delivered = [f for f in sockets["u0"].sent if f["type"] == "msg:delivered"]
+    assert len(delivered) == 1
+    assert sorted(delivered[0]["data"]["userIds"]) == sorted(f"u{i}" for i in range(1, GROUP_SIZE))
+    pending = db.query(RTMessageReceiptModel).filter(RTMessageReceiptModel.delivered_at.is_(None)).count()
+    assert pending == 0
+
+
+def test_each_member_gets_one_combined_frame(db):
+    sockets = _connect_all(rt_chat_ws.manager)
+    for n in range(2):
+        asyncio.run(handle_msg_send(sockets["u0"], "u0", {
+            "conversationId": "conv-1",
+            "clientMessageId": f"c-{n}",
+            "content": f"message {n}",
+            "_reqId": f"r{n}",
+        }, db))
+
+    frames = [f for f in sockets["u7"].sent if f["type"] == "batch"]
+    assert len(frames) == 2
+    events = frames[-1]["data"]["events"]
+    assert [e["type"] for e in events] == ["msg:new", "conv:upsert"]
+    assert events[0]["data"]["message"]["content"] == "message 1"
+    assert events[1]["data"]["conversation"]["unreadCount"] == 2
+    assert len(events[1]["data"]["conversation"]["members"]) == GROUP_SIZE
+    # Sender sees its own message with no unread
+    own = [f for f in sockets["u0"].sent if f["type"] == "batch"][-1]
+    assert own["data"]["events"][1]["data"]["conversation"]["unreadCount"] == 0
+    # The frame sent is the buffered (replayable) event exactly
+    buffered = rt_chat_ws.manager.replay_buffers["u7"].events[-1]
+    assert frames[-1] == json.loads(json.dumps(buffered))
+
+
+def test_warm_send_reads_no_members_or_users(db):
+    sockets = _connect_all(rt_chat_ws.manager)
+    statements = []
+    event.listen(db.get_bind(), "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+
+    def send(n):
+        asyncio.run(handle_msg_send(sockets["u0"], "u0", {
+            "conversationId": "conv-1", "clientMessageId": f"w-{n}", "content": "x", "_reqId": str(n),
+        }, db))
+
+    send(0)
+    statements.clear()
+    send(1)
+    reads = [s for s in statements if s.lstrip().upper().startswith("SELECT")]
+    assert not [s for s in reads if "FROM users" in s or "FROM rt_conversation_members" in s
+                or "FROM rt_conversations" in s]
+
+
+def test_profile_change_invalidates_cached_sender(db):
+    sockets = _connect_all(rt_chat_ws.manager)
+    payload = {"conversationId": "conv-1", "content": "x"}
+    asyncio.run(handle_msg_send(sockets["u0"], "u0", {**payload, "clientMessageId": "p-0"}, db))
+
+    db.query(UserModel).filter(UserModel.id == "u0").update({UserModel.display_name: "Thu kho"})
+    db.commit()
+    directory.invalidate_user("u0")
+    asyncio.run(handle_msg_send(sockets["u0"], "u0", {**payload, "clientMessageId": "p-1"}, db))
+
+    frame = [f for f in sockets["u3"].sent if f["type"] == "batch"][-1]
+    assert frame["data"]["events"][0]["data"]["message"]["senderDisplayName"] == "Thu kho"
+
+
+def test_legacy_duplicates_do_not_block_idempotent_send(db):
+    sockets = _connect_all(rt_chat_ws.manager)
+    db.execute(text("DROP INDEX idx_rt_messages_sender_client"))
+    for message_id in ("m-old", "m-dup"):
+        db.add(RTMessageModel(id=message_id, conversation_id="conv-1", sender_id="u0",
+                              client_message_id="legacy", content="x"))
+        db.flush()
+    db.commit()
+
+    ensure_rt_message_unique_constraint(db.get_bind())
+    assert {m.id: m.client_message_id for m in db.query(RTMessageModel)} == {
+        "m-old": "legacy", "m-dup": "legacy:dup:m-dup"
+    }
+
+    # Retrying the legacy id is answered with the original message, not an error
+    asyncio.run(handle_msg_send(sockets["u0"], "u0", {
+        "conversationId": "conv-1", "clientMessageId": "legacy", "content": "x", "_reqId": "r",
+    }, db))
+    ack = [f for f in sockets["u0"].sent if f["type"] == "msg:ack"][-1]
+    assert ack["data"]["serverMessageId"] == "m-old"
+    assert db.query(RTMessageModel).count() == 2
@@ -0,0 +1,110 @@
+"""Tests for the durable outbox of offline recipients
+
+File: test_rt_outbox.py
+Location: KhoHang_API/
+Description: Events for members without a socket are queued compactly and
+delivered as one outbox:drain after a reconnect that cannot resume
+"""
+
+import asyncio
+
+import pytest
+
+from app.database import RTOutboxEventModel
+from app import rt_chat_ws, rt_outbox
+from app.rt_chat_ws import (
+    handle_client_hello,
+    handle_msg_send,
+    handle_msg_edit,
+    handle_msg_react,
+    handle_msg_pin,
+    handle_msg_read,
+)
+from conftest import FakeWebSocket
+
+
+@pytest.fixture
+def db(rt_session):
+    return rt_session(("alice", "bob", "carol"), send_rate=100)
+
+
+async def _send(ws, user_id, n, db):
+    await handle_msg_send(ws, user_id, {
+        "conversationId": "conv-1", "clientMessageId": f"{user_id}-{n}", "content": f"Phieu {n}", "_reqId": str(n)
+    }, db)
+    return next(f["data"]["serverMessageId"] for f in reversed(ws.sent) if f["type"] == "msg:ack")
+
+
+def test_offline_member_gets_one_compacted_drain(db):
+    async def scenario():
+        manager = rt_chat_ws.manager
+        alice, carol = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(alice, "alice")
+        await manager.connect(carol, "carol")
+        from_carol = await _send(carol, "carol", 0, db)
+        manager.disconnect(carol)
+
+        # bob and carol offline: three sends, an edit, two reactions, a pin, a read
+        ids = [await _send(alice, "alice", n, db) for n in range(1, 4)]
+        args = {"conversationId": "conv-1", "messageId": ids[0]}
+        await handle_msg_edit(alice, "alice", {**args, "content": "Phieu 1 (sua)"}, db)
+        await handle_msg_react(alice, "alice", {**args, "emoji": "👍"}, db)
+        await handle_msg_react(alice, "alice", {**args, "emoji": "👌"}, db)
+        await handle_msg_pin(alice, "alice", args, db)
+        await handle_msg_read(alice, "alice", {"conversationId": "conv-1", "lastReadMessageId": from_carol}, db)
+        queued = db.query(RTOutboxEventModel).filter(RTOutboxEventModel.user_id == "bob").count()
+
+        # The replay buffer cannot cover the gap (e.g. after a restart)
+        bob = FakeWebSocket()
+        await manager.connect(bob, "bob")
+        await handle_client_hello(bob, "bob", {"streamId": "stale", "lastEventId": 7}, db)
+        carol_ws = FakeWebSocket()
+        await manager.connect(carol_ws, "carol")
+        await handle_client_hello(carol_ws, "carol", {"streamId": "stale", "lastEventId": 3}, db)
+        return ids, queued, bob.sent, carol_ws.sent
+
+    ids, queued, bob_frames, carol_frames = asyncio.run(scenario())
+    # 4 messages (carol's and alice's three) + 1 pin, edits and reactions folded in
+    assert queued == 5
+    hello, drain = bob_frames
+    assert hello["data"]["resyncRequired"] and hello["data"]["outboxCount"] == 5
+    assert drain["type"] == "outbox:drain"
+    data = drain["data"]
+    assert [m["id"] for m in data["messages"][1:]] == ids
+    first = data["messages"][1]
+    assert first["content"] == "Phieu 1 (sua)" and first["editedAt"]
+    assert sorted(r["emoji"] for r in first["reactions"]) == ["👌", "👍"]
+    assert data["pins"] == [{"conversationId": "conv-1", "messageId": ids[0], "pinned": True,
+                             "pinnedBy": "alice", "pinnedAt": data["pins"][0]["pinnedAt"]}]
+    assert data["conversations"] == [{"conversationId": "conv-1", "unreadCount": 4}]
+    assert data["resyncConversationIds"] == []
+
+    carol_drain = carol_frames[-1]["data"]
+    assert [r["userId"] for r in carol_drain["reads"]] == ["alice"]
+    assert len(carol_drain["messages"]) == 3
+
+
+def test_overflowing_conversation_is_truncated_and_resume_discards(db, monkeypatch):
+    monkeypatch.setattr(rt_outbox, "OUTBOX_MAX_MESSAGES_PER_CONVERSATION", 3)
+
+    async def scenario():
+        manager = rt_chat_ws.manager
+        alice = FakeWebSocket()
+        await manager.connect(alice, "alice")
+        for n in range(5):
+            await _send(alice, "alice", n, db)
+        bob = FakeWebSocket()
+        await manager.connect(bob, "bob")
+        await handle_client_hello(bob, "bob", {"streamId": "stale", "lastEventId": 1}, db)
+        # A fresh start (no streamId) loads over REST: carol's queue is dropped unsent
+        carol = FakeWebSocket()
+        await manager.connect(carol, "carol")
+        await handle_client_hello(carol, "carol", {}, db)
+        return bob.sent, carol.sent
+
+    bob_frames, carol_frames = asyncio.run(scenario())
+    data = bob_frames[-1]["data"]
+    assert data["messages"] == [] and data["resyncConversationIds"] == ["conv-1"]
+    assert data["conversations"] == [{"conversationId": "conv-1", "unreadCount": 5}]
+    assert [f["type"] for f in carol_frames] == ["server:hello"]
+    assert db.query(RTOutboxEventModel).count() == 0
@@ -0,0 +1,112 @@
+"""Tests for realtime chat indexes and the idempotent msg:send insert
+
+File: test_rt_query_plans.py
+Location: KhoHang_API/
+Description: EXPLAIN QUERY PLAN of the hot message / receipt queries uses the
+composite and partial indexes (no full table scans), ensure_rt_indexes adds
+them to an existing database, and a retried msg:send is one INSERT that
+does nothing
+"""
+
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.pool import StaticPool
+
+from app.database import (
+    Base,
+    RTMessageModel,
+    RT_INDEXES,
+    ensure_rt_indexes,
+)
+from app import rt_chat_ws
+from app.rt_chat_ws import handle_msg_send, handle_msg_read, handle_conv_sync
+from app.rt_chat_routes import list_conversations
+from app.rt_message_cache import message_cache
+from conftest import FakeWebSocket
+
+
+@pytest.fixture
+def db(rt_session):
+    return rt_session(("alice", "bob"), send_rate=100)
+
+
+def _capture(db):
+    statements = []
+    event.listen(db.get_bind(), "before_cursor_execute",
+                 lambda conn, cursor, statement, params, *args: statements.append((statement, params)))
+    return statements
+
+
+def _plan(db, statement, params):
+    return [row[3] for row in db.connection().exec_driver_sql("EXPLAIN QUERY PLAN " + statement, params)]
+
+
+def test_retried_send_is_one_insert_that_does_nothing(db):
+    ws = FakeWebSocket()
+    statements = _capture(db)
+    payload = {"conversationId": "conv-1", "clientMessageId": "c-1", "content": "Nhap kho", "_reqId": "r"}
+
+    async def scenario():
+        await rt_chat_ws.manager.connect(ws, "alice")
+        await handle_msg_send(ws, "alice", payload, db)
+        first = list(statements)
+        await handle_msg_send(ws, "alice", payload, db)
+        return first
+
+    first = asyncio.run(scenario())
+    inserts = [s for s, _ in first if s.startswith("INSERT INTO rt_messages ")]
+    assert len(inserts) == 1 and "ON CONFLICT (sender_id, client_message_id) DO NOTHING" in inserts[0]
+    assert not [s for s, _ in first if s.startswith("SELECT") and "FROM rt_messages" in s]
+    acks = [f["data"] for f in ws.sent if f["type"] == "msg:ack"]
+    assert len(acks) == 2 and acks[0] == acks[1]
+    assert db.query(RTMessageModel).count() == 1
+
+
+def test_hot_queries_use_indexes(db):
+    ws, other = FakeWebSocket(), FakeWebSocket()
+    statements = _capture(db)
+
+    async def scenario():
+        await rt_chat_ws.manager.connect(ws, "alice")
+        await rt_chat_ws.manager.connect(other, "bob")
+        for n in range(5):
+            await handle_msg_send(ws, "alice", {"conversationId": "conv-1", "clientMessageId": f"c-{n}", "content": "x"}, db)
+        ids = [f["data"]["serverMessageId"] for f in ws.sent if f["type"] == "msg:ack"]
+        message_cache.clear()
+        statements.clear()
+        await handle_conv_sync(other, "bob", {"conversationId": "conv-1", "afterMessageId": ids[1]}, db, "s")
+        message_cache.latest(db, "conv-1", 50)
+        await handle_msg_read(other, "bob", {"conversationId": "conv-1", "lastReadMessageId": ids[3]}, db)
+        list_conversations(current_user={"id": "bob"}, db=db)
+
+    asyncio.run(scenario())
+    plans = [
+        _plan(db, s, p) for s, p in statements
+        if s.lstrip().startswith(("SELECT", "WITH")) and ("rt_messages" in s or "rt_message_receipts" in s)
+    ]
+    steps = [step for plan in plans for step in plan]
+    assert not [step for step in steps if step.startswith(("SCAN rt_messages", "SCAN rt_message_receipts"))]
+    assert any("idx_rt_messages_conv_deleted_created (conversation_id=? AND deleted_at=? AND created_at>?)" in step
+               for step in steps)
+    assert any("idx_rt_receipts_unread (user_id=?)" in step for step in steps)
+    assert any("idx_rt_members_user_accepted" in step for step in steps)
+
+
+def test_ensure_rt_indexes_migrates_existing_database():
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    names = [statement.split()[5] for statement in RT_INDEXES]
+    with engine.begin() as conn:
+        for name in names:
+            conn.execute(text(f"DROP INDEX {name}"))
+
+    ensure_rt_indexes(engine)
+    ensure_rt_indexes(engine)
+    with engine.connect() as conn:
+        present = {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))}
+        analyzed = conn.execute(text("SELECT count(*) FROM sqlite_master WHERE name = 'sqlite_stat1'")).scalar()
+    assert set(names) <= present
+    assert analyzed == 1
+    engine.dispose()
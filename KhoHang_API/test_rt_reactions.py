@@ -0,0 +1,114 @@
+"""Tests for aggregated reaction counts
+
+File: test_rt_reactions.py
+Location: KhoHang_API/
+Description: msg:react moves one per-emoji count (no re-read of the reaction list),
+message lists carry { emoji, count, userIds, reactedByMe } and the per-user list
+is only served by GET /rt/messages/{id}/reactions
+"""
+
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.database import (
+    Base,
+    RTMessageModel,
+    RTMessageReactionCountModel,
+    ensure_rt_reaction_counts,
+)
+from app import rt_chat_ws
+from app.rt_chat_ws import handle_msg_react
+from app.rt_chat_routes import get_conversation_messages, get_message_reactions
+from app.rt_message_cache import message_cache
+from conftest import FakeWebSocket
+
+USERS = ("an", "binh", "chi", "dung", "giang")
+
+
+def _seed_message(session):
+    session.add(RTMessageModel(id="m1", conversation_id="conv-1", sender_id="an", client_message_id="c1",
+                               content="Da nhap 20 thung"))
+
+
+@pytest.fixture
+def db(rt_session):
+    return rt_session(USERS, seed=_seed_message)
+
+
+def _react(db, user_id, emoji, ws=None):
+    ws = ws or FakeWebSocket()
+    asyncio.run(handle_msg_react(ws, user_id, {"conversationId": "conv-1", "messageId": "m1", "emoji": emoji}, db))
+    return ws
+
+
+def _reactions(db, user_id):
+    page = get_conversation_messages("conv-1", after=None, before=None, limit=50,
+                                     current_user={"id": user_id}, db=db)
+    return page["messages"][0]["reactions"]
+
+
+def test_react_moves_one_count_without_reading_the_list(db):
+    # Warm the message window so reactions update it in place
+    assert _reactions(db, "an") == []
+    for uid in USERS:
+        _react(db, uid, "👍")
+
+    statements = []
+    event.listen(db.get_bind(), "before_cursor_execute", lambda *args: statements.append(args[2]))
+    viewer = FakeWebSocket()
+    asyncio.run(rt_chat_ws.manager.connect(viewer, "chi"))
+    _react(db, "dung", "👍")
+    reads = [s for s in statements if s.lstrip().startswith("SELECT") and "rt_message_reactions" in s]
+    assert reads == []
+    broadcast = viewer.sent[-1]["data"]
+    assert broadcast["action"] == "removed" and broadcast["count"] == 4
+    assert broadcast["userIds"] == ["an", "binh", "chi"]
+
+    # Removing a sampled reactor refills the sample from the oldest remaining ones
+    _react(db, "an", "👍")
+    _react(db, "binh", "😂")
+    assert _reactions(db, "binh") == [
+        {"emoji": "👍", "count": 3, "userIds": ["binh", "chi", "giang"], "reactedByMe": True},
+        {"emoji": "😂", "count": 1, "userIds": ["binh"], "reactedByMe": True},
+    ]
+    assert _reactions(db, "an")[0]["reactedByMe"] is False
+    # Same answer from the database as from the cache
+    message_cache.clear()
+    assert _reactions(db, "an")[0] == {"emoji": "👍", "count": 3, "userIds": ["binh", "chi", "giang"],
+                                       "reactedByMe": False}
+
+
+def test_per_user_list_is_paged_on_demand(db):
+    for uid in USERS:
+        _react(db, uid, "👍")
+    _react(db, "an", "❤️")
+
+    thumbs = get_message_reactions("m1", emoji="👍", limit=2, offset=2, db=db, current_user={"id": "an"})
+    assert [r["user_id"] for r in thumbs] == ["chi", "dung"]
+    everyone = get_message_reactions("m1", emoji=None, limit=100, offset=0, db=db, current_user={"id": "an"})
+    assert len(everyone) == 6
+
+    _react(db, "an", "❤️")
+    assert db.query(RTMessageReactionCountModel).filter_by(emoji="❤️").count() == 0
+
+
+def test_counts_are_backfilled_from_existing_reactions():
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO rt_message_reactions (message_id, user_id, emoji, created_at) VALUES "
+                          "('m1', 'an', '👍', '2026-01-01 08:00:00'), ('m1', 'binh', '👍', '2026-01-01 08:01:00'), "
+                          "('m1', 'chi', '👍', '2026-01-01 08:02:00'), ('m1', 'dung', '👍', '2026-01-01 08:03:00'), "
+                          "('m1', 'an', '😂', '2026-01-01 08:04:00')"))
+
+    ensure_rt_reaction_counts(engine)
+    ensure_rt_reaction_counts(engine)
+    session = sessionmaker(bind=engine)()
+    rows = {r.emoji: (r.count, r.sample_user_ids) for r in session.query(RTMessageReactionCountModel)}
+    assert rows == {"👍": (4, ["an", "binh", "chi"]), "😂": (1, ["an"])}
+    session.close()
+    engine.dispose()
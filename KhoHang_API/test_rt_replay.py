@@ -0,0 +1,63 @@
+"""Tests for resumable WebSocket sessions (event replay buffer)
+
+File: test_rt_replay.py
+Location: KhoHang_API/
+Description: Ring buffer overrun detection and ConnectionManager replay on client:hello
+"""
+
+import asyncio
+from app.rt_chat_ws import ConnectionManager, EventReplayBuffer
+from conftest import FakeWebSocket
+
+
+def test_buffer_assigns_monotonic_event_ids():
+    buffer = EventReplayBuffer(maxlen=4)
+    ids = [buffer.append({"type": "msg:new"})["eventId"] for _ in range(3)]
+    assert ids == [1, 2, 3]
+    assert [e["eventId"] for e in buffer.since(1)] == [2, 3]
+    assert buffer.since(3) == []
+
+
+def test_buffer_reports_overrun():
+    buffer = EventReplayBuffer(maxlen=2)
+    for _ in range(5):
+        buffer.append({"type": "msg:new"})
+    # Events 1-3 were evicted, so resuming from 1 or 2 needs a full resync
+    assert buffer.since(1) is None
+    assert buffer.since(2) is None
+    assert [e["eventId"] for e in buffer.since(3)] == [4, 5]
+    # Ids from the future (e.g. previous server process) also force resync
+    assert buffer.since(99) is None
+
+
+def test_manager_replays_events_missed_while_offline():
+    manager = ConnectionManager()
+
+    async def scenario():
+        first = FakeWebSocket()
+        await manager.connect(first, "u1")
+        await manager.send_to_user("u1", {"type": "msg:new", "data": {"n": 1}})
+        stream_id = manager.replay_buffers["u1"].stream_id
+        last_seen = first.sent[-1]["eventId"]
+
+        manager.disconnect(first)
+        await manager.send_to_user("u1", {"type": "msg:new", "data": {"n": 2}})
+        await manager.send_to_user("u1", {"type": "conv:upsert", "data": {"n": 3}})
+
+        second = FakeWebSocket()
+        await manager.connect(second, "u1")
+        return manager.get_replay("u1", stream_id, last_seen)
+
+    replay = asyncio.run(scenario())
+    assert [e["data"]["n"] for e in replay] == [2, 3]
+
+
+def test_manager_requires_resync_for_unknown_stream():
+    manager = ConnectionManager()
+
+    async def scenario():
+        ws = FakeWebSocket()
+        await manager.connect(ws, "u1")
+        return manager.get_replay("u1", "stale-stream", 0)
+
+    assert asyncio.run(scenario()) is None
@@ -0,0 +1,120 @@
+"""Tests for the orphaned upload collector
+
+File: test_upload_gc.py
+Location: KhoHang_API/
+Description: Uploads referenced by live messages, the archive (through the
+mention index), avatars or the company logo survive (with their image
+variants), so does the bundled chatbot avatar; unreferenced ones older than
+the grace period - blob URLs, legacy files, stray blobs, temp files - are
+reported by a dry run and removed by a real one
+"""
+
+import asyncio
+import io
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from PIL import Image
+
+from app import rt_archive, upload_gc
+from app.database import CompanyInfoModel, RTMessageModel, UploadBlobModel, UploadRefModel, UserModel
+from app.rt_archive import MessageArchive
+from app.upload_store import add_image_variants, save_bytes
+
+NOW = datetime.now(timezone.utc)
+OLD = NOW - timedelta(days=10)
+
+
+@pytest.fixture
+def db(upload_store_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(rt_archive, "archive", MessageArchive(tmp_path / "archive"))
+    return upload_store_db
+
+
+def _upload(db, data, folder="rt_files", ext=".pdf", created_at=OLD):
+    stored = save_bytes(db, data, folder, ext)
+    db.flush()
+    db.get(UploadRefModel, (folder, stored.name)).created_at = created_at
+    return stored
+
+
+def _old_file(path, data=b"legacy"):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    os.utime(path, (OLD.timestamp(), OLD.timestamp()))
+    return path
+
+
+def _message(db, message_id, attachments, deleted=False, created_at=OLD):
+    db.add(RTMessageModel(
+        id=message_id, conversation_id="c1", sender_id="u1", client_message_id=message_id,
+        content="", content_type="file", attachments_json=attachments, created_at=created_at,
+        deleted_at=created_at if deleted else None
+    ))
+
+
+def test_dry_run_reports_and_real_run_removes_orphans(db, tmp_path):
+    png = io.BytesIO()
+    Image.new("RGB", (800, 600), (200, 30, 30)).save(png, "PNG")
+    photo = _upload(db, png.getvalue(), ext=".png")
+    thumbnails = asyncio.run(add_image_variants(db, photo, "rt_files"))
+    for size, url in thumbnails.items():
+        db.get(UploadRefModel, ("rt_files", url.rsplit("/", 1)[1])).created_at = OLD
+    sent = _upload(db, b"bao gia")
+    recalled = _upload(db, b"tin nhan da thu hoi")
+    orphan = _upload(db, b"phieu nhap nhap")
+    fresh = _upload(db, b"vua tai len", created_at=NOW)  # not sent yet: inside the grace period
+    avatar = _upload(db, b"avatar", folder="avatars", ext=".webp")
+    _message(db, "m1", [{"url": photo.url, "thumbnail_url": thumbnails["medium"]}, {"url": sent.url}])
+    _message(db, "m2", [{"url": recalled.url}], deleted=True)
+    db.add(UserModel(id="u1", username="kho1", email="kho1@n3t.vn", password_hash="x", avatar_url=avatar.url))
+    db.add(CompanyInfoModel(id=1, logo="http://localhost:8000/uploads/logos/logo_cu.png"))
+    db.commit()
+
+    kept_logo = _old_file(tmp_path / "uploads" / "logos" / "logo_cu.png")
+    old_logo = _old_file(tmp_path / "uploads" / "logos" / "logo_2023.png", b"x" * 1000)
+    stray_blob = _old_file(tmp_path / "blobs" / "ab" / ("ab" + "0" * 62 + ".pdf"))
+    stray_tmp = _old_file(tmp_path / "blobs" / "tmp" / "dead.part")
+
+    report = upload_gc.collect_orphans(db, grace_hours=48, dry_run=True)
+    assert report["refs"] == 2 and report["legacyFiles"] == 1
+    assert report["blobs"] == 1 and report["tmpFiles"] == 1
+    assert sorted(report["sample"][:2]) == sorted([recalled.url, orphan.url])
+    assert report["folders"] == {"rt_files": 2, "logos": 1}
+    assert db.query(UploadRefModel).count() == 9 and old_logo.exists() and stray_tmp.exists()
+
+    report = upload_gc.collect_orphans(db, grace_hours=48)
+    assert report["kept"] == 0
+    names = {name for (name,) in db.query(UploadRefModel.name)}
+    assert {photo.name, sent.name, fresh.name, avatar.name} <= names and len(names) == 7  # + 3 variants
+    assert recalled.name not in names and orphan.name not in names
+    assert not orphan.path.exists() and db.get(UploadBlobModel, orphan.sha256) is None
+    assert kept_logo.exists() and not old_logo.exists()
+    assert not stray_blob.exists() and not stray_tmp.exists()
+    assert upload_gc.collect_orphans(db, grace_hours=48, dry_run=True)["refs"] == 0
+
+
+def test_archived_messages_and_chatbot_files_are_kept(db, tmp_path, monkeypatch):
+    archived = _upload(db, b"bien ban kiem ke 2023")
+    bot_file = _upload(db, b"file gui cho chatbot", folder="chat_files")
+    old_bot_file = _upload(db, b"file chatbot cu", folder="chat_files", created_at=NOW - timedelta(days=45))
+    db.commit()
+    rt_archive.archive.store([{
+        "id": "m-old", "conversation_id": "c1", "sender_id": "u1", "client_message_id": "m-old",
+        "content": "", "content_type": "file", "attachments": [{"url": archived.url}], "reply_to_id": None,
+        "created_at": OLD, "edited_at": None, "deleted_at": None, "receipts": {}, "reactions": []
+    }])
+
+    default_bot_avatar = _old_file(tmp_path / "uploads" / "chatbot" / "chatbot_avatar.png")
+
+    upload_gc.collect_orphans(db, grace_hours=1)
+    names = {name for (name,) in db.query(UploadRefModel.name)}
+    # chatbot attachments only live in the client's history: 30 days before they go
+    assert names == {archived.name, bot_file.name}
+    assert old_bot_file.name not in names
+    assert default_bot_avatar.exists()  # shipped with the client, never in the DB
+
+    # Later sweeps read the mention index, not the archive
+    monkeypatch.setattr(rt_archive.archive, "iter_records", lambda: pytest.fail("archive re-read"))
+    assert upload_gc.collect_orphans(db, grace_hours=1, dry_run=True)["refs"] == 0
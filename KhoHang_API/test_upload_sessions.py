@@ -0,0 +1,90 @@
+"""Tests for resumable chunked uploads
+
+File: test_upload_sessions.py
+Location: KhoHang_API/
+Description: A file sent in chunks survives a dropped chunk (resume from the
+offset the server reports), is verified against its SHA-256 on complete and
+lands in upload_store like a normal upload; a wrong checksum discards it
+"""
+
+import hashlib
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app import rt_chat_routes, upload_sessions, upload_store
+from app.auth_middleware import get_current_user
+from app.database import UploadBlobModel, UploadSessionModel, get_db
+from conftest import db_override
+
+DATA = bytes(range(256)) * 4000  # 1 MB
+
+
+@pytest.fixture
+def client(upload_store_db, memory_db, monkeypatch):
+    monkeypatch.setattr(upload_store, "CHUNK_SIZE", 64 * 1024)
+    monkeypatch.setattr(upload_sessions, "MAX_CHUNK_SIZE", 512 * 1024)
+
+    app = FastAPI()
+    app.include_router(rt_chat_routes.router)
+    app.dependency_overrides[get_db] = db_override(memory_db)
+    app.dependency_overrides[get_current_user] = lambda: {"id": "u-kho-1"}
+    client = TestClient(app)
+    client.session = memory_db
+    return client
+
+
+def _start(client, data=DATA, sha256=None):
+    res = client.post("/rt/files/uploads", json={
+        "name": "kiem_ke_thang_6.zip", "size": len(data), "mime_type": "application/zip",
+        "sha256": sha256 or hashlib.sha256(data).hexdigest()
+    })
+    assert res.status_code == 200
+    return res.json()["upload_id"]
+
+
+def test_interrupted_upload_resumes_and_is_verified(client):
+    upload_id = _start(client)
+    url = f"/rt/files/uploads/{upload_id}"
+
+    assert client.put(url, params={"offset": 0}, content=DATA[:400_000]).json()["offset"] == 400_000
+    # Chunk resent for an offset that is already past / not yet reached
+    conflict = client.put(url, params={"offset": 0}, content=DATA[:10])
+    assert conflict.status_code == 409 and conflict.headers["upload-offset"] == "400000"
+    assert client.post(f"{url}/complete").status_code == 409
+    # Too big for one PUT: rejected, nothing counted
+    assert client.put(url, params={"offset": 400_000}, content=DATA[400_000:]).status_code == 413
+
+    offset = client.get(url).json()["offset"]
+    assert offset == 400_000
+    while offset < len(DATA):
+        offset = client.put(url, params={"offset": offset}, content=DATA[offset:offset + 300_000]).json()["offset"]
+
+    res = client.post(f"{url}/complete")
+    assert res.status_code == 200
+    body = res.json()
+    assert body["size"] == len(DATA) and body["name"] == "kiem_ke_thang_6.zip"
+    assert upload_store.resolve("rt_files", body["url"].rsplit("/", 1)[1]).read_bytes() == DATA
+
+    db = client.session()
+    assert db.query(UploadSessionModel).count() == 0
+    assert db.get(UploadBlobModel, hashlib.sha256(DATA).hexdigest()).ref_count == 1
+    assert client.get(url).status_code == 404
+    assert not list(upload_store.TMP_DIR.iterdir())
+
+
+def test_checksum_mismatch_discards_the_session(client):
+    upload_id = _start(client, sha256="0" * 64)
+    url = f"/rt/files/uploads/{upload_id}"
+    for offset in range(0, len(DATA), 500_000):
+        client.put(url, params={"offset": offset}, content=DATA[offset:offset + 500_000])
+
+    assert client.post(f"{url}/complete").status_code == 422
+    assert client.get(url).status_code == 404
+    assert client.session().query(UploadBlobModel).count() == 0
+    assert not list(upload_store.TMP_DIR.iterdir())
+
+    other = _start(client)
+    client.app.dependency_overrides[get_current_user] = lambda: {"id": "u-kho-2"}
+    assert client.get(f"/rt/files/uploads/{other}").status_code == 404
@@ -0,0 +1,128 @@
+"""Tests for content-addressed upload storage
+
+File: test_upload_store.py
+Location: KhoHang_API/
+Description: The same content uploaded twice is one blob with two URLs and
+ref_count 2, releases take effect on commit and the last one leaves the blob to
+the collector (delete_blobs), and /uploads URLs resolve
+through upload_refs (legacy files on disk still served) with immutable cache
+headers and precompressed copies
+"""
+
+import asyncio
+import io
+
+import pytest
+from fastapi import FastAPI, HTTPException, UploadFile
+from fastapi.testclient import TestClient
+
+from app import upload_store
+from app.database import UploadBlobModel, UploadRefModel
+from app.upload_store import UploadStaticFiles, precompressed_path, release, save_bytes, save_upload
+
+PRICE_LIST = b"%PDF-1.4 bang gia thang 6" * 500
+
+
+@pytest.fixture
+def store(upload_store_db):
+    return upload_store_db
+
+
+def _upload(db, data, name="bang_gia.pdf", max_size=10 * 1024 * 1024):
+    file = UploadFile(io.BytesIO(data), filename=name)
+    return asyncio.run(save_upload(db, file, "rt_files", ".pdf", max_size))
+
+
+def test_same_content_is_stored_once_and_refcounted(store, tmp_path):
+    first = _upload(store, PRICE_LIST)
+    second = _upload(store, PRICE_LIST, name="bang_gia (1).pdf")
+    store.commit()
+
+    assert first.url != second.url and first.sha256 == second.sha256
+    assert not first.deduplicated and second.deduplicated
+    blobs = [p for p in (tmp_path / "blobs").rglob("*") if p.is_file()]
+    assert len(blobs) == 1 and blobs[0].read_bytes() == PRICE_LIST
+    assert store.get(UploadBlobModel, first.sha256).ref_count == 2
+
+    release(store, first.url)
+    store.commit()
+    assert store.get(UploadBlobModel, first.sha256).ref_count == 1 and blobs[0].exists()
+    # Claimed by an upload since the collector listed it: row and file stay
+    assert upload_store.delete_blobs(store, [store.get(UploadBlobModel, first.sha256)]) == 0
+    assert blobs[0].exists()
+    # Rolled back: nothing happened
+    release(store, second.url)
+    store.rollback()
+    assert store.get(UploadBlobModel, first.sha256).ref_count == 1 and blobs[0].exists()
+    # The last URL leaves the blob to the collector
+    release(store, second.url)
+    store.commit()
+    assert store.get(UploadBlobModel, first.sha256).ref_count == 0 and blobs[0].exists()
+    assert upload_store.delete_blobs(store, store.query(UploadBlobModel).all()) == 1
+    assert store.query(UploadBlobModel).count() == 0 and not blobs[0].exists()
+
+    with pytest.raises(HTTPException) as too_large:
+        _upload(store, PRICE_LIST, max_size=1024)
+    assert too_large.value.status_code == 413
+    assert not [p for p in (tmp_path / "blobs").rglob("*") if p.is_file()]
+
+
+def test_upload_urls_resolve_through_the_blob_store(store, tmp_path):
+    stored = save_bytes(store, b"RIFF....WEBPVP8 avatar", "avatars", ".webp")
+    store.commit()
+    legacy = tmp_path / "uploads" / "logos" / "old.png"
+    legacy.parent.mkdir(parents=True)
+    legacy.write_bytes(b"\x89PNG legacy")
+
+    app = FastAPI()
+    app.mount("/uploads", UploadStaticFiles(directory=str(tmp_path / "uploads")), name="uploads")
+    client = TestClient(app)
+
+    res = client.get(stored.url)
+    assert res.status_code == 200 and res.content == b"RIFF....WEBPVP8 avatar"
+    assert res.headers["content-type"] == "image/webp"
+    assert client.get("/uploads/logos/old.png").content == b"\x89PNG legacy"
+    assert client.get("/uploads/avatars/missing.webp").status_code == 404
+    assert store.get(UploadRefModel, ("avatars", stored.name)).sha256 == stored.sha256
+
+
+def test_uploads_are_cached_and_served_precompressed(store, tmp_path):
+    report = "Ma hang;Ten hang;Ton kho\n".encode() + b"SP001;Xi mang Ha Tien;120\n" * 400
+    file = UploadFile(io.BytesIO(report), filename="ton_kho.txt")
+    stored = asyncio.run(save_upload(store, file, "rt_files", ".txt", 10 * 1024 * 1024))
+    store.commit()
+    assert precompressed_path(stored.path).is_file()
+    legacy = tmp_path / "uploads" / "logos" / "old.png"
+    legacy.parent.mkdir(parents=True)
+    legacy.write_bytes(b"\x89PNG legacy")
+
+    app = FastAPI()
+    app.mount("/uploads", UploadStaticFiles(directory=str(tmp_path / "uploads")), name="uploads")
+    client = TestClient(app)
+
+    res = client.get(stored.url, headers={"Accept-Encoding": "gzip"})
+    assert res.content == report  # decoded by the client
+    assert res.headers["content-encoding"] == "gzip" and int(res.headers["content-length"]) < len(report) // 10
+    assert res.headers["cache-control"] == "public, max-age=31536000, immutable"
+    assert res.headers["vary"] == "Accept-Encoding" and res.headers["content-type"].startswith("text/plain")
+    plain = client.get(stored.url, headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers and plain.content == report
+
+    # Mutable legacy file: revalidated through its ETag
+    old = client.get("/uploads/logos/old.png")
+    assert old.headers["cache-control"] == "no-cache"
+    again = client.get("/uploads/logos/old.png", headers={"If-None-Match": old.headers["etag"]})
+    assert again.status_code == 304 and again.headers["cache-control"] == "no-cache"
+
+    release(store, stored.url)
+    store.commit()
+    upload_store.delete_blobs(store, store.query(UploadBlobModel).filter(UploadBlobModel.ref_count == 0).all())
+    assert not precompressed_path(stored.path).exists()
+
+    # A legacy file goes only once the release is committed
+    release(store, "/uploads/logos/old.png")
+    store.rollback()
+    assert (tmp_path / "uploads" / "logos" / "old.png").exists()
+    release(store, "/uploads/logos/old.png")
+    store.commit()
+    assert not (tmp_path / "uploads" / "logos" / "old.png").exists()
@@ -0,0 +1,104 @@
+"""Tests for batch voucher export
+
+File: test_voucher_batch_export.py
+Location: KhoHang_API/
+Description: Stock records of a date range (cancelled ones skipped) come back
+as one streamed ZIP with a PDF / XLSX per voucher under PN/ and PX/; vouchers
+the Excel template cannot hold are listed in LOI.txt; renders really run in
+worker processes and records are only read as the pool takes them
+"""
+
+import asyncio
+import io
+import zipfile
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from openpyxl import load_workbook
+
+from app import main, voucher_export
+from app.database import get_db
+from conftest import db_override
+
+
+@pytest.fixture
+def client(stock_records, monkeypatch):
+    monkeypatch.setattr(voucher_export, "EXPORT_POOL_WORKERS", 0)
+    app = FastAPI()
+    app.add_api_route("/export/batch", main.export_voucher_batch, methods=["POST"])
+    app.dependency_overrides[get_db] = db_override(stock_records)
+    return TestClient(app)
+
+
+def test_date_range_is_exported_as_one_zip(client):
+    res = client.post("/export/batch", json={
+        "date_from": "2025-12-01", "date_to": "2025-12-31", "formats": ["pdf", "xlsx"]
+    })
+    assert res.status_code == 200
+    assert res.headers["content-type"] == "application/zip"
+    assert 'filename="Phieu_2025-12-01_2025-12-31.zip"' in res.headers["content-disposition"]
+
+    archive = zipfile.ZipFile(io.BytesIO(res.content))
+    names = set(archive.namelist())
+    assert names == {
+        "PN/PN_K01_202512_K01_PN_1225_001.pdf", "PN/PN_K01_202512_K01_PN_1225_001.xlsx",
+        "PN/PN_K01_202512_K01_PN_1225_002.pdf",  # 25 lines: no room in the Excel template
+        "PX/PX_K01_202512_K01_PX_1225_001.pdf", "PX/PX_K01_202512_K01_PX_1225_001.xlsx",
+        "LOI.txt",
+    }
+    assert archive.testzip() is None
+    assert archive.read("PN/PN_K01_202512_K01_PN_1225_001.pdf").startswith(b"%PDF")
+    assert "K01_PN_1225_002.xlsx" in archive.read("LOI.txt").decode("utf-8")
+
+    ws = load_workbook(io.BytesIO(archive.read("PX/PX_K01_202512_K01_PX_1225_001.xlsx"))).active
+    assert ws["F11"].value == "Kho chính Thủ Đức"
+
+    # By id, one type; nothing selected / nothing matching
+    res = client.post("/export/batch", json={"voucher_ids": ["K01_PN_0126_001", "K01_PX_1225_001"], "types": ["PN"]})
+    assert zipfile.ZipFile(io.BytesIO(res.content)).namelist() == ["PN/PN_K01_202601_K01_PN_0126_001.pdf"]
+    assert client.post("/export/batch", json={}).status_code == 400
+    assert client.post("/export/batch", json={"voucher_ids": ["K01_PN_1225_003"]}).status_code == 404
+
+
+def _voucher(i):
+    return voucher_export.VoucherExportRequest(
+        voucher_type="PN", voucher_no=f"PN-{i:06d}", voucher_date="2025-12-15", partner_name="NCC",
+        warehouse_code="K01", items=[{"sku": "SP-1", "name": "Hàng", "unit": "Cái",
+                                      "qty_doc": 1, "qty_actual": 1, "unit_price": 1000}]
+    )
+
+
+def test_renders_run_in_worker_processes(monkeypatch):
+    monkeypatch.setattr(voucher_export, "EXPORT_POOL_WORKERS", 2)
+    vouchers = [_voucher(i) for i in range(6)]
+
+    async def collect():
+        return [chunk async for chunk in voucher_export.stream_zip(vouchers, ["pdf", "xlsx"])]
+
+    try:
+        chunks = asyncio.run(collect())
+    finally:
+        voucher_export.shutdown()
+    assert len(chunks) > 1  # streamed while rendering, not in one piece at the end
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(chunks)))
+    assert len(archive.namelist()) == 12 and archive.testzip() is None
+
+
+def test_vouchers_are_read_only_as_renders_free_up(monkeypatch):
+    monkeypatch.setattr(voucher_export, "EXPORT_POOL_WORKERS", 0)
+    pulled = []
+
+    def vouchers():
+        for i in range(50):
+            pulled.append(i)
+            yield _voucher(i)
+
+    async def first_chunk():
+        stream = voucher_export.stream_zip(vouchers(), ["pdf"])
+        chunk = await stream.__anext__()
+        await stream.aclose()
+        return chunk
+
+    assert asyncio.run(first_chunk())
+    assert len(pulled) <= voucher_export.PENDING_PER_WORKER + 1
@@ -0,0 +1,62 @@
+"""Tests for voucher export by record id
+
+File: test_voucher_record_export.py
+Location: KhoHang_API/
+Description: /stock/in|out/{id}/export.{pdf,xlsx} builds the voucher from the
+stored record; a re-print of an unchanged voucher comes from the artifact
+cache (or 304 with its ETag), an edited record is rendered again
+"""
+
+import io
+
+import pytest
+from fastapi.testclient import TestClient
+from openpyxl import load_workbook
+
+from app import main, voucher_export
+from app.database import StockInRecordModel, get_db
+from conftest import db_override
+
+
+@pytest.fixture
+def client(stock_records, monkeypatch):
+    monkeypatch.setattr(voucher_export, "EXPORT_POOL_WORKERS", 0)
+    monkeypatch.setattr(voucher_export, "artifact_cache", voucher_export.ArtifactCache(1024 * 1024))
+    main.app.dependency_overrides[get_db] = db_override(stock_records)
+    client = TestClient(main.app)
+    client.session = stock_records
+    yield client
+    main.app.dependency_overrides.clear()
+
+
+def test_voucher_is_built_from_the_record(client):
+    res = client.get("/stock/out/K01_PX_1225_001/export.xlsx")
+    assert res.status_code == 200
+    assert 'filename="PX_K01_202512_K01_PX_1225_001.xlsx"' in res.headers["content-disposition"]
+    ws = load_workbook(io.BytesIO(res.content)).active
+    assert ws["C11"].value == "K01" and ws["F11"].value == "Kho chính Thủ Đức"
+
+    assert client.get("/stock/in/K01_PN_1225_001/export.pdf").content.startswith(b"%PDF")
+    assert client.get("/stock/in/K01_PN_9999_001/export.pdf").status_code == 404
+    assert client.get("/stock/in/K01_PN_1225_001/export.docx").status_code == 404
+
+
+def test_reprints_come_from_the_cache_until_the_record_changes(client, monkeypatch):
+    renders = []
+    render = voucher_export.render_voucher
+    monkeypatch.setattr(voucher_export, "render_voucher", lambda data, fmt: renders.append(fmt) or render(data, fmt))
+    url = "/stock/in/K01_PN_1225_001/export.pdf"
+
+    first = client.get(url)
+    again = client.get(url)
+    assert again.content == first.content and renders == ["pdf"]
+    assert voucher_export.artifact_cache.stats()["hits"] == 1
+    assert client.get(url, headers={"If-None-Match": first.headers["etag"]}).status_code == 304
+
+    db = client.session()
+    record = db.get(StockInRecordModel, "K01_PN_1225_001")
+    record.items = [{**record.items[0], "quantity": 45}]
+    db.commit()
+    edited = client.get(url)
+    assert renders == ["pdf", "pdf"] and edited.headers["etag"] != first.headers["etag"]
+    assert client.get(url, headers={"If-None-Match": first.headers["etag"]}).status_code == 200
@@ -63,6 +63,28 @@ function extractFilename(contentDisposition: string | null, defaultName: string)
   return defaultName;
 }
 
+/**
+ * Request file phiếu: theo mã phiếu (GET, server tự dựng dữ liệu + cache file đã render)
+ * hoặc gửi toàn bộ dữ liệu phiếu (POST /export/excel|pdf)
+ */
+function requestVoucherFile(
+  data: VoucherExportData,
+  format: 'xlsx' | 'pdf',
+  recordId?: string
+): Promise<Response> {
+  if (recordId) {
+    const kind = data.voucher_type === 'PN' ? 'in' : 'out';
+    return fetch(`${API_BASE_URL}/stock/${kind}/${encodeURIComponent(recordId)}/export.${format}`);
+  }
+  return fetch(`${API_BASE_URL}/export/${format === 'xlsx' ? 'excel' : 'pdf'}`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify(data),
+  });
+}
+
 // ============================================
 // EXPORT FUNCTIONS
 // ============================================
@@ -71,9 +93,10 @@ function extractFilename(contentDisposition: string | null, defaultName: string)
  * Export phiếu ra file Excel qua API
  * 
  * @param data - VoucherExportData
+ * @param recordId - Mã phiếu nhập/xuất đã lưu (nếu có): server dựng dữ liệu từ DB
  * @returns Promise<boolean> - true nếu thành công
  */
-export async function exportToExcel(data: VoucherExportData): Promise<boolean> {
+export async function exportToExcel(data: VoucherExportData, recordId?: string): Promise<boolean> {
   try {
     // Validate
     if (data.items.length > 30) {
@@ -82,19 +105,14 @@ export async function exportToExcel(data: VoucherExportData): Promise<boolean> {
     }
 
     /**
-     * API: POST /export/excel
+     * API: GET /stock/{in|out}/{recordId}/export.xlsx (khi có recordId)
+     *      POST /export/excel
      * Purpose: Export voucher to Excel file
      * Request (JSON): VoucherExportData
      * Response: File stream (application/vnd.openxmlformats-officedocument.spreadsheetml.sheet)
      * Headers: Content-Disposition: attachment; filename="..."
      */
-    const response = await fetch(`${API_BASE_URL}/export/excel`, {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
-      body: JSON.stringify(data),
-    });
+    const response = await requestVoucherFile(data, 'xlsx', recordId);
 
     if (!response.ok) {
       const error = await response.json().catch(() => ({ detail: 'Unknown error' }));
@@ -140,9 +158,10 @@ export async function exportToExcel(data: VoucherExportData): Promise<boolean> {
  * Export phiếu ra file PDF qua API
  * 
  * @param data - VoucherExportData
+ * @param recordId - Mã phiếu nhập/xuất đã lưu (nếu có): server dựng dữ liệu từ DB
  * @returns Promise<boolean> - true nếu thành công
  */
-export async function exportToPdf(data: VoucherExportData): Promise<boolean> {
+export async function exportToPdf(data: VoucherExportData, recordId?: string): Promise<boolean> {
   try {
     // Validate
     if (data.items.length > 30) {
@@ -151,19 +170,14 @@ export async function exportToPdf(data: VoucherExportData): Promise<boolean> {
     }
 
     /**
-     * API: POST /export/pdf
+     * API: GET /stock/{in|out}/{recordId}/export.pdf (khi có recordId)
+     *      POST /export/pdf
      * Purpose: Export voucher to PDF file
      * Request (JSON): VoucherExportData
      * Response: File stream (application/pdf)
      * Headers: Content-Disposition: attachment; filename="..."
      */
-    const response = await fetch(`${API_BASE_URL}/export/pdf`, {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
-      body: JSON.stringify(data),
-    });
+    const response = await requestVoucherFile(data, 'pdf', recordId);
 
     if (!response.ok) {
       const error = await response.json().catch(() => ({ detail: 'Unknown error' }));
@@ -204,3 +218,68 @@ export async function exportToPdf(data: VoucherExportData): Promise<boolean> {
     return false;
   }
 }
+
+export interface VoucherBatchExportParams {
+  voucher_ids?: string[];
+  date_from?: string;   // YYYY-MM-DD
+  date_to?: string;     // YYYY-MM-DD
+  types?: Array<'PN' | 'PX'>;
+  formats?: Array<'pdf' | 'xlsx'>;
+}
+
+/**
+ * Export nhiều phiếu (kết sổ cuối kỳ) thành một file ZIP qua API
+ * 
+ * @param params - danh sách mã phiếu hoặc khoảng ngày
+ * @returns Promise<boolean> - true nếu thành công
+ */
+export async function exportVoucherBatch(params: VoucherBatchExportParams): Promise<boolean> {
+  try {
+    const defaultFilename = params.date_from && params.date_to
+      ? `Phieu_${params.date_from}_${params.date_to}.zip`
+      : 'Phieu.zip';
+
+    // Chọn nơi lưu trước: backend render lâu khi có nhiều phiếu
+    const filePath = await save({
+      defaultPath: defaultFilename,
+      filters: [{ name: 'ZIP Files', extensions: ['zip'] }],
+      title: 'Lưu phiếu nhập/xuất kho',
+    });
+
+    if (!filePath) {
+      // User cancelled
+      return false;
+    }
+
+    /**
+     * API: POST /export/batch
+     * Purpose: Export many vouchers as one ZIP (PN/*, PX/*, LOI.txt nếu có phiếu lỗi)
+     * Request (JSON): VoucherBatchExportParams
+     * Response: File stream (application/zip)
+     */
+    const response = await fetch(`${API_BASE_URL}/export/batch`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify(params),
+    });
+
+    if (!response.ok) {
+      const error = await response.json().catch(() => ({ detail: 'Unknown error' }));
+      throw new Error(error.detail || `HTTP ${response.status}`);
+    }
+
+    const arrayBuffer = await response.arrayBuffer();
+    await writeFile(filePath, new Uint8Array(arrayBuffer));
+
+    showToast.success(`Đã xuất file thành công: ${filePath}`);
+
+    return true;
+  } catch (error) {
+    console.error('Export batch error:', error);
+    const errorMsg = error instanceof Error ? error.message : String(error);
+    showToast.error(`Lỗi khi xuất phiếu: ${errorMsg}`);
+    return false;
+  }
+}
@@ -14,12 +14,14 @@ interface AttachmentPickerProps {
   onUploadComplete?: (attachments: Attachment[]) => void;
   multiple?: boolean;
   disabled?: boolean;
+  maxFileSize?: number;
 }
 
 export const AttachmentPicker: React.FC<AttachmentPickerProps> = ({
   onFilesSelected,
   multiple = true,
   disabled = false,
+  maxFileSize = MAX_FILE_SIZE,
 }) => {
   const fileInputRef = useRef<HTMLInputElement>(null);
 
@@ -37,8 +39,8 @@ export const AttachmentPicker: React.FC<AttachmentPickerProps> = ({
     const errors: string[] = [];
 
     for (const file of files) {
-      if (file.size > MAX_FILE_SIZE) {
-        errors.push(`${file.name}: Vượt quá 10MB`);
+      if (file.size > maxFileSize) {
+        errors.push(`${file.name}: Vượt quá ${formatFileSize(maxFileSize)}`);
         continue;
       }
 
@@ -666,10 +666,14 @@ const ImageAttachments: React.FC<ImageAttachmentsProps> = ({ attachments, onImag
     }`}>
       {attachments.map((attachment, idx) => {
         const imageUrl = resolveMediaUrl(attachment.url) || attachment.url;
+        // Bubble shows the medium variant; the viewer opens the original
+        const previewUrl = attachment.thumbnail_url || attachment.thumbnails?.medium;
+        const thumbUrl = (previewUrl && resolveMediaUrl(previewUrl)) || imageUrl;
         return (
           <img
             key={attachment.file_id || idx}
-            src={imageUrl}
+            src={thumbUrl}
+            loading="lazy"
             alt={attachment.name}
             className="w-full h-auto rounded-lg cursor-pointer hover:opacity-90 transition-opacity"
             onClick={() => onImageClick?.(imageUrl)}
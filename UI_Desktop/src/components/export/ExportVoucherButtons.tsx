@@ -3,6 +3,7 @@
  * 
  * Props:
  * - data: VoucherExportData - Dữ liệu phiếu cần xuất
+ * - recordId?: string - Mã phiếu đã lưu: server dựng phiếu từ DB (có cache)
  * - className?: string - CSS classes tùy chỉnh
  * 
  * Features:
@@ -19,11 +20,13 @@ import { showToast } from '../../utils/toast';
 
 interface ExportVoucherButtonsProps {
   data: VoucherExportData;
+  recordId?: string;
   className?: string;
 }
 
 export const ExportVoucherButtons: React.FC<ExportVoucherButtonsProps> = ({
   data,
+  recordId,
   className = '',
 }) => {
   const [isExportingExcel, setIsExportingExcel] = useState(false);
@@ -37,7 +40,7 @@ export const ExportVoucherButtons: React.FC<ExportVoucherButtonsProps> = ({
 
     setIsExportingExcel(true);
     try {
-      await exportToExcel(data);
+      await exportToExcel(data, recordId);
       // Toast đã được xử lý trong exportToExcel
     } catch (error) {
       console.error('Export Excel error:', error);
@@ -52,7 +55,7 @@ export const ExportVoucherButtons: React.FC<ExportVoucherButtonsProps> = ({
 
     setIsExportingPDF(true);
     try {
-      await exportToPdf(data);
+      await exportToPdf(data, recordId);
       // Toast đã được xử lý trong exportToPdf
     } catch (error) {
       console.error('Export PDF error:', error);
@@ -6,11 +6,11 @@
 
 import { useState, useEffect, useRef, useMemo, useCallback, useLayoutEffect } from "react";
 import { useThemeStore } from "../../theme/themeStore";
-import { useRTChatStore, MessageUI } from "../../state/rt_chat_store";
+import { useRTChatStore, MessageUI, type MessageReaction } from "../../state/rt_chat_store";
 import { useAuthStore } from "../../state/auth_store";
 import { rtWSClient } from "../../services/rt_ws_client";
 import { AttachmentPicker, AttachmentPreview } from "../chat/AttachmentPicker";
-import { isImageMimeType, type Attachment, type UploadProgress } from "../../types/attachment";
+import { isImageMimeType, MAX_RT_FILE_SIZE, type Attachment, type UploadProgress } from "../../types/attachment";
 import { showError } from "../../utils/toast";
 import { isNearBottom } from "../../utils/chatHelpers";
 import ChatBackground from "../chat/ChatBackground";
@@ -28,6 +28,20 @@ function getDateKey(isoString: string): string {
   return `${d.getFullYear()}-${String(d.getMonth() + 1).padStart(2, '0')}-${String(d.getDate()).padStart(2, '0')}`;
 }
 
+/**
+ * MessageBubble works on one entry per user per emoji; expand the per-emoji counts
+ * (sampled user ids first, the rest as anonymous placeholders).
+ */
+function toBubbleReactions(reactions: MessageReaction[] | undefined, currentUserId?: string) {
+  return (reactions || []).flatMap(r => {
+    const others = r.userIds.filter(id => id !== currentUserId);
+    const mine = r.reactedByMe && currentUserId ? [currentUserId] : [];
+    const ids = [...mine, ...others];
+    while (ids.length < r.count) ids.push(`${r.emoji}#${ids.length}`);
+    return ids.slice(0, r.count).map(userId => ({ userId, emoji: r.emoji, createdAt: '' }));
+  });
+}
+
 function parseLocalDateKey(key: string): Date {
   const [y, m, d] = key.split('-').map(Number);
   return new Date(y, m - 1, d);
@@ -182,7 +196,13 @@ export default function RealtimeChatRoom({ conversationId, sidebarCollapsed, onE
       });
       
       try {
-        const result = await uploadFile(file);
+        const result = await uploadFile(file, (progress) => {
+          setUploadProgress(prev => {
+            const progressMapUploading = new Map(prev);
+            progressMapUploading.set(file.name, { file, progress, status: 'uploading' });
+            return progressMapUploading;
+          });
+        });
         
         setUploadProgress(prev => {
           const progressMapDone = new Map(prev);
@@ -395,7 +415,7 @@ export default function RealtimeChatRoom({ conversationId, sidebarCollapsed, onE
                   mine={msg.senderId === currentUser?.id}
                   isLastInGroup={idx === group.messages.length - 1 || group.messages[idx + 1]?.senderId !== msg.senderId}
                   replyTo={getReplyInfo(msg)}
-                  initialReactions={msg.reactions || []}
+                  initialReactions={toBubbleReactions(msg.reactions, currentUser?.id)}
                   onReactionChange={(messageId, emoji) => toggleReaction(conversationId, messageId, emoji)}
                   onReply={() => handleReply(msg)}
                   status={msg.status}
@@ -492,7 +512,7 @@ export default function RealtimeChatRoom({ conversationId, sidebarCollapsed, onE
         )}
         
         <div className="flex items-center gap-3 p-4">
-          <AttachmentPicker onFilesSelected={handleFilesSelected} />
+          <AttachmentPicker onFilesSelected={handleFilesSelected} maxFileSize={MAX_RT_FILE_SIZE} />
           <input
             ref={inputRef}
             type="text"
@@ -958,6 +958,7 @@ export default function Stock_In_Page() {
               {selectedRecord && (
                 <ExportVoucherButtons 
                   data={stockInToVoucherData(selectedRecord, 'K01', 'Kho chính Thủ Đức', selectedRecord.tax_rate ?? 0)}
+                  recordId={selectedRecord.id}
                 />
               )}
 
@@ -1031,6 +1031,7 @@ export default function Stock_Out_Page() {
               {selectedRecord && (
                 <ExportVoucherButtons 
                   data={stockOutToVoucherData(selectedRecord, 'K01', 'Kho chính Thủ Đức', selectedRecord.tax_rate ?? 0)}
+                  recordId={selectedRecord.id}
                 />
               )}
 
@@ -10,6 +10,14 @@ const BASE_URL = import.meta.env.VITE_API_BASE_URL ?? "http://localhost:8000";
 
 const WS_URL = BASE_URL.replace(/^http/, 'ws');
 
+// Binary frames start with a flag byte (see KhoHang_API/app/rt_codec.py)
+const FRAME_FLAG_MSGPACK = 0x01;
+const FRAME_FLAG_DEFLATE = 0x02;
+// Opt-in app-level deflate of large frames, for deployments where the proxy
+// strips permessage-deflate from the upgrade. Encoding stays JSON.
+const RT_WS_COMPRESSION =
+  import.meta.env.VITE_RT_WS_COMPRESSION === 'deflate' && typeof DecompressionStream !== 'undefined';
+
 type EventHandler = (data: any) => void;
 type EventType = 
   | 'server:hello'
@@ -26,6 +34,8 @@ type EventType =
   | 'msg:pinned'
   | 'msg:unpinned'
   | 'typing'
+  | 'presence:diff'
+  | 'outbox:drain'
   | 'conv:sync:result'
   | 'conv:upsert'
   | 'conv:rejected'
@@ -52,6 +62,11 @@ class RealtimeWSClient {
   private eventQueue: QueuedEvent[] = [];
   private isConnecting = false;
   private isManualClose = false;
+  // Resume cursor: server replays events after lastEventId on the same stream
+  private streamId: string | null = null;
+  private lastEventId = 0;
+  // Inbound frames are decoded in order even when inflating is async
+  private inbound: Promise<void> = Promise.resolve();
   
   constructor() {
     this.url = `${WS_URL}/ws/rt`;
@@ -77,6 +92,7 @@ class RealtimeWSClient {
     
     try {
       this.ws = new WebSocket(wsUrl);
+      this.ws.binaryType = 'arraybuffer';
       
       this.ws.onopen = () => {
         console.log('[RT-WS] Connected');
@@ -84,16 +100,15 @@ class RealtimeWSClient {
         this.reconnectAttempts = 0;
         this.reconnectDelay = 1000;
         this.startHeartbeat();
+        this.sendHello();
         this.flushQueue();
       };
       
       this.ws.onmessage = (event) => {
-        try {
-          const message = JSON.parse(event.data);
-          this.handleMessage(message);
-        } catch (e) {
-          console.error('[RT-WS] Failed to parse message:', e);
-        }
+        this.inbound = this.inbound
+          .then(() => this.decodeFrame(event.data))
+          .then((message) => this.handleMessage(message))
+          .catch((e) => console.error('[RT-WS] Failed to parse message:', e));
       };
       
       this.ws.onerror = (error) => {
@@ -129,6 +144,36 @@ class RealtimeWSClient {
     this.token = null;
     this.reconnectAttempts = 0;
     this.eventQueue = [];
+    this.streamId = null;
+    this.lastEventId = 0;
+  }
+  
+  private sendHello() {
+    this.ws?.send(JSON.stringify({
+      type: 'client:hello',
+      reqId: '',
+      data: {
+        ...(this.streamId ? { streamId: this.streamId, lastEventId: this.lastEventId } : {}),
+        ...(RT_WS_COMPRESSION ? { compression: 'deflate' } : {})
+      }
+    }));
+  }
+  
+  private async decodeFrame(data: string | ArrayBuffer): Promise<any> {
+    if (typeof data === 'string') {
+      return JSON.parse(data);
+    }
+    const bytes = new Uint8Array(data);
+    if (bytes[0] & FRAME_FLAG_MSGPACK) {
+      // Only requested by clients that ship a MessagePack decoder
+      throw new Error('MessagePack frame received but not negotiated');
+    }
+    let payload = bytes.subarray(1);
+    if (bytes[0] & FRAME_FLAG_DEFLATE) {
+      const stream = new Blob([payload]).stream().pipeThrough(new DecompressionStream('deflate-raw'));
+      payload = new Uint8Array(await new Response(stream).arrayBuffer());
+    }
+    return JSON.parse(new TextDecoder().decode(payload));
   }
   
   private scheduleReconnect() {
@@ -171,13 +216,29 @@ class RealtimeWSClient {
   private handleMessage(message: any) {
     const { type, data } = message;
     
+    if (typeof message.eventId === 'number' && message.eventId > this.lastEventId) {
+      this.lastEventId = message.eventId;
+    }
+    
+    if (type === 'batch') {
+      // Several events for this user coalesced into one frame (e.g. msg:new + conv:upsert)
+      for (const event of data?.events ?? []) {
+        this.handleMessage(event);
+      }
+      return;
+    }
+    
     if (type === 'ping') {
       this.send({ type: 'pong', reqId: '', data: {} });
       return;
     }
     
     if (type === 'server:hello') {
-      const { heartbeatIntervalMs } = data;
+      const { heartbeatIntervalMs, streamId, lastEventId } = data;
+      if (streamId && (streamId !== this.streamId || !data.resumed)) {
+        this.streamId = streamId;
+        this.lastEventId = lastEventId ?? 0;
+      }
       if (heartbeatIntervalMs) {
         this.heartbeatIntervalMs = heartbeatIntervalMs;
         this.startHeartbeat();
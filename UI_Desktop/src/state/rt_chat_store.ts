@@ -9,7 +9,12 @@ import { persist } from 'zustand/middleware';
 import { rtWSClient } from '../services/rt_ws_client';
 import { BASE_URL } from '../app/api_client';
 import { useAuthStore } from './auth_store';
-import type { Attachment, ContentType } from '../types/attachment';
+import { CHUNKED_UPLOAD_THRESHOLD, type Attachment, type ContentType } from '../types/attachment';
+
+// The server re-announces an ongoing typing start every 10 s and sends the stop
+// itself (see KhoHang_API/app/rt_coalesce.py); this only covers a lost stop.
+const TYPING_INDICATOR_TIMEOUT_MS = 15000;
+const typingTimers = new Map<string, ReturnType<typeof setTimeout>>();
 
 export interface MessageReceipt {
   userId: string;
@@ -17,10 +22,79 @@ export interface MessageReceipt {
   readAt?: string;
 }
 
+// Per-emoji reaction count; who reacted is fetched on demand (GET /rt/messages/{id}/reactions)
 export interface MessageReaction {
-  userId: string;
   emoji: string;
-  createdAt: string;
+  count: number;
+  userIds: string[]; // First few reactors
+  reactedByMe: boolean;
+}
+
+/**
+ * Replace one emoji's summary (count 0 removes it), keeping the most used emoji first.
+ */
+function setReactionSummary(reactions: MessageReaction[], summary: MessageReaction): MessageReaction[] {
+  const others = reactions.filter(r => r.emoji !== summary.emoji);
+  const next = summary.count > 0 ? [...others, summary] : others;
+  return next.sort((a, b) => b.count - a.count || a.emoji.localeCompare(b.emoji));
+}
+
+const CHUNK_RETRIES = 5;
+const CHUNK_CHECKSUM_MAX_SIZE = 64 * 1024 * 1024; // crypto.subtle hashes in memory
+
+async function fileSha256(file: File): Promise<string | undefined> {
+  if (file.size > CHUNK_CHECKSUM_MAX_SIZE || !crypto?.subtle) return undefined;
+  const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+  return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+}
+
+/**
+ * Resumable upload: POST /rt/files/uploads, PUT chunks at ?offset=, POST .../complete.
+ * A failed chunk is retried from the offset the server reports, so a dropped
+ * connection only costs the chunk in flight.
+ */
+async function uploadInChunks(file: File, token: string, onProgress?: (percent: number) => void): Promise<Response> {
+  const headers = { 'Authorization': `Bearer ${token}` };
+  const init = await fetch(`${BASE_URL}/rt/files/uploads`, {
+    method: 'POST',
+    headers: { ...headers, 'Content-Type': 'application/json' },
+    body: JSON.stringify({
+      name: file.name,
+      size: file.size,
+      mime_type: file.type || undefined,
+      sha256: await fileSha256(file),
+    }),
+  });
+  if (!init.ok) return init;
+  const session = await init.json();
+  const sessionUrl = `${BASE_URL}/rt/files/uploads/${session.upload_id}`;
+
+  let offset: number = session.offset;
+  let failures = 0;
+  while (offset < file.size) {
+    try {
+      const res = await fetch(`${sessionUrl}?offset=${offset}`, {
+        method: 'PUT',
+        headers: { ...headers, 'Content-Type': 'application/octet-stream' },
+        body: file.slice(offset, offset + session.chunk_size),
+      });
+      if (res.status === 409) {
+        offset = Number(res.headers.get('Upload-Offset') ?? offset);
+        continue;
+      }
+      if (!res.ok) return res;
+      offset = (await res.json()).offset;
+      failures = 0;
+      onProgress?.(Math.round((offset / file.size) * 100));
+    } catch (error) {
+      // Network error: wait, ask the server how much arrived, resume from there
+      if (++failures > CHUNK_RETRIES) throw error;
+      await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** failures));
+      const status = await fetch(sessionUrl, { headers }).catch(() => null);
+      if (status?.ok) offset = (await status.json()).offset;
+    }
+  }
+  return fetch(`${sessionUrl}/complete`, { method: 'POST', headers });
 }
 
 export interface MessageUI {
@@ -100,7 +174,7 @@ interface RTChatState {
   markRead: (conversationId: string, lastReadMessageId: string) => void;
   syncConversation: (conversationId: string, afterMessageId?: string) => void;
   createDirectConversation: (email: string) => Promise<string>;
-  uploadFile: (file: File) => Promise<Attachment>;
+  uploadFile: (file: File, onProgress?: (percent: number) => void) => Promise<Attachment>;
   toggleReaction: (conversationId: string, messageId: string, emoji: string) => void;
   
   handleServerHello: (data: any) => void;
@@ -113,6 +187,8 @@ interface RTChatState {
   handleMsgDelivered: (data: any) => void;
   handleMsgRead: (data: any) => void;
   handleTyping: (data: any) => void;
+  handlePresenceDiff: (data: any) => void;
+  handleOutboxDrain: (data: any) => void;
   handleConvSyncResult: (data: any) => void;
   handleConvUpsert: (data: any) => void;
   handleConvRejected: (data: any) => void;
@@ -137,6 +213,8 @@ export const useRTChatStore = create<RTChatState>()(
         rtWSClient.on('msg:delivered', (msg) => get().handleMsgDelivered(msg.data));
         rtWSClient.on('msg:read', (msg) => get().handleMsgRead(msg.data));
         rtWSClient.on('typing', (msg) => get().handleTyping(msg.data));
+        rtWSClient.on('presence:diff', (msg) => get().handlePresenceDiff(msg.data));
+        rtWSClient.on('outbox:drain', (msg) => get().handleOutboxDrain(msg.data));
         rtWSClient.on('conv:sync:result', (msg) => get().handleConvSyncResult(msg.data));
         rtWSClient.on('conv:upsert', (msg) => get().handleConvUpsert(msg.data));
         rtWSClient.on('conv:rejected', (msg) => get().handleConvRejected(msg.data));
@@ -593,24 +671,21 @@ export const useRTChatStore = create<RTChatState>()(
             const messages = state.messagesByConv[conversationId] || [];
             const updatedMessages = messages.map(msg => {
               if (msg.id === messageId) {
-                let reactions = msg.reactions || [];
-                const existingIndex = reactions.findIndex(
-                  r => r.userId === currentUser.id && r.emoji === emoji
-                );
+                const reactions = msg.reactions || [];
+                const current = reactions.find(r => r.emoji === emoji);
+                const reacted = !!current?.reactedByMe;
+                const userIds = current?.userIds || [];
                 
-                if (existingIndex >= 0) {
-                  // Remove reaction
-                  reactions = reactions.filter((_, i) => i !== existingIndex);
-                } else {
-                  // Add reaction
-                  reactions = [...reactions, {
-                    userId: currentUser.id,
+                // Toggle: server count follows in the msg:react broadcast
+                return {
+                  ...msg,
+                  reactions: setReactionSummary(reactions, {
                     emoji,
-                    createdAt: new Date().toISOString()
-                  }];
-                }
-                
-                return { ...msg, reactions };
+                    count: (current?.count || 0) + (reacted ? -1 : 1),
+                    userIds: reacted ? userIds.filter(id => id !== currentUser.id) : userIds,
+                    reactedByMe: !reacted
+                  })
+                };
               }
               return msg;
             });
@@ -790,28 +865,33 @@ export const useRTChatStore = create<RTChatState>()(
           return data.conversation_id;
         },
         
-        uploadFile: async (file: File): Promise<Attachment> => {
+        uploadFile: async (file: File, onProgress?: (percent: number) => void): Promise<Attachment> => {
           /**
-           * API: POST /rt/files
+           * API: POST /rt/files (small files) or chunked /rt/files/uploads (large files)
            * Purpose: Upload file for chat
            * Request (JSON): multipart/form-data
-           * Response (JSON) [200]: { file_id, url, name, size, mime_type }
+           * Response (JSON) [200]: { file_id, url, name, size, mime_type, thumbnail_url?, thumbnails? }
            */
           const token = useAuthStore.getState().token;
           if (!token) {
             throw new Error('No authentication token');
           }
           
-          const formData = new FormData();
-          formData.append('file', file);
-          
-          const response = await fetch(`${BASE_URL}/rt/files`, {
-            method: 'POST',
-            headers: {
-              'Authorization': `Bearer ${token}`
-            },
-            body: formData
-          });
+          let response: Response;
+          if (file.size > CHUNKED_UPLOAD_THRESHOLD) {
+            response = await uploadInChunks(file, token, onProgress);
+          } else {
+            const formData = new FormData();
+            formData.append('file', file);
+            
+            response = await fetch(`${BASE_URL}/rt/files`, {
+              method: 'POST',
+              headers: {
+                'Authorization': `Bearer ${token}`
+              },
+              body: formData
+            });
+          }
           
           if (response.status === 401) {
             // Token expired or invalid - logout user
@@ -830,6 +910,12 @@ export const useRTChatStore = create<RTChatState>()(
         
         handleServerHello: (data) => {
           console.log('[RT-Chat] Server hello:', data);
+          if (data?.resyncRequired && get().conversations.length === 0) {
+            // Nothing loaded yet: rebuild from REST
+            get().loadConversations();
+          }
+          // Otherwise everything missed while offline arrives as one outbox:drain
+          // (outboxCount > 0) and the loaded state stays valid
         },
         
         handleMsgAck: (data) => {
@@ -1014,28 +1100,24 @@ export const useRTChatStore = create<RTChatState>()(
         handleMsgReact: (data) => {
           /**
            * Handle msg:react event from server (realtime broadcast)
-           * data: { conversationId, messageId, emoji, userId, action: 'added'|'removed', createdAt }
+           * data: { conversationId, messageId, emoji, userId, action: 'added'|'removed', count, userIds, createdAt }
+           * Notes: count/userIds are the emoji's new totals and replace the local summary
            */
-          const { conversationId, messageId, emoji, userId, action, createdAt } = data;
+          const { conversationId, messageId, emoji, userId, action, count, userIds } = data;
+          const currentUserId = useAuthStore.getState().user?.id;
           
           set((state) => {
             const messages = state.messagesByConv[conversationId] || [];
             const updatedMessages = messages.map(msg => {
               if (msg.id === messageId) {
-                let reactions = msg.reactions || [];
-                
-                if (action === 'added') {
-                  // Add reaction if not exists
-                  const exists = reactions.some(r => r.userId === userId && r.emoji === emoji);
-                  if (!exists) {
-                    reactions = [...reactions, { userId, emoji, createdAt }];
-                  }
-                } else if (action === 'removed') {
-                  // Remove reaction
-                  reactions = reactions.filter(r => !(r.userId === userId && r.emoji === emoji));
-                }
+                const reactions = msg.reactions || [];
+                const current = reactions.find(r => r.emoji === emoji);
+                const reactedByMe = userId === currentUserId ? action === 'added' : !!current?.reactedByMe;
                 
-                return { ...msg, reactions };
+                return {
+                  ...msg,
+                  reactions: setReactionSummary(reactions, { emoji, count, userIds: userIds || [], reactedByMe })
+                };
               }
               return msg;
             });
@@ -1059,7 +1141,9 @@ export const useRTChatStore = create<RTChatState>()(
         },
         
         handleMsgDelivered: (data) => {
-          const { conversationId, messageId, userId, deliveredAt } = data;
+          const { conversationId, messageId, deliveredAt } = data;
+          // Server sends one aggregated event per message: userIds = all recipients marked delivered
+          const userIds: string[] = data.userIds ?? (data.userId ? [data.userId] : []);
           
           set((state) => {
             const messages = state.messagesByConv[conversationId] || [];
@@ -1067,11 +1151,13 @@ export const useRTChatStore = create<RTChatState>()(
               if (msg.id === messageId) {
                 const receipts = msg.receipts || [];
                 const updatedReceipts = receipts.map(r => 
-                  r.userId === userId ? { ...r, deliveredAt } : r
+                  userIds.includes(r.userId) ? { ...r, deliveredAt } : r
                 );
                 
-                if (!updatedReceipts.find(r => r.userId === userId)) {
-                  updatedReceipts.push({ userId, deliveredAt });
+                for (const userId of userIds) {
+                  if (!updatedReceipts.find(r => r.userId === userId)) {
+                    updatedReceipts.push({ userId, deliveredAt });
+                  }
                 }
                 
                 return {
@@ -1128,6 +1214,8 @@ export const useRTChatStore = create<RTChatState>()(
         
         handleTyping: (data) => {
           const { conversationId, userId, isTyping } = data;
+          const timerKey = `${conversationId}:${userId}`;
+          clearTimeout(typingTimers.get(timerKey));
           
           set((state) => ({
             typingByConv: {
@@ -1139,7 +1227,8 @@ export const useRTChatStore = create<RTChatState>()(
             }
           }));
           
-          setTimeout(() => {
+          typingTimers.set(timerKey, setTimeout(() => {
+            typingTimers.delete(timerKey);
             set((state) => {
               const typing = { ...(state.typingByConv[conversationId] || {}) };
               delete typing[userId];
@@ -1150,7 +1239,20 @@ export const useRTChatStore = create<RTChatState>()(
                 }
               };
             });
-          }, 3000);
+          }, isTyping ? TYPING_INDICATOR_TIMEOUT_MS : 0));
+        },
+        
+        handlePresenceDiff: (data) => {
+          // Net online/offline changes of watched users since the last diff
+          const users: Array<{ userId: string; isOnline: boolean; lastSeenAt?: string }> = data?.users ?? [];
+          if (users.length === 0) return;
+          set((state) => {
+            const presenceByUser = { ...state.presenceByUser };
+            for (const user of users) {
+              presenceByUser[user.userId] = { isOnline: user.isOnline, lastSeenAt: user.lastSeenAt };
+            }
+            return { presenceByUser };
+          });
         },
         
         handleConvSyncResult: (data) => {
@@ -1255,6 +1357,93 @@ export const useRTChatStore = create<RTChatState>()(
           }
         },
 
+        handleOutboxDrain: (data) => {
+          /**
+           * Handle outbox:drain event from server (after a reconnect that could not resume).
+           * data: { messages, reads: [{ conversationId, userId, lastReadMessageId, readAt }],
+           *         pins: [{ conversationId, messageId, pinned }], conversations: [{ conversationId, unreadCount }],
+           *         resyncConversationIds, eventCount }
+           * Messages are current snapshots (edits, deletes, reactions applied) and replace local copies.
+           */
+          const messages: MessageUI[] = data?.messages ?? [];
+          const reads: any[] = data?.reads ?? [];
+          const pins: any[] = data?.pins ?? [];
+          const summaries: any[] = data?.conversations ?? [];
+          const resyncIds: string[] = data?.resyncConversationIds ?? [];
+          const currentUser = useAuthStore.getState().user;
+          console.log('[RT-Chat] Outbox drain:', data?.eventCount, 'events,', messages.length, 'messages');
+          
+          set((state) => {
+            const messagesByConv = { ...state.messagesByConv };
+            for (const message of messages) {
+              const list = messagesByConv[message.conversationId] || [];
+              const index = list.findIndex(m => m.id === message.id);
+              const merged = { ...(index >= 0 ? list[index] : {}), ...message, status: 'delivered' } as MessageUI;
+              messagesByConv[message.conversationId] = index >= 0
+                ? list.map((m, i) => (i === index ? merged : m))
+                : [...list, merged].sort((a, b) => new Date(a.createdAt).getTime() - new Date(b.createdAt).getTime());
+            }
+            
+            // Read positions: every own message up to the reader's last read one
+            for (const read of reads) {
+              const list = messagesByConv[read.conversationId];
+              if (!list) continue;
+              const lastRead = list.find(m => m.id === read.lastReadMessageId);
+              const cutoff = new Date(lastRead ? lastRead.createdAt : read.readAt).getTime();
+              messagesByConv[read.conversationId] = list.map((msg): MessageUI => {
+                if (msg.senderId !== currentUser?.id || new Date(msg.createdAt).getTime() > cutoff) return msg;
+                const receipts = (msg.receipts || []).filter(r => r.userId !== read.userId);
+                return { ...msg, receipts: [...receipts, { userId: read.userId, readAt: read.readAt }], status: 'read' };
+              });
+            }
+            
+            const pinnedMessagesByConv = { ...state.pinnedMessagesByConv };
+            for (const pin of pins) {
+              const current = (pinnedMessagesByConv[pin.conversationId] || []).filter(id => id !== pin.messageId);
+              pinnedMessagesByConv[pin.conversationId] = pin.pinned ? [...current, pin.messageId] : current;
+            }
+            
+            const unreadByConv = new Map(summaries.map(c => [c.conversationId, c.unreadCount]));
+            const conversations = state.conversations.map(conv => {
+              const list = messagesByConv[conv.id];
+              const newest = list && list.length > 0 ? list[list.length - 1] : undefined;
+              const lastMessage = newest && (!conv.lastMessage || new Date(newest.createdAt) > new Date(conv.lastMessage.createdAt))
+                ? {
+                    id: newest.id,
+                    content: newest.content,
+                    senderId: newest.senderId,
+                    contentType: newest.contentType,
+                    attachments: newest.attachments,
+                    createdAt: newest.createdAt
+                  }
+                : undefined;
+              if (!unreadByConv.has(conv.id) && !lastMessage) return conv;
+              return {
+                ...conv,
+                unreadCount: unreadByConv.get(conv.id) ?? conv.unreadCount,
+                ...(lastMessage ? { lastMessage, updatedAt: lastMessage.createdAt } : {})
+              };
+            }).sort((a, b) => new Date(b.updatedAt).getTime() - new Date(a.updatedAt).getTime());
+            
+            // Too much queued for these: drop the local page and reload it
+            for (const id of resyncIds) {
+              delete messagesByConv[id];
+            }
+            
+            return { messagesByConv, pinnedMessagesByConv, conversations };
+          });
+          
+          const known = new Set(get().conversations.map(c => c.id));
+          const touched = [...summaries.map(c => c.conversationId), ...resyncIds];
+          if (touched.some(id => !known.has(id))) {
+            // New conversation started while offline
+            get().loadConversations();
+          }
+          for (const id of resyncIds) {
+            if (known.has(id)) get().joinConversation(id);
+          }
+        },
+
         handleMsgPinned: (data) => {
           /**
            * Handle msg:pinned event from server.
@@ -7,10 +7,15 @@ export interface Attachment {
   size: number;
   mime_type: string;
   thumbnail_url?: string;
+  thumbnails?: { small?: string; medium?: string; large?: string };
 }
 
 export const MAX_FILE_SIZE = 10 * 1024 * 1024;
 
+// Realtime chat: files above the threshold go through resumable chunked upload (/rt/files/uploads)
+export const MAX_RT_FILE_SIZE = 200 * 1024 * 1024;
+export const CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+
 export const ALLOWED_IMAGE_EXTS = ['png', 'jpg', 'jpeg', 'gif', 'webp'];
 
 export const ALLOWED_FILE_EXTS = [